@@ -0,0 +1,281 @@
+# aliases.py
+"""
+幣種俗稱正規化：把訊息裡的俗稱 / 別名一次換成標準代號（大餅 → BTC、PEPE → 1000PEPE），方便預過濾與 LLM 解析。
+
+別名來源：
+  1) ALIAS_FILE（aliases.txt）人工整理的俗稱，每行「代號: 俗稱1, 俗稱2」
+  2) exchange_info 的 base asset（load_symbol_registry 每次更新時呼叫 update_symbols）：
+     - 1000PEPE / 1000000MOG 這類合約：沒有單獨上架的 PEPE / MOG 改寫成完整代號（只比對大寫完整單字）
+     - 中文名稱合約（如 币安人生）原樣保留，較短的俗稱不會改寫到合約名稱內部
+所有別名編成一個前綴樹形式的正規式（同一位置取最長的別名），一則訊息只掃描一遍；
+symbol 清單變動時只重算有變動的 base 的別名，別名表真的改變才重新編譯。
+
+用法：
+  python aliases.py "大餅 姨太 #PEPE 多"            # 印出正規化結果
+  python aliases.py --bench --messages 2000          # 與逐條 re.sub 的舊作法比較
+"""
+import os
+import re
+import time
+import argparse
+import threading
+from config import ALIAS_FILE
+from logs import get_printer
+print = get_printer("aliases")
+
+_WORD_CHARS = "0-9A-Za-z"
+_MULTIPLIER_PREFIX = re.compile(r"^1(000)+")
+
+def load_alias_file(path=ALIAS_FILE):
+    """讀取俗稱檔 → {俗稱: 代號}；檔案不存在回傳空 dict，格式錯誤的行略過。"""
+    table = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return table
+    for lineno, raw in enumerate(lines, 1):
+        line = raw.split("#", 1)[0].strip()
+        if not line:
+            continue
+        target, sep, names = line.partition(":")
+        target = target.strip()
+        if not sep or not target:
+            print(f"[warning] 俗稱檔第 {lineno} 行格式錯誤（應為「代號: 俗稱1, 俗稱2」）：{raw.strip()}")
+            continue
+        for name in re.split(r"[,，、]", names):
+            name = name.strip()
+            if name:
+                table[name] = target.upper() if target.isascii() else target
+    return table
+
+def _trie_pattern(words):
+    """把一組字串編成前綴樹形式的正規式；貪婪比對，同一位置會先試最長的字。"""
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = None
+
+    def build(node):
+        if "" in node and len(node) == 1:
+            return None
+        alts, chars = [], []
+        for ch in sorted(k for k in node if k):
+            sub = build(node[ch])
+            if sub is None:
+                chars.append(re.escape(ch))
+            else:
+                alts.append(re.escape(ch) + sub)
+        chars_only = not alts
+        if chars:
+            alts.append(chars[0] if len(chars) == 1 else "[" + "".join(chars) + "]")
+        out = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            out = out + "?" if chars_only else "(?:" + out + ")?"
+        return out
+
+    return build(trie) if trie else None
+
+class AliasNormalizer:
+    """
+    別名表：key 為比對用的字（英文轉小寫）→ (替換成的代號, 需完全相符的原文 或 None)。
+    normalize() 讀的是 (pattern, table) 一組快照，重建時整組替換，不必對讀取加鎖。
+    """
+
+    def __init__(self, path=ALIAS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_mtime = None
+        self._nicknames = {}        # 俗稱檔：俗稱 → 代號
+        self._listed = frozenset()  # 目前上架的 base asset
+        self._derived = {}          # base → [(比對字, 代號, 原文)]（由 exchange_info 產生）
+        self._compiled = (None, {})
+        self.builds = 0
+        self.reload()
+
+    # ---- 來源 ----
+    def _file_changed(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        return mtime != self._file_mtime, mtime
+
+    def reload(self, force=False):
+        """俗稱檔有修改（或 force）時重新載入並重建；回傳是否重建。"""
+        with self._lock:
+            changed, mtime = self._file_changed()
+            if not (changed or force):
+                return False
+            self._file_mtime = mtime
+            self._nicknames = load_alias_file(self.path)
+            return self._rebuild()
+
+    def update_symbols(self, bases):
+        """
+        傳入目前上架的 base asset（exchange_info）。只重算新增 / 下架的 base，
+        別名表沒有實際變動時不重新編譯；回傳是否重建。俗稱檔有修改也會在這裡一併載入。
+        """
+        listed = frozenset(bases)
+        with self._lock:
+            file_changed, mtime = self._file_changed()
+            if listed == self._listed and not file_changed:
+                return False
+            added, removed = listed - self._listed, self._listed - listed
+            for base in removed:
+                self._derived.pop(base, None)
+            for base in added:
+                derived = self._derive(base, listed)
+                if derived:
+                    self._derived[base] = derived
+            if added or removed:
+                # 單獨上架的 PEPE 會讓 1000PEPE 不再需要 PEPE → 1000PEPE 的改寫：重算受影響的 1000x 合約
+                touched = {_MULTIPLIER_PREFIX.sub("", b) for b in added | removed}
+                for base in listed:
+                    stripped = _MULTIPLIER_PREFIX.sub("", base)
+                    if stripped != base and stripped in touched:
+                        self._derived[base] = self._derive(base, listed)
+            self._listed = listed
+            if file_changed:
+                self._file_mtime = mtime
+                self._nicknames = load_alias_file(self.path)
+            if added or removed:
+                print(f"[aliases] symbol 清單更新：新增 {len(added)}、下架 {len(removed)}")
+            return self._rebuild()
+
+    @staticmethod
+    def _derive(base, listed):
+        if not base.isascii():
+            return [(base, base, None)]
+        stripped = _MULTIPLIER_PREFIX.sub("", base)
+        if stripped != base and stripped not in listed:
+            return [(stripped.lower(), base, stripped)]
+        return []
+
+    def _resolve(self, target):
+        """俗稱檔的代號 → 上架中的 base（PEPE 只有 1000PEPE 時對應過去）；清單未載入時原樣採用。"""
+        if not self._listed or target in self._listed:
+            return target
+        for base in self._listed:
+            if _MULTIPLIER_PREFIX.sub("", base) == target:
+                return base
+        return None
+
+    # ---- 編譯 ----
+    def _rebuild(self):
+        table = {}
+        for entries in self._derived.values():
+            for key, repl, exact in entries:
+                table[key] = (repl, exact)
+        skipped = set()
+        for name, target in self._nicknames.items():
+            resolved = self._resolve(target)
+            if resolved is None:
+                skipped.add(target)
+                continue
+            # 俗稱檔優先於自動產生的別名
+            table[name.lower() if name.isascii() else name] = (resolved, None)
+        if skipped:
+            print(f"[aliases] 俗稱檔中不在合約清單的代號已略過：{', '.join(sorted(skipped))}")
+        if table == self._compiled[1]:
+            return False
+
+        ascii_words = [k for k in table if k.isascii()]
+        other_words = [k for k in table if not k.isascii()]
+        parts = []
+        ascii_re = _trie_pattern(ascii_words)
+        if ascii_re:
+            parts.append(f"(?<![{_WORD_CHARS}]){ascii_re}(?![{_WORD_CHARS}])")
+        other_re = _trie_pattern(other_words)
+        if other_re:
+            parts.append(other_re)
+        pattern = re.compile("|".join(parts), re.IGNORECASE) if parts else None
+        self._compiled = (pattern, table)
+        self.builds += 1
+        return True
+
+    # ---- 正規化 ----
+    def normalize(self, text):
+        pattern, table = self._compiled
+        if not text or pattern is None:
+            return text
+
+        def repl(m):
+            word = m.group(0)
+            hit = table.get(word.lower() if word.isascii() else word)
+            if hit is None or (hit[1] is not None and word != hit[1]):
+                return word
+            return hit[0]
+
+        return pattern.sub(repl, text)
+
+    def stats(self):
+        pattern, table = self._compiled
+        return {"aliases": len(table), "nicknames": len(self._nicknames), "listed": len(self._listed),
+                "builds": self.builds, "pattern_chars": len(pattern.pattern) if pattern else 0}
+
+_normalizer = None
+_normalizer_lock = threading.Lock()
+
+def get_normalizer():
+    global _normalizer
+    if _normalizer is None:
+        with _normalizer_lock:
+            if _normalizer is None:
+                _normalizer = AliasNormalizer()
+    return _normalizer
+
+def normalize(text):
+    return get_normalizer().normalize(text)
+
+def update_symbols(bases):
+    return get_normalizer().update_symbols(bases)
+
+# === [bench] 與逐條 re.sub 的舊作法比較 ===
+def _bench(messages, extra_bases):
+    import random
+    rng = random.Random(1)
+    norm = AliasNormalizer()
+    bases = {"BTC", "ETH", "BNB", "SOL", "DOGE", "XRP", "LTC", "TRX", "DOT", "TRUMP", "1000PEPE", "币安人生"}
+    bases |= {f"1000{''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(5))}" for _ in range(extra_bases)}
+    norm.update_symbols(bases)
+    _, table = norm._compiled
+    # 舊作法：每個別名一條規則、每則訊息逐條 re.sub(..., flags=re.IGNORECASE)
+    old_rules = [(rf"(?<![{_WORD_CHARS}]){re.escape(k)}(?![{_WORD_CHARS}])" if k.isascii() else re.escape(k), v[0])
+                 for k, v in sorted(table.items(), key=lambda kv: -len(kv[0]))]
+    words = list(table) + ["多", "空", "進場", "市價", "止損", "止盈", "TP", "SL", "100", "3.5", "#", "\n"]
+    msgs = [" ".join(rng.choice(words) for _ in range(rng.randint(5, 40))) for _ in range(messages)]
+
+    def old(text):
+        for pat, rep in old_rules:
+            text = re.sub(pat, rep, text, flags=re.IGNORECASE)
+        return text
+
+    for label, fn in (("逐條 re.sub", old), ("單一正規式", norm.normalize)):
+        t0 = time.perf_counter()
+        for m in msgs:
+            fn(m)
+        per = (time.perf_counter() - t0) / len(msgs) * 1e6
+        print(f"  {label:<10} {per:8.1f} µs/則")
+    t0 = time.perf_counter()
+    norm.update_symbols(bases | {"NEWCOIN"})
+    print(f"  新增一個 symbol 後重建 {(time.perf_counter() - t0) * 1000:.2f} ms；清單不變時："
+          f"{'重建' if norm.update_symbols(bases | {'NEWCOIN'}) else '不重建'}")
+    print(f"  別名 {len(table)} 個，正規式 {norm.stats()['pattern_chars']} 字元")
+
+def main():
+    ap = argparse.ArgumentParser(description="幣種俗稱正規化")
+    ap.add_argument("text", nargs="*")
+    ap.add_argument("--bench", action="store_true")
+    ap.add_argument("--messages", type=int, default=2000)
+    ap.add_argument("--extra-bases", type=int, default=300, help="bench 時額外產生的 1000x 合約數（模擬完整合約清單）")
+    args = ap.parse_args()
+    if args.bench:
+        _bench(args.messages, args.extra_bases)
+    for text in args.text:
+        print(normalize(text))
+
+if __name__ == "__main__":
+    main()
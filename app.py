@@ -0,0 +1,300 @@
+# app.py
+"""
+應用程式 context：金鑰、幣安帳戶與 Telethon 客戶端都在第一次使用時才建立。
+
+import 任何模組都不會讀金鑰檔、連網或建立客戶端，login_once.py、replay、bench 與離線工具只付自己用到的成本。
+會動到帳戶的初始化（切換雙向持倉、讀取可用保證金）只在 chao_bi.py 啟動時明確呼叫 connect_binance()。
+
+  金鑰：config.SECRET_FILES（預設 ~/.secret/telegram.txt、~/.secret/binance.txt），同名環境變數優先
+  多帳戶：config.BINANCE_ACCOUNTS；with use_account(acct): 區塊內（含 run_in_pool 丟出去的工作）
+         get_binance_client() / available_margin() 都指向該帳戶，區塊外為主帳戶
+  replay / 測試：set_binance_client(mock)、set_secret(name, value) 直接注入，不會讀檔
+"""
+import os
+import threading
+import contextvars
+from contextlib import contextmanager
+from config import (
+    SECRET_FILES, REAL_FUTURES_BASE_URL, CLIENT_SESSION_NAME, load_api_keys,
+    BINANCE_ACCOUNTS, MAX_INITIAL_MARGIN_PCT,
+)
+from logs import get_printer
+print = get_printer("app")
+
+SECRET_NAMES = ("API_ID", "API_HASH", "BOT_TOKEN", "BOT_CHAT_ID", "BINANCE_API_KEY", "BINANCE_API_SECRET")
+_UNSET = object()
+# 目前作用中的幣安帳戶；None = 主帳戶。scheduler 的池會帶上呼叫端的 contextvars
+_current_account = contextvars.ContextVar("binance_account", default=None)
+
+class Account:
+    """
+    一個幣安期貨帳戶。key_source() 回傳 (api_key, api_secret)，第一次取用 client 才呼叫。
+    margin_pct：每筆初始保證金占可用餘額的比例；max_leverage：此帳戶的槓桿上限（None = 不限制）。
+    """
+
+    def __init__(self, name, key_source, margin_pct=None, max_leverage=None, primary=False):
+        self.name = name
+        self.primary = primary
+        self.margin_pct = float(margin_pct) if margin_pct is not None else float(MAX_INITIAL_MARGIN_PCT)
+        self.max_leverage = int(max_leverage) if max_leverage else None
+        self.available_margin = 0.0          # connect() 讀到的 availableBalance（USDT）
+        self._key_source = key_source
+        self._client = _UNSET
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"Account({self.name})"
+
+    @property
+    def client(self):
+        """UMFutures（含 metrics 計時）；第一次取用才建立，建立本身不連網。金鑰缺少或初始化失敗時為 None。"""
+        if self._client is _UNSET:
+            with self._lock:
+                if self._client is _UNSET:
+                    self._client = self._build()
+        return self._client
+
+    def _build(self):
+        key, secret = self._key_source()
+        if not key or not secret:
+            print(f"[Binance] [error]: 帳戶 {self.name} 找不到金鑰檔或金鑰不完整。")
+            return None
+        try:
+            from binance.um_futures import UMFutures
+        except ImportError as e:
+            print(f"[error] 致命錯誤：找不到 'binance.um_futures' 模組！錯誤詳情: {e}")
+            return None
+        from metrics import instrument_client
+        return instrument_client(UMFutures(key=key, secret=secret, base_url=REAL_FUTURES_BASE_URL))
+
+    def set_client(self, client):
+        with self._lock:
+            self._client = client
+
+    def cap_leverage(self, leverage):
+        return min(int(leverage), self.max_leverage) if self.max_leverage else int(leverage)
+
+    def connect(self):
+        """
+        確認 / 切換為雙向持倉並讀取可用保證金。
+        失敗（金鑰錯誤、保證金為 0）時把客戶端設為 None 並回傳 False。
+        """
+        from binance.error import ClientError
+        client = self.client
+        if client is None:
+            return False
+        tag = f"[Binance:{self.name}]"
+        try:
+            try:
+                position_mode = client.get_position_mode()
+                if position_mode.get('dualSidePosition') == False:
+                    print(f"{tag} [warning]: 偵測到帳戶為「單向持倉」，正在嘗試切換至「雙向持倉」...")
+                    client.change_position_mode(dualSidePosition=True)
+                    print(f"{tag} 資訊：已成功切換至「雙向持倉 (Hedge Mode)」。")
+                else:
+                    print(f"{tag} 資訊：帳戶已處於「雙向持倉 (Hedge Mode)」。")
+            except ClientError as e:
+                if e.error_code == -4059: # "No need to change position side."
+                    print(f"{tag} 資訊：帳戶已處於「雙向持倉 (Hedge Mode)」。")
+                else:
+                    raise
+
+            account_info = client.account()
+            self.available_margin = float(account_info['availableBalance'])
+            if self.available_margin <= 0:
+                print(f"{tag} [error]: 總可用保證金 (availableBalance) 為 0。")
+                self.set_client(None)
+                return False
+            print(f"{tag} [info]: 幣安 *真實環境* 連接成功！\n"
+                  f"   多幣種保證金 總可用餘額 (availableBalance): {self.available_margin} USDT")
+            return True
+        except ClientError as e:
+            print(f"{tag} [error]: API Key 或 Secret 錯誤。{e}")
+        except Exception as e:
+            print(f"{tag} [error]: 連接失敗: {e}")
+        self.set_client(None)
+        return False
+
+class AppContext:
+    def __init__(self, secret_files=SECRET_FILES, account_specs=BINANCE_ACCOUNTS):
+        self.secret_files = tuple(secret_files)
+        self.account_specs = list(account_specs) or [{"name": "main"}]
+        self._secrets = None
+        self._overrides = {}
+        self._accounts = None
+        self._telegram = _UNSET
+        self._lock = threading.RLock()
+
+    # ---- 金鑰 ----
+    def secret(self, name, default=None):
+        if name in self._overrides:
+            return self._overrides[name]
+        if self._secrets is None:
+            with self._lock:
+                if self._secrets is None:
+                    loaded = load_api_keys(*self.secret_files)
+                    for key in SECRET_NAMES:
+                        if os.environ.get(key):
+                            loaded[key] = os.environ[key]
+                    self._secrets = loaded
+        return self._secrets.get(name) or default
+
+    def set_secret(self, name, value):
+        self._overrides[name] = value
+
+    # ---- 幣安帳戶 ----
+    @property
+    def accounts(self):
+        """全部設定的帳戶（第一個為主帳戶）；建立 Account 不會讀金鑰檔。"""
+        if self._accounts is None:
+            with self._lock:
+                if self._accounts is None:
+                    self._accounts = [self._make_account(spec, i) for i, spec in enumerate(self.account_specs)]
+        return self._accounts
+
+    def _make_account(self, spec, index):
+        primary = index == 0
+        name = spec.get("name") or ("main" if primary else f"acct{index}")
+        if primary:
+            def keys():
+                return self.secret("BINANCE_API_KEY"), self.secret("BINANCE_API_SECRET")
+        else:
+            def keys():
+                suffix = name.upper()
+                loaded = load_api_keys(spec["secret_file"]) if spec.get("secret_file") else {}
+                return (os.environ.get(f"BINANCE_API_KEY_{suffix}") or loaded.get("BINANCE_API_KEY"),
+                        os.environ.get(f"BINANCE_API_SECRET_{suffix}") or loaded.get("BINANCE_API_SECRET"))
+        return Account(name, keys, spec.get("margin_pct"), spec.get("max_leverage"), primary=primary)
+
+    @property
+    def primary(self):
+        return self.accounts[0]
+
+    def account(self, name=None):
+        if name is None:
+            return self.primary
+        for acct in self.accounts:
+            if acct.name == name:
+                return acct
+        raise KeyError(f"未知的幣安帳戶：{name}")
+
+    @property
+    def current(self):
+        return _current_account.get() or self.primary
+
+    @property
+    def binance(self):
+        """目前帳戶（use_account 區塊外為主帳戶）的 UMFutures。"""
+        return self.current.client
+
+    def set_binance_client(self, client, name=None):
+        self.account(name).set_client(client)
+
+    @property
+    def available_margin(self):
+        return self.current.available_margin
+
+    @available_margin.setter
+    def available_margin(self, value):
+        self.primary.available_margin = value
+
+    def connect_binance(self):
+        """
+        啟動時呼叫一次：逐一連接所有帳戶（雙向持倉 + 可用保證金）。
+        主帳戶失敗回傳 False；子帳戶失敗只停用該帳戶（客戶端設為 None，不參與下單）。
+        """
+        if not self.primary.connect():
+            return False
+        for acct in self.accounts[1:]:
+            if not acct.connect():
+                print(f"[warning] 子帳戶 {acct.name} 連接失敗，本次執行不會對它下單。")
+        return True
+
+    def add_account(self, name, client, available_margin=0.0, margin_pct=None, max_leverage=None):
+        """直接注入一個已建立客戶端的帳戶（replay / 測試用，不讀金鑰）。"""
+        acct = Account(name, lambda: (None, None), margin_pct, max_leverage)
+        acct.set_client(client)
+        acct.available_margin = float(available_margin)
+        with self._lock:
+            self.accounts.append(acct)
+        return acct
+
+    def active_accounts(self):
+        """客戶端可用的帳戶（依設定順序）。"""
+        return [a for a in self.accounts if a.client is not None]
+
+    # ---- Telegram ----
+    @property
+    def telegram(self):
+        """Telethon TelegramClient；第一次取用才 import telethon 並建立（不連線）。金鑰缺少時為 None。"""
+        if self._telegram is _UNSET:
+            with self._lock:
+                if self._telegram is _UNSET:
+                    self._telegram = self._build_telegram()
+        return self._telegram
+
+    def _build_telegram(self):
+        api_id, api_hash = self.secret("API_ID"), self.secret("API_HASH")
+        if not api_id or not api_hash:
+            print("[error] 找不到 'telegram.txt' 或金鑰不完整。")
+            return None
+        try:
+            from telethon import TelegramClient
+        except ImportError as e:
+            print(f"[error] 致命錯誤：找不到 'telethon' 模組！錯誤詳情: {e}")
+            return None
+        try:
+            return TelegramClient(CLIENT_SESSION_NAME, api_id, api_hash)
+        except Exception as e:
+            print(f"[error] Telethon 錯誤: {e}")
+            return None
+
+_app = None
+_app_lock = threading.Lock()
+
+def get_app():
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = AppContext()
+    return _app
+
+def get_secret(name, default=None):
+    return get_app().secret(name, default)
+
+def set_secret(name, value):
+    get_app().set_secret(name, value)
+
+def get_binance_client():
+    return get_app().binance
+
+def set_binance_client(client, account=None):
+    get_app().set_binance_client(client, account)
+
+def get_telegram_client():
+    return get_app().telegram
+
+def connect_binance():
+    return get_app().connect_binance()
+
+def available_margin():
+    return get_app().available_margin
+
+def get_accounts():
+    """可下單的幣安帳戶（主帳戶在前）。"""
+    return get_app().active_accounts()
+
+def current_account():
+    return get_app().current
+
+@contextmanager
+def use_account(account):
+    """區塊內的幣安呼叫（含 run_in_pool / run_in_lane 丟出去的工作）改用 account（Account 或帳戶名稱；None = 主帳戶）。"""
+    if account is not None and not isinstance(account, Account):
+        account = get_app().account(account)
+    token = _current_account.set(account)
+    try:
+        yield account or get_app().primary
+    finally:
+        _current_account.reset(token)
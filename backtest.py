@@ -0,0 +1,440 @@
+# backtest.py
+"""
+Python 風控（select_sl_tp_with_user_pref + sanitize_targets）的離線回測與參數掃描。
+
+用法：
+  先把歷史 K 線存到 BACKTEST_KLINES_DIR（公開 API，不需要金鑰；已存在的檔案只補新的部分）：
+    python backtest.py fetch --journal --days 90                    # 取 trade_journal 內出現過的 symbol
+    python backtest.py fetch --symbols BTCUSDT ETHUSDT --days 180
+    python backtest.py import-csv BTCUSDT-5m-2025-01.csv --symbol BTCUSDT   # data.binance.vision 的月檔
+  以目前 config 的參數回測：
+    python backtest.py run --journal --days 90
+    python backtest.py run --csv signals.csv
+  參數掃描（多核心，start:stop:step 或逗號列表）：
+    python backtest.py sweep --journal --days 90 --min-stop 0.002:0.012:0.001 --atr-k 0.5:3:0.25 \\
+        --rr 1:3:0.25 --rr-max 2,3,4 --workers 8 --top 20 --out sweep.csv
+
+訊號來源：
+  --journal：trade_journal 已結案的交易；方向 / 下單型態 / 進場價取自紀錄，使用者 SL/TP 從原始訊息文字解析
+            （紀錄中的 stop_loss / take_profit 已經過當時的風控，不能當成使用者給的值）
+  --csv    ：欄位 ts,symbol,side,entry,sl,tp（ts 為 epoch 秒 / 毫秒或 ISO 時間；entry 空白 = 市價；sl / tp 可空白）
+
+模擬方式（每筆訊號只前處理一次，與參數無關）：
+  ATR 取訊號前已收盤的 K 線；市價單以下一根開盤價成交，LIMIT 單在 AUTO_CANCEL_SECONDS 內被觸及才成交。
+  成交後 BACKTEST_HORIZON_HOURS 內的最低 / 最高價做前綴極值，SL / TP 第一次被觸及的 K 線以 searchsorted 一次求出，
+  所有參數組合共用；同一根同時觸及 SL 與 TP 時保守地算 SL。期限內都沒觸及則以最後收盤價平倉。
+  報酬為名目價值的百分比（扣 BACKTEST_FEE_PCT），與倉位大小 / 槓桿無關。sanitize_targets 的 minPrice / maxPrice 邊界不模擬。
+"""
+import os
+import re
+import csv
+import time
+import argparse
+import itertools
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import indicators
+from config import (
+    MIN_STOP_DISTANCE_PCT, ATR_K, ATR_PERIOD, RR_DEFAULT, RR_MAX, AUTO_CANCEL_SECONDS,
+    REAL_FUTURES_BASE_URL,
+    BACKTEST_KLINES_DIR, BACKTEST_INTERVAL, BACKTEST_HORIZON_HOURS, BACKTEST_FEE_PCT,
+)
+
+PARAM_NAMES = ("min_stop_pct", "atr_k", "rr_default", "rr_max")
+_UNIT_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000}
+_FETCH_LIMIT = 1500   # 幣安 /fapi/v1/klines 單次上限
+
+def interval_ms(interval):
+    return int(interval[:-1]) * _UNIT_MS[interval[-1]]
+
+# === [store] K 線儲存（每個 symbol / 週期一個 .npz：open_time int64 毫秒 + ohlcv (n, 5)）===
+def klines_path(symbol, interval=BACKTEST_INTERVAL):
+    return os.path.join(BACKTEST_KLINES_DIR, f"{symbol}_{interval}.npz")
+
+def load_klines(symbol, interval=BACKTEST_INTERVAL):
+    """回傳 (open_time, ohlcv)；沒有存檔回傳 None。"""
+    path = klines_path(symbol, interval)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as z:
+        return z["open_time"], z["ohlcv"]
+
+def save_klines(symbol, interval, open_time, ohlcv):
+    """與既有存檔合併（依 open_time 去重、排序）後寫回；回傳合併後的根數。"""
+    old = load_klines(symbol, interval)
+    if old is not None:
+        open_time = np.concatenate([old[0], open_time])
+        ohlcv = np.concatenate([old[1], ohlcv])
+    # 新資料在後面，反轉後 unique 取第一次出現 = 保留較新的那份
+    _, idx = np.unique(open_time[::-1], return_index=True)
+    idx = len(open_time) - 1 - idx
+    os.makedirs(BACKTEST_KLINES_DIR, exist_ok=True)
+    tmp = klines_path(symbol, interval) + ".tmp.npz"
+    np.savez(tmp, open_time=open_time[idx].astype(np.int64), ohlcv=ohlcv[idx])
+    os.replace(tmp, klines_path(symbol, interval))
+    return len(idx)
+
+def _rows_to_arrays(rows):
+    rows = list(rows)
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, 5))
+    return np.array([int(r[0]) for r in rows], dtype=np.int64), indicators.klines_to_array(rows)
+
+def fetch_klines(symbol, days, interval=BACKTEST_INTERVAL):
+    """以公開 API 抓最近 days 天的 K 線（已存的部分只補新的）；回傳存檔根數。"""
+    from binance.um_futures import UMFutures
+    client = UMFutures(base_url=REAL_FUTURES_BASE_URL)
+    step = interval_ms(interval)
+    now_ms = int(time.time() * 1000)
+    start = now_ms - int(days * 86_400_000)
+    old = load_klines(symbol, interval)
+    if old is not None and len(old[0]) and old[0][0] <= start:
+        start = int(old[0][-1])   # 最後一根可能尚未收盤，重抓覆蓋
+    rows = []
+    while start < now_ms:
+        batch = client.klines(symbol=symbol, interval=interval, startTime=start, limit=_FETCH_LIMIT)
+        if not batch:
+            break
+        rows.extend(batch)
+        start = int(batch[-1][0]) + step
+        if len(batch) < _FETCH_LIMIT:
+            break
+    return save_klines(symbol, interval, *_rows_to_arrays(rows))
+
+def import_csv(path, symbol, interval=BACKTEST_INTERVAL):
+    """匯入 data.binance.vision 格式的 K 線 CSV（open_time,open,high,low,close,volume,...；標題列可有可無）。"""
+    with open(path, newline="") as f:
+        rows = [r for r in csv.reader(f) if r and r[0].strip().isdigit()]
+    return save_klines(symbol, interval, *_rows_to_arrays(rows))
+
+# === [signals] 訊號來源 ===
+_NUM = r"(\d+(?:\.\d+)?)"
+_SL_RE = re.compile(rf"(?:止損|止损|SL)[：: ]*{_NUM}", re.IGNORECASE)
+_TP_RE = re.compile(rf"(?:止盈|TP)[：: \n]*{_NUM}", re.IGNORECASE)
+
+def _num(s):
+    try:
+        return float(s) if s not in (None, "") else None
+    except ValueError:
+        return None
+
+def _first_num(pattern, text):
+    m = pattern.search(text or "")
+    return float(m.group(1)) if m else None
+
+def _parse_ts(s):
+    s = str(s).strip()
+    try:
+        v = float(s)
+        return v / 1000 if v > 1e11 else v
+    except ValueError:
+        return datetime.fromisoformat(s).timestamp()
+
+def signals_from_journal(since=None, until=None, symbol=None, channel=None):
+    import trade_journal
+    out = []
+    for r in trade_journal.query_trades(symbol, channel, since=since, until=until, limit=10**9):
+        ts = r.get("signal_received_at") or r.get("order_sent_at")
+        if not ts or r.get("position_side") not in ("LONG", "SHORT"):
+            continue
+        text = r.get("signal_text")
+        out.append({
+            "ts": ts, "symbol": r["symbol"], "side": "BUY" if r["position_side"] == "LONG" else "SELL",
+            "entry": _num(r.get("entry_price")) if (r.get("order_type") or "").upper() == "LIMIT" else None,
+            "sl": _first_num(_SL_RE, text), "tp": _first_num(_TP_RE, text),
+        })
+    return sorted(out, key=lambda s: s["ts"])
+
+def signals_from_csv(path):
+    out = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            side = (r.get("side") or "").strip().upper()
+            side = {"LONG": "BUY", "SHORT": "SELL"}.get(side, side)
+            if side not in ("BUY", "SELL") or not r.get("symbol"):
+                continue
+            out.append({"ts": _parse_ts(r["ts"]), "symbol": r["symbol"].strip().upper(), "side": side,
+                        "entry": _num(r.get("entry")), "sl": _num(r.get("sl")), "tp": _num(r.get("tp"))})
+    return sorted(out, key=lambda s: s["ts"])
+
+# === [prepare] 每筆訊號的成交價、ATR 與成交後的前綴極值（與參數無關，只算一次）===
+def prepare(signals, interval=BACKTEST_INTERVAL, horizon_hours=BACKTEST_HORIZON_HOURS,
+            fill_seconds=AUTO_CANCEL_SECONDS, atr_period=ATR_PERIOD):
+    """
+    回傳 dict of arrays（S = 成交的訊號數，H = 追蹤根數）：
+      entry / is_buy / atr / user_sl / user_tp / last_close / ts：(S,)，缺值為 NaN
+      run_low / run_high：(S, H) 成交後的最低價 / 最高價前綴極值（資料不足的尾端沿用最後的值）
+      symbols：(S,)；skipped：{原因: 筆數}
+    """
+    step = interval_ms(interval)
+    horizon = max(1, int(horizon_hours * 3_600_000 // step))
+    fill_bars = max(1, int(fill_seconds * 1000 // step))
+    cache, rows, skipped = {}, [], {}
+
+    def skip(reason):
+        skipped[reason] = skipped.get(reason, 0) + 1
+
+    for s in signals:
+        if s["symbol"] not in cache:
+            k = load_klines(s["symbol"], interval)
+            cache[s["symbol"]] = None if k is None else (k[0], k[1], indicators.atr(k[1], atr_period))
+        data = cache[s["symbol"]]
+        if data is None:
+            skip("沒有 K 線")
+            continue
+        open_time, ohlcv, atr_series = data
+        ts_ms = int(s["ts"] * 1000)
+        i = int(np.searchsorted(open_time, ts_ms, side="left"))   # 訊號後第一根
+        # 訊號當下已收盤的最後一根（open_time + step <= 訊號時間）；i - 1 通常還在進行中，不能用
+        closed = int(np.searchsorted(open_time, ts_ms - step, side="right")) - 1
+        if i == 0 or i >= len(open_time):
+            skip("超出 K 線範圍")
+            continue
+        high, low = ohlcv[:, indicators.HIGH], ohlcv[:, indicators.LOW]
+        if s["entry"] is None:
+            j, entry = i, ohlcv[i, indicators.OPEN]
+        else:
+            entry = s["entry"]
+            touched = np.nonzero((low[i:i + fill_bars] <= entry) & (high[i:i + fill_bars] >= entry))[0]
+            if not len(touched):
+                skip("LIMIT 未成交")
+                continue
+            j = i + int(touched[0])
+        end = min(j + horizon, len(open_time))
+        run_low = np.full(horizon, np.nan)
+        run_high = np.full(horizon, np.nan)
+        run_low[:end - j] = np.minimum.accumulate(low[j:end])
+        run_high[:end - j] = np.maximum.accumulate(high[j:end])
+        run_low[end - j:] = run_low[end - j - 1]
+        run_high[end - j:] = run_high[end - j - 1]
+        atr_value = atr_series[closed] if closed >= 0 else np.nan
+        rows.append((s, entry, atr_value, ohlcv[end - 1, indicators.CLOSE], run_low, run_high))
+
+    def col(fn):
+        return np.array([fn(r) for r in rows], dtype=np.float64)
+
+    return {
+        "ts": col(lambda r: r[0]["ts"]),
+        "symbols": np.array([r[0]["symbol"] for r in rows]),
+        "is_buy": np.array([r[0]["side"] == "BUY" for r in rows], dtype=bool),
+        "entry": col(lambda r: r[1]),
+        "atr": col(lambda r: r[2]),
+        "user_sl": col(lambda r: np.nan if r[0]["sl"] is None else r[0]["sl"]),
+        "user_tp": col(lambda r: np.nan if r[0]["tp"] is None else r[0]["tp"]),
+        "last_close": col(lambda r: r[3]),
+        "run_low": np.array([r[4] for r in rows]).reshape(len(rows), horizon),
+        "run_high": np.array([r[5] for r in rows]).reshape(len(rows), horizon),
+        "skipped": skipped,
+    }
+
+# === [engine] 向量化風控與 SL/TP 模擬 ===
+def risk_distances(prep, params):
+    """
+    select_sl_tp_with_user_pref + sanitize_targets 的向量化版本。params：(P, 4) 依 PARAM_NAMES 排列。
+    回傳 (sl_dist, tp_dist)：(P, S)，皆為距離進場價的正值。
+      距離下限 = max(ATR × atr_k, entry × min_stop_pct)（沒有 ATR 時只用百分比）
+      使用者 SL 方向正確且距離 ≥ 下限 → 採用，否則 SL = 下限
+      使用者 TP 方向正確且不超過 預設 TP 距離 × rr_max → 採用，否則 TP = rr_default × SL 距離
+    """
+    min_pct, atr_k, rr, rr_max = (params[:, i:i + 1] for i in range(4))
+    entry, sign = prep["entry"], np.where(prep["is_buy"], 1.0, -1.0)
+    floor = np.fmax(prep["atr"] * atr_k, entry * min_pct)
+    user_sl_dist = (entry - prep["user_sl"]) * sign
+    with np.errstate(invalid="ignore"):
+        use_user_sl = (user_sl_dist > 0) & (user_sl_dist >= floor)
+    sl_dist = np.where(use_user_sl, user_sl_dist, floor)
+    default_tp = rr * sl_dist
+    user_tp_dist = (prep["user_tp"] - entry) * sign
+    with np.errstate(invalid="ignore"):
+        use_user_tp = (user_tp_dist > 0) & ~(user_tp_dist > default_tp * rr_max)
+    return sl_dist, np.where(use_user_tp, user_tp_dist, default_tp)
+
+def simulate(prep, params, fee_pct=BACKTEST_FEE_PCT):
+    """
+    回傳 (ret, outcome, bars)：(P, S)。ret 為扣費後報酬（名目價值比例）；
+    outcome：1 = TP、-1 = SL、0 = 期限內未觸及（以最後收盤價平倉）；bars 為出場前經過的 K 線數。
+    """
+    sl_dist, tp_dist = risk_distances(prep, params)
+    P, S = sl_dist.shape
+    H = prep["run_low"].shape[1]
+    sl_idx = np.empty((P, S), dtype=np.int64)
+    tp_idx = np.empty((P, S), dtype=np.int64)
+    for s in range(S):
+        e, low, high = prep["entry"][s], prep["run_low"][s], prep["run_high"][s]
+        # 前綴極值單調：-run_low 與 run_high 皆遞增，第一次觸及的位置即 searchsorted 的插入點
+        if prep["is_buy"][s]:
+            sl_idx[:, s] = np.searchsorted(-low, -(e - sl_dist[:, s]), side="left")
+            tp_idx[:, s] = np.searchsorted(high, e + tp_dist[:, s], side="left")
+        else:
+            sl_idx[:, s] = np.searchsorted(high, e + sl_dist[:, s], side="left")
+            tp_idx[:, s] = np.searchsorted(-low, -(e - tp_dist[:, s]), side="left")
+    hit_sl = (sl_idx < H) & (sl_idx <= tp_idx)
+    hit_tp = (tp_idx < H) & ~hit_sl
+    sign = np.where(prep["is_buy"], 1.0, -1.0)
+    timeout_ret = (prep["last_close"] - prep["entry"]) * sign / prep["entry"]
+    ret = np.where(hit_sl, -sl_dist / prep["entry"], np.where(hit_tp, tp_dist / prep["entry"], timeout_ret)) - fee_pct
+    outcome = np.where(hit_sl, -1, np.where(hit_tp, 1, 0)).astype(np.int8)
+    bars = np.where(hit_sl, sl_idx, np.where(hit_tp, tp_idx, H))
+    return ret, outcome, bars
+
+def summarize_returns(ret, outcome, bars):
+    """每組參數一列：trades / win_rate / tp_rate / sl_rate / avg_ret / total_ret / profit_factor / max_dd / avg_bars。"""
+    n = ret.shape[1]
+    gains = np.where(ret > 0, ret, 0).sum(axis=1)
+    losses = -np.where(ret < 0, ret, 0).sum(axis=1)
+    cum = np.cumsum(ret, axis=1)
+    max_dd = np.max(np.maximum.accumulate(np.maximum(cum, 0), axis=1) - cum, axis=1) if n else np.zeros(len(ret))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "trades": np.full(len(ret), n),
+            "win_rate": (ret > 0).mean(axis=1),
+            "tp_rate": (outcome == 1).mean(axis=1),
+            "sl_rate": (outcome == -1).mean(axis=1),
+            "avg_ret": ret.mean(axis=1),
+            "total_ret": ret.sum(axis=1),
+            "profit_factor": np.where(losses > 0, gains / losses, np.inf),
+            "max_dd": max_dd,
+            "avg_bars": bars.mean(axis=1),
+        }
+
+# === [sweep] 參數掃描（ProcessPoolExecutor；前處理結果只在 worker 啟動時傳一次）===
+_worker_prep = None
+
+def _init_worker(prep):
+    global _worker_prep
+    _worker_prep = prep
+
+def _run_chunk(params, fee_pct):
+    return summarize_returns(*simulate(_worker_prep, params, fee_pct))
+
+def sweep(prep, grid, workers=None, chunk=256, fee_pct=BACKTEST_FEE_PCT):
+    """grid：(P, 4)。回傳與 summarize_returns 相同欄位、長度 P 的結果（順序與 grid 相同）。"""
+    chunks = [grid[i:i + chunk] for i in range(0, len(grid), chunk)]
+    if workers == 1 or len(chunks) == 1:
+        _init_worker(prep)
+        parts = [_run_chunk(c, fee_pct) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(prep,)) as pool:
+            parts = list(pool.map(_run_chunk, chunks, itertools.repeat(fee_pct)))
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+def parse_range(spec):
+    """'0.002:0.01:0.001'（含終點）或 '1,1.5,2' → list[float]。"""
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        n = int(round((stop - start) / step)) + 1
+        return [round(start + i * step, 10) for i in range(max(n, 1))]
+    return [float(x) for x in spec.split(",") if x]
+
+def build_grid(min_stop, atr_k, rr, rr_max):
+    return np.array(list(itertools.product(min_stop, atr_k, rr, rr_max)), dtype=np.float64).reshape(-1, 4)
+
+def current_params():
+    return build_grid([float(MIN_STOP_DISTANCE_PCT)], [float(ATR_K)], [float(RR_DEFAULT)], [float(RR_MAX)])
+
+# === [cli] ===
+def _print_rows(grid, res, order, top):
+    print(f"  {'min_stop':>8} {'atr_k':>6} {'rr':>5} {'rr_max':>6} | {'trades':>6} {'win%':>6} {'tp%':>6} {'sl%':>6} "
+          f"{'avg%':>7} {'total%':>8} {'PF':>6} {'maxDD%':>7} {'bars':>6}")
+    for i in order[:top]:
+        p = grid[i]
+        print(f"  {p[0]:>8.4f} {p[1]:>6.2f} {p[2]:>5.2f} {p[3]:>6.2f} | {int(res['trades'][i]):>6} "
+              f"{res['win_rate'][i] * 100:>6.1f} {res['tp_rate'][i] * 100:>6.1f} {res['sl_rate'][i] * 100:>6.1f} "
+              f"{res['avg_ret'][i] * 100:>7.3f} {res['total_ret'][i] * 100:>8.2f} {res['profit_factor'][i]:>6.2f} "
+              f"{res['max_dd'][i] * 100:>7.2f} {res['avg_bars'][i]:>6.1f}")
+
+def _write_csv(path, grid, res):
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(list(PARAM_NAMES) + list(res))
+        for i in range(len(grid)):
+            w.writerow(list(grid[i]) + [res[k][i] for k in res])
+
+def _load_signals(args):
+    if args.csv:
+        return signals_from_csv(args.csv)
+    since = time.time() - args.days * 86400 if args.days else None
+    return signals_from_journal(since=since, symbol=args.symbol, channel=args.channel)
+
+def _add_source_args(p):
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--journal", action="store_true", help="使用 trade_journal 已結案的交易")
+    src.add_argument("--csv", help="訊號 CSV：ts,symbol,side,entry,sl,tp")
+    p.add_argument("--days", type=float, default=None, help="--journal 只取最近 N 天")
+    p.add_argument("--symbol")
+    p.add_argument("--channel")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Python 風控回測 / 參數掃描")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("fetch", help="下載歷史 K 線")
+    p.add_argument("--symbols", nargs="+")
+    p.add_argument("--journal", action="store_true", help="取 trade_journal 內出現過的 symbol")
+    p.add_argument("--days", type=float, default=90)
+    p = sub.add_parser("import-csv", help="匯入 data.binance.vision 的 K 線 CSV")
+    p.add_argument("path")
+    p.add_argument("--symbol", required=True)
+    for name in ("run", "sweep"):
+        p = sub.add_parser(name)
+        _add_source_args(p)
+        p.add_argument("--horizon-hours", type=float, default=BACKTEST_HORIZON_HOURS)
+        p.add_argument("--fee", type=float, default=BACKTEST_FEE_PCT, help="來回手續費（名目價值比例）")
+        if name == "sweep":
+            p.add_argument("--min-stop", default="0.002:0.012:0.001")
+            p.add_argument("--atr-k", default="0.5:3:0.25")
+            p.add_argument("--rr", default="1:3:0.25")
+            p.add_argument("--rr-max", default="2,3,4")
+            p.add_argument("--workers", type=int, default=None, help="預設 = CPU 核心數")
+            p.add_argument("--sort", default="total_ret",
+                           choices=["total_ret", "avg_ret", "profit_factor", "win_rate", "max_dd"])
+            p.add_argument("--top", type=int, default=20)
+            p.add_argument("--out", help="全部組合的結果寫成 CSV")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "import-csv":
+        print(f"[backtest] {args.symbol} 共 {import_csv(args.path, args.symbol)} 根")
+        return
+    if args.cmd == "fetch":
+        symbols = set(args.symbols or [])
+        if args.journal:
+            symbols |= {s["symbol"] for s in signals_from_journal(since=time.time() - args.days * 86400)}
+        if not symbols:
+            raise SystemExit("請指定 --symbols 或 --journal")
+        for sym in sorted(symbols):
+            print(f"[backtest] {sym} 共 {fetch_klines(sym, args.days)} 根")
+        return
+
+    t0 = time.time()
+    signals = _load_signals(args)
+    prep = prepare(signals, horizon_hours=args.horizon_hours)
+    n = len(prep["entry"])
+    skipped = "、".join(f"{k} {v}" for k, v in prep["skipped"].items()) or "無"
+    print(f"[backtest] 訊號 {len(signals)} 筆，可模擬 {n} 筆（略過：{skipped}），前處理 {time.time() - t0:.2f}s")
+    if not n:
+        raise SystemExit(1)
+    if args.cmd == "run":
+        grid = current_params()
+        res = summarize_returns(*simulate(prep, grid, args.fee))
+        _print_rows(grid, res, [0], 1)
+        return
+
+    grid = build_grid(parse_range(args.min_stop), parse_range(args.atr_k), parse_range(args.rr), parse_range(args.rr_max))
+    t1 = time.time()
+    res = sweep(prep, grid, workers=args.workers, fee_pct=args.fee)
+    elapsed = time.time() - t1
+    print(f"[backtest] {len(grid)} 組參數 × {n} 筆訊號，耗時 {elapsed:.2f}s（{len(grid) * n / max(elapsed, 1e-9):,.0f} 筆模擬/秒）")
+    key = res[args.sort]
+    order = np.argsort(key if args.sort == "max_dd" else -key, kind="stable")
+    _print_rows(grid, res, order, args.top)
+    print("  目前 config：")
+    base = current_params()
+    _print_rows(base, summarize_returns(*simulate(prep, base, args.fee)), [0], 1)
+    if args.out:
+        _write_csv(args.out, grid, res)
+        print(f"[backtest] 結果已寫入 {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# bench_e2e.py
+"""
+端到端延遲 benchmark：訊號 → 開倉單送達交易所、成交 → SL/TP 掛上（dry-run，使用 mock_binance 的本地替身）。
+
+用法：
+  python bench_e2e.py                                   # 預設 60 則訊號，每秒 5 則，一半 LIMIT 一半市價
+  python bench_e2e.py --signals 200 --rate 20 --binance-latency 0.08 --binance-jitter 0.05
+  python bench_e2e.py --user-stream                     # 以 ORDER_TRADE_UPDATE 推送驅動，而非只靠輪詢
+  python bench_e2e.py --compare                         # 輪詢 vs user stream 各跑一次並排比較
+  python bench_e2e.py --error-rate 0.02 --inject change_leverage:-4028:5,new_order:-1003:2
+  python bench_e2e.py --signals 6 --limit-ratio 1 --limit-offset 0.05 --partial-fill 0.5 --fill-after 20 \
+                     --fill-wait 30 --inject new_order.STOP_MARKET:-1001:3
+                                                        # 部分成交後掛 SL 失敗：依退避重試補掛，不必等到完全成交
+
+流程直接走 replay.run_replay（同一個訊息 handler、OrderTracker、執行緒池），mock 撮合引擎在背景成交
+LIMIT 單與觸發 SL/TP。結束後以 mock 的成交時間與 trade_journal 的生命週期時間點計算：
+  signal→entry：收到訊號 → 開倉單被 mock 交易所接受
+  fill→exit   ：開倉單第一次成交（mock 撮合時間）→ SL/TP 掛上（journal exits_attached_at）
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+
+import replay
+from mock_binance import DEFAULT_MOCK_PRICES
+
+def _pct(samples, q):
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(len(s) * q))]
+
+def bench_messages(n, rate, symbols, limit_ratio, seed=None, limit_offset=0.0):
+    """
+    全部都是可成交的訊號：limit_ratio 比例帶進場價（≈ mock 目前價格的 LIMIT），其餘為市價單。
+    limit_offset > 0 時進場價往不利成交的方向偏移這個比例（做多掛低、做空掛高），LIMIT 單只會依 fill-after 逐步成交。
+    """
+    rng = random.Random(seed)
+    t0 = time.time()
+    rows = []
+    for i in range(n):
+        base = rng.choice(symbols)
+        side = rng.choice(["多", "空"])
+        if rng.random() < limit_ratio:
+            px = float(DEFAULT_MOCK_PRICES.get(base + "USDT", "100"))
+            away = -limit_offset if side == "多" else limit_offset
+            entry = f"{px * (1 + away + rng.uniform(-0.0005, 0.0005)):.6g}"
+        else:
+            entry = "市價"
+        rows.append({"chat_id": -2000 - (i % 3), "chat_title": f"bench-{i % 3}", "message_id": i + 1,
+                     "date": t0 + i / max(rate, 1e-9), "text": f"#{base} {side}\n進場：{entry}\n止損：無",
+                     "out": False, "sender_id": 42, "via_bot_id": None})
+    return rows
+
+def collect(stats, mock):
+    """從 mock 與 trade_journal 取出每筆開倉單的端到端延遲（秒）。"""
+    import trade_journal
+    trade_journal.flush()
+    conn = trade_journal._read_conn()
+    rows = conn.execute("SELECT entry_order_id, order_type, signal_received_at, exits_attached_at FROM trades").fetchall() if conn else []
+    if conn:
+        conn.close()
+    signal_to_entry, fill_to_exit = {"LIMIT": [], "MARKET": []}, {"LIMIT": [], "MARKET": []}
+    not_attached = 0
+    for r in rows:
+        od = mock.orders.get(r["entry_order_id"])
+        if od is None:
+            continue
+        kind = "MARKET" if od["type"] == "MARKET" else "LIMIT"
+        if r["signal_received_at"]:
+            signal_to_entry[kind].append(od["time"] / 1000 - r["signal_received_at"])
+        first_fill = mock.first_fill_ms.get(od["orderId"])
+        if first_fill is None:
+            continue
+        if r["exits_attached_at"]:
+            fill_to_exit[kind].append(max(0.0, r["exits_attached_at"] - first_fill / 1000))
+        else:
+            not_attached += 1
+    signals = [m for m in stats.per_msg.values() if m["parsed"] and m["parsed"].get("action") in ("BUY", "SELL")]
+    return {
+        "signals": len(signals),
+        "dropped": sum(1 for m in signals if not m["executed"]),
+        "orders": len(rows),
+        "filled_not_attached": not_attached,
+        "errors": {str(k): v for k, v in mock.errors.items()},
+        "rest_calls": sum(mock.calls.values()),
+        "signal_to_entry": signal_to_entry,
+        "fill_to_exit": fill_to_exit,
+    }
+
+def _line(name, samples):
+    ms = [v * 1000 for v in samples]
+    return (f"  {name:<18}{len(ms):>6}{_pct(ms, 0.50):>10.1f}{_pct(ms, 0.95):>10.1f}"
+            f"{_pct(ms, 0.99):>10.1f}{max(ms or [0]):>10.1f}")
+
+def print_result(res, title):
+    print("\n" + "=" * 30)
+    print(f"⏱️ 端到端延遲（{title}）")
+    print(f"• 訊號 {res['signals']}，被丟棄 {res['dropped']}，開倉單 {res['orders']}，"
+          f"成交但未掛上 SL/TP {res['filled_not_attached']}，REST 呼叫 {res['rest_calls']}")
+    if res["errors"]:
+        print("• mock 錯誤: " + ", ".join(f"{k} ×{v}" for k, v in sorted(res["errors"].items())))
+    print(f"  {'(ms)':<18}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for metric in ("signal_to_entry", "fill_to_exit"):
+        for kind in ("MARKET", "LIMIT"):
+            print(_line(f"{metric.replace('_to_', '→')} {kind.lower()}", res[metric][kind]))
+    print("=" * 30)
+
+def replay_argv(args, user_stream):
+    argv = ["run", "--speed", "1", "--llm-latency", str(args.llm_latency), "--llm-jitter", "0",
+            "--binance-latency", str(args.binance_latency), "--binance-jitter", str(args.binance_jitter),
+            "--error-rate", str(args.error_rate), "--fill-after", str(args.fill_after),
+            "--fill-wait", str(args.fill_wait), "--engine-interval", str(args.engine_interval)]
+    if args.partial_fill is not None:
+        argv += ["--partial-fill", str(args.partial_fill)]
+    if args.inject:
+        argv += ["--inject", args.inject]
+    if args.pools:
+        argv += ["--pools", args.pools]
+    if args.seed is not None:
+        argv += ["--seed", str(args.seed)]
+    if user_stream:
+        argv.append("--user-stream")
+    return argv
+
+def run_once(args):
+    rows = bench_messages(args.signals, args.rate, [s.strip().upper() for s in args.symbols.split(",")],
+                          args.limit_ratio, args.seed, args.limit_offset)
+    rargs = replay.build_parser().parse_args(replay_argv(args, args.user_stream))
+    stats, mock = asyncio.run(replay.run_replay(rows, rargs))
+    return collect(stats, mock)
+
+def run_compare(argv):
+    """輪詢 / user stream 各在獨立行程跑一次（replay 會替換模組全域，不能在同一行程重複安裝）。"""
+    results = {}
+    for mode in ("poll", "stream"):
+        cmd = [sys.executable, __file__, *argv, "--json"] + (["--user-stream"] if mode == "stream" else [])
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        last = (out.stdout.strip().splitlines() or [""])[-1]
+        try:
+            results[mode] = json.loads(last)
+        except ValueError:
+            print(f"[error] {mode} 執行失敗：\n{out.stdout[-2000:]}\n{out.stderr[-2000:]}")
+            return
+    for mode, res in results.items():
+        print_result(res, "輪詢" if mode == "poll" else "user stream")
+    p, s = results["poll"]["fill_to_exit"]["LIMIT"], results["stream"]["fill_to_exit"]["LIMIT"]
+    if p and s:
+        print(f"LIMIT 成交→掛上 SL/TP p50：輪詢 {_pct(p, 0.5) * 1000:.0f}ms → user stream {_pct(s, 0.5) * 1000:.0f}ms")
+
+def main():
+    ap = argparse.ArgumentParser(description="chao_bi 端到端延遲 benchmark（mock 幣安）")
+    ap.add_argument("--signals", type=int, default=60, help="訊號則數")
+    ap.add_argument("--rate", type=float, default=5.0, help="每秒訊號數")
+    ap.add_argument("--symbols", default="BTC,ETH,SOL,BNB", help="使用的幣種")
+    ap.add_argument("--limit-ratio", type=float, default=0.5, help="帶進場價（LIMIT）的訊號比例")
+    ap.add_argument("--limit-offset", type=float, default=0.0, help="LIMIT 進場價偏離目前價格的比例（不被價格穿越，只依 fill-after 成交）")
+    ap.add_argument("--llm-latency", type=float, default=0.2, help="本地 LLM 替身的延遲（秒）")
+    ap.add_argument("--binance-latency", type=float, default=0.05, help="mock 幣安每次呼叫的延遲（秒）")
+    ap.add_argument("--binance-jitter", type=float, default=0.02, help="mock 幣安延遲的隨機抖動上限（秒）")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="mock 每次呼叫回 429 的機率")
+    ap.add_argument("--inject", default=None, help="錯誤注入 method:錯誤碼[:次數]，逗號分隔；new_order.STOP_MARKET 只針對該單別")
+    ap.add_argument("--fill-after", type=float, default=1.5, help="mock LIMIT 單最晚多久後成交（秒）")
+    ap.add_argument("--partial-fill", type=float, default=None, help="LIMIT 單先部分成交的比例（0~1）")
+    ap.add_argument("--engine-interval", type=float, default=0.05, help="mock 撮合引擎週期（秒）")
+    ap.add_argument("--fill-wait", type=float, default=10.0, help="結束前最多等待追蹤收尾的秒數")
+    ap.add_argument("--pools", default=None, help="覆寫 EXECUTOR_POOL_SIZES，例如 llm=4,order=8")
+    ap.add_argument("--user-stream", action="store_true", help="以 ORDER_TRADE_UPDATE 推送驅動 OrderTracker")
+    ap.add_argument("--compare", action="store_true", help="輪詢與 user stream 各跑一次並排比較")
+    ap.add_argument("--json", action="store_true", help="最後一行輸出 JSON 結果（--compare 內部使用）")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    if args.compare:
+        run_compare([a for a in sys.argv[1:] if a not in ("--compare", "--user-stream")])
+        return
+    res = run_once(args)
+    if args.json:
+        print(json.dumps(res))
+    else:
+        print_result(res, "user stream" if args.user_stream else "輪詢")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# bench_indicators.py
+"""
+指標計算 benchmark：原本逐根 Decimal 的純 Python 實作 vs indicators.py（NumPy 向量化）。
+
+用法：
+  python bench_indicators.py                                  # 預設：20 個 symbol × 3 個週期 × 200 根
+  python bench_indicators.py --symbols 200 --timeframes 5 --bars 500
+  python bench_indicators.py --repeat 50 --seed 3
+
+兩種情境：
+  single：風控單筆路徑 —— 幣安原始 K 線 → ATR（Decimal），即 compute_atr_from_klines 的舊 / 新實作
+  batch ：symbols × timeframes 全部序列一次算 ATR、真實波幅、滾動高低點、已實現波動率、最近擺動高低點
+舊實作逐序列、逐根以 Decimal 計算；新實作把所有序列疊成一個陣列一次算完。
+最後檢查兩者結果一致（相對誤差 < 1e-9）。
+"""
+import math
+import time
+import random
+import argparse
+from decimal import Decimal
+
+import indicators
+
+def _pct(samples, q):
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(len(s) * q))]
+
+def _fake_klines(rng, bars, start=None):
+    """幣安格式的隨機漫步 K 線：[open_time, open, high, low, close, volume, ...]（價格為字串）。"""
+    price = start or rng.uniform(0.01, 60000)
+    out = []
+    for i in range(bars):
+        o = price
+        c = max(o * (1 + rng.gauss(0, 0.004)), 1e-8)
+        h = max(o, c) * (1 + abs(rng.gauss(0, 0.002)))
+        l = min(o, c) * (1 - abs(rng.gauss(0, 0.002)))
+        out.append([i * 300_000, f"{o:.8g}", f"{h:.8g}", f"{l:.8g}", f"{c:.8g}", f"{rng.uniform(1, 1e5):.3f}",
+                    i * 300_000 + 299_999])
+        price = c
+    return out
+
+# === [reference] 原本的逐根 Decimal 實作 ===
+def _rows(klines):
+    return [{"open": Decimal(k[1]), "high": Decimal(k[2]), "low": Decimal(k[3]), "close": Decimal(k[4])} for k in klines]
+
+def _atr_python(rows, period=14):
+    if len(rows) < period + 1:
+        return None
+    trs = []
+    prev_close = rows[0]["close"]
+    for i in range(1, len(rows)):
+        high, low = rows[i]["high"], rows[i]["low"]
+        trs.append(max(high - low, abs(high - prev_close), abs(prev_close - low)))
+        prev_close = rows[i]["close"]
+    return sum(trs[-period:]) / Decimal(period)
+
+def _summary_python(klines, period=14, window=20, left=2, right=2):
+    rows = _rows(klines)
+    prev = rows[-2]["close"]
+    last = rows[-1]
+    tail = rows[-window:]
+    closes = [float(r["close"]) for r in rows[-window - 1:]]
+    rets = [math.log(closes[i] / closes[i - 1]) for i in range(1, len(closes))]
+    mean = sum(rets) / len(rets)
+    swing_high = swing_low = math.nan
+    for i in range(left, len(rows) - right):
+        h, l = rows[i]["high"], rows[i]["low"]
+        around = rows[i - left:i] + rows[i + 1:i + right + 1]
+        if all(h > r["high"] for r in around):
+            swing_high = float(h)
+        if all(l < r["low"] for r in around):
+            swing_low = float(l)
+    return {
+        f"atr{period}": float(_atr_python(rows, period)),
+        "tr": float(max(last["high"] - last["low"], abs(last["high"] - prev), abs(prev - last["low"]))),
+        f"high{window}": float(max(r["high"] for r in tail)),
+        f"low{window}": float(min(r["low"] for r in tail)),
+        f"rv{window}": math.sqrt(sum((r - mean) ** 2 for r in rets) / (len(rets) - 1)),
+        "swing_high": swing_high,
+        "swing_low": swing_low,
+    }
+
+def _close(a, b):
+    if math.isnan(a) or math.isnan(b):
+        return math.isnan(a) and math.isnan(b)
+    return abs(a - b) <= 1e-9 * max(1.0, abs(a), abs(b))
+
+def _timed(fn, repeat):
+    samples, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples, result
+
+def _report(label, old, new):
+    speedup = _pct(old, 0.5) / _pct(new, 0.5) if _pct(new, 0.5) > 0 else float("inf")
+    print(f"  {label:<8} python  p50={_pct(old, 0.5):8.3f}ms p95={_pct(old, 0.95):8.3f}ms")
+    print(f"  {label:<8} numpy   p50={_pct(new, 0.5):8.3f}ms p95={_pct(new, 0.95):8.3f}ms  (×{speedup:.1f})")
+
+def run_single(klines, repeat, period):
+    old, atr_old = _timed(lambda: _atr_python(_rows(klines), period), repeat)
+    new, atr_new = _timed(lambda: indicators.atr_last(klines, period), repeat)
+    _report("single", old, new)
+    ok = _close(float(atr_old), float(atr_new))
+    print(f"  single   ATR{period} python={atr_old:.10g} numpy={atr_new} {'✅ 一致' if ok else '❌ 不一致'}")
+    return ok
+
+def run_batch(series, repeat, period, window):
+    old, res_old = _timed(lambda: {k: _summary_python(v, period, window) for k, v in series.items()}, repeat)
+    new, res_new = _timed(lambda: indicators.summarize(series, atr_periods=(period,), window=window), repeat)
+    _report("batch", old, new)
+    bad = [(k, name) for k, row in res_old.items() for name, v in row.items() if not _close(v, res_new[k][name])]
+    print(f"  batch    {len(series)} 組序列 × {len(next(iter(res_old.values())))} 項指標 "
+          f"{'✅ 一致' if not bad else f'❌ 不一致 {len(bad)} 項，例如 {bad[:3]}'}")
+    return not bad
+
+def main():
+    ap = argparse.ArgumentParser(description="indicators.py vs 純 Python Decimal 指標計算 benchmark")
+    ap.add_argument("--symbols", type=int, default=20)
+    ap.add_argument("--timeframes", type=int, default=3)
+    ap.add_argument("--bars", type=int, default=200, help="每組序列的 K 線數（single 情境用 60 根，與風控預取相同）")
+    ap.add_argument("--period", type=int, default=14)
+    ap.add_argument("--window", type=int, default=20)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    tfs = ["1m", "5m", "15m", "1h", "4h", "1d"][:args.timeframes] or ["5m"]
+    series = {(f"SYM{i}USDT", tf): _fake_klines(rng, args.bars) for i in range(args.symbols) for tf in tfs}
+    print(f"[bench] symbols={args.symbols} timeframes={len(tfs)} bars={args.bars} repeat={args.repeat}")
+    ok = run_single(_fake_klines(rng, max(args.period + 20, 60)), args.repeat * 10, args.period)
+    ok = run_batch(series, args.repeat, args.period, args.window) and ok
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
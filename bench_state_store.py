@@ -0,0 +1,243 @@
+# bench_state_store.py
+"""
+狀態檔寫入延遲 benchmark（在暫存目錄執行，不會動到正式的 chao_bi_state.json）。
+
+用法：
+  python bench_state_store.py                       # 預設：三種後端 × 追蹤筆數 10/100/1000
+  python bench_state_store.py --sizes 100 5000 --ops 300 --fsync always
+  python bench_state_store.py --backends wal sqlite
+  python bench_state_store.py --stress --threads 16 --ops 300   # 併發壓力測試
+
+每輪先預填 N 筆追蹤中的交易，再量測 register → update_exits → clear 三種異動的單次延遲，
+最後做一次「模擬崩潰後重新載入」檢查資料是否完整。
+
+--stress 模式：多個執行緒同時 register / update_trade_status / update_exits / clear
+（其中一部分開倉單被多個執行緒同時搶著異動），另有讀者執行緒持續取快照與查索引；
+結束後檢查 ① 每個執行緒預期存活的交易都在 ② 索引與資料一致 ③ 重新載入後與記憶體一致。
+"""
+import os
+import time
+import shutil
+import random
+import argparse
+import tempfile
+import threading
+
+import state_store
+from trade_record import TrackedTrade
+
+def _pct(samples, q):
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(len(s) * q))]
+
+def _fake_trade(i):
+    return dict(
+        symbol=random.choice(["BTCUSDT", "ETHUSDT", "SOLUSDT", "PIPPINUSDT"]),
+        position_side=random.choice(["LONG", "SHORT"]),
+        order_type="LIMIT", entry_price="100.5", quantity="1.234", leverage="50",
+        stop_loss="99.1", take_profit="103.2", entry_order_id=10_000_000 + i,
+    )
+
+def run_one(backend_name, size, ops, fsync_mode):
+    tmp_dir = tempfile.mkdtemp(prefix="chao_bi_bench_")
+    try:
+        json_path = os.path.join(tmp_dir, "chao_bi_state.json")
+        path = os.path.join(tmp_dir, "chao_bi_state.db") if backend_name == 'sqlite' else json_path
+        state_store.STATE_FILE_PATH = json_path
+        state_store.configure_backend(backend_name, path, fsync_mode)
+        state_store.load_state()
+
+        # 預填（整份寫一次，不計入延遲）
+        for i in range(size):
+            t = _fake_trade(i)
+            state_store._tracked_trades[str(t["entry_order_id"])] = TrackedTrade(**t)
+        state_store.rebuild_indexes()
+        state_store.save_state()
+
+        lat = {"register": [], "update_exits": [], "clear": []}
+        base = size
+        # 靜音：各異動函式會列印訊息
+        import builtins
+        _print = builtins.print
+        builtins.print = lambda *a, **k: None
+        try:
+            for j in range(ops):
+                t = _fake_trade(base + j)
+                t0 = time.perf_counter()
+                state_store.register_entry_trade(**t)
+                lat["register"].append((time.perf_counter() - t0) * 1000)
+
+                t0 = time.perf_counter()
+                state_store.update_exits_for_trade(t["entry_order_id"], 1, 2)
+                lat["update_exits"].append((time.perf_counter() - t0) * 1000)
+
+                if j % 2:
+                    t0 = time.perf_counter()
+                    state_store.clear_closed_trade(t["entry_order_id"])
+                    lat["clear"].append((time.perf_counter() - t0) * 1000)
+        finally:
+            builtins.print = _print
+
+        expected = dict(state_store._tracked_trades)
+        # 模擬崩潰：不壓實、直接丟掉記憶體狀態後重新載入
+        state_store.close_state()
+        state_store._tracked_trades.clear()
+        state_store.configure_backend(backend_name, path, fsync_mode)
+        state_store.load_state()
+        ok = state_store._tracked_trades == expected
+        state_store.close_state()
+
+        for name, samples in lat.items():
+            print(f"  {backend_name:<6} N={size:<6} {name:<13} "
+                  f"p50={_pct(samples, 0.50):7.3f}ms  p95={_pct(samples, 0.95):7.3f}ms  "
+                  f"p99={_pct(samples, 0.99):7.3f}ms  max={max(samples or [0]):7.3f}ms")
+        print(f"  {backend_name:<6} N={size:<6} 重新載入 {'✅ 一致' if ok else '❌ 不一致'}（{len(expected)} 筆）")
+    finally:
+        state_store.close_state()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def _check_indexes():
+    """以目前資料重建一份索引，與增量維護的索引比對。"""
+    with state_store._lock:
+        live = (dict(state_store._by_symbol), dict(state_store._by_symbol_side),
+                dict(state_store._by_status), dict(state_store._by_exit_order))
+        live = tuple({k: (set(v) if isinstance(v, set) else v) for k, v in d.items()} for d in live)
+        state_store.rebuild_indexes()
+        rebuilt = (state_store._by_symbol, state_store._by_symbol_side,
+                   state_store._by_status, state_store._by_exit_order)
+        return all(a == b for a, b in zip(live, rebuilt))
+
+def run_stress(backend_name, threads, ops, fsync_mode):
+    tmp_dir = tempfile.mkdtemp(prefix="chao_bi_stress_")
+    import builtins
+    _print = builtins.print
+    try:
+        json_path = os.path.join(tmp_dir, "chao_bi_state.json")
+        path = os.path.join(tmp_dir, "chao_bi_state.db") if backend_name == 'sqlite' else json_path
+        state_store.STATE_FILE_PATH = json_path
+        state_store.configure_backend(backend_name, path, fsync_mode)
+        state_store.load_state()
+
+        shared_ids = [90_000_000 + i for i in range(32)]   # 多個執行緒搶同一批開倉單
+        kept = [set() for _ in range(threads)]
+        errors = []
+        stop = threading.Event()
+        reader_stats = {"snapshots": 0, "mismatch": 0}
+        barrier = threading.Barrier(threads + 2)   # 寫入執行緒 + 讀者 + 主執行緒
+
+        def worker(n):
+            rng = random.Random(n)
+            barrier.wait()
+            try:
+                for j in range(ops):
+                    t = _fake_trade(n * 1_000_000 + j)
+                    t["symbol"] = rng.choice(["BTCUSDT", "ETHUSDT", "SOLUSDT", "PIPPINUSDT"])
+                    state_store.register_entry_trade(**t)
+                    state_store.update_trade_status(t["entry_order_id"], "PARTIALLY_FILLED")
+                    eid = t["entry_order_id"]
+                    state_store.update_exits_for_trade(eid, eid + 500_000_000, eid + 600_000_000)
+                    if rng.random() < 0.5:
+                        state_store.clear_closed_trade(t["entry_order_id"])
+                    else:
+                        kept[n].add(str(t["entry_order_id"]))
+                    # 競爭：同一筆共享開倉單被多個執行緒同時註冊 / 更新 / 移除
+                    sid = rng.choice(shared_ids)
+                    op = rng.random()
+                    if op < 0.4:
+                        state_store.register_entry_trade(**dict(_fake_trade(0), entry_order_id=sid))
+                    elif op < 0.8:
+                        state_store.update_exits_for_trade(sid, sid + 500_000_000, sid + 600_000_000)
+                    else:
+                        state_store.clear_closed_trade(sid)
+            except Exception as e:
+                errors.append(repr(e))
+
+        def reader():
+            barrier.wait()
+            try:
+                while not stop.is_set():
+                    snap = state_store.iter_tracked_trades()
+                    reader_stats["snapshots"] += 1
+                    for key, rec in snap:
+                        if key != rec.key:
+                            reader_stats["mismatch"] += 1
+                    for key, rec in state_store.find_trades_by_status("EXITS_ATTACHED")[:50]:
+                        if rec.status != "EXITS_ATTACHED":
+                            reader_stats["mismatch"] += 1
+                        for oid in rec.exit_order_ids:
+                            hit = state_store.find_trade_by_exit_order(oid)
+                            if hit is not None and hit[0] != key:
+                                reader_stats["mismatch"] += 1
+            except Exception as e:
+                errors.append(f"reader: {e!r}")
+
+        builtins.print = lambda *a, **k: None
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        rd = threading.Thread(target=reader)
+        for th in pool + [rd]:
+            th.start()
+        t0 = time.perf_counter()
+        barrier.wait()
+        for th in pool:
+            th.join()
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        rd.join()
+        builtins.print = _print
+
+        live = set(state_store._tracked_trades)
+        shared = {str(i) for i in shared_ids}
+        expected = set().union(*kept)
+        missing = expected - live
+        unexpected = live - expected - shared
+        indexes_ok = _check_indexes()
+
+        before = dict(state_store._tracked_trades)
+        state_store.close_state()
+        state_store._tracked_trades.clear()
+        state_store.configure_backend(backend_name, path, fsync_mode)
+        builtins.print = lambda *a, **k: None
+        state_store.load_state()
+        builtins.print = _print
+        reload_ok = state_store._tracked_trades == before
+
+        total_ops = threads * ops * 5
+        ok = not errors and not missing and not unexpected and indexes_ok and reload_ok and not reader_stats["mismatch"]
+        print(f"  {backend_name:<6} threads={threads} ops={total_ops}（{total_ops / elapsed:,.0f} ops/s）"
+              f" 存活 {len(live)} 筆，讀者快照 {reader_stats['snapshots']} 次")
+        print(f"  {backend_name:<6} 缺少 {len(missing)}、多出 {len(unexpected)}、讀者不一致 {reader_stats['mismatch']}、"
+              f"索引{'一致' if indexes_ok else '不一致'}、重新載入{'一致' if reload_ok else '不一致'}、例外 {len(errors)}"
+              f" → {'✅ PASS' if ok else '❌ FAIL'}")
+        for e in errors[:5]:
+            print(f"    {e}")
+        return ok
+    finally:
+        builtins.print = _print
+        state_store.close_state()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def main():
+    ap = argparse.ArgumentParser(description="state_store 寫入延遲 benchmark")
+    ap.add_argument("--backends", nargs="+", default=["json", "wal", "sqlite"], choices=["json", "wal", "sqlite"])
+    ap.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000], help="預先追蹤中的交易筆數")
+    ap.add_argument("--ops", type=int, default=200, help="每輪量測的開倉筆數")
+    ap.add_argument("--fsync", default="batch", choices=["always", "batch", "off"])
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--stress", action="store_true", help="改跑多執行緒併發壓力測試")
+    ap.add_argument("--threads", type=int, default=16, help="--stress 的寫入執行緒數")
+    args = ap.parse_args()
+
+    random.seed(args.seed)
+    if args.stress:
+        print(f"[stress] fsync={args.fsync} threads={args.threads} ops/thread={args.ops}")
+        results = [run_stress(name, args.threads, args.ops, args.fsync) for name in args.backends]
+        raise SystemExit(0 if all(results) else 1)
+    print(f"[bench] fsync={args.fsync} ops={args.ops}")
+    for size in args.sizes:
+        for name in args.backends:
+            run_one(name, size, args.ops, args.fsync)
+
+if __name__ == "__main__":
+    main()
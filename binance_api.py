@@ -1,20 +1,33 @@
 import re
 import time
 import json
+import hashlib
 import asyncio
 from decimal import Decimal, ROUND_DOWN
 from config import (
     DEFAULT_LEVERAGE, LEVERAGE_OVERRIDES,
-    BINANCE_API_KEY, BINANCE_API_SECRET, REAL_FUTURES_BASE_URL,
     RR_DEFAULT, RR_MAX, MIN_STOP_DISTANCE_PCT, ATR_K, ATR_PERIOD,
     SLOW_STABLE_RECONCILE, PER_SYMBOL_RETRY, RECONCILE_VERBOSE,
     AUTO_CANCEL_SECONDS, ORDER_MONITOR_INTERVAL, PER_SYMBOL_SLEEP_SEC,
+    KLINES_LLM_FORMAT, KLINES_LLM_FULL_BARS, KLINES_LLM_COMPACT_BARS, KLINES_LLM_PRICE_SCALE,
+    SYMBOL_REGISTRY_TTL_SEC, ENTRY_TIME_IN_FORCE, GTD_UNSUPPORTED_SYMBOLS,
 )
-from telegram import client, notify_user
-from binance.um_futures import UMFutures
+from telegram import notify_user
 from binance.error import ClientError
 from datetime import datetime, timedelta
-from state_store import _tracked_trades, update_exits_for_trade, clear_closed_trade
+from state_store import (
+    iter_tracked_trades, update_exits_for_trade, update_trade_status,
+    clear_closed_trade, find_trade_by_exit_order,
+    mark_entry_terminal,
+)
+from trade_record import fmt_decimal, TradeStatus
+from app import get_binance_client, get_accounts, current_account, use_account
+from scheduler import run_in_pool
+from aliases import normalize as alias_normalize, update_symbols as update_alias_symbols
+from logs import get_printer
+print = get_printer("binance_api")
+# RECONCILE_VERBOSE 的逐筆明細（可能每輪上百行）走獨立 logger，依 LOG_SAMPLE_EVERY 抽樣
+_verbose = get_printer("binance_api.reconcile")
 try:
     from zoneinfo import ZoneInfo
 except Exception:
@@ -23,30 +36,15 @@ except Exception:
 # === [binance_ext] 幣安 API 包裝與工具 ===
 # --- 4. 💸 幣安 API 函數 (v32) ---
 
-# 全域變數
-total_available_margin = 0.0
-binance_client = None
+# 全域變數（幣安客戶端由 app.get_binance_client() 在第一次使用時建立）
 _symbol_max_leverage_cache = {} # 槓桿上限快取
 
-# 追蹤目前已啟動監控的 (symbol, order_id)，避免重複啟動 monitor_and_auto_cancel
-_monitoring_orders: set[tuple[str, int]] = set()
+# order_tracker 單一監控的註冊表：(symbol, order_id) → OrderTracker（同一張單不會重複追蹤）
+_monitoring_orders: dict = {}
 
+# --- 俗稱/別名正規化（將中文俗稱替換為標準代號，方便預過濾與解析；別名見 aliases.txt / aliases.py） ---
 def normalize_aliases(text: str) -> str:
-    if not text:
-        return text
-    t = text
-    for pat, repl in ALIAS_MAP.items():
-        try:
-            t = re.sub(pat, repl, t, flags=re.IGNORECASE)
-        except Exception:
-            pass
-    return t
-# -------------------------------------------------------------------
-# --- 俗稱/別名正規化（將中文俗稱替換為標準代號，方便預過濾與解析） ---
-ALIAS_MAP = {
-    r"(大餅|比特|比特幣)": "BTC",
-    r"(姨太|以太|二餅)": "ETH",
-}
+    return alias_normalize(text)
 
 def get_symbol_max_leverage(symbol: str) -> int:
     """
@@ -57,6 +55,7 @@ def get_symbol_max_leverage(symbol: str) -> int:
       3) exchange_info 內的 LEVERAGE filter（若存在）
       4) fallback: DEFAULT_LEVERAGE
     """
+    binance_client = get_binance_client()
     if symbol in _symbol_max_leverage_cache:
         return _symbol_max_leverage_cache[symbol]
 
@@ -133,67 +132,102 @@ def apply_leverage_override(symbol: str, suggested: int | None) -> int:
         lev = int(suggested)
     return lev
 
-# 在腳本頂層初始化幣安客戶端
-if not BINANCE_API_KEY or not BINANCE_API_SECRET:
-    print("[Binance] [error]: 找不到 'binance.txt' 或金鑰不完整。")
-else:
-    try:
-        binance_client = UMFutures(
-            key=BINANCE_API_KEY, 
-            secret=BINANCE_API_SECRET, 
-            base_url=REAL_FUTURES_BASE_URL
-        )
-        
-        try:
-            position_mode = binance_client.get_position_mode()
-            if position_mode.get('dualSidePosition') == False:
-                print("[Binance] [warning]: 偵測到帳戶為「單向持倉」，正在嘗試切換至「雙向持倉」...")
-                binance_client.change_position_mode(dualSidePosition=True)
-                print("[Binance 資訊]：已成功切換至「雙向持倉 (Hedge Mode)」。")
-            else:
-                print("[Binance 資訊]：帳戶已處於「雙向持倉 (Hedge Mode)」。")
-        except ClientError as e:
-            if e.error_code == -4059: # "No need to change position side."
-                print("[Binance 資訊]：帳戶已處於「雙向持倉 (Hedge Mode)」。")
-            else:
-                raise 
-        
-        account_info = binance_client.account()
-        total_available_margin = float(account_info['availableBalance'])
-        
-        if total_available_margin <= 0:
-             print(f"[Binance] [error]: 總可用保證金 (availableBalance) 為 0。")
-             binance_client = None
-        else:
-            print(f"[Binance] [info]: 幣安 *真實環境* 連接成功！")
-            print(f"   多幣種保證金 總可用餘額 (availableBalance): {total_available_margin} USDT")
+symbol_info_cache = {} 
+# symbol 註冊表：一次下載 exchange_info 後建立 base asset → USDT 永續合約 的對照（供預取猜測 symbol）
+_symbol_registry = {"loaded_at": 0.0, "bases": {}}
 
+def load_symbol_registry(force=False):
+    """
+    下載 exchange_info 並快取全部 symbol 資訊（取代逐一 symbol 的查找）。
+    未過期（SYMBOL_REGISTRY_TTL_SEC）且非 force 時直接沿用。回傳是否有可用的註冊表。
+    """
+    binance_client = get_binance_client()
+    loaded_at = _symbol_registry["loaded_at"]
+    if not force and symbol_registry_fresh():
+        return True
+    if binance_client is None:
+        return bool(loaded_at)
+    try:
+        info = binance_client.exchange_info()
     except ClientError as e:
-        print(f"[Binance] [error]: API Key 或 Secret 錯誤。{e}")
-        binance_client = None
-    except Exception as e:
-        print(f"[Binance] [error]: 連接失敗: {e}")
-        binance_client = None
+        print(f"[Binance] [error]: 獲取 Exchange Info 失敗: {e}")
+        return bool(loaded_at)
 
+    bases = {}
+    listed = set()
+    for item in info.get('symbols', []):
+        sym = item.get('symbol')
+        if not sym:
+            continue
+        symbol_info_cache[sym] = item
+        if item.get('quoteAsset', 'USDT') != 'USDT' or item.get('contractType', 'PERPETUAL') != 'PERPETUAL':
+            continue
+        if item.get('status', 'TRADING') != 'TRADING':
+            continue
+        base = (item.get('baseAsset') or sym[:-4]).upper()
+        bases[base] = sym
+        listed.add(base)
+        # 1000PEPE / 1000000MOG 這類合約，也允許以 PEPE / MOG 命中（不覆蓋已存在的名稱）
+        stripped = re.sub(r'^1(000)+', '', base)
+        if stripped and stripped != base:
+            bases.setdefault(stripped, sym)
+    _symbol_registry["bases"] = bases
+    _symbol_registry["loaded_at"] = time.time()
+    # 別名表跟著合約清單更新（清單沒變時不重建）
+    try:
+        update_alias_symbols(listed)
+    except Exception as e:
+        print(f"[warning] 更新幣種別名失敗：{e}")
+    return True
 
-symbol_info_cache = {} 
+def symbol_registry_fresh():
+    """註冊表已載入且未超過 SYMBOL_REGISTRY_TTL_SEC。"""
+    loaded_at = _symbol_registry["loaded_at"]
+    return bool(loaded_at) and (time.time() - loaded_at) < SYMBOL_REGISTRY_TTL_SEC
 
 def get_symbol_info(symbol):
-    """(此函數不變)"""
+    """從 symbol 註冊表取得交易對資訊；查無時若註冊表已超過 60 秒未更新，重新下載一次（新上架合約）。"""
+    binance_client = get_binance_client()
     if symbol in symbol_info_cache:
         return symbol_info_cache[symbol]
     if binance_client is None: return None
-    try:
-        info = binance_client.exchange_info()
-        for item in info['symbols']:
-            if item['symbol'] == symbol:
-                symbol_info_cache[symbol] = item
-                return item
-        print(f"[Binance] [error]: 找不到 {symbol} 的交易對資訊")
-        return None
-    except ClientError as e:
-        print(f"[Binance] [error]: 獲取 Exchange Info 失敗: {e}")
+    loaded_at = _symbol_registry["loaded_at"]
+    if not loaded_at or (time.time() - loaded_at) >= 60:
+        load_symbol_registry(force=True)
+    if symbol in symbol_info_cache:
+        return symbol_info_cache[symbol]
+    print(f"[Binance] [error]: 找不到 {symbol} 的交易對資訊")
+    return None
+
+# 預取猜 symbol 時略過的常見縮寫（避免誤判為幣種）
+_SYMBOL_GUESS_STOPWORDS = {"TP", "SL", "USDT", "USD", "LONG", "SHORT", "BUY", "SELL", "X"}
+_SYMBOL_TOKEN_RE = re.compile(r'([#$])?([0-9A-Za-z]+)')
+
+def guess_symbol_from_text(text: str, refresh=True):
+    """
+    以正規式 + symbol 註冊表，從原始訊息猜出最可能的 USDT 永續合約（不呼叫 LLM）。
+    優先順序：#/$ 前綴的代號 → 一般英數代號（依出現順序）→ 中文合約名稱（如 币安人生）。
+    refresh=False 時只用已載入的註冊表（不會下載 exchange_info，可在事件迴圈上呼叫）。
+    猜不到回傳 None。
+    """
+    if not text or not (load_symbol_registry() if refresh else _symbol_registry["loaded_at"]):
         return None
+    bases = _symbol_registry["bases"]
+    prefixed, plain = [], []
+    for m in _SYMBOL_TOKEN_RE.finditer(text):
+        tok = m.group(2).upper()
+        if tok.isdigit() or tok in _SYMBOL_GUESS_STOPWORDS:
+            continue
+        (prefixed if m.group(1) else plain).append(tok)
+    for tok in prefixed + plain:
+        if tok.endswith("USDT") and tok in symbol_info_cache:
+            return tok
+        if tok in bases:
+            return bases[tok]
+    for base, sym in bases.items():
+        if not base.isascii() and base in text:
+            return sym
+    return None
 
 # --- 檢查 symbol 是否有效 ---
 def is_valid_symbol(symbol: str) -> bool:
@@ -207,6 +241,7 @@ def is_valid_symbol(symbol: str) -> bool:
 
 def get_binance_market_price(symbol):
     """(此函數不變)"""
+    binance_client = get_binance_client()
     if binance_client is None: return None
     try:
         ticker = binance_client.ticker_price(symbol)
@@ -215,13 +250,19 @@ def get_binance_market_price(symbol):
         print(f"[Binance] [error]: 獲取 {symbol} 市價失敗: {e}")
         return None
 
-def get_binance_klines_for_llm(symbol, interval='5m', limit=50):
-    """(此函數不變)"""
+def get_binance_klines_for_llm(symbol, interval='5m', limit=None, fmt=None):
+    """
+    取得餵給 LLM 第二階段的 K 線文字。
+    fmt: 'full'（逐根完整 OHLCV）或 'compact'（相對價格縮放整數 + 預先計算的統計值），預設依 KLINES_LLM_FORMAT。
+    """
+    binance_client = get_binance_client()
     if binance_client is None: return "K-line data not available."
-    
+
+    fmt = (fmt or KLINES_LLM_FORMAT).lower()
+    if limit is None:
+        limit = KLINES_LLM_FULL_BARS
     interval_map = {'1h': '1h', '4h': '4h', '1d': '1d', '5m': '5m'}
-    klines_string = "Timestamp, Open, High, Low, Close, Volume\n"
-    
+
     try:
         print(f"[Binance] [info]: 正在獲取 {symbol} 最近 {limit} 根 {interval} K線...")
         klines = binance_client.klines(
@@ -229,57 +270,100 @@ def get_binance_klines_for_llm(symbol, interval='5m', limit=50):
             interval=interval_map.get(interval, '5m'), 
             limit=limit
         )
-        for k in klines:
-            timestamp = time.strftime('%Y-%m-%d %H:%M', time.localtime(k[0]/1000))
-            klines_string += f"{timestamp}, {k[1]}, {k[2]}, {k[3]}, {k[4]}, {k[5]}\n"
-        return klines_string
     except ClientError as e:
         print(f"[Binance] [error]: 獲取 {symbol} K 線失敗: {e}")
         return "K-line data not available."
 
+    if fmt == 'compact':
+        klines_string = encode_klines_compact(klines, interval=interval)
+    else:
+        klines_string = encode_klines_full(klines)
+    print(f"[Binance] [info]: K 線格式 {fmt}，共 {len(klines_string)} 字元。")
+    return klines_string
+
+def encode_klines_full(klines):
+    """原始格式：每根 K 線一行，含時間與完整精度的 OHLCV。"""
+    klines_string = "Timestamp, Open, High, Low, Close, Volume\n"
+    for k in klines:
+        timestamp = time.strftime('%Y-%m-%d %H:%M', time.localtime(k[0]/1000))
+        klines_string += f"{timestamp}, {k[1]}, {k[2]}, {k[3]}, {k[4]}, {k[5]}\n"
+    return klines_string
+
+def encode_klines_compact(klines, bars=None, scale=None, interval='5m'):
+    """
+    精簡格式：將價格改寫為相對最後收盤價 ref 的縮放整數，大幅減少 LLM 需要 prefill 的 token。
+      x = round((price / ref - 1) * scale)，還原：price = ref * (1 + x / scale)
+    • 只列出最近 bars 根 K 線，成交量以「相對平均量的百分比」整數表示
+    • ATR、支撐/壓力、區間位置等統計值以全部 K 線預先計算，並同時給出絕對價格
+    """
+    bars = int(bars or KLINES_LLM_COMPACT_BARS)
+    scale_dec = Decimal(str(scale or KLINES_LLM_PRICE_SCALE))
+    try:
+        rows = [
+            {"open": Decimal(str(k[1])), "high": Decimal(str(k[2])), "low": Decimal(str(k[3])),
+             "close": Decimal(str(k[4])), "volume": Decimal(str(k[5]))}
+            for k in klines
+        ]
+    except Exception:
+        return "K-line data not available."
+    if not rows or rows[-1]["close"] <= 0:
+        return "K-line data not available."
+
+    ref = rows[-1]["close"]
+
+    def _rel(p):
+        return int(((p / ref - 1) * scale_dec).to_integral_value())
+
+    support = min(r["low"] for r in rows)
+    resistance = max(r["high"] for r in rows)
+    avg_vol = sum(r["volume"] for r in rows) / Decimal(len(rows))
+    atr = compute_atr_from_klines(klines, period=ATR_PERIOD)
+    span = resistance - support
+    pos_pct = int(((ref - support) / span * 100).to_integral_value()) if span > 0 else 50
+    first_open = rows[0]["open"]
+    change = int(((ref / first_open - 1) * scale_dec).to_integral_value()) if first_open > 0 else 0
+
+    # 絕對價格的顯示精度：比 ref 多 2 位小數即可
+    quant = Decimal(1).scaleb(ref.as_tuple().exponent - 2) if ref.as_tuple().exponent < 0 else Decimal('0.01')
+    atr_str = f"{atr.quantize(quant)} ({_rel(ref + atr)})" if atr is not None else "N/A"
+
+    lines = [
+        f"ref={ref}（{interval}，共 {len(rows)} 根；價格 = ref × (1 + x/{scale_dec})）",
+        f"ATR{ATR_PERIOD}={atr_str} | 支撐={support} ({_rel(support)}) | 壓力={resistance} ({_rel(resistance)})"
+        f" | 區間={_rel(resistance) - _rel(support)} | 位於區間 {pos_pct}% | 區間漲跌={change}",
+        f"o,h,l,c,v%（舊→新，最近 {min(bars, len(rows))} 根）:",
+    ]
+    for r in rows[-bars:]:
+        v_pct = int((r["volume"] / avg_vol * 100).to_integral_value()) if avg_vol > 0 else 0
+        lines.append(f"{_rel(r['open'])},{_rel(r['high'])},{_rel(r['low'])},{_rel(r['close'])},{v_pct}")
+    return "\n".join(lines) + "\n"
+
 def get_binance_klines_raw(symbol, interval='5m', limit=200):
-    """取得數值化 K 線：回傳 list(dict) with keys: open, high, low, close."""
+    """取得數值化 K 線：回傳 (n, 5) float64 陣列，欄位 open, high, low, close, volume（見 indicators.py）。"""
+    from indicators import klines_to_array
+    binance_client = get_binance_client()
     if binance_client is None:
-        return []
+        return klines_to_array([])
     try:
         klines = binance_client.klines(symbol=symbol, interval=interval, limit=limit)
-        out = []
-        for k in klines:  # [open_time, open, high, low, close, volume, close_time, ...]
-            out.append({
-                "open": Decimal(k[1]),
-                "high": Decimal(k[2]),
-                "low":  Decimal(k[3]),
-                "close":Decimal(k[4]),
-            })
-        return out
+        return klines_to_array(klines)  # [open_time, open, high, low, close, volume, close_time, ...]
     except ClientError as e:
         print(f"[Binance] [error]: 取得 {symbol} 原始 K 線失敗: {e}")
-        return []
+        return klines_to_array([])
 
 def compute_atr_from_klines(klines, period=14):
-    """純 Python 計 ATR；需要至少 period+1 根 K 線。"""
-    if len(klines) < period + 1:
-        return None
-    trs = []
-    prev_close = klines[0]["close"]
-    for i in range(1, len(klines)):
-        high = klines[i]["high"]
-        low  = klines[i]["low"]
-        tr = max(high - low, abs(high - prev_close), abs(prev_close - low))
-        trs.append(tr)
-        prev_close = klines[i]["close"]
-    if len(trs) < period:
-        return None
-    atr = sum(trs[-period:]) / Decimal(period)
-    return atr
+    """ATR（Decimal）；klines 可為幣安原始 K 線、dict 列或 get_binance_klines_raw 的陣列。需要至少 period+1 根 K 線。"""
+    from indicators import atr_last
+    return atr_last(klines, period)
 
-def compute_sl_tp_python(symbol, action, entry_price_dec):
+def compute_sl_tp_python(symbol, action, entry_price_dec, klines_raw=None):
     """
     以 ATR 與最小百分比距離計算止損與止盈（RR = 1.5）。
     BUY:  SL = entry - dist；TP = entry + 1.5*dist
     SELL: SL = entry + dist；TP = entry - 1.5*dist
+    klines_raw: 已取得的數值化 K 線（例如預取結果）；None 則即時抓取。
     """
-    k_raw = get_binance_klines_raw(symbol, interval='5m', limit=max(ATR_PERIOD + 20, 60))
+    k_raw = klines_raw if klines_raw is not None else get_binance_klines_raw(symbol, interval='5m', limit=max(ATR_PERIOD + 20, 60))
     atr = compute_atr_from_klines(k_raw, period=ATR_PERIOD)
     min_pct_dist = (entry_price_dec * MIN_STOP_DISTANCE_PCT)
     if atr is None:
@@ -300,20 +384,21 @@ def compute_sl_tp_python(symbol, action, entry_price_dec):
 
 
 # --- 新增 helper: select_sl_tp_with_user_pref ---
-def select_sl_tp_with_user_pref(symbol, action, entry_price_dec, user_sl_str, user_tp_str):
+def select_sl_tp_with_user_pref(symbol, action, entry_price_dec, user_sl_str, user_tp_str, klines_raw=None):
     """
     遵從使用者/訊號給的 SL/TP（若有效），否則 fallback 到 Python 風控算法。
     規則：
     • SL 若提供且方向正確，且距離 ≥ min_stop（max(ATR*ATR_K, MIN_STOP_DISTANCE_PCT)），則採用使用者 SL。
     • 否則用 compute_sl_tp_python() 產生的 SL。
     • TP 若提供且方向正確，則保留；若未提供或方向錯誤，依 RR_DEFAULT 與最終 SL 計算。
+    klines_raw 可傳入已取得的數值化 K 線（預取結果），避免重複抓取。
     回傳 (sl_decimal, tp_decimal, warnings_list)
     """
     warnings = []
     is_buy = action.upper() == 'BUY'
 
     # 先計算 ATR 與最小距離基準
-    k_raw = get_binance_klines_raw(symbol, interval='5m', limit=max(ATR_PERIOD + 20, 60))
+    k_raw = klines_raw if klines_raw is not None else get_binance_klines_raw(symbol, interval='5m', limit=max(ATR_PERIOD + 20, 60))
     atr = compute_atr_from_klines(k_raw, period=ATR_PERIOD)
     min_pct_dist = (entry_price_dec * MIN_STOP_DISTANCE_PCT)
     if atr is None:
@@ -347,7 +432,7 @@ def select_sl_tp_with_user_pref(symbol, action, entry_price_dec, user_sl_str, us
         sl_dec = user_sl
         print(f"   [Risk-Py] 沿用使用者提供的 SL: {sl_dec}")
     else:
-        sl_dec, _tp_tmp = compute_sl_tp_python(symbol, action, entry_price_dec)
+        sl_dec, _tp_tmp = compute_sl_tp_python(symbol, action, entry_price_dec, klines_raw=k_raw)
         print(f"   [Risk-Py] 採用程式計算 SL: {sl_dec}")
 
     # 決定 TP：若使用者 TP 有給且方向正確就保留，否則用 RR_DEFAULT 與最終 SL 推出
@@ -381,7 +466,7 @@ def select_sl_tp_with_user_pref(symbol, action, entry_price_dec, user_sl_str, us
     except Exception as e:
         # 若 sanitize 失敗，退回保守方案：用 compute_sl_tp_python 產生
         warnings.append(f"sanitize 失敗，回退程式 SL/TP：{e}")
-        sl_fallback, tp_fallback = compute_sl_tp_python(symbol, action, entry_price_dec)
+        sl_fallback, tp_fallback = compute_sl_tp_python(symbol, action, entry_price_dec, klines_raw=k_raw)
         return (sl_fallback, tp_fallback, warnings)
 
 
@@ -502,6 +587,7 @@ def sanitize_targets(symbol, action, entry_price, stop_loss, take_profit):
 
 def set_binance_leverage(symbol, leverage):
     """設定槓桿；回傳實際設定成功的倍數 (int)。若失敗回傳 0。若因 -4028 觸發回退則回傳回退後的倍數。"""
+    binance_client = get_binance_client()
     if binance_client is None:
         return 0
 
@@ -589,6 +675,7 @@ def set_binance_leverage(symbol, leverage):
 
 def _query_order(symbol, order_id=None, client_order_id=None):
     """查詢單一訂單狀態（REST），回傳 dict。"""
+    binance_client = get_binance_client()
     if binance_client is None: 
         return None
     try:
@@ -602,24 +689,79 @@ def _query_order(symbol, order_id=None, client_order_id=None):
         print(f"❌ [Binance 錯誤]: 查詢訂單失敗: {e}")
         return None
     
-def _get_open_positions_set():
+# === [gtd] 開倉單交易所端到期（timeInForce=GTD） ===
+# 幣安規定 goodTillDate 必須晚於現在 + 600 秒，且只保留到秒
+_GTD_MIN_LEAD_SEC = 600
+# 執行期間被拒過 GTD 的 symbol（與 GTD_UNSUPPORTED_SYMBOLS 一起判斷）
+_gtd_rejected_symbols = set()
+
+def entry_time_in_force(symbol, timeout_seconds=AUTO_CANCEL_SECONDS, now=None):
     """
-    取得目前持倉集合：回傳 set{ (symbol, positionSide) }，僅包含部位數量不為 0 的倉位。
-    Hedge Mode 下，positionSide 會是 'LONG' 或 'SHORT'。
+    回傳 (LIMIT 開倉單要帶的參數, 交易所端到期時間 epoch 秒 或 None)。
+    GTD 不可用（設定為 GTC、symbol 不支援、期限短於幣安下限）時回傳 GTC，改由程式端計時撤單。
+    """
+    if (str(ENTRY_TIME_IN_FORCE).upper() != 'GTD' or symbol in GTD_UNSUPPORTED_SYMBOLS
+            or symbol in _gtd_rejected_symbols or timeout_seconds < _GTD_MIN_LEAD_SEC + 5):
+        return {'timeInForce': 'GTC'}, None
+    expires_at = int((now or time.time()) + timeout_seconds)
+    return {'timeInForce': 'GTD', 'goodTillDate': expires_at * 1000}, float(expires_at)
+
+def is_gtd_rejection(e) -> bool:
+    """下單錯誤是否為 GTD / goodTillDate 不被接受（例如 -1116 Invalid timeInForce）。"""
+    code = getattr(e, 'error_code', None)
+    msg = str(getattr(e, 'error_message', '') or e)
+    return code == -1116 or 'goodTillDate' in msg or 'GTD' in msg
+
+def mark_gtd_unsupported(symbol):
+    if symbol not in _gtd_rejected_symbols:
+        _gtd_rejected_symbols.add(symbol)
+        print(f"⚠️ {symbol} 不接受 GTD，之後改用 GTC + 程式端計時撤單。")
+
+# === [idempotency] 同一則訊號重複投遞時不重複開倉 ===
+def entry_client_order_id(signal_key, account=None):
+    """由訊號的冪等鍵（chat_id:message_id）導出固定的 newClientOrderId；幣安限制 ≤ 36 字元、[.A-Z:/a-z0-9_-]。"""
+    digest = hashlib.sha1(f"{signal_key}|{account or ''}".encode("utf-8")).hexdigest()[:28]
+    return f"cb-{digest}"
+
+def is_duplicate_client_order(e) -> bool:
+    """下單錯誤是否為 clientOrderId 重複（-4116：同一 clientOrderId 的單仍掛著）。"""
+    return getattr(e, 'error_code', None) == -4116
+
+def find_order_by_client_id(symbol, client_order_id):
+    """以 clientOrderId 查單；查無此單（-2013）回傳 None，其他錯誤往上拋。"""
+    try:
+        return get_binance_client().query_order(symbol=symbol, origClientOrderId=client_order_id)
+    except ClientError as e:
+        if getattr(e, 'error_code', None) == -2013:
+            return None
+        raise
+
+def _get_position_amounts():
+    """
+    一次 account() 取得所有持倉：回傳 dict{ (symbol, positionSide): Decimal(positionAmt) }，
+    僅包含部位數量不為 0 的倉位。Reconcile / 狀態恢復用它取代逐筆呼叫 _get_position_amount。
     """
-    s = set()
+    binance_client = get_binance_client()
+    amounts = {}
     try:
         info = binance_client.account()
         positions = info.get('positions', [])
         for p in positions:
             symbol = p.get('symbol')
             amt = Decimal(p.get('positionAmt', '0'))
-            side = p.get('positionSide') or ('LONG' if amt > 0 else 'SHORT' if amt < 0 else None)
+            side = (p.get('positionSide') or '').upper() or ('LONG' if amt > 0 else 'SHORT' if amt < 0 else None)
             if symbol and amt != 0 and side:
-                s.add((symbol, side))
+                amounts[(symbol, side)] = amt
     except Exception as e:
         print(f"⚠️ 讀取當前持倉失敗：{e}")
-    return s
+    return amounts
+
+def _get_open_positions_set():
+    """
+    取得目前持倉集合：回傳 set{ (symbol, positionSide) }，僅包含部位數量不為 0 的倉位。
+    Hedge Mode 下，positionSide 會是 'LONG' 或 'SHORT'。
+    """
+    return set(_get_position_amounts())
 
 # --- 新增: 取得單一持倉數量 ---
 def _get_position_amount(symbol: str, position_side: str):
@@ -627,6 +769,7 @@ def _get_position_amount(symbol: str, position_side: str):
     取得指定 symbol 與 positionSide ('LONG'/'SHORT') 的 positionAmt (Decimal)。
     若找不到或錯誤，回傳 Decimal('0')。
     """
+    binance_client = get_binance_client()
     try:
         info = binance_client.account()
         positions = info.get('positions', [])
@@ -640,6 +783,7 @@ def _get_position_amount(symbol: str, position_side: str):
 
 def _cancel_order_safely(symbol, order_id):
     """安全撤單：失敗不丟例外，只印錯誤。優先用低階 DELETE，失敗再用 SDK。"""
+    binance_client = get_binance_client()
     try:
         # 優先用低階 DELETE
         if hasattr(binance_client, 'sign_request'):
@@ -666,6 +810,7 @@ def _list_all_active_symbols():
     列出期貨可交易且活躍(TRADING)的所有 symbol（PERPETUAL / 季度）。
     不再過濾非 ASCII 名稱，因有像「币安人生USDT」這類中文合約。
     """
+    binance_client = get_binance_client()
     syms = []
     try:
         info = binance_client.exchange_info()
@@ -686,6 +831,7 @@ def _fapi_signed_get(path: str, payload: dict | None = None):
     以最低層的 sign_request 呼叫期貨 REST，避免 SDK 方法名差異。
     path 例如：'/fapi/v1/openOrders' 或 '/fapi/v1/allOpenOrders'
     """
+    binance_client = get_binance_client()
     try:
         if hasattr(binance_client, 'sign_request'):
             return binance_client.sign_request('GET', path, payload or {})
@@ -723,6 +869,7 @@ def get_today_pnl_summary(tz_name: str = 'Asia/Taipei') -> str:
     計算【本地時區】當日 00:00 至目前為止的已實現損益彙總（不含未實現）。
     來源：/fapi/v1/income（REALIZED_PNL、COMMISSION、FUNDING_FEE…）
     """
+    binance_client = get_binance_client()
     if binance_client is None:
         return "❌ 無法計算：幣安客戶端未初始化。"
 
@@ -817,12 +964,16 @@ async def daily_pnl_notifier(tz_name: str = 'Asia/Taipei', hour: int = 12, minut
         secs = (next_run - now).total_seconds()
         print(f"⏰ PnL 通知排程：將於 {next_run.strftime('%Y-%m-%d %H:%M:%S %Z')} 執行（{int(secs)}s 後）")
         await _sleep_until(next_run)
-        # 計算與通知
-        try:
-            summary = get_today_pnl_summary(tz_name)
-            notify_user(summary, loop=client.loop if client else None)
-        except Exception as e:
-            print(f"⚠️ 發送 PnL 通知失敗：{e}")
+        # 計算與通知（多帳戶時每個帳戶各一則）
+        accounts = get_accounts()
+        for acct in accounts:
+            try:
+                # 查 income 是阻塞 REST，丟到 maint 池，避免卡住事件迴圈
+                with use_account(acct):
+                    summary = await run_in_pool('maint', get_today_pnl_summary, tz_name)
+                notify_user(f"[{acct.name}] {summary}" if len(accounts) > 1 else summary)
+            except Exception as e:
+                print(f"⚠️ 發送 {acct.name} PnL 通知失敗：{e}")
         # 下一輪循環
 
 # --- 新增: 兼容不同 binance-connector 版本的 open orders 查詢 ---
@@ -834,6 +985,7 @@ def _sdk_get_open_orders(symbol: str):
        'orderId is mandatory' 的錯誤）
     • 若低階呼叫意外失敗，再嘗試 SDK: get_open_orders/open_orders
     """
+    binance_client = get_binance_client()
     # 先走低階；加上 recvWindow 增加容忍度
     try:
         return _fapi_signed_get('/fapi/v1/openOrders', {'symbol': symbol, 'recvWindow': 5000})
@@ -882,10 +1034,10 @@ def _get_all_open_orders():
                 except Exception as e:
                     if _try >= PER_SYMBOL_RETRY:
                         if RECONCILE_VERBOSE:
-                            print(f"⚠️ 取 {sym} open orders 失敗（放棄）：{e}")
+                            _verbose(f"⚠️ 取 {sym} open orders 失敗（放棄）：{e}")
                     else:
                         if RECONCILE_VERBOSE:
-                            print(f"⚠️ 取 {sym} open orders 失敗（重試）：{e}")
+                            _verbose(f"⚠️ 取 {sym} open orders 失敗（重試）：{e}")
                         time.sleep(PER_SYMBOL_SLEEP_SEC)
                 finally:
                     time.sleep(PER_SYMBOL_SLEEP_SEC)  # 節流
@@ -898,7 +1050,7 @@ def _get_all_open_orders():
             return ods
     except Exception as e:
         if RECONCILE_VERBOSE:
-            print(f"⚠️ 低階 allOpenOrders 失敗（將改走逐 symbol）：{e}")
+            _verbose(f"⚠️ 低階 allOpenOrders 失敗（將改走逐 symbol）：{e}")
 
     results = []
     pos_syms = set(s for (s, _side) in _get_open_positions_set())
@@ -910,51 +1062,63 @@ def _get_all_open_orders():
                 results.extend(fetched)
         except Exception as e:
             if RECONCILE_VERBOSE:
-                print(f"⚠️ 低階取 {sym} openOrders 失敗：{e}")
+                _verbose(f"⚠️ 低階取 {sym} openOrders 失敗：{e}")
             continue
     return results
 
+def _owned_by(rec, acct):
+    """狀態檔紀錄是否屬於 acct（沒有帳戶欄位的舊紀錄屬於主帳戶）。"""
+    return rec.account == acct.name or (rec.account is None and acct.primary)
+
 def resume_trades_from_state(event_loop=None):
     """
     程式重啟後，根據 chao_bi_state.json 嘗試恢復：
     1) 還掛著但未完全成交的 LIMIT 開倉單 → 重新啟動 monitor_and_auto_cancel
     2) 已完全成交但缺少 SL/TP 的倉位 → 依當初紀錄的 SL/TP 補掛風控單
     3) 已被撤單 / 查無此單 → 自狀態檔移除
+    只處理目前帳戶（use_account）的紀錄；多帳戶時由呼叫端逐一切換帳戶呼叫。
     """
+    binance_client = get_binance_client()
     if binance_client is None:
         print("⚠️ 無法恢復狀態：幣安客戶端未初始化。")
         return
 
-    if not _tracked_trades:
+    acct = current_account()
+    trades = [(key, rec) for key, rec in iter_tracked_trades() if _owned_by(rec, acct)]
+    if not trades:
         print("ℹ️ 沒有需要恢復的交易狀態。")
         return
 
-    print(f"🔁 嘗試恢復 {len(_tracked_trades)} 筆已記錄交易狀態 …")
-    for key, rec in list(_tracked_trades.items()):
+    print(f"🔁 嘗試恢復 {len(trades)} 筆已記錄交易狀態 …")
+    # 持倉只查一次、open orders 每個 symbol 只查一次（而非每筆交易各查一次）
+    pos_amounts = None
+    open_orders_by_symbol = {}
+    for key, rec in trades:
         try:
-            entry_id = rec.get("entry_order_id") or int(key)
-            symbol = rec.get("symbol")
-            position_side = (rec.get("position_side") or "LONG").upper()
-            sl_price = rec.get("stop_loss")
-            tp_price = rec.get("take_profit")
+            entry_id = rec.entry_order_id
+            symbol = rec.symbol
+            position_side = rec.position_side
+            sl_price = fmt_decimal(rec.stop_loss)
+            tp_price = fmt_decimal(rec.take_profit)
 
             if not symbol or not entry_id:
-                clear_closed_trade(key)
+                clear_closed_trade(key, reason="invalid_record")
                 continue
 
             od = _query_order(symbol, order_id=int(entry_id))
             if not od:
                 # 查無此單，視為已結束
-                clear_closed_trade(entry_id)
+                clear_closed_trade(entry_id, reason="not_found")
                 continue
 
             status = str(od.get("status", "")).upper()
             otype = str(od.get("type", "")).upper()
 
-            # 若已被取消/過期/拒絕，直接清掉
+            # 已被取消 / 過期（含 GTD 到期）/ 拒絕：沒有成交就清掉；部分成交則倉位仍在，往下確認 SL/TP
             if status in ("CANCELED", "EXPIRED", "REJECTED"):
-                clear_closed_trade(entry_id)
-                continue
+                if not mark_entry_terminal(entry_id, status, od.get("executedQty")):
+                    continue
+                status = "FILLED"
 
             # case 1: LIMIT 單還在 NEW/PARTIALLY_FILLED → 恢復長時間監控（避免重複啟動）
             if otype == "LIMIT" and status in ("NEW", "PARTIALLY_FILLED"):
@@ -962,45 +1126,49 @@ def resume_trades_from_state(event_loop=None):
                 if key_tuple in _monitoring_orders:
                     print(f"ℹ️ 開倉單 {entry_id} ({symbol}) 已在監控中，略過重複註冊。")
                 elif event_loop is not None and getattr(event_loop, "is_running", lambda: False)():
-                    try:
-                        _monitoring_orders.add(key_tuple)
-                        asyncio.run_coroutine_threadsafe(
-                            monitor_and_auto_cancel(
-                                symbol,
-                                int(entry_id),
-                                position_side,
-                                str(sl_price),
-                                str(tp_price),
-                                AUTO_CANCEL_SECONDS,
-                                ORDER_MONITOR_INTERVAL,
-                            ),
-                            event_loop,
-                        )
-                        print(f"⏱️ 已恢復監控開倉單 {entry_id} ({symbol})。")
-                    except Exception as e:
-                        _monitoring_orders.discard(key_tuple)
-                        print(f"⚠️ 恢復監控 {symbol}/{entry_id} 失敗：{e}")
+                    from order_tracker import track_order
+                    # 部分成交且尚未掛 SL/TP：帶入目前狀態，狀態機會立刻補掛
+                    attached = rec.status == TradeStatus.EXITS_ATTACHED
+                    initial_status = status if (status == "PARTIALLY_FILLED" and not attached) else None
+                    # GTD 單由交易所到期；GTC 單才需要程式端計時（以原始下單時間起算）
+                    gtd = str(od.get("timeInForce", "")).upper() == "GTD"
+                    placed_at = int(od.get("time", 0) or 0) / 1000 or time.time()
+                    remaining = max(1, AUTO_CANCEL_SECONDS - (time.time() - placed_at))
+                    event_loop.call_soon_threadsafe(
+                        lambda s=symbol, i=int(entry_id), ps=position_side, sl=sl_price, tp=tp_price,
+                               st=initial_status, ea=attached, ex=gtd, rm=remaining, ac=rec.account:
+                            track_order(s, i, ps, sl, tp, initial_status=st, exits_attached=ea,
+                                        timeout_seconds=rm, exchange_expiry=ex, account=ac)
+                    )
+                    print(f"⏱️ 已恢復監控開倉單 {entry_id} ({symbol})。")
                 else:
                     print(f"⚠️ 事件迴圈不可用，無法恢復監控 {symbol}/{entry_id}。")
                 continue
 
             # case 2: 已經 FILLED/部分成交且有持倉，但可能缺少 SL/TP → 補掛
             if status in ("FILLED", "PARTIALLY_FILLED"):
-                pos_amt = _get_position_amount(symbol, position_side)
+                update_trade_status(entry_id, status)
+                if pos_amounts is None:
+                    pos_amounts = _get_position_amounts()
+                pos_amt = pos_amounts.get((symbol, position_side), Decimal('0'))
                 if pos_amt == 0:
                     # 沒有倉位了，清掉紀錄
-                    clear_closed_trade(entry_id)
+                    clear_closed_trade(entry_id, reason="position_closed")
                     continue
 
                 # 檢查是否已存在 closePosition/reduceOnly 的 SL/TP 單
-                try:
-                    open_ods = _sdk_get_open_orders(symbol)
-                except Exception as e:
-                    print(f"⚠️ 讀取 {symbol} open orders 失敗，略過 SL/TP 檢查：{e}")
-                    continue
+                if symbol not in open_orders_by_symbol:
+                    try:
+                        open_orders_by_symbol[symbol] = _sdk_get_open_orders(symbol) or []
+                    except Exception as e:
+                        print(f"⚠️ 讀取 {symbol} open orders 失敗，略過 SL/TP 檢查：{e}")
+                        continue
+                open_ods = open_orders_by_symbol[symbol]
 
-                has_exit = False
-                for od2 in open_ods or []:
+                # 先用狀態檔記錄的 SL/TP ID 比對，找不到再逐筆判斷訂單型態
+                known_exit_ids = {str(i) for i in rec.exit_order_ids}
+                has_exit = any(str(od2.get("orderId")) in known_exit_ids for od2 in open_ods)
+                for od2 in ([] if has_exit else open_ods):
                     try:
                         ps = (od2.get("positionSide") or "").upper()
                         if ps != position_side:
@@ -1060,17 +1228,19 @@ def reconcile_on_start(event_loop=None, timeout_seconds=AUTO_CANCEL_SECONDS):
         return summary
 
     now_ms = int(time.time() * 1000)
-    pos_set = _get_open_positions_set()
+    # 持倉只查一次；每筆 open order 以 dict / 狀態檔索引 O(1) 對應，整體 O(orders)
+    pos_amounts = _get_position_amounts()
+    pos_set = set(pos_amounts)
     if RECONCILE_VERBOSE:
-        print(f"[ReconcileVerbose] current non-zero positions: {sorted(list(pos_set))}")
+        _verbose(f"[ReconcileVerbose] current non-zero positions: {sorted(list(pos_set))}")
 
     for od in open_orders:
         try:
             if RECONCILE_VERBOSE:
                 try:
-                    print(f"[ReconcileVerbose] raw open order: {json.dumps(od, ensure_ascii=False)}")
+                    _verbose(f"[ReconcileVerbose] raw open order: {json.dumps(od, ensure_ascii=False)}")
                 except Exception:
-                    print(f"[ReconcileVerbose] raw open order (repr): {od}")
+                    _verbose(f"[ReconcileVerbose] raw open order (repr): {od}")
             symbol = od.get('symbol')
             order_id = od.get('orderId')
             otype = od.get('type')
@@ -1099,15 +1269,20 @@ def reconcile_on_start(event_loop=None, timeout_seconds=AUTO_CANCEL_SECONDS):
             # (A) Orphan exits: exit order exists but there is no corresponding position
             if consider_exit:
                 # 先查精確倉位數量
-                position_amt = _get_position_amount(symbol, pos_side)
+                position_amt = pos_amounts.get((symbol, pos_side.upper()), Decimal('0'))
+                tracked = find_trade_by_exit_order(order_id)
                 if RECONCILE_VERBOSE:
-                    print(f"[ReconcileVerbose] positionAmt({symbol}, {pos_side}) = {position_amt}")
+                    _verbose(f"[ReconcileVerbose] positionAmt({symbol}, {pos_side}) = {position_amt}"
+                          f"{f', 屬於開倉單 {tracked[0]}' if tracked else ''}")
                 amt_abs = abs(position_amt)
                 if amt_abs == Decimal('0'):
                     # 無部位，視為孤兒單
                     ok = _cancel_order_safely(symbol, order_id)
                     if ok:
                         summary["orphan_exits"].append({"symbol": symbol, "orderId": order_id, "type": otype, "positionSide": pos_side})
+                        if tracked:
+                            # 倉位已平，對應的追蹤紀錄一併結案
+                            clear_closed_trade(tracked[0], reason="position_closed")
                         notify_user(
                             text=(f"🧹 清理：孤兒 SL/TP 已撤單\n"
                                   f"• 標的: {symbol}\n"
@@ -1133,13 +1308,14 @@ def reconcile_on_start(event_loop=None, timeout_seconds=AUTO_CANCEL_SECONDS):
                     continue
                 continue
 
-            # (B) 陳舊開倉單：非 closePosition，超過逾時未完全成交
-            if create_time and (now_ms - create_time) >= (timeout_seconds * 1000):
+            # (B) 陳舊開倉單：非 closePosition，超過逾時未完全成交（GTD 單由交易所自行到期，不在此處理）
+            is_gtd = str(od.get('timeInForce', '')).upper() == 'GTD'
+            if not is_gtd and create_time and (now_ms - create_time) >= (timeout_seconds * 1000):
                 ok = _cancel_order_safely(symbol, order_id)
                 if ok:
                     summary["stale_entries"].append({"symbol": symbol, "orderId": order_id, "type": otype, "positionSide": pos_side})
                     try:
-                        clear_closed_trade(order_id)
+                        mark_entry_terminal(order_id, "CANCELED", od.get('executedQty'), reason="stale_canceled")
                     except Exception as e:
                         print(f"[error] Reconcile 移除本地狀態失敗：{e}")
                     notify_user(
@@ -1168,113 +1344,24 @@ def reconcile_on_start(event_loop=None, timeout_seconds=AUTO_CANCEL_SECONDS):
     return summary
 
 async def monitor_and_auto_cancel(symbol, order_id, position_side, sl_price_str, tp_price_str, timeout_seconds=AUTO_CANCEL_SECONDS, poll_interval=ORDER_MONITOR_INTERVAL):
-    """ 
-    監控未成交的『開倉 LIMIT 單』；超過 timeout 仍未完全成交則自動撤單。
-    偵測到成交時立刻補掛 SL/TP。
     """
-    key_tuple = (symbol, order_id)
-    print(f"   [Monitor] 開始監控 {symbol} 訂單 {order_id}，逾時 {timeout_seconds}s 未成交將撤單。")
-    exits_attached = False
-    t0 = time.time()
-    try:
-        while True:
-            await asyncio.sleep(poll_interval)
-            try:
-                q = _query_order(symbol, order_id=order_id)
-                if not q:
-                    continue
-                status = str(q.get('status', ''))
-                if status in ('PARTIALLY_FILLED', 'FILLED'):
-                    if not exits_attached:
-                        try:
-                            sl_id, tp_id = _attach_exits_after_fill(
-                                symbol,
-                                position_side,
-                                sl_price_str,
-                                tp_price_str,
-                                entry_order_id=order_id
-                            )
-                            exits_attached = True
-                            print(f"   [Monitor] 偵測到成交（{status}），已立刻補掛 SL/TP。")
-                            notify_user(
-                                text=(f"📎 監控：補掛 SL/TP\n"
-                                      f"• 標的: {symbol}\n"
-                                      f"• 狀態: {status}\n"
-                                      f"• SL: {sl_price_str} (ID: {sl_id})\n"
-                                      f"• TP: {tp_price_str} (ID: {tp_id})\n"
-                                      f"• OrderID: {order_id}"),
-                                loop=client.loop if client else None
-                            )
-                        except Exception as ee:
-                            print(f"   [Monitor] 補掛 SL/TP 失敗：{ee}")
-                    if status == 'FILLED':
-                        print(f"   [Monitor] 訂單 {order_id} 已完全成交，停止監控。")
-                        # 通知完全成交
-                        notify_user(
-                            text=(f"✅ 監控：開倉單已完全成交\n"
-                                  f"• 標的: {symbol}\n"
-                                  f"• OrderID: {order_id}"),
-                            loop=client.loop if client else None
-                        )
-                        return
-                    # PARTIALLY_FILLED: 繼續等，直到完全成交或逾時
-                elif status in ('CANCELED', 'EXPIRED', 'REJECTED'):
-                    print(f"   [Monitor] 訂單 {order_id} 狀態 {status}，停止監控。")
-                    try:
-                        clear_closed_trade(order_id)
-                    except Exception as e:
-                        print(f"⚠️ 移除本地狀態失敗：{e}")
-                    break
-                if time.time() - t0 >= timeout_seconds:
-                    if status != 'FILLED':
-                        print(f"   [Monitor] 超過 {timeout_seconds}s 未完全成交，嘗試撤單 {order_id} ...")
-                        try:
-                            binance_client.cancel_order(symbol=symbol, orderId=order_id)
-                            print(f"   ✅ 已撤單 {order_id}（若部分成交，僅撤未成交殘量）。")
-                            try:
-                                clear_closed_trade(order_id)
-                                # 通知超時撤單
-                                notify_user(
-                                    text=(f"🕒 監控：超過期限未完全成交，已撤單\n"
-                                        f"• 標的: {symbol}\n"
-                                        f"• OrderID: {order_id}"),
-                                    loop=client.loop if client else None
-                                )
-                            except Exception as e:
-                                print(f"⚠️ 移除本地狀態失敗：{e}")
-                                # 通知超時撤單
-                                notify_user(
-                                    text=(f"🕒 監控：超過期限未完全成交，已撤單，移除本地狀態失敗\n"
-                                        f"• 標的: {symbol}\n"
-                                        f"• OrderID: {order_id}"),
-                                    loop=client.loop if client else None
-                                )
-                        except ClientError as e:
-                            print(f"   ❌ 撤單失敗：{e}")
-                            # 通知撤單失敗
-                            notify_user(
-                                text=(f"⚠️ 監控：撤單失敗\n"
-                                      f"• 標的: {symbol}\n"
-                                      f"• OrderID: {order_id}\n"
-                                      f"• 錯誤: {e}"),
-                                loop=client.loop if client else None
-                            )
-                    return
-            except Exception as e:
-                print(f"   [Monitor] 查詢訂單時發生錯誤：{e}")
-    finally:
-        # 無論正常結束或遇到例外，皆移除監控標記
-        try:
-            _monitoring_orders.discard(key_tuple)
-        except Exception:
-            pass
+    相容舊呼叫：改由 order_tracker 的狀態機追蹤這張開倉單，並等待追蹤結束。
+    （poll_interval 參數保留但不再使用；查單頻率由 order_tracker 決定）
+    """
+    from order_tracker import track_order
+    tracker = track_order(symbol, order_id, position_side, sl_price_str, tp_price_str,
+                          timeout_seconds=timeout_seconds)
+    await tracker.wait_closed()
 
 def _attach_exits_after_fill(symbol, position_side, sl_price_str, tp_price_str,
                              working_type='MARK_PRICE', entry_order_id=None):
     """
     在『倉位已建立』後，送出 SL/TP 兩張【條件關倉單】。
     使用 STOP_MARKET / TAKE_PROFIT_MARKET + closePosition="true"。
+    sl_price_str / tp_price_str 為 None 的一邊不掛（重試時只補失敗的那一邊）。
+    回傳實際掛上的 (sl_id, tp_id)，失敗的一邊為 None；已掛上的一邊照樣寫回狀態檔。
     """
+    binance_client = get_binance_client()
     close_side = 'SELL' if position_side == 'LONG' else 'BUY'
 
     sl_order_params = {
@@ -1298,22 +1385,26 @@ def _attach_exits_after_fill(symbol, position_side, sl_price_str, tp_price_str,
         'priceProtect': "true",
     }
 
+    sl_id = tp_id = None
     try:
-        print("   [Binance] 成交後掛上止損單 (STOP_MARKET, closePosition=true)...")
-        res1 = binance_client.new_order(**sl_order_params)
-        sl_id = res1.get('orderId')
-        print(f"   ✅ SL 已掛上 (ID: {sl_id})")
-
-        print("   [Binance] 成交後掛上止盈單 (TAKE_PROFIT_MARKET, closePosition=true)...")
-        res2 = binance_client.new_order(**tp_order_params)
-        tp_id = res2.get('orderId')
-        print(f"   ✅ TP 已掛上 (ID: {tp_id})")
+        if sl_price_str is not None:
+            print("   [Binance] 成交後掛上止損單 (STOP_MARKET, closePosition=true)...")
+            res1 = binance_client.new_order(**sl_order_params)
+            sl_id = res1.get('orderId')
+            print(f"   ✅ SL 已掛上 (ID: {sl_id})")
+
+        if tp_price_str is not None:
+            print("   [Binance] 成交後掛上止盈單 (TAKE_PROFIT_MARKET, closePosition=true)...")
+            res2 = binance_client.new_order(**tp_order_params)
+            tp_id = res2.get('orderId')
+            print(f"   ✅ TP 已掛上 (ID: {tp_id})")
+    except ClientError as e:
+        print(f"❌ 成交後掛 SL/TP 失敗：{e}")
+    # SL 已掛上但 TP 失敗時，SL 的 ID 也要寫回，之後只重試 TP
+    if sl_id is not None or tp_id is not None:
         try:
             if entry_order_id is not None:
                 update_exits_for_trade(entry_order_id, sl_id, tp_id)
         except Exception as e:
             print(f"⚠️ 更新本地狀態 SL/TP 失敗：{e}")
-        return sl_id, tp_id
-    except ClientError as e:
-        print(f"❌ 成交後掛 SL/TP 失敗：{e}")
-        return None, None
\ No newline at end of file
+    return sl_id, tp_id
@@ -2,33 +2,53 @@ import asyncio
 import time
 from decimal import Decimal, ROUND_DOWN, ROUND_UP
 from config import (
-    RISK_PER_TRADE_PERCENT,MAX_INITIAL_MARGIN_PCT,
+    RISK_PER_TRADE_PERCENT,
     POSITION_SIZING_MODE,USE_PY_RISK_MANAGER,
-    AUTO_CANCEL_SECONDS, ORDER_MONITOR_INTERVAL,
-    INITIAL_FILL_WAIT_SECONDS, INITIAL_POLL_INTERVAL,
+    AUTO_CANCEL_SECONDS,
+    SOURCE_CHAT_IDS, TRADE_JOURNAL_COMPACT_INTERVAL_SEC,
 )
 from state_store import (
-    register_entry_trade, load_state
+    register_entry_trade, update_trade_status, load_state, get_tracked_trade,
 )
+from trade_journal import compact as compact_journal
 from llm import (
     parse_signal_with_llm,
     complete_trade_with_llm,
 )
 from telegram import (
-    client, notify_user
+    notify_user,
+    accept_new_message, get_sender_cached,
+    get_chat_title, is_saved_message,
+    set_self_user_id, command_of, ADMIN_COMMANDS,
 )
 from binance_api import (
-    binance_client, get_symbol_info,
+    get_symbol_info,
     set_binance_leverage, format_value_by_precision,
     get_binance_market_price, _get_lot_size_filter,
-    total_available_margin, _cap_qty_by_initial_margin,
-    _query_order, monitor_and_auto_cancel,
-    _attach_exits_after_fill, normalize_aliases,
+    _cap_qty_by_initial_margin,
+    normalize_aliases,
     is_valid_symbol, get_binance_klines_for_llm,
     apply_leverage_override, select_sl_tp_with_user_pref,
     sanitize_targets, reconcile_on_start,
+    entry_time_in_force, is_gtd_rejection, mark_gtd_unsupported,
+    entry_client_order_id, is_duplicate_client_order, find_order_by_client_id,
     daily_pnl_notifier, resume_trades_from_state,
 )
+from prefetch import start_prefetch, take_prefetch, discard_prefetch, warm_symbol_registry
+from order_tracker import track_order, attach_exits_for_fill
+from scheduler import run_in_pool, run_in_lane, format_pool_stats
+from loop_monitor import start_loop_monitor
+from profiler import handle_admin_command, note_signal
+from app import (
+    get_binance_client, get_telegram_client, connect_binance, available_margin,
+    get_accounts, current_account, use_account,
+)
+from metrics import (
+    stage, observe_stage, new_correlation_id, current_correlation_id,
+    trace_set, get_trace, format_trace, SIGNALS, start_metrics_server,
+)
+from logs import get_printer
+print = get_printer("chao_bi")
 # --- [warning] 導入幣安官方 SDK (v32) [warning] ---
 try:
     from binance.error import ClientError
@@ -36,32 +56,35 @@ except ImportError as e:
     print(f"[error] 致命錯誤：找不到 'binance.um_futures' 模組！")
     print(f"錯誤詳情: {e}")
     exit()
-
-# --- 導入 Telethon (v32) ---
-try:
-    from telethon import events
-except ImportError as e:
-    print(f"[error] 致命錯誤：找不到 'telethon' 模組！")
-    print(f"錯誤詳情: {e}")
-    exit()
+# Telethon 與幣安客戶端由 app.py 在第一次使用時建立（import 本模組不連網）
 
 # === [executor] 真實下單主流程 ===
 def execute_trade(trade_command: dict, event_loop=None):
-    """真實下單流程：先下【開倉單】，成交後再掛【SL/TP 關倉單】。"""
+    """
+    真實下單流程：先下【開倉單】，成交後再掛【SL/TP 關倉單】。
+    對目前帳戶（use_account）下單；成功送出開倉單回傳 orderId，其餘情況回傳 None。
+    """
+    binance_client = get_binance_client()
+    total_available_margin = available_margin()
+    acct = current_account()
+    margin_pct = acct.margin_pct
+    acct_line = f"• 帳戶: {acct.name}\n" if len(get_accounts()) > 1 else ""
     if binance_client is None:
         print("[error] 交易失敗：幣安客戶端未初始化。")
         return
 
-    print("\n" + "="*30)
-    print(f"🚨🚨🚨 執行交易 (!!! 真實環境 !!!) 🚨🚨🚨")
-    print(f"   動作: {trade_command.get('action')}")
-    print(f"   標的: {trade_command.get('symbol')}")
-    print(f"   入場: {trade_command.get('entry_price')}")
-    print(f"   止盈: {trade_command.get('take_profit')}")
-    print(f"   止損: {trade_command.get('stop_loss')}")
-    print(f"   槓桿: {trade_command.get('leverage')}x")
-    print(f"   數量: {trade_command.get('quantity')}")
-    print("="*30)
+    # 橫幅合成一筆紀錄（一次入列，不再逐行寫 stdout）
+    print("\n" + "="*30 + "\n"
+          f"🚨🚨🚨 執行交易 (!!! 真實環境 !!!) 🚨🚨🚨\n"
+          f"   帳戶: {acct.name}\n"
+          f"   動作: {trade_command.get('action')}\n"
+          f"   標的: {trade_command.get('symbol')}\n"
+          f"   入場: {trade_command.get('entry_price')}\n"
+          f"   止盈: {trade_command.get('take_profit')}\n"
+          f"   止損: {trade_command.get('stop_loss')}\n"
+          f"   槓桿: {trade_command.get('leverage')}x\n"
+          f"   數量: {trade_command.get('quantity')}\n"
+          + "="*30)
 
     symbol = trade_command.get('symbol')
     action = trade_command.get('action')  # 'BUY' or 'SELL'
@@ -78,7 +101,14 @@ def execute_trade(trade_command: dict, event_loop=None):
     if requested_leverage is None:
         print(f"[error] 交易失敗：LLM 未能提供槓桿，已取消下單。")
         return
-    applied_leverage = set_binance_leverage(symbol, requested_leverage)
+    target_leverage = requested_leverage
+    max_leverage = trade_command.get('prefetched_max_leverage')
+    if max_leverage and requested_leverage > int(max_leverage):
+        # 預取已查到上限：直接以上限設定，省去一次 -4028 回退（回退流程同樣會先試這個上限）
+        target_leverage = int(max_leverage)
+        print(f"   [Prefetch] {symbol} 槓桿上限 {target_leverage}x，直接以上限設定。")
+    with stage("set_leverage"):
+        applied_leverage = set_binance_leverage(symbol, target_leverage)
     if not applied_leverage:
         print(f"[error] 交易失敗：設定 {requested_leverage}x 槓桿失敗，已取消下單。")
         return
@@ -90,11 +120,13 @@ def execute_trade(trade_command: dict, event_loop=None):
 
     # 2) 交易對精度
     print(f"   [Binance] 正在獲取 {symbol} 交易對資訊...")
-    info = get_symbol_info(symbol)
+    with stage("symbol_info"):
+        info = get_symbol_info(symbol)
     if not info:
         print(f"[error] 交易失敗：無法獲取 {symbol} 資訊，已停止下單")
         return
 
+    t_format = time.perf_counter()
     try:
         price_precision = next(f['tickSize'] for f in info['filters'] if f['filterType'] == 'PRICE_FILTER')
         lot_filter = _get_lot_size_filter(info)
@@ -125,7 +157,7 @@ def execute_trade(trade_command: dict, event_loop=None):
         cap_qty_by_margin = None
         try:
             if ref_price_dec and Decimal(str(leverage)) > 0:
-                cap_qty_by_margin = (Decimal(str(total_available_margin)) * Decimal(str(MAX_INITIAL_MARGIN_PCT)) * Decimal(str(leverage))) / ref_price_dec
+                cap_qty_by_margin = (Decimal(str(total_available_margin)) * Decimal(str(margin_pct)) * Decimal(str(leverage))) / ref_price_dec
         except Exception:
             cap_qty_by_margin = None
 
@@ -188,7 +220,7 @@ def execute_trade(trade_command: dict, event_loop=None):
         try:
             lev_dec2 = Decimal(str(leverage))
             if ref_price_dec is not None and lev_dec2 > 0:
-                max_margin_amt2 = Decimal(str(total_available_margin)) * Decimal(str(MAX_INITIAL_MARGIN_PCT))
+                max_margin_amt2 = Decimal(str(total_available_margin)) * Decimal(str(margin_pct))
                 cur_qty_dec2 = Decimal(str(formatted_quantity))
                 capped_qty = _cap_qty_by_initial_margin(ref_price_dec, lev_dec2, cur_qty_dec2,
                                                         max_margin_amt2, Decimal(str(quantity_precision)), Decimal(str(min_qty_str)))
@@ -196,7 +228,8 @@ def execute_trade(trade_command: dict, event_loop=None):
                     print("[error] 交易取消：在最終封頂後，最小下單量也超出 3% 保證金上限。")
                     notify_user(
                         text=(f"[warning] 已取消下單（超出 3% 初始保證金上限）\n"
-                              f"• 標的: {symbol}\n"
+                              + acct_line
+                              + f"• 標的: {symbol}\n"
                               f"• 計算後數量無法符合上限與最小下單量"),
                         loop=event_loop
                     )
@@ -235,7 +268,9 @@ def execute_trade(trade_command: dict, event_loop=None):
 
     except Exception as e:
         print(f"[error] 交易失敗：格式化精度時出錯: {e}")
+        observe_stage("format_qty", time.perf_counter() - t_format, error=True)
         return
+    observe_stage("format_qty", time.perf_counter() - t_format)
 
     # 若最終數量仍為 0，直接中止，避免 -4003
     if Decimal(str(formatted_quantity)) == 0:
@@ -246,12 +281,13 @@ def execute_trade(trade_command: dict, event_loop=None):
     try:
         if ref_price_dec is not None and Decimal(str(leverage)) > 0:
             est_initial_margin = (ref_price_dec * Decimal(str(formatted_quantity))) / Decimal(str(leverage))
-            cap_amt = Decimal(str(total_available_margin)) * Decimal(str(MAX_INITIAL_MARGIN_PCT))
+            cap_amt = Decimal(str(total_available_margin)) * Decimal(str(margin_pct))
             if est_initial_margin > cap_amt * Decimal('1.001'):
                 print(f"[error] 交易取消：估算初始保證金 {est_initial_margin} 超過上限 {cap_amt}")
                 notify_user(
                     text=(f"[warning] 已取消下單（初始保證金超標）\n"
-                          f"• 標的: {symbol}\n"
+                          + acct_line
+                          + f"• 標的: {symbol}\n"
                           f"• 估算初始保證金: {est_initial_margin}\n"
                           f"• 上限(3%): {cap_amt}"),
                     loop=event_loop
@@ -271,34 +307,89 @@ def execute_trade(trade_command: dict, event_loop=None):
         'quantity': formatted_quantity,
         'newOrderRespType': 'RESULT',  # 盡可能拿到即時結果
     }
+    expires_at = None
     if order_type == 'LIMIT':
         entry_order_params['price'] = formatted_price
-        entry_order_params['timeInForce'] = 'GTC'
+        # 預設 GTD：到期由幣安撤單；不支援的 symbol 回退 GTC，由 OrderTracker 計時撤單
+        tif_params, expires_at = entry_time_in_force(symbol, AUTO_CANCEL_SECONDS)
+        entry_order_params.update(tif_params)
+    # 由訊號冪等鍵導出的固定 clientOrderId：同一訊號重複投遞時可查回上一次送出的開倉單
+    client_order_id = trade_command.get('client_order_id')
+    if client_order_id:
+        entry_order_params['newClientOrderId'] = client_order_id
 
     try:
-        print("   [Binance 動作] 送出『開倉單』 ...")
-        entry_resp = binance_client.new_order(**entry_order_params)
-        print(f"   ✅ 開倉單已送出。狀態: {entry_resp.get('status')}，ID: {entry_resp.get('orderId')}")
+        timeline = dict(trade_command.get('timeline') or {})
+        timeline['order_sent'] = time.time()
+        existing = None
+        if client_order_id and trade_command.get('redelivered'):
+            existing = find_order_by_client_id(symbol, client_order_id)
+            if existing is None and trade_command.get('adopt_only'):
+                print("   [冪等] 訊號已過期且此帳戶先前未送出開倉單，不再補下。")
+                print("="*30 + "\n")
+                return None
+        if existing is None:
+            print("   [Binance 動作] 送出『開倉單』 ...")
+            try:
+                with stage("entry_order"):
+                    entry_resp = binance_client.new_order(**entry_order_params)
+            except ClientError as e:
+                if client_order_id and is_duplicate_client_order(e):
+                    existing = find_order_by_client_id(symbol, client_order_id)
+                    if existing is None:
+                        raise
+                elif expires_at is None or not is_gtd_rejection(e):
+                    raise
+                else:
+                    print(f"[warning] GTD 開倉單被拒（{e}），改用 GTC 重送。")
+                    mark_gtd_unsupported(symbol)
+                    entry_order_params.pop('goodTillDate', None)
+                    entry_order_params['timeInForce'] = 'GTC'
+                    expires_at = None
+                    with stage("entry_order"):
+                        entry_resp = binance_client.new_order(**entry_order_params)
+        if existing is not None:
+            # 同一訊號先前已送出開倉單（行程在回報前被重啟）：沿用該單，不再重送
+            entry_resp = existing
+            formatted_quantity = existing.get('origQty') or formatted_quantity
+            if order_type == 'LIMIT':
+                formatted_price = existing.get('price') or formatted_price
+                gtd_ms = int(existing.get('goodTillDate') or 0)
+                expires_at = gtd_ms / 1000.0 if str(existing.get('timeInForce')).upper() == 'GTD' and gtd_ms else None
+            print(f"   [冪等] 同一訊號的開倉單已存在（ID: {existing.get('orderId')}，狀態 {existing.get('status')}），不再重送。")
+            if get_tracked_trade(existing.get('orderId')) is not None:
+                print("="*30 + "\n")
+                return existing.get('orderId')
+        else:
+            print(f"   ✅ 開倉單已送出。狀態: {entry_resp.get('status')}，ID: {entry_resp.get('orderId')}")
         order_id = entry_resp.get('orderId')
+        trace_set(**{"order_id" if acct.primary else f"order_id_{acct.name}": order_id}, order_type=order_type)
         try:
-            register_entry_trade(
-                symbol=symbol,
-                position_side=position_side,
-                order_type=order_type,
-                entry_price=(formatted_price or (str(ref_price_dec) if ref_price_dec is not None else None)),
-                quantity=formatted_quantity,
-                leverage=leverage,
-                stop_loss=formatted_sl_price,
-                take_profit=formatted_tp_price,
-                entry_order_id=order_id,
-            )
+            with stage("register"):
+                register_entry_trade(
+                    symbol=symbol,
+                    position_side=position_side,
+                    order_type=order_type,
+                    entry_price=(formatted_price or (str(ref_price_dec) if ref_price_dec is not None else None)),
+                    quantity=formatted_quantity,
+                    leverage=leverage,
+                    stop_loss=formatted_sl_price,
+                    take_profit=formatted_tp_price,
+                    entry_order_id=order_id,
+                    channel=trade_command.get('channel'),
+                    signal_text=signal_text,
+                    timeline=timeline,
+                    expires_at=expires_at,
+                    account=None if acct.primary else acct.name,
+                )
         except Exception as e:
             print(f"[warning] 記錄開倉單狀態失敗（不影響下單）：{e}")
         try:
             decision_signal = ("市價觸發" if order_type == 'MARKET' else f"限價@{formatted_price}") + " | 解析: " + (signal_text[:80] if signal_text else "N/A")
             notify_user(
                 text=(f"📤 已送出開倉單\n"
-                    f"• 標的: {symbol}\n"
+                    + acct_line
+                    + f"• 標的: {symbol}\n"
                     f"• 方向: {action} ({position_side})\n"
                     f"• 類型: {order_type}\n"
                     f"• 價格: {formatted_price or 'MARKET'}\n"
@@ -317,149 +408,184 @@ def execute_trade(trade_command: dict, event_loop=None):
         print("="*30 + "\n")
         return
 
-    # 4) 等待成交（或 MARKET 視為立即成交），成交後再掛 SL/TP
+    # 4) 交給 OrderTracker：成交（MARKET 視為立即成交）→ 掛 SL/TP → 逾時撤單，全部在事件迴圈中非同步完成，
+    #    executor 執行緒在此即可返回，不再阻塞輪詢等待成交。
     order_id = entry_resp.get('orderId')
-    filled = False
+    decision_signal = ("市價觸發" if order_type == 'MARKET' else f"限價@{formatted_price}") + " | 解析: " + (signal_text[:80] if signal_text else "N/A")
+    leverage_note = f"• 槓桿回退: {requested_leverage}x → {leverage}x\n" if requested_leverage != leverage else ""
+    initial_status = 'FILLED' if order_type == 'MARKET' else None
 
     if order_type == 'MARKET':
-        # MARKET 一般直接 FILLED
-        filled = True
         print("   [Binance] 市價單視為已成交。")
         try:
-            decision_signal = ("市價觸發" if order_type == 'MARKET' else f"限價@{formatted_price}") + " | 解析: " + (signal_text[:80] if signal_text else "N/A")
             notify_user(
                 text=(
                     f"✅ 市價單已成交\n"
-                    f"• 標的: {symbol}\n"
+                    + acct_line
+                    + f"• 標的: {symbol}\n"
                     f"• 方向: {action} ({position_side})\n"
                     f"• 決策訊號: {decision_signal}\n"
                     f"• 將掛 SL/TP: SL {formatted_sl_price} / TP {formatted_tp_price}\n"
                     f"• OrderID: {order_id}\n"
-                    + (f"• 槓桿回退: {requested_leverage}x → {leverage}x\n" if requested_leverage != leverage else "")
+                    + leverage_note
                     + f"• 來源訊號: {signal_text}"
                 ),
                 loop=event_loop
             )
         except Exception:
             pass
-    else:
-        # LIMIT：輪詢查詢訂單狀態
-        print(f"   [Binance] 等待開倉單成交 (最多 {INITIAL_FILL_WAIT_SECONDS} 秒，每 {INITIAL_POLL_INTERVAL} 秒檢查一次)...")
-        t0 = time.time()
-        while time.time() - t0 < INITIAL_FILL_WAIT_SECONDS:
-            time.sleep(INITIAL_POLL_INTERVAL)
-            q = _query_order(symbol, order_id=order_id)
-            if not q:
-                continue
-            status = str(q.get('status', ''))
-            if status in ('FILLED', 'PARTIALLY_FILLED'):
-                filled = True
-                print(f"   [Binance] 開倉單狀態: {status}，已準備掛 TP/SL。")
-                try:
-                    decision_signal = ("市價觸發" if order_type == 'MARKET' else f"限價@{formatted_price}") + " | 解析: " + (signal_text[:80] if signal_text else "N/A")
-                    notify_user(
-                        text=(f"✅ 開倉單成交狀態: {status}\n"
-                            f"• 標的: {symbol}\n"
-                            f"• 方向: {action} ({position_side})\n"
-                            f"• 決策訊號: {decision_signal}\n"
-                            f"• 將掛 SL/TP: SL {formatted_sl_price} / TP {formatted_tp_price}\n"
-                            f"• OrderID: {order_id}\n"
-                            + (f"• 槓桿回退: {requested_leverage}x → {leverage}x\n" if requested_leverage != leverage else "")
-                            + f"• 來源訊號: {signal_text}"),
-                        loop=event_loop
-                    )
-                except Exception:
-                    pass
-                break
-            elif status in ('CANCELED', 'EXPIRED', 'REJECTED'):
-                print(f"[error] 開倉單未成交（狀態: {status}），取消掛 TP/SL。")
-                break
-
-    if not filled:
-        # 未在短時間內成交：啟動長時監控，逾時自動撤單（在主事件迴圈中排程）
-        try:
-            if event_loop and hasattr(event_loop, "is_running") and event_loop.is_running():
-                asyncio.run_coroutine_threadsafe(
-                    monitor_and_auto_cancel(symbol, order_id, position_side, formatted_sl_price, formatted_tp_price, AUTO_CANCEL_SECONDS, ORDER_MONITOR_INTERVAL),
-                    event_loop
-                )
-                print(f"   [Binance] 已啟動 12 小時未成交自動撤單監控（訂單 {order_id}）。")
-            else:
-                print("   [warning] 無法啟動監控任務：主事件迴圈不可用，略過背景監控。")
-        except Exception as e:
-            print(f"   [warning] 無法啟動監控任務：{e}")
-        print("="*30 + "\n")
-        return
 
-    # 5) 安全檢查：避免「立即觸發」的 TP（可依偏好關掉）
-    try:
-        current_mark_price_str = get_binance_market_price(symbol)
-        current_mark_price = Decimal(current_mark_price_str)
-        tp_price_dec = Decimal(formatted_tp_price)
-
-        print(f"   [Binance] 成交後 TP 檢查：目標 {tp_price_dec}，當前 {current_mark_price}")
-        will_trigger_immediately = (is_buy_signal and tp_price_dec <= current_mark_price) or \
-                                   ((not is_buy_signal) and tp_price_dec >= current_mark_price)
-        if will_trigger_immediately:
-            print("[warning] [Binance 提示] TP 將立即觸發。依照目前設定，為避免『成交即平倉』，**略過** TP（仍保留 SL）。")
-            # 只掛 SL
-            sl_id, _ = _attach_exits_after_fill(
-                symbol,
-                position_side,
-                formatted_sl_price,
-                formatted_sl_price,
-                entry_order_id=order_id
+    if event_loop and hasattr(event_loop, "is_running") and event_loop.is_running():
+        context = {
+            "action": action,
+            "signal_text": signal_text,
+            "decision_signal": decision_signal,
+            "leverage_note": leverage_note,
+            "cid": current_correlation_id(),
+        }
+        event_loop.call_soon_threadsafe(
+            lambda: track_order(
+                symbol, order_id, position_side, formatted_sl_price, formatted_tp_price,
+                order_type=order_type, initial_status=initial_status,
+                timeout_seconds=AUTO_CANCEL_SECONDS, exchange_expiry=expires_at is not None,
+                context=context, account=None if acct.primary else acct.name,
             )
-            try:
-                notify_user(
-                    text=(f"[warning] 價格過近，僅掛 SL 以避免即刻觸發 TP\n"
-                        f"• 標的: {symbol}\n"
-                        f"• 方向: {action} ({position_side})\n"
-                        f"• SL: {formatted_sl_price} (ID: {sl_id})"),
-                    loop=event_loop
-                )
-            except Exception:
-                pass
-            print("="*30 + "\n")
-            return
-    except Exception as e:
-        print(f"[warning] 當前價查詢失敗，仍將嘗試掛 SL/TP：{e}")
-
-    # 6) 正式掛上 SL/TP（條件關倉單）
-    sl_id, tp_id = _attach_exits_after_fill(
-        symbol,
-        position_side,
-        formatted_sl_price,
-        formatted_tp_price,
-        entry_order_id=order_id
-    )
-    try:
-        notify_user(
-            text=(f"📎 已掛上風控單 (SL/TP)\n"
-                f"• 標的: {symbol}\n"
-                f"• 方向: {action} ({position_side})\n"
-                f"• SL: {formatted_sl_price} (ID: {sl_id})\n"
-                f"• TP: {formatted_tp_price} (ID: {tp_id})\n"
-                f"• 來源訊號: {signal_text}"),
-            loop=event_loop
         )
+        print(f"   [Binance] 已交由 OrderTracker 追蹤訂單 {order_id}（未成交 {AUTO_CANCEL_SECONDS}s 後"
+              f"{'由交易所 GTD 到期' if expires_at is not None else '自動撤單'}）。")
+    elif order_type == 'MARKET':
+        # 沒有事件迴圈（例如單獨呼叫）：市價單仍同步掛上 SL/TP
+        update_trade_status(order_id, 'FILLED')
+        sl_id, tp_id, tp_skipped = attach_exits_for_fill(symbol, position_side, formatted_sl_price, formatted_tp_price, order_id)
+        print(f"   [Binance] SL/TP 掛單結果：SL {sl_id} / TP {tp_id}{'（略過 TP）' if tp_skipped else ''}")
+    else:
+        print("   [warning] 無法啟動監控任務：主事件迴圈不可用，略過背景監控。")
+    print("="*30 + "\n")
+    return order_id
+
+# === [sizing] 依帳戶計算倉位 ===
+def size_position(symbol, entry_price, stop_loss, leverage):
+    """以目前帳戶（use_account）的可用保證金與 margin_pct 計算下單數量；入場價等於止損價時回傳 None。"""
+    acct = current_account()
+    margin_pct = acct.margin_pct
+    eprice_dec = Decimal(str(entry_price))
+    lev_dec = Decimal(str(leverage))
+    price_diff = abs(Decimal(str(entry_price)) - Decimal(str(stop_loss)))
+    if price_diff == 0:
+        print(f"[error] 交易拒絕：入場價和止損價相同！")
+        return None
+
+    total_available_margin = available_margin()
+    max_margin_amt = Decimal(str(total_available_margin)) * Decimal(str(margin_pct))
+
+    if POSITION_SIZING_MODE == 'margin':
+        # 以「初始保證金 = 可用餘額 * margin_pct」計算部位
+        qty_by_margin = (max_margin_amt * lev_dec) / eprice_dec
+        final_quantity = float(qty_by_margin)
+        planned_initial_margin = (eprice_dec * Decimal(str(final_quantity))) / lev_dec
+        planned_risk_amount = Decimal(str(final_quantity)) * price_diff  # 用於對照說明
+        sizing_note = f"（按初始保證金 {margin_pct*100:.1f}% 計算）"
+    else:
+        # 原本的「每筆風險金額」算法
+        risk_amount_usdt = Decimal(str(total_available_margin)) * Decimal(str(RISK_PER_TRADE_PERCENT))
+        final_quantity = float(risk_amount_usdt / price_diff)
+        # 仍受初始保證金上限保護
+        qty_cap_by_margin = (max_margin_amt * lev_dec) / eprice_dec
+        if Decimal(str(final_quantity)) > qty_cap_by_margin:
+            print(f"[warning] 已啟動保證金上限保護：每筆初始保證金 ≤ {margin_pct*100:.1f}% 可用餘額。")
+            print(f"   原計算數量: {final_quantity:.6f}，上限數量: {qty_cap_by_margin:.6f}")
+            final_quantity = float(qty_cap_by_margin)
+        planned_initial_margin = (eprice_dec * Decimal(str(final_quantity))) / lev_dec
+        planned_risk_amount = Decimal(str(final_quantity)) * price_diff
+        sizing_note = "（按每筆風險金額計算）"
+
+    print(f"--- Python 倉位計算 [{acct.name}] ---")
+    print(f"   總可用保證金: {total_available_margin:.2f} USDT")
+    print(f"   模式: {POSITION_SIZING_MODE} {sizing_note}")
+    print(f"   初始保證金目標: {margin_pct*100:.1f}% → 計劃使用 ≈ {planned_initial_margin:.4f} USDT")
+    try:
+        est_pct = (planned_initial_margin / Decimal(str(total_available_margin))) * Decimal('100')
+        print(f"   預估初始保證金占比: {est_pct:.4f}% （上限 {margin_pct*100:.2f}%）")
     except Exception:
         pass
-    print("="*30 + "\n")
-
+    print(f"   入場價: {entry_price}, 止損價: {stop_loss}")
+    print(f"   價差(至SL): {price_diff}")
+    print(f"   理論最大虧損(至SL): {planned_risk_amount:.4f} USDT")
+    print(f"   槓桿: {int(leverage)}x")
+    print(f"   ==> 計算數量: {final_quantity:.6f} {symbol.replace('USDT', '')}")
+    return final_quantity
+
+async def _execute_for_account(acct, base_command, entry_price, loop):
+    """
+    對單一帳戶：套用槓桿上限 → 依該帳戶餘額計算數量 → 在該帳戶的 symbol lane 下單。
+    回傳 (帳戶名稱, orderId 或 None, 耗時秒數)；耗時記入 metrics 的 account_<name> 階段。
+    """
+    t0 = time.perf_counter()
+    order_id = None
+    try:
+        with use_account(acct):
+            symbol = base_command["symbol"]
+            leverage = acct.cap_leverage(base_command["leverage"])
+            quantity = size_position(symbol, entry_price, base_command["stop_loss"], leverage)
+            if quantity is None:
+                return acct.name, None, time.perf_counter() - t0
+            cmd = dict(base_command, leverage=leverage, quantity=quantity)
+            if base_command.get("signal_key"):
+                cmd["client_order_id"] = entry_client_order_id(base_command["signal_key"], None if acct.primary else acct.name)
+            if not acct.primary:
+                # 槓桿上限是以主帳戶查詢的，其他帳戶照常由 -4028 回退
+                cmd["prefetched_max_leverage"] = None
+            # 同帳戶同 symbol 依序執行；不同帳戶（含同 symbol）平行
+            lane = symbol if acct.primary else f"{symbol}@{acct.name}"
+            order_id = await run_in_lane(lane, 'order', execute_trade, cmd, loop)
+    except Exception as e:
+        print(f"[error] 帳戶 {acct.name} 下單失敗：{e}")
+    finally:
+        observe_stage(f"account_{acct.name}", time.perf_counter() - t0, error=order_id is None)
+    return acct.name, order_id, time.perf_counter() - t0
 
 
-# (v32: 監聽所有訊息)
-@client.on(events.NewMessage()) 
+# 來源過濾在 Telethon 事件層級完成（accept_new_message，零網路呼叫）；
+# 白名單見 config 的 SOURCE_CHAT_IDS / COMMAND_CHAT_IDS / ALLOW_SELF_TEST_CHAT
 async def handle_new_channel_message(event):
+    """每則訊息一個 correlation id：各階段耗時記入 metrics，結束時印出一行 trace。"""
+    if not event.message.message:
+        return
+    cid = new_correlation_id(chat_id=getattr(event, "chat_id", None))
+    try:
+        with stage("handler_total"):
+            await _handle_message(event)
+    finally:
+        finish_signal_trace(cid)
+
+def finish_signal_trace(cid):
+    """依 trace 內容記錄訊號結果（SIGNALS 計數），交易訊號另印一行 trace。"""
+    t = get_trace(cid) or {}
+    if any(name == "entry_order" for name, _ in t.get("stages", ())):
+        outcome = "order_sent"
+    elif t.get("action") in ("BUY", "SELL"):
+        outcome = "rejected"
+    elif t.get("action"):
+        outcome = "ignored"
+    else:
+        outcome = "other"
+    SIGNALS.inc((outcome,))
+    if t.get("action") in ("BUY", "SELL"):
+        print(format_trace(cid))
+        note_signal()
+
+async def _handle_message(event):
 
     message_text = event.message.message
     if not message_text:
         return
+    signal_received_at = time.time()
 
     # 忽略所有機器人帳號發出的訊息（避免自己的 Bot 推播被吃進來）
+    # via_bot / 自己的通知 Bot / 已快取的 Bot 已在 accept_new_message 擋掉；這裡只處理首次見到的 sender
     try:
-        sender = await event.get_sender()
+        with stage("sender"):
+            sender = await get_sender_cached(event)
         if getattr(sender, "bot", False):
             return
     except Exception:
@@ -470,27 +596,30 @@ async def handle_new_channel_message(event):
     # 將中文俗稱（如 大餅/姨太/以太/二餅）正規化為 BTC/ETH
     normalized_text = normalize_aliases(message_text)
 
-    channel_title = "未知聊天"
-    if event.chat:
-        channel_title = getattr(event.chat, 'title', getattr(event.chat, 'username', str(event.chat.id)))
+    channel_title = get_chat_title(event)
 
-    is_saved_message = (
-        event.is_private 
-        and event.message.out == True 
-        and event.peer_id.user_id == event.message.from_id.user_id
-    )
-    if is_saved_message:
+    if is_saved_message(event):
         channel_title = "Saved Messages (自我測試)"
     elif event.message.out == True:
          channel_title = f"(我發送到 {channel_title} 的訊息)"
 
     # --- 便利指令優先處理（不可被預過濾擋掉） ---
-    cmd_lower = message_text.strip().lower()
-    if cmd_lower in ("/where", "/id", "/ping"):
+    cmd_lower = command_of(message_text)
+    if cmd_lower in ADMIN_COMMANDS:
+        # 診斷指令（/profile /mem /stats）：accept_new_message 已限定為自己帳號送出的訊息
+        try:
+            await handle_admin_command(cmd_lower, message_text.split()[1:], event.reply)
+        except Exception as e:
+            await event.reply(f"[warning] 指令 {cmd_lower} 執行失敗：{e}")
+        return
+    if cmd_lower is not None:
         try:
             if cmd_lower == "/ping":
                 await event.reply("pong ✅")
                 return
+            if cmd_lower == "/pools":
+                await event.reply(format_pool_stats())
+                return
             # /where 或 /id：回覆 chat_id 與標題
             chat_id = event.chat_id
             reply = (
@@ -505,7 +634,26 @@ async def handle_new_channel_message(event):
             await event.reply(f"[warning] 讀取 chat_id 失敗：{e}")
         return
 
+    signal = {
+        "key": f"{event.chat_id}:{event.message.id}",   # 冪等鍵：同一則訊息只會被執行一次
+        "chat_id": event.chat_id,
+        "channel": channel_title,
+        "text": message_text,
+        "normalized": normalized_text,
+        "received_at": signal_received_at,
+    }
+    await _dispatch_signal(signal)
 
+async def process_signal(signal):
+    """
+    一則（已過濾、已正規化的）訊息：LLM 解析 → 風控補齊 → 各帳戶倉位計算與下單。
+    單一行程時由 _handle_message 直接呼叫；行程拆分模式（workers.py）由 executor 從佇列取出後呼叫，
+    此時 signal["attempt"] > 1 代表重新投遞。
+    """
+    message_text = signal["text"]
+    normalized_text = signal["normalized"]
+    channel_title = signal["channel"]
+    signal_received_at = signal["received_at"]
 
     print(f"\n--- 監聽到來自 [{channel_title}] 的新訊息 ---")
     print(f"原始訊息: {message_text}")
@@ -515,15 +663,25 @@ async def handle_new_channel_message(event):
     
     loop = asyncio.get_event_loop()
 
+    # --- 投機預取：與 LLM 解析平行抓取猜測 symbol 的幣安資料 ---
+    prefetch_task = start_prefetch(loop, normalized_text)
+
     # --- [warning] v32 工作流 Step 1: 解析 ---
-    trade_command_1 = await loop.run_in_executor(None, parse_signal_with_llm, normalized_text)
+    with stage("llm_parse"):
+        trade_command_1 = await run_in_pool('llm', parse_signal_with_llm, normalized_text)
+    parsed_at = time.time()
     print(f"LLM 解析結果 (1/2): {trade_command_1}")
     
     action = trade_command_1.get('action')
+    trace_set(action=action, symbol=trade_command_1.get('symbol'))
     if action and action != "NONE":
         symbol = trade_command_1.get('symbol')
+        with stage("prefetch_wait"):
+            prefetched = await take_prefetch(prefetch_task, symbol)
         # 若 LLM 給出 BUY/SELL 但 symbol 缺失或無效，直接忽略
-        if action in ("BUY", "SELL") and (not symbol or not is_valid_symbol(symbol)):
+        # （預取已拿到交易對資訊就不必再查；否則 exchange_info 可能要打 REST，丟到執行緒池）
+        if action in ("BUY", "SELL") and (not symbol or not (
+                (prefetched and prefetched.get('info')) or await run_in_pool('market', is_valid_symbol, symbol))):
             print(f"[error] 訊號拒絕：無效或缺失的 symbol（{symbol}），忽略。")
             return
         print("[info] 偵測到有效訊號，正在提交 LLM 進行二次驗證 (策略補充)...")
@@ -537,8 +695,10 @@ async def handle_new_channel_message(event):
         is_market_order = (entry_price is None)
         if is_market_order:
             print("[info] 偵測到【市價單】，正在獲取當前市價...")
-            current_market_price_task = loop.run_in_executor(None, get_binance_market_price, symbol)
-            current_market_price = await current_market_price_task
+            current_market_price = prefetched.get('price') if prefetched else None
+            if not current_market_price:
+                with stage("market_price"):
+                    current_market_price = await run_in_pool('market', get_binance_market_price, symbol)
             
             if not current_market_price:
                 print(f"[error] 交易拒絕：無法獲取 {symbol} 的市價。")
@@ -551,9 +711,6 @@ async def handle_new_channel_message(event):
             print("[error] 訊號不完整 (缺少 Entry Price)，已忽略。")
             return
 
-        # --- [warning] v32 工作流 Step 2: 獲取 K 線 ---
-        klines_data = await loop.run_in_executor(None, get_binance_klines_for_llm, symbol)
-        
         # --- [warning] v33 工作流 Step 3: 風控補齊（可選 LLM / Python） ---
         if USE_PY_RISK_MANAGER:
             print("[Risk-Py] 使用 Python 計算止損/止盈（略過 LLM 第二階段）...")
@@ -562,7 +719,15 @@ async def handle_new_channel_message(event):
                 dec_entry_price = Decimal(str(entry_price))
                 user_sl = trade_command_1.get('stop_loss')
                 user_tp = trade_command_1.get('take_profit')
-                sl_dec, tp_dec, warn_msgs = select_sl_tp_with_user_pref(symbol, action, dec_entry_price, user_sl, user_tp)
+                klines_raw = prefetched.get('klines_raw') if prefetched else None
+                with stage("risk_py"):
+                    if klines_raw is None or not len(klines_raw):
+                        # 沒有預取到 K 線：計算 ATR 前要先打 REST，丟到執行緒池避免卡住事件迴圈
+                        sl_dec, tp_dec, warn_msgs = await run_in_pool(
+                            'market', select_sl_tp_with_user_pref, symbol, action, dec_entry_price, user_sl, user_tp)
+                    else:
+                        sl_dec, tp_dec, warn_msgs = select_sl_tp_with_user_pref(
+                            symbol, action, dec_entry_price, user_sl, user_tp, klines_raw=klines_raw)
                 for w in warn_msgs:
                     print(f"[warning] 風控提醒：{w}")
                 final_stop_loss = str(sl_dec)
@@ -571,7 +736,13 @@ async def handle_new_channel_message(event):
                 print(f"[error] 交易拒絕：Python 止損/止盈計算失敗: {e}")
                 return
         else:
-            validation_json = await loop.run_in_executor(None, complete_trade_with_llm, trade_command_1, klines_data)
+            # --- [warning] v32 工作流 Step 2: 獲取 K 線（僅 LLM 風控需要；格式見 KLINES_LLM_FORMAT） ---
+            klines_data = prefetched.get('klines_llm') if prefetched else None
+            if not klines_data:
+                with stage("klines"):
+                    klines_data = await run_in_pool('market', get_binance_klines_for_llm, symbol)
+            with stage("llm_risk"):
+                validation_json = await run_in_pool('llm', complete_trade_with_llm, trade_command_1, klines_data)
             print(f"LLM 驗證結果 (2/2): {validation_json}")
             if not (validation_json and validation_json.get("approve") == True):
                 reason = "LLM 驗證失敗"
@@ -597,82 +768,71 @@ async def handle_new_channel_message(event):
 
         print(f"[info] 風控補齊完成（SL/TP 已確定）。")
 
-        # --- [warning] v33 工作流 Step 4: Python 倉位計算 ---
+        # --- [warning] v33 工作流 Step 4: 各帳戶倉位計算 + 平行下單（LLM 解析與風控只做一次） ---
         try:
-            eprice_dec = Decimal(str(entry_price))
-            lev_dec = Decimal(str(final_leverage))
-            price_diff = abs(Decimal(str(entry_price)) - Decimal(str(final_stop_loss)))
-            if price_diff == 0:
-                print(f"[error] 交易拒絕：入場價和止損價相同！")
-                return
-
-            max_margin_amt = Decimal(str(total_available_margin)) * Decimal(str(MAX_INITIAL_MARGIN_PCT))
-
-            if POSITION_SIZING_MODE == 'margin':
-                # 以「初始保證金 = 可用餘額 * MAX_INITIAL_MARGIN_PCT」計算部位
-                qty_by_margin = (max_margin_amt * lev_dec) / eprice_dec
-                final_quantity = float(qty_by_margin)
-                planned_initial_margin = (eprice_dec * Decimal(str(final_quantity))) / lev_dec
-                planned_risk_amount = Decimal(str(final_quantity)) * price_diff  # 用於對照說明
-                sizing_note = "（按初始保證金 3% 計算）"
-            else:
-                # 原本的「每筆風險金額」算法
-                risk_amount_usdt = Decimal(str(total_available_margin)) * Decimal(str(RISK_PER_TRADE_PERCENT))
-                final_quantity = float(risk_amount_usdt / price_diff)
-                # 仍受初始保證金上限保護
-                qty_cap_by_margin = (max_margin_amt * lev_dec) / eprice_dec
-                if Decimal(str(final_quantity)) > qty_cap_by_margin:
-                    print(f"[warning] 已啟動保證金上限保護：每筆初始保證金 ≤ {MAX_INITIAL_MARGIN_PCT*100:.1f}% 可用餘額。")
-                    print(f"   原計算數量: {final_quantity:.6f}，上限數量: {qty_cap_by_margin:.6f}")
-                    final_quantity = float(qty_cap_by_margin)
-                planned_initial_margin = (eprice_dec * Decimal(str(final_quantity))) / lev_dec
-                planned_risk_amount = Decimal(str(final_quantity)) * price_diff
-                sizing_note = "（按每筆風險金額計算）"
-
-            print(f"--- Python 倉位計算 ---")
-            print(f"   總可用保證金: {total_available_margin:.2f} USDT")
-            print(f"   模式: {POSITION_SIZING_MODE} {sizing_note}")
-            print(f"   初始保證金目標: {MAX_INITIAL_MARGIN_PCT*100:.1f}% → 計劃使用 ≈ {planned_initial_margin:.4f} USDT")
-            try:
-                est_pct = (planned_initial_margin / Decimal(str(total_available_margin))) * Decimal('100')
-                print(f"   預估初始保證金占比: {est_pct:.4f}% （上限 {MAX_INITIAL_MARGIN_PCT*100:.2f}%）")
-            except Exception:
-                pass
-            print(f"   入場價: {entry_price}, 止損價: {final_stop_loss}")
-            print(f"   價差(至SL): {price_diff}")
-            print(f"   理論最大虧損(至SL): {planned_risk_amount:.4f} USDT")
-            print(f"   槓桿: {int(final_leverage)}x")
-            print(f"   ==> 計算數量: {final_quantity:.6f} {symbol.replace('USDT', '')}")
-
             # 在送交下單前，保留觸發下單的原訊號（使用正規化後的文字較穩定）
             signal_text = normalized_text.strip()
 
-            final_trade_command = {
+            base_command = {
                 "action": action,
                 "symbol": symbol,
                 "entry_price": None if is_market_order else entry_price,
                 "take_profit": final_take_profit,
                 "stop_loss": final_stop_loss,
                 "leverage": int(final_leverage),
-                "quantity": final_quantity,
-                "signal_text": signal_text
+                "signal_text": signal_text,
+                "prefetched_max_leverage": prefetched.get('max_leverage') if prefetched else None,
+                "channel": channel_title,
+                "timeline": {"signal_received": signal_received_at, "parsed": parsed_at},
+                "signal_key": signal.get("key"),
+                "redelivered": signal.get("attempt", 1) > 1,
+                "adopt_only": bool(signal.get("adopt_only")),
             }
 
-            await loop.run_in_executor(None, execute_trade, final_trade_command, loop)
+            accounts = get_accounts()
+            with stage("execute_trade"):
+                results = await asyncio.gather(*(_execute_for_account(a, base_command, entry_price, loop) for a in accounts))
+            if len(accounts) > 1:
+                summary = " | ".join(f"{name}: {'✅ ' + str(oid) if oid else '❌'} {sec*1000:.0f}ms"
+                                     for name, oid, sec in results)
+                print(f"[info] {symbol} {action} 多帳戶下單結果：{summary}")
+                notify_user(f"📊 {symbol} {action} 多帳戶下單\n" + "\n".join(
+                    f"• {name}: {('OrderID ' + str(oid)) if oid else '未下單'}（{sec*1000:.0f}ms）"
+                    for name, oid, sec in results))
         except Exception as e:
             print(f"[error] 交易拒絕：Python 倉位計算失敗: {e}")
             
     else:
+        discard_prefetch(prefetch_task)
         print("[info] 非交易訊號，已忽略。")
 
+# 過濾完的訊息交給誰：預設直接在本行程處理；workers.py 的 listener 改為寫入佇列
+_dispatch_signal = process_signal
+
+def set_signal_dispatcher(fn):
+    global _dispatch_signal
+    _dispatch_signal = fn or process_signal
+
 
 # --- 6. 🚀 啟動腳本---
 
+def register_handlers(tg_client):
+    """註冊訊息 handler；func 過濾器讓不相關聊天的訊息在進入 handler 前就被丟棄。"""
+    from telethon import events
+    tg_client.add_event_handler(handle_new_channel_message, events.NewMessage(func=accept_new_message))
+
 async def main_telethon():
     """Telethon 啟動 + 啟動時對帳/恢復監控"""
+    client = get_telegram_client()
     print("[info] 正在啟動 Telethon 客戶端...")
     await client.start()
     print("[info] 客戶端已登入。")
+    try:
+        me = await client.get_me()
+        set_self_user_id(me.id)
+    except Exception as e:
+        print(f"[warning] 取得自身帳號資訊失敗（Saved Messages 判斷改用訊息欄位）：{e}")
+    register_handlers(client)
 
     # 取得正在運行中的事件迴圈
     loop = asyncio.get_running_loop()
@@ -682,38 +842,62 @@ async def main_telethon():
         load_state()
     except Exception as e:
         print(f"[warning] 載入狀態檔失敗：{e}")
+    # 背景下載 symbol 註冊表（預取猜測 symbol 與幣種別名都會用到）
+    warm_symbol_registry()
 
     # 2) 啟動週期性清理孤兒單任務
     asyncio.create_task(_periodic_reconcile_task(600))
     # 3) 啟動每日盈虧通知
     asyncio.create_task(daily_pnl_notifier('Asia/Taipei', 0, 0))
-
-    print(f"[info] 正在監聽 *所有* 訊息 (包含傳出)...")
+    # 4) 定期壓實已結案交易紀錄
+    asyncio.create_task(_periodic_journal_compact_task(TRADE_JOURNAL_COMPACT_INTERVAL_SEC))
+    # 5) 本機 metrics 端點（/metrics、/traces、/stalls）與事件迴圈延遲監測
+    start_metrics_server()
+    start_loop_monitor(loop)
+
+    if SOURCE_CHAT_IDS:
+        print(f"[info] 正在監聽 {len(SOURCE_CHAT_IDS)} 個來源聊天的訊息（含 Saved Messages 與指令）...")
+    else:
+        print(f"[info] 正在監聽 *所有* 訊息 (包含傳出)...")
     await client.run_until_disconnected()
 
 async def _periodic_reconcile_task(interval_sec: int = 600):
     """
     週期性清理孤兒單與逾時開倉單（慢速穩定掃描）：預設每 10 分鐘跑一次。
     """
+    loop = asyncio.get_running_loop()
     while True:
-        try:
-            await asyncio.get_event_loop().run_in_executor(None, reconcile_on_start, asyncio.get_event_loop())
-        except Exception as e:
-            print(f"[warning] 週期性 Reconcile 失敗：{e}")
-        try:
-            print("[info] 週期性清理本地 json 單據紀錄")
-            await asyncio.get_event_loop().run_in_executor(None, resume_trades_from_state, loop)
-        except Exception as e:
-            print(f"[warning] 本地端單據清理失敗：{e}")
+        for acct in get_accounts():
+            with use_account(acct):
+                try:
+                    await run_in_pool('maint', reconcile_on_start, asyncio.get_event_loop())
+                except Exception as e:
+                    print(f"[warning] {acct.name} 週期性 Reconcile 失敗：{e}")
+                try:
+                    print(f"[info] 週期性清理本地 json 單據紀錄（{acct.name}）")
+                    await run_in_pool('maint', resume_trades_from_state, loop)
+                except Exception as e:
+                    print(f"[warning] {acct.name} 本地端單據清理失敗：{e}")
         # 加一點小抖動，避免每次都撞在同一時間窗（不用額外 import random）
         jitter = (int(time.time()) % 7)  # 0~6 秒
         await asyncio.sleep(interval_sec + jitter)
 
+async def _periodic_journal_compact_task(interval_sec: int):
+    """定期把過舊的已結案交易壓實成每日彙總（SQLite 寫入在 maint 池執行）。"""
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            await run_in_pool('maint', compact_journal)
+        except Exception as e:
+            print(f"[warning] 交易紀錄壓實失敗：{e}")
+
 if __name__ == '__main__':
 
-    if binance_client is None:
+    # 幣安：建立客戶端、確認雙向持倉並讀取可用保證金（import 時不再做）
+    if not connect_binance():
         print("[error] 幣安客戶端未初始化。請檢查您的 'binance.txt' 和 API Key 權限。")
         exit()
+    client = get_telegram_client()
     if client is None:
         print("[error] Telethon 客戶端未初始化。請檢查您的 'telegram.txt'。")
         exit()
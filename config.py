@@ -27,19 +27,35 @@ def load_api_keys(*files):
             print(f"[error] 讀取 '{file_name}' 時發生錯誤: {e}")
     return config
 
-# 這裡依照你原本的設定檔路徑
-api_config = load_api_keys(
-    '/home/pinhao/.secret/telegram.txt',
-    '/home/pinhao/.secret/binance.txt'
+# 金鑰檔路徑（import 時不讀取；由 app.py 在第一次需要金鑰時才載入）
+# 預設與 start.sh 相同的 ~/.secret；可用 CHAO_BI_SECRET_DIR 或個別的 CHAO_BI_*_SECRET 環境變數改寫，
+# 同名環境變數（API_ID、BINANCE_API_KEY 等）優先於檔案內容
+SECRET_DIR = os.environ.get('CHAO_BI_SECRET_DIR', os.path.join(os.path.expanduser('~'), '.secret'))
+SECRET_FILES = (
+    os.environ.get('CHAO_BI_TELEGRAM_SECRET', os.path.join(SECRET_DIR, 'telegram.txt')),
+    os.environ.get('CHAO_BI_BINANCE_SECRET', os.path.join(SECRET_DIR, 'binance.txt')),
 )
 
 STATE_FILE_PATH = os.path.join(os.path.dirname(__file__), "chao_bi_state.json")
+# 狀態檔後端：
+#   'json'  : 每次異動整份重寫 STATE_FILE_PATH（原行為，改為原子替換）
+#   'wal'   : STATE_FILE_PATH 為快照 + 旁邊的 .wal 追加日誌，每次異動只追加一行，定期壓實回快照
+#   'sqlite': STATE_SQLITE_PATH（WAL 模式），每次異動一筆 UPSERT / DELETE
+# wal / sqlite 首次啟動時若沒有資料，會自動匯入既有的 chao_bi_state.json
+STATE_BACKEND = 'wal'
+STATE_SQLITE_PATH = os.path.join(os.path.dirname(__file__), "chao_bi_state.db")
+# fsync 策略：'always'（每筆異動都 fsync）、'batch'（背景每 STATE_FSYNC_INTERVAL_SEC 秒 fsync 一次）、'off'
+STATE_FSYNC_MODE = 'batch'
+STATE_FSYNC_INTERVAL_SEC = 0.5
+STATE_WAL_COMPACT_EVERY = 500        # WAL 追加超過此筆數就壓實回快照
+# 已結案交易歷史紀錄（trade_journal.py，SQLite）：保留各生命週期時間點供事後分析
+TRADE_JOURNAL_ENABLED = True
+TRADE_JOURNAL_PATH = os.path.join(os.path.dirname(__file__), "chao_bi_journal.db")
+TRADE_JOURNAL_RETENTION_DAYS = 180   # 超過此天數的已結案交易壓實成每日彙總後刪除
+TRADE_JOURNAL_COMPACT_INTERVAL_SEC = 24 * 60 * 60
+TRADE_JOURNAL_QUEUE_MAXSIZE = 10000  # 背景寫入佇列上限；滿了丟棄並計數
 
-# Telegram 設定
-API_ID = api_config.get('API_ID')
-API_HASH = api_config.get('API_HASH')
-BOT_TOKEN = api_config.get('BOT_TOKEN')
-BOT_CHAT_ID = api_config.get('BOT_CHAT_ID')
+# Telegram 設定（API_ID / API_HASH / BOT_TOKEN / BOT_CHAT_ID 在 telegram.txt，見 app.get_secret）
 CLIENT_SESSION_NAME = 'chao_bi'
 
 # Ollama
@@ -48,10 +64,17 @@ OLLAMA_TIMEOUT = 180
 OLLAMA_PARSER_MODEL = 'gpt-oss:20b'
 OLLAMA_RISK_MODEL = 'gpt-oss:20b'
 
-# Binance
-BINANCE_API_KEY = api_config.get('BINANCE_API_KEY')
-BINANCE_API_SECRET = api_config.get('BINANCE_API_SECRET')
+# Binance（BINANCE_API_KEY / BINANCE_API_SECRET 在 binance.txt，見 app.get_secret）
 REAL_FUTURES_BASE_URL = "https://fapi.binance.com"
+# 多帳戶：同一則訊號只解析一次，依各帳戶自己的可用餘額 / 槓桿規則計算數量後同時下單（見 app.py）
+# 第一個為主帳戶，沿用上面的 binance.txt；其餘帳戶的金鑰檔格式相同（BINANCE_API_KEY= / BINANCE_API_SECRET=），
+# 也可用環境變數 BINANCE_API_KEY_<NAME> / BINANCE_API_SECRET_<NAME>（NAME 為大寫帳戶名）提供。
+#   margin_pct  ：每筆初始保證金占該帳戶可用餘額的比例（省略 = MAX_INITIAL_MARGIN_PCT）
+#   max_leverage：該帳戶的槓桿上限（省略 = 不另外限制）
+BINANCE_ACCOUNTS = [
+    {"name": "main"},
+    # {"name": "sub1", "secret_file": os.path.join(SECRET_DIR, "binance_sub1.txt"), "margin_pct": 0.02, "max_leverage": 20},
+]
 
 # 風險參數
 RISK_PER_TRADE_PERCENT = 0.03        # 3%
@@ -80,17 +103,115 @@ MIN_STOP_DISTANCE_PCT = Decimal('0.004')   # 0.4%
 # ATR 參數（以 5 分鐘 K 線計算）
 ATR_PERIOD = 14
 ATR_K = Decimal('1.0')  # 止損距離至少為 ATR * ATR_K
+# ---- LLM 第二階段的 K 線餵入格式（僅 USE_PY_RISK_MANAGER=False 時使用）----
+# 'full'   : 原始格式，逐根列出時間與完整精度的 OHLCV
+# 'compact': 精簡格式，價格以「相對最後收盤價的萬分位整數」表示，並附上 ATR / 支撐壓力 / 區間統計
+KLINES_LLM_FORMAT = 'compact'
+KLINES_LLM_FULL_BARS = 50          # full 格式列出的 K 線根數
+KLINES_LLM_COMPACT_BARS = 20       # compact 格式列出的 K 線根數（統計值仍以 full 根數計算）
+KLINES_LLM_PRICE_SCALE = 10000     # 相對價格的縮放倍數（10000 = 萬分位 / bp）
 # 12 小時未成交自動撤單（秒）
 AUTO_CANCEL_SECONDS = 12 * 60 * 60
+# 開倉 LIMIT 單的有效期限方式：
+# 'GTD'：帶 goodTillDate = 下單時間 + AUTO_CANCEL_SECONDS，由幣安到期自動撤單（程式停掉也有效）
+# 'GTC'：舊行為，完全由程式端計時撤單
+ENTRY_TIME_IN_FORCE = 'GTD'
+# 已知不能用 GTD 的 symbol（下單被拒時也會自動記住），改用 GTC + 程式端計時撤單
+GTD_UNSUPPORTED_SYMBOLS = set()
 # 監控輪詢間隔（秒）
 ORDER_MONITOR_INTERVAL = 30
+# 成交後掛 SL/TP 失敗的重試：只補失敗的那一邊，間隔從 BASE 起倍增（最長 MAX）；
+# 累計失敗 EXIT_ATTACH_MAX_ATTEMPTS 次就停止重試、推播提醒並結束追蹤（仍在掛的剩餘開倉單會先撤掉）
+EXIT_ATTACH_MAX_ATTEMPTS = 5
+EXIT_ATTACH_RETRY_BASE_SEC = 5
+EXIT_ATTACH_RETRY_MAX_SEC = 120
+# 單一監控每輪涉及的 symbol 超過此數量時，改為一次取全部 open orders（權重 40）而非逐 symbol（權重 1）
+ORDER_MONITOR_ALL_OPEN_THRESHOLD = 10
 # Reconcile 診斷輸出（True=詳細列印每個 symbol 的錯誤；False=靜默）
 RECONCILE_VERBOSE = True
-# 初始短期輪詢（剛下LIMIT單時在主流程內的等待）
-INITIAL_FILL_WAIT_SECONDS = 60     # 最長等待時間
+# 初始短期輪詢（剛下LIMIT單後由 OrderTracker 在事件迴圈中快速查單，之後改用 ORDER_MONITOR_INTERVAL）
+INITIAL_FILL_WAIT_SECONDS = 60     # 快速查單的時間窗（秒）
 INITIAL_POLL_INTERVAL = 1.0        # 每次查詢間隔（原本是0.5秒；為降低API壓力改為1秒）
 
 # ---- 慢速但穩定的 Reconcile 模式（回滾版） ----
 SLOW_STABLE_RECONCILE = True      # True = 使用逐 symbol 掃描（SDK），雖慢但穩
 PER_SYMBOL_SLEEP_SEC = 0       # 逐 symbol 查詢之間休息，降低被 WAF/限流
-PER_SYMBOL_RETRY = 2              # 每個 symbol 失敗時重試次數
\ No newline at end of file
+PER_SYMBOL_RETRY = 2              # 每個 symbol 失敗時重試次數
+
+# ---- 訊號投機預取（LLM 解析的同時先抓幣安資料）----
+ENABLE_SPECULATIVE_PREFETCH = True
+PREFETCH_MAX_LEVERAGE = True         # 預取時查詢槓桿上限（唯讀；change_leverage 一律在 LLM 確認訊號後才呼叫）
+PREFETCH_PRICE_MAX_AGE_SEC = 15      # 預取的市價超過此秒數即視為過期，改為即時查詢
+PREFETCH_KLINES_MAX_AGE_SEC = 60     # 預取的 K 線超過此秒數即視為過期
+SYMBOL_REGISTRY_TTL_SEC = 3600       # exchange_info 註冊表的更新週期（秒）
+ALIAS_FILE = os.path.join(os.path.dirname(__file__), "aliases.txt")   # 幣種俗稱檔（aliases.py）；註冊表更新時一併檢查是否修改
+
+# ---- 分階段執行緒池（scheduler.py；慢的 reconcile / LLM 不會擠掉下單）----
+EXECUTOR_POOL_SIZES = {
+    'llm': 2,       # Ollama 解析 / 風控（本機模型同時跑太多只會更慢）
+    'market': 8,    # 市價 / K 線 / 交易對資訊 / 訂單監控查詢
+    'order': 4,     # 下單 / 撤單 / 掛 SL/TP / 設定槓桿（同一 symbol 另外依序執行）
+    'maint': 2,     # reconcile / 狀態恢復 / 紀錄壓實
+    'queue': 1,     # 行程拆分模式的 SQLite 佇列存取（單一執行緒依序寫入）
+}
+
+# ---- 延遲量測 / metrics（metrics.py；Prometheus 文字格式，只綁 localhost）----
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+METRICS_TRACE_HISTORY = 200          # /traces 保留最近幾則訊息的逐階段耗時
+
+# ---- 事件迴圈延遲 / 阻塞偵測（loop_monitor.py）----
+LOOP_LAG_INTERVAL_SEC = 0.1          # 量測用 sleep 的間隔
+LOOP_BLOCK_THRESHOLD_SEC = 0.25      # 事件迴圈被卡住超過此秒數就擷取當下堆疊並警告
+LOOP_LAG_SUMMARY_SEC = 600           # 每隔多久在日誌印一次延遲分位數摘要（0 = 不印）
+LOOP_STALL_HISTORY = 20              # /stalls 保留最近幾次阻塞的堆疊
+
+# ---- 線上診斷（profiler.py；/profile /mem /stats 指令，只接受自己帳號送出的訊息）----
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), "profiles")   # 報告輸出目錄
+PROFILE_DEFAULT_SIGNALS = 10         # /profile 未指定時，對接下來幾則交易訊號做 profiling
+PROFILE_MAX_SECONDS = 600            # 單次 profiling 最長秒數（忘了停也會自動結束）
+PROFILE_SAMPLE_INTERVAL_SEC = 0.005  # 取樣式 profiler 的取樣間隔
+PROFILE_TOP_N = 10                   # 聊天摘要列出前幾名
+TRACEMALLOC_FRAMES = 1               # tracemalloc 每筆配置保留的堆疊深度（越深越準、開銷越大）
+
+# ---- 回測 / 參數掃描（backtest.py；離線執行，不會下單）----
+BACKTEST_KLINES_DIR = os.path.join(os.path.dirname(__file__), "backtest_klines")   # 歷史 K 線存檔（每個 symbol / 週期一個 .npz）
+BACKTEST_INTERVAL = '5m'                  # 與 ATR_PERIOD 的計算週期相同
+BACKTEST_HORIZON_HOURS = 72               # 成交後最多追蹤多久；期限內未觸及 SL/TP 以最後收盤價平倉
+BACKTEST_FEE_PCT = 0.0008                 # 來回手續費（占名目價值的比例）
+
+# ---- 行程拆分（workers.py；listener / executor / maint 以本機 SQLite 佇列串接，見 signal_queue.py）----
+SIGNAL_QUEUE_PATH = os.path.join(os.path.dirname(__file__), "chao_bi_queue.db")
+SIGNAL_QUEUE_LEASE_SEC = 120          # executor 領取事件後多久沒 ack（也沒續租）就視為當掉，事件重新投遞
+SIGNAL_QUEUE_MAX_ATTEMPTS = 3         # 投遞超過此次數仍未完成 → dead letter，由 maint 推播提醒
+SIGNAL_QUEUE_POLL_SEC = 1.0           # 沒收到喚醒通知時的輪詢間隔（寫入後會經 Unix socket 立即喚醒）
+SIGNAL_QUEUE_RETENTION_SEC = 7 * 24 * 60 * 60   # 已完成事件保留多久（maint 定期清除）
+SIGNAL_MAX_AGE_SEC = 120              # 訊號排隊超過此秒數才被領取就不再下單（例如 executor 停機期間累積的訊號）
+EXECUTOR_MAX_INFLIGHT = 8             # 單一 executor 同時處理的訊號數（單行程模式下每則訊息各自一個 task）
+WORKER_METRICS_PORT_OFFSET = {'executor': 0, 'listener': 1, 'maint': 2}   # 各行程的 metrics 埠 = METRICS_PORT + offset
+
+# ---- 日誌（logs.py；print 改走背景佇列，磁碟慢不會卡住下單執行緒與事件迴圈）----
+LOG_ENABLED = True
+LOG_LEVEL = 'INFO'
+LOG_TO_STDOUT = True                 # 原本的純文字訊息（start.sh 會導到 log.txt）
+LOG_FILE_PATH = os.path.join(os.path.dirname(__file__), "chao_bi.log.jsonl")  # JSON lines；None = 不寫
+LOG_MAX_BYTES = 20 * 1024 * 1024     # 超過就輪替
+LOG_BACKUP_COUNT = 5
+LOG_QUEUE_MAXSIZE = 10000            # 佇列上限；滿了丟棄並計數
+LOG_LEVELS = {}                      # 依模組調整等級，例如 {'prefetch': 'WARNING', 'state_store': 'WARNING'}
+LOG_SAMPLE_EVERY = {'binance_api.reconcile': 20}   # INFO 每 N 筆只保留 1 筆（WARNING 以上一律保留）
+
+# ---- 通知佇列（notify_user 非阻塞，背景執行緒送出 Bot API）----
+NOTIFY_QUEUE_MAXSIZE = 500           # 佇列上限；滿了會丟棄新通知並計數
+NOTIFY_COALESCE_WINDOW_SEC = 1.0     # 收到第一則後再等多久，把期間內的通知合併成一則彙整訊息
+NOTIFY_MIN_INTERVAL_SEC = 1.0        # 同一私聊最短發送間隔（Telegram 建議 ≤ 1 則/秒）
+NOTIFY_GROUP_MIN_INTERVAL_SEC = 3.0  # 群組/頻道最短發送間隔（Telegram 限制約 20 則/分鐘）
+NOTIFY_MAX_RETRIES = 5               # 429 / 網路錯誤的最大重試次數
+
+# ---- 訊息來源過濾（在 Telethon 事件層級、零網路呼叫完成）----
+# chat_id 請用 /id 指令查詢（整數）；空集合 = 不限制（監聽所有聊天）
+SOURCE_CHAT_IDS = set()              # 允許解析交易訊號的聊天
+COMMAND_CHAT_IDS = set()             # 允許 /ping /where /id 等指令的聊天
+ALLOW_SELF_TEST_CHAT = True          # Saved Messages（自我測試）永遠允許
+ENTITY_CACHE_SIZE = 1024             # sender / chat 實體 LRU 快取上限
@@ -0,0 +1,186 @@
+# indicators.py
+"""
+向量化技術指標（NumPy）：真實波幅、ATR、滾動高低點、已實現波動率、擺動高低點、波動度分位。
+
+所有函式都沿「最後一個 K 線軸」計算，前面可以有任意批次維度：
+  (n_bars, 5)                        單一 symbol / 週期
+  (n_symbols, n_bars, 5)             多個 symbol 一次算完（stack_klines 以 NaN 在前方補齊長度）
+  (n_timeframes, n_symbols, n_bars, 5)
+欄位順序為 OPEN, HIGH, LOW, CLOSE, VOLUME；內部一律 float64，
+只有在下單邊界（SL / TP 距離）才用 to_decimal() 轉回 Decimal。
+
+  python bench_indicators.py          # 與原本逐根 Decimal 的實作比較
+"""
+import math
+from decimal import Decimal
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(5)
+_FIELDS = ("open", "high", "low", "close", "volume")
+
+# === [convert] K 線 → 陣列 / 陣列 → Decimal ===
+def klines_to_array(klines):
+    """
+    幣安 klines（[open_time, o, h, l, c, v, ...]，價格為字串）或 {"open": Decimal, ...} dict 列
+    → (n, 5) float64。已是陣列時原樣回傳。
+    """
+    if isinstance(klines, np.ndarray):
+        return klines.astype(np.float64, copy=False)
+    if not len(klines):
+        return np.empty((0, 5))
+    if isinstance(klines[0], dict):
+        return np.array([[float(k.get(f, math.nan)) for f in _FIELDS] for k in klines], dtype=np.float64)
+    return np.array([k[1:6] for k in klines], dtype=np.float64)
+
+def stack_klines(series, length=None):
+    """多組 K 線 → (len(series), length, 5)；只保留最新的 length 根，較短者在前方補 NaN。"""
+    arrays = [klines_to_array(s) for s in series]
+    length = length or max((len(a) for a in arrays), default=0)
+    out = np.full((len(arrays), length, 5), np.nan)
+    for i, a in enumerate(arrays):
+        a = a[-length:]
+        if len(a):
+            out[i, length - len(a):] = a
+    return out
+
+def to_decimal(x):
+    """float → Decimal（取最短的十進位表示，避免 Decimal(float) 帶出二進位尾數）；NaN / inf / None → None。"""
+    if x is None:
+        return None
+    x = float(x)
+    if not math.isfinite(x):
+        return None
+    return Decimal(repr(x))
+
+# === [core] 指標 ===
+def _rolling(x, window, fn):
+    """沿最後一軸套用滾動視窗 fn(view, axis=-1)；前 window-1 根為 NaN。"""
+    out = np.full(x.shape, np.nan)
+    if window < 1 or x.shape[-1] < window:
+        return out
+    out[..., window - 1:] = fn(sliding_window_view(x, window, axis=-1), axis=-1)
+    return out
+
+def _shift(x, n=1):
+    out = np.full(x.shape, np.nan)
+    out[..., n:] = x[..., :-n]
+    return out
+
+def true_range(ohlc):
+    """TR = max(H−L, |H−前收|, |L−前收|)；第一根沒有前一根收盤，為 NaN。形狀 (..., n)。"""
+    high, low = ohlc[..., HIGH], ohlc[..., LOW]
+    prev_close = _shift(ohlc[..., CLOSE])
+    return np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(prev_close - low)))
+
+def atr(ohlc, period=14, method="sma"):
+    """
+    ATR，形狀 (..., n)。
+    method='sma'   ：最近 period 根 TR 的簡單平均（與原本 compute_atr_from_klines 相同，至少 period+1 根）
+    method='wilder'：以第一個 SMA 為種子的 Wilder 平滑（沿 K 線軸遞迴，批次維度仍向量化）
+    """
+    tr = true_range(ohlc)
+    seed = _rolling(tr, period, np.mean)
+    if method == "sma":
+        return seed
+    out = np.full(tr.shape, np.nan)
+    prev = np.full(tr.shape[:-1], np.nan)
+    for t in range(tr.shape[-1]):
+        cur = np.where(np.isnan(prev), seed[..., t], (prev * (period - 1) + tr[..., t]) / period)
+        out[..., t] = cur
+        prev = cur
+    return out
+
+def rolling_high(ohlc, window):
+    return _rolling(ohlc[..., HIGH], window, np.max)
+
+def rolling_low(ohlc, window):
+    return _rolling(ohlc[..., LOW], window, np.min)
+
+def log_returns(close):
+    out = np.full(close.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[..., 1:] = np.log(close[..., 1:] / close[..., :-1])
+    return out
+
+def realized_volatility(ohlc, window=20, bars_per_year=None):
+    """滾動的對數報酬標準差（ddof=1）；給 bars_per_year（例如 5m K 線 = 105120）時年化。"""
+    vol = _rolling(log_returns(ohlc[..., CLOSE]), window, lambda w, axis: np.std(w, axis=axis, ddof=1))
+    return vol * math.sqrt(bars_per_year) if bars_per_year else vol
+
+def volatility_regime(ohlc, window=20, lookback=100):
+    """目前已實現波動率在最近 lookback 根中的分位（0~1），形狀 (...)；資料不足為 NaN。"""
+    return _percentile_of_last(realized_volatility(ohlc, window), lookback)
+
+def _percentile_of_last(vol, lookback):
+    if vol.shape[-1] < lookback:
+        return np.full(vol.shape[:-1], np.nan)
+    hist = vol[..., -lookback:]
+    valid = ~np.isnan(hist)
+    below = np.sum((hist <= hist[..., -1:]) & valid, axis=-1)
+    n = np.sum(valid, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where((n > 1) & valid[..., -1], (below - 1) / (n - 1), np.nan)
+
+def swing_points(ohlc, left=2, right=2):
+    """
+    擺動高 / 低點：該根的高（低）點嚴格高（低）於前 left 根與後 right 根。
+    回傳 (is_swing_high, is_swing_low) 布林陣列 (..., n)；最後 right 根尚未確認，一律 False。
+    """
+    high, low = ohlc[..., HIGH], ohlc[..., LOW]
+    hi = np.zeros(high.shape, dtype=bool)
+    lo = np.zeros(low.shape, dtype=bool)
+    w = left + right + 1
+    if left < 1 or right < 1 or high.shape[-1] < w:
+        return hi, lo
+    hw, lw = sliding_window_view(high, w, axis=-1), sliding_window_view(low, w, axis=-1)
+    end = high.shape[-1] - right
+    hi[..., left:end] = hw[..., left] > np.maximum(hw[..., :left].max(-1), hw[..., left + 1:].max(-1))
+    lo[..., left:end] = lw[..., left] < np.minimum(lw[..., :left].min(-1), lw[..., left + 1:].min(-1))
+    return hi, lo
+
+def last_where(values, mask):
+    """每個序列最後一個 mask 為 True 的值，形狀 (...)；沒有則為 NaN。"""
+    n = mask.shape[-1]
+    if n == 0:
+        return np.full(mask.shape[:-1], np.nan)
+    idx = n - 1 - np.argmax(mask[..., ::-1], axis=-1)
+    picked = np.take_along_axis(values, idx[..., None], axis=-1)[..., 0]
+    return np.where(mask.any(axis=-1), picked, np.nan)
+
+def last_valid(x):
+    """每個序列最後一根的值（指標的「目前值」）。"""
+    return x[..., -1] if x.shape[-1] else np.full(x.shape[:-1], np.nan)
+
+# === [batch] 多 symbol / 多週期一次計算 ===
+def summarize(klines_by_key, atr_periods=(14,), window=20, swing=(2, 2), regime_lookback=100):
+    """
+    klines_by_key：{key: K 線}，key 通常是 (symbol, interval)。所有序列疊成一個批次一起計算，
+    回傳 {key: {"atr14": float, "tr": ..., "high20": ..., "low20": ..., "rv20": ..., "regime": ...,
+                "swing_high": ..., "swing_low": ..., "close": ...}}（皆為 float，NaN 代表資料不足）。
+    """
+    keys = list(klines_by_key)
+    if not keys:
+        return {}
+    batch = stack_klines([klines_by_key[k] for k in keys])
+    cols = {f"atr{p}": last_valid(atr(batch, p)) for p in atr_periods}
+    sh, sl = swing_points(batch, *swing)
+    rv = realized_volatility(batch, window)
+    cols.update({
+        "tr": last_valid(true_range(batch)),
+        f"high{window}": last_valid(rolling_high(batch, window)),
+        f"low{window}": last_valid(rolling_low(batch, window)),
+        f"rv{window}": last_valid(rv),
+        "regime": _percentile_of_last(rv, regime_lookback),
+        "swing_high": last_where(batch[..., HIGH], sh),
+        "swing_low": last_where(batch[..., LOW], sl),
+        "close": last_valid(batch[..., CLOSE]),
+    })
+    return {k: {name: float(v[i]) for name, v in cols.items()} for i, k in enumerate(keys)}
+
+def atr_last(klines, period=14):
+    """單一序列目前的 ATR（Decimal，給下單邊界使用）；K 線不足 period+1 根回傳 None。"""
+    ohlc = klines_to_array(klines)
+    if len(ohlc) < period + 1:
+        return None
+    return to_decimal(last_valid(atr(ohlc, period)))
@@ -1,7 +1,9 @@
 import re
 import json
-import requests
+import time
 from config import OLLAMA_API_URL, OLLAMA_TIMEOUT, OLLAMA_PARSER_MODEL, OLLAMA_RISK_MODEL
+from logs import get_printer
+print = get_printer("llm")
 
 
 # === [llm_client] LLM Prompt 與呼叫 ===
@@ -97,7 +99,7 @@ RISK_MANAGER_PROMPT_TEMPLATE = """
 {trade_json}
 
 【當前市場數據】
-這是 {symbol} 最新的【5 分鐘 K 線】數據 (OHLCV - 開/高/低/收/量):
+這是 {symbol} 最新的【5 分鐘 K 線】數據 (OHLCV - 開/高/低/收/量；若首行為 ref=...，價格為相對 ref 的縮放整數，請依首行公式換算回實際價格):
 {klines_data}
 
 【嚴格規則】
@@ -121,12 +123,38 @@ RISK_MANAGER_PROMPT_TEMPLATE = """
 7) 僅回傳 JSON，數字請直接用十進位字面值（最多 4 位小數），不得加千分位或多餘的 0。
 
 【輸出格式】
-{"approve": true, "reason": "訊號可執行。已根據 5m K 線補充 SL/TP。", "stop_loss": "xxxxx.xxxx", "leverage": 50, "take_profit": "yyyyy.yyyy"}
+{{"approve": true, "reason": "訊號可執行。已根據 5m K 線補充 SL/TP。", "stop_loss": "xxxxx.xxxx", "leverage": 50, "take_profit": "yyyyy.yyyy"}}
 """
 
 # --- 3. 🧠 Ollama 函數 ---
-def call_ollama(prompt_text, model_name):
-    """(此函數不變)"""
+# 每個呼叫標籤（parse / risk）的累計統計：次數、prompt token、prefill 與總耗時（毫秒）
+llm_call_stats = {}
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數（中日韓字元約 1 字 1 token，其餘約 3.5 字元 1 token），僅用於比較 prompt 大小。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + int((len(text) - cjk) / 3.5 + 0.999)
+
+def _record_llm_stats(tag, body, elapsed_sec):
+    """記錄 Ollama 回傳的 prompt_eval_count / *_duration（奈秒），並印出單次摘要。"""
+    prompt_tokens = int(body.get('prompt_eval_count') or 0)
+    prefill_ms = (body.get('prompt_eval_duration') or 0) / 1e6
+    total_ms = (body.get('total_duration') or 0) / 1e6 or elapsed_sec * 1000
+    st = llm_call_stats.setdefault(tag, {"calls": 0, "prompt_tokens": 0, "prefill_ms": 0.0, "total_ms": 0.0})
+    st["calls"] += 1
+    st["prompt_tokens"] += prompt_tokens
+    st["prefill_ms"] += prefill_ms
+    st["total_ms"] += total_ms
+    print(f"[LLM 統計] {tag}: prompt_tokens={prompt_tokens}, prefill={prefill_ms:.0f}ms, "
+          f"total={total_ms:.0f}ms (平均 prompt_tokens={st['prompt_tokens'] / st['calls']:.0f}, "
+          f"平均 total={st['total_ms'] / st['calls']:.0f}ms)")
+
+def call_ollama(prompt_text, model_name, tag=None):
+    """呼叫 Ollama 並解析回應中的 JSON；tag 用於分類延遲 / token 統計。"""
     data = { 
         "model": model_name, 
         "prompt": prompt_text, 
@@ -138,10 +166,17 @@ def call_ollama(prompt_text, model_name):
         if not prompt_text.strip().endswith("JSON:"):
              prompt_text += "\nJSON:"
 
+    import requests  # 延後到第一次呼叫才載入（import llm 不付 requests 的載入成本）
     try:
+        t0 = time.perf_counter()
         response = requests.post(OLLAMA_API_URL, json=data, timeout=OLLAMA_TIMEOUT) 
         response.raise_for_status()
-        response_text = response.json().get('response', '{}')
+        body = response.json()
+        try:
+            _record_llm_stats(tag or model_name, body, time.perf_counter() - t0)
+        except Exception:
+            pass
+        response_text = body.get('response', '{}')
         json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
         if json_match:
             response_text = json_match.group(0)
@@ -157,7 +192,7 @@ def parse_signal_with_llm(message_text: str) -> dict:
     """(此函數不變)"""
     print(f"[LLM 1/2: 解析中 (使用 {OLLAMA_PARSER_MODEL})...]")
     prompt = MASTER_PROMPT_TEMPLATE.format(user_message=message_text)
-    result = call_ollama(prompt, OLLAMA_PARSER_MODEL) 
+    result = call_ollama(prompt, OLLAMA_PARSER_MODEL, tag="parse") 
     return result if result else {"action": "NONE"}
 
 def complete_trade_with_llm(trade_command: dict, klines_data: str) -> dict:
@@ -171,5 +206,6 @@ def complete_trade_with_llm(trade_command: dict, klines_data: str) -> dict:
         entry_price=trade_command['entry_price'],
         action=trade_command['action']
     )
-    result = call_ollama(prompt, OLLAMA_RISK_MODEL)
-    return result if result else {"approve": False, "reason": "LLM 驗證失敗"}
\ No newline at end of file
+    print(f"[LLM 2/2] prompt 約 {estimate_tokens(prompt)} tokens（其中 K 線約 {estimate_tokens(klines_data)} tokens，估算值）")
+    result = call_ollama(prompt, OLLAMA_RISK_MODEL, tag="risk")
+    return result if result else {"approve": False, "reason": "LLM 驗證失敗"}
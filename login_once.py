@@ -1,11 +1,14 @@
-from telethon import TelegramClient
-from config import API_ID, API_HASH, CLIENT_SESSION_NAME
+from app import get_telegram_client
 
-client = TelegramClient(CLIENT_SESSION_NAME, API_ID, API_HASH)
+# 只建立 Telethon 客戶端並登入（不會連幣安、不會載入其他模組）
+client = get_telegram_client()
 
 async def main():
     # 觸發登入流程
     await client.get_me()
 
+if client is None:
+    raise SystemExit("[error] 找不到 'telegram.txt' 或金鑰不完整，無法登入。")
+
 with client:
     client.loop.run_until_complete(main())
\ No newline at end of file
@@ -0,0 +1,176 @@
+# logs.py
+"""
+非阻塞結構化日誌。
+
+原本各模組直接 print()：start.sh 把 stdout 導到 log.txt，磁碟一慢，下單執行緒與事件迴圈就跟著卡住。
+這裡把紀錄丟進佇列（QueueHandler），由單一背景執行緒（QueueListener）寫出：
+  • stdout：原本的純文字訊息（log.txt 看起來與以前相同）
+  • LOG_FILE_PATH：JSON lines（時間、等級、模組、執行緒、訊號 correlation id），依大小輪替
+  • LOG_LEVELS 依模組調整等級；LOG_SAMPLE_EVERY 對冗長輸出（例如 reconcile 逐筆明細）抽樣
+佇列滿了就丟棄並計數，絕不阻塞呼叫端。
+
+既有模組不必逐行改寫：在模組頂端 `print = get_printer("模組名")`，原本的 print(...) 就會改走這裡，
+等級由訊息前綴判斷（[error] → ERROR、[warning] / ⚠️ → WARNING，其餘 INFO）。
+"""
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import builtins
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config import (
+    LOG_ENABLED, LOG_LEVEL, LOG_TO_STDOUT, LOG_FILE_PATH, LOG_MAX_BYTES, LOG_BACKUP_COUNT,
+    LOG_QUEUE_MAXSIZE, LOG_LEVELS, LOG_SAMPLE_EVERY,
+)
+from metrics import current_correlation_id
+
+_ROOT = "chao_bi"
+_queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+_listener = None
+_configured = False
+_setup_lock = threading.Lock()
+log_stats = {"dropped": 0, "sampled_out": 0}
+
+# === [handlers] 呼叫端（熱路徑）只做：建立 record、補上 cid、丟進佇列 ===
+class _ContextFilter(logging.Filter):
+    """在呼叫端的執行緒補上 correlation id（背景執行緒拿不到呼叫端的 contextvars）。"""
+
+    def filter(self, record):
+        record.cid = current_correlation_id()
+        return True
+
+class _DroppingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # 只有這一個 handler：不必像預設實作那樣複製 record 並先格式化一次，交給背景執行緒處理
+        if record.args:
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_stats["dropped"] += 1
+
+class SamplingFilter(logging.Filter):
+    """INFO 以下每 every 筆只保留 1 筆（WARNING 以上一律保留），被略過的筆數記在下一筆保留的 record 上。"""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, int(every))
+        self._n = 0
+        self._skipped = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        self._n += 1
+        if (self._n - 1) % self.every:
+            self._skipped += 1
+            log_stats["sampled_out"] += 1
+            return False
+        record.sampled_out, self._skipped = self._skipped, 0
+        return True
+
+# === [format] 背景執行緒才做格式化與 I/O ===
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name[len(_ROOT) + 1:] if record.name.startswith(_ROOT + ".") else record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "cid", None):
+            out["cid"] = record.cid
+        if getattr(record, "sampled_out", 0):
+            out["sampled_out"] = record.sampled_out
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False)
+
+def setup_logging():
+    """建立佇列與背景 listener（可重複呼叫）；LOG_ENABLED=False 時什麼都不做。"""
+    global _listener, _configured
+    if not LOG_ENABLED or _configured:
+        return
+    with _setup_lock:
+        if _configured:
+            return
+        handlers = []
+        if LOG_TO_STDOUT:
+            console = logging.StreamHandler(sys.stdout)
+            console.setFormatter(logging.Formatter("%(message)s"))
+            handlers.append(console)
+        if LOG_FILE_PATH:
+            try:
+                fh = RotatingFileHandler(LOG_FILE_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                         encoding="utf-8")
+                fh.setFormatter(JsonFormatter())
+                handlers.append(fh)
+            except OSError as e:
+                builtins.print(f"[warning] 無法開啟日誌檔 {LOG_FILE_PATH}：{e}（只輸出到 stdout）")
+        root = logging.getLogger(_ROOT)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        qh = _DroppingQueueHandler(_queue)
+        qh.addFilter(_ContextFilter())
+        root.addHandler(qh)
+        for name, level in LOG_LEVELS.items():
+            logging.getLogger(f"{_ROOT}.{name}").setLevel(level)
+        for name, every in LOG_SAMPLE_EVERY.items():
+            logging.getLogger(f"{_ROOT}.{name}").addFilter(SamplingFilter(every))
+        _listener = QueueListener(_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _configured = True
+        atexit.register(stop)
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(f"{_ROOT}.{name}")
+
+def _level_of(text):
+    head = text.lstrip()[:24].lower()
+    if head.startswith(("[error]", "❌")) or "[error]" in head or "致命錯誤" in head:
+        return logging.ERROR
+    if head.startswith(("[warning]", "⚠️")) or "[warning]" in head:
+        return logging.WARNING
+    return logging.INFO
+
+def get_printer(name):
+    """
+    回傳與 print 相容的函式，內容改送到 logger（name）；指定 file= 時維持原本的 print。
+    背景 listener 與日誌檔在第一次輸出時才建立，模組在頂端呼叫本函式不會有任何副作用。
+    """
+    if not LOG_ENABLED:
+        return builtins.print
+    logger = logging.getLogger(f"{_ROOT}.{name}")
+
+    def _print(*args, sep=" ", end="\n", file=None, flush=False):
+        if file is not None and file is not sys.stdout:
+            builtins.print(*args, sep=sep, end=end, file=file, flush=flush)
+            return
+        if not _configured:
+            setup_logging()
+        text = sep.join(map(str, args))
+        level = _level_of(text)
+        if logger.isEnabledFor(level):
+            # 直接建立 record：略過 logger.log 逐層找呼叫端 frame（findCaller）的開銷
+            logger.handle(logger.makeRecord(logger.name, level, name, 0, text, None, None))
+    return _print
+
+def flush(timeout: float = 5.0):
+    """等背景 listener 把目前佇列寫完（replay 報告 / 結束前使用）。"""
+    deadline = time.time() + timeout
+    while not _queue.empty() and time.time() < deadline:
+        time.sleep(0.01)
+
+def stop():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,155 @@
+# loop_monitor.py
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+from config import (
+    LOOP_LAG_INTERVAL_SEC, LOOP_BLOCK_THRESHOLD_SEC,
+    LOOP_LAG_SUMMARY_SEC, LOOP_STALL_HISTORY,
+)
+from metrics import histogram, counter, register_collector, register_json_endpoint
+from logs import get_printer
+print = get_printer("loop_monitor")
+
+# === [loop_monitor] 事件迴圈延遲 / 阻塞偵測 ===
+# 事件迴圈裡只要有一個 callback 做了阻塞呼叫（REST、檔案 I/O、大量計算），Telethon 就會無聲地落後。
+#   • 量測：一個協程每 LOOP_LAG_INTERVAL_SEC 秒 sleep 一次，實際醒來的延遲 = 迴圈延遲（lag），寫入直方圖。
+#   • 抓兇手：另一條 watchdog 執行緒盯著心跳；超過 LOOP_BLOCK_THRESHOLD_SEC 沒跳，就擷取事件迴圈執行緒
+#     「當下」的堆疊（正在阻塞的那個 callback），印出警告並保留最近幾筆（/stalls）。
+#   • 每 LOOP_LAG_SUMMARY_SEC 秒印一次 p50 / p95 / p99 / 最大延遲與卡住次數。
+
+LOOP_LAG = histogram("chao_bi_loop_lag_seconds", "事件迴圈延遲（排程 sleep 實際醒來的延遲）",
+                     buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+LOOP_STALLS = counter("chao_bi_loop_stalls_total", "事件迴圈被阻塞超過門檻的次數")
+
+_STACK_LIMIT = 15
+
+def _pct(samples, q):
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(len(s) * q))]
+
+class LoopMonitor:
+    def __init__(self, loop, interval=LOOP_LAG_INTERVAL_SEC, threshold=LOOP_BLOCK_THRESHOLD_SEC,
+                 summary_every=LOOP_LAG_SUMMARY_SEC):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.summary_every = summary_every
+        self.samples = deque(maxlen=8192)        # 自上次摘要以來的 lag（秒）
+        self.stalls = deque(maxlen=LOOP_STALL_HISTORY)
+        self.total_stalls = 0
+        self.max_lag = 0.0
+        self._beat = time.perf_counter()
+        self._reported_beat = None
+        self._pending = None                      # watchdog 剛回報、還不知道總長度的那次阻塞
+        self._thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._task = self.loop.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="chao_bi_loop_watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # ---- 事件迴圈端：量測延遲 ----
+    async def _run(self):
+        last_summary = time.perf_counter()
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - t0 - self.interval)
+            self._beat = now
+            LOOP_LAG.observe(lag)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                pending["duration_ms"] = round(lag * 1000, 1)
+                print(f"[LoopLag] 事件迴圈恢復，這次共卡住約 {lag * 1000:.0f}ms。")
+            if self.summary_every and now - last_summary >= self.summary_every:
+                print(self.format_summary())
+                self.samples.clear()
+                last_summary = now
+
+    # ---- watchdog 執行緒：心跳停了就擷取事件迴圈執行緒的堆疊 ----
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            stalled = time.perf_counter() - beat - self.interval
+            if stalled < self.threshold or beat == self._reported_beat:
+                continue
+            self._reported_beat = beat
+            frame = sys._current_frames().get(self._thread_id)
+            stack = traceback.format_stack(frame, limit=_STACK_LIMIT) if frame is not None else []
+            record = {"at": time.time(), "stalled_ms": round(stalled * 1000, 1), "duration_ms": None,
+                      "stack": [line.rstrip() for line in stack]}
+            self.stalls.append(record)
+            self.total_stalls += 1
+            LOOP_STALLS.inc()
+            self._pending = record
+            where = "".join(stack[-4:]).rstrip() or "（無法取得堆疊）"
+            print(f"⚠️ [LoopLag] 事件迴圈已被阻塞 {stalled * 1000:.0f}ms（門檻 {self.threshold * 1000:.0f}ms），目前執行位置：\n{where}")
+
+    def stats(self):
+        s = list(self.samples)
+        return {
+            "samples": len(s),
+            "p50_ms": _pct(s, 0.50) * 1000,
+            "p95_ms": _pct(s, 0.95) * 1000,
+            "p99_ms": _pct(s, 0.99) * 1000,
+            "max_ms": max(s or [0.0]) * 1000,
+            "max_ever_ms": self.max_lag * 1000,
+            "stalls": self.total_stalls,
+        }
+
+    def format_summary(self):
+        st = self.stats()
+        return (f"[LoopLag] 事件迴圈延遲 p50 {st['p50_ms']:.1f}ms / p95 {st['p95_ms']:.1f}ms / "
+                f"p99 {st['p99_ms']:.1f}ms / 最大 {st['max_ms']:.1f}ms（{st['samples']} 個取樣），"
+                f"累計阻塞 {st['stalls']} 次")
+
+_monitor = None
+
+def start_loop_monitor(loop=None):
+    """在事件迴圈執行緒呼叫；重複呼叫會回傳同一個監測器。"""
+    global _monitor
+    loop = loop or asyncio.get_running_loop()
+    if _monitor is None or _monitor.loop is not loop:
+        if _monitor is not None:
+            _monitor.stop()
+        _monitor = LoopMonitor(loop)
+        _monitor.start()
+        print(f"[info] 事件迴圈延遲監測已啟動（阻塞門檻 {LOOP_BLOCK_THRESHOLD_SEC * 1000:.0f}ms）。")
+    return _monitor
+
+def get_loop_monitor():
+    return _monitor
+
+def recent_stalls():
+    return list(_monitor.stalls) if _monitor is not None else []
+
+@register_collector
+def _lag_gauges():
+    if _monitor is None:
+        return []
+    st = _monitor.stats()
+    return [("chao_bi_loop_lag_recent_ms", "gauge", "最近一段時間的事件迴圈延遲分位數（ms）",
+             [({"quantile": q}, st[f"{k}_ms"]) for q, k in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))])]
+
+register_json_endpoint("/stalls", recent_stalls)
@@ -0,0 +1,398 @@
+# metrics.py
+"""
+延遲量測與 Prometheus 文字格式 metrics（只綁 localhost）。
+
+  • 每則訊息一個 correlation id（contextvars；scheduler 的執行緒池會帶進 executor 執行緒），
+    handler / execute_trade / OrderTracker 的每個階段以 stage() 計時，寫入直方圖並串成該訊號的 trace。
+  • 直方圖為固定 bucket（bisect + 一把鎖），每次觀測只做幾個整數加法。
+  • 佇列長度、快取大小、執行緒池、REST 權重等 gauge 在抓取時才計算（零熱路徑成本）。
+
+  curl -s localhost:9108/metrics          # Prometheus 文字格式
+  curl -s localhost:9108/traces           # 最近訊號的逐階段耗時（JSON）
+  python metrics.py bench                 # 量測 stage() 本身的開銷
+"""
+import sys
+import json
+import time
+import itertools
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_TRACE_HISTORY
+
+# === [metrics] 基本型別 ===
+# 秒；涵蓋 REST（數十 ms）到 LLM（數十秒）與等待成交（數分鐘）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 180.0, 600.0)
+
+_registry = OrderedDict()      # name → metric（輸出順序 = 註冊順序）
+_collectors = []               # 抓取時呼叫的 fn() → [(name, type, help, [(labels, value), ...]), ...]
+
+def _fmt_labels(labelnames, labels):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{k}="{str(v)}"' for k, v in zip(labelnames, labels))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        lines += [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in items]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}      # labels → [各 bucket 次數..., +Inf 次數, 總和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def snapshot(self, labels=()):
+        with self._lock:
+            s = self._series.get(labels)
+            return list(s) if s else None
+
+    def quantile(self, q, labels=()):
+        """以 bucket 上界估計分位數（給 /traces 與日誌用；精確值請交給 Prometheus）。"""
+        s = self.snapshot(labels)
+        if not s:
+            return None
+        total = sum(s[:-1])
+        acc = 0
+        for bound, n in zip(self.buckets + (float("inf"),), s[:-1]):
+            acc += n
+            if acc >= q * total:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for labels, s in items:
+            base = ",".join(f'{k}="{v}"' for k, v in zip(self.labelnames, labels))
+            acc = 0
+            for bound, n in zip(self.buckets, s):
+                acc += n
+                lines.append(f'{self.name}_bucket{{{base + "," if base else ""}le="{bound}"}} {acc}')
+            acc += s[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{base + "," if base else ""}le="+Inf"}} {acc}')
+            suffix = "{" + base + "}" if base else ""
+            lines.append(f"{self.name}_sum{suffix} {s[-1]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {acc}")
+        return lines
+
+def counter(name, help, labelnames=()):
+    return _registry.setdefault(name, Counter(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _registry.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+_json_endpoints = {}           # path → fn()（回傳可 JSON 序列化的物件）
+
+def register_json_endpoint(path, fn):
+    """在 metrics 伺服器加上一個 JSON 端點（例如 loop_monitor 的 /stalls）。"""
+    _json_endpoints[path] = fn
+    return fn
+
+def register_collector(fn):
+    """fn() 回傳 [(name, 'gauge'|'counter', help, [(labels_dict, value), ...]), ...]；抓取時才呼叫。"""
+    _collectors.append(fn)
+    return fn
+
+STAGE_SECONDS = histogram("chao_bi_stage_seconds", "各階段耗時（訊息 handler / execute_trade / OrderTracker）", ("stage",))
+STAGE_ERRORS = counter("chao_bi_stage_errors_total", "階段內拋出例外的次數", ("stage",))
+SIGNALS = counter("chao_bi_signals_total", "處理過的訊息（依結果）", ("outcome",))
+REST_SECONDS = histogram("chao_bi_binance_request_seconds", "幣安 REST 呼叫耗時", ("method",))
+REST_CALLS = counter("chao_bi_binance_requests_total", "幣安 REST 呼叫次數（status = ok 或錯誤碼）", ("method", "status"))
+REST_WEIGHT = counter("chao_bi_binance_weight_total", "幣安 REST 請求權重（依官方權重表估算）", ("method",))
+
+# === [trace] correlation id 與逐訊號 trace ===
+_cid = contextvars.ContextVar("chao_bi_cid", default=None)
+_seq = itertools.count(1)
+_traces = OrderedDict()        # cid → {"started": epoch, "fields": {...}, "stages": [(stage, ms), ...]}
+_traces_lock = threading.Lock()
+
+def new_correlation_id(**fields):
+    """為目前的訊息建立 correlation id 並設為 context 值；之後同一 context（含執行緒池）的 stage 都歸到它。"""
+    cid = f"{time.strftime('%H%M%S')}-{next(_seq)}"
+    _cid.set(cid)
+    with _traces_lock:
+        _traces[cid] = {"started": time.time(), "fields": dict(fields), "stages": []}
+        while len(_traces) > METRICS_TRACE_HISTORY:
+            _traces.popitem(last=False)
+    return cid
+
+def current_correlation_id():
+    return _cid.get()
+
+def trace_set(cid=None, **fields):
+    t = _traces.get(cid or _cid.get())
+    if t is not None:
+        t["fields"].update(fields)
+
+def get_trace(cid):
+    t = _traces.get(cid)
+    return None if t is None else {"cid": cid, "started": t["started"], **t["fields"], "stages": list(t["stages"])}
+
+def recent_traces(limit=50):
+    with _traces_lock:
+        cids = list(_traces)[-limit:]
+    return [get_trace(c) for c in reversed(cids)]
+
+def format_trace(cid):
+    """一行文字版 trace（給日誌）：[Trace] cid symbol llm_parse=812ms execute_trade=95ms ..."""
+    t = get_trace(cid)
+    if not t:
+        return f"[Trace] {cid}（已淘汰）"
+    parts = " ".join(f"{name}={ms:.0f}ms" for name, ms in t["stages"])
+    return f"[Trace] {cid} {t.get('symbol') or ''} {parts}".replace("  ", " ")
+
+def observe_stage(name, seconds, cid=None, error=False):
+    STAGE_SECONDS.observe(seconds, (name,))
+    if error:
+        STAGE_ERRORS.inc((name,))
+    t = _traces.get(cid or _cid.get())
+    if t is not None:
+        t["stages"].append((name, seconds * 1000))
+
+class stage:
+    """with stage("llm_parse"): ...  — 計時區塊並記錄到直方圖與目前（或指定）correlation id 的 trace。"""
+    __slots__ = ("name", "cid", "t0")
+
+    def __init__(self, name, cid=None):
+        self.name = name
+        self.cid = cid
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe_stage(self.name, time.perf_counter() - self.t0, self.cid, exc_type is not None)
+        return False
+
+# === [rest] 幣安 REST 計時 / 權重 ===
+# USDⓈ-M 期貨官方權重（IP 1200/min 限制以此計算）；未列出的方法以 1 計
+_REST_WEIGHTS = {
+    "account": 5, "get_position_mode": 30, "exchange_info": 1, "leverage_bracket": 1,
+    "change_leverage": 1, "change_position_mode": 1, "new_order": 0, "cancel_order": 1,
+    "query_order": 1, "new_batch_order": 5, "get_income_history": 30,
+}
+_weight_window = deque()       # [epoch 秒, 權重]，算最近 60 秒用量
+_weight_lock = threading.Lock()
+
+def _rest_weight(method, args, kwargs):
+    if method in ("get_open_orders", "open_orders"):
+        return 1 if kwargs.get("symbol") or args else 40
+    if method == "ticker_price":
+        return 1 if kwargs.get("symbol") or args else 2
+    if method == "klines":
+        limit = int(kwargs.get("limit", 500))
+        return 1 if limit < 100 else 2 if limit < 500 else 5 if limit <= 1000 else 10
+    if method in ("sign_request", "_request") and len(args) >= 2:
+        path, payload = args[1], (args[2] if len(args) > 2 else None) or {}
+        if path.endswith("/openOrders"):
+            return 1 if payload.get("symbol") else 40
+        if path.endswith("/income"):
+            return 30
+        if path.endswith("/batchOrders"):
+            return 5
+        return 1
+    return _REST_WEIGHTS.get(method, 1)
+
+def _record_weight(w):
+    if not w:
+        return
+    sec = int(time.time())
+    with _weight_lock:
+        if _weight_window and _weight_window[-1][0] == sec:
+            _weight_window[-1][1] += w
+        else:
+            _weight_window.append([sec, w])
+            while _weight_window and _weight_window[0][0] <= sec - 60:
+                _weight_window.popleft()
+
+def rest_weight_1m():
+    cutoff = int(time.time()) - 60
+    with _weight_lock:
+        return sum(w for s, w in _weight_window if s > cutoff)
+
+class InstrumentedClient:
+    """包住 UMFutures（或 mock）：每個方法呼叫都計時、計數並累計估算權重，其餘屬性原樣轉發。"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith("__"):
+            return attr
+
+        def call(*args, **kwargs):
+            method = f"{args[0]} {args[1]}" if name in ("sign_request", "_request") and len(args) >= 2 else name
+            t0 = time.perf_counter()
+            status = "ok"
+            try:
+                return attr(*args, **kwargs)
+            except Exception as e:
+                status = str(getattr(e, "error_code", None) or getattr(e, "status_code", None) or type(e).__name__)
+                raise
+            finally:
+                REST_SECONDS.observe(time.perf_counter() - t0, (method,))
+                REST_CALLS.inc((method, status))
+                w = _rest_weight(name, args, kwargs)
+                REST_WEIGHT.inc((method,), w)
+                _record_weight(w)
+        return call
+
+def instrument_client(client):
+    if client is None or isinstance(client, InstrumentedClient) or not METRICS_ENABLED:
+        return client
+    return InstrumentedClient(client)
+
+# === [collect] 抓取時計算的 gauge（佇列 / 快取 / 執行緒池 / 追蹤中訂單）===
+@register_collector
+def _default_gauges():
+    out = [("chao_bi_binance_weight_1m", "gauge", "最近 60 秒的幣安 REST 權重（估算）", [({}, rest_weight_1m())])]
+    mods = sys.modules
+    if "scheduler" in mods:
+        stats = mods["scheduler"].pool_stats()
+        lanes = stats.pop("lanes", {})
+        for key, help in (("active", "執行中的工作"), ("queued", "排隊中的工作"), ("utilization", "使用率 0~1"),
+                          ("wait_p95_ms", "排隊等待 p95（ms）")):
+            out.append((f"chao_bi_pool_{key}", "gauge", f"執行緒池{help}",
+                        [({"pool": name}, s[key]) for name, s in stats.items()]))
+        out.append(("chao_bi_symbol_lanes_active", "gauge", "使用中的 symbol 通道", [({}, lanes.get("active_lanes", 0))]))
+    if "telegram" in mods:
+        tg = mods["telegram"]
+        out.append(("chao_bi_notify_queue_size", "gauge", "通知佇列長度", [({}, tg._notify_queue.qsize())]))
+        out.append(("chao_bi_notify_total", "counter", "通知佇列統計",
+                    [({"event": k}, v) for k, v in tg.notify_stats.items()]))
+        for cname in ("sender_cache", "chat_cache"):
+            c = getattr(tg, cname)
+            out.append((f"chao_bi_{cname}_entries", "gauge", f"{cname} 筆數", [({}, len(c))]))
+            out.append((f"chao_bi_{cname}_lookups_total", "counter", f"{cname} 查詢",
+                        [({"result": "hit"}, c.hits), ({"result": "miss"}, c.misses)]))
+    if "trade_journal" in mods:
+        tj = mods["trade_journal"]
+        out.append(("chao_bi_journal_queue_size", "gauge", "trade_journal 寫入佇列長度", [({}, tj._queue.qsize())]))
+        out.append(("chao_bi_journal_total", "counter", "trade_journal 寫入統計",
+                    [({"event": k}, v) for k, v in tj.journal_stats.items()]))
+    if "binance_api" in mods:
+        ba = mods["binance_api"]
+        out.append(("chao_bi_symbol_info_cache_entries", "gauge", "交易對資訊快取筆數", [({}, len(ba.symbol_info_cache))]))
+    if "order_tracker" in mods:
+        ot = mods["order_tracker"]
+        out.append(("chao_bi_trackers", "gauge", "追蹤中的開倉單（依狀態）",
+                    [({"state": k}, v) for k, v in ot.tracker_stats().items()]))
+        out.append(("chao_bi_order_timers", "gauge", "時間輪中的逾時期限", [({}, len(ot._timers))]))
+        if ot._monitor is not None:
+            out.append(("chao_bi_monitor_total", "counter", "訂單監控統計",
+                        [({"event": k}, v) for k, v in ot._monitor.stats.items()]))
+    return out
+
+def collect():
+    """呼叫所有 collector，回傳 [(name, type, help, samples), ...]（/stats 指令也用這份）；失敗的 collector 以 None 代表。"""
+    out = []
+    for fn in _collectors:
+        try:
+            out += fn()
+        except Exception as e:
+            out.append((getattr(fn, "__name__", str(fn)), None, str(e), []))
+    return out
+
+def render():
+    lines = []
+    for m in list(_registry.values()):
+        lines += m.render()
+    for name, mtype, help, samples in collect():
+        if mtype is None:
+            lines.append(f"# collector {name} failed: {help}")
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {mtype}"]
+        for labels, value in samples:
+            lines.append(f"{name}{_fmt_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return "\n".join(lines) + "\n"
+
+# === [server] localhost HTTP（http.server 在啟動時才載入）===
+def _make_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body, ctype = render().encode(), "text/plain; version=0.0.4; charset=utf-8"
+            elif path in _json_endpoints:
+                body, ctype = json.dumps(_json_endpoints[path](), ensure_ascii=False).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return _Handler
+
+_server = None
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """在背景執行緒啟動 /metrics 與 /traces；已啟動或停用時直接返回。"""
+    global _server
+    if not METRICS_ENABLED or _server is not None:
+        return _server
+    from http.server import ThreadingHTTPServer
+    try:
+        _server = ThreadingHTTPServer((host, port), _make_handler())
+    except OSError as e:
+        print(f"[warning] metrics 伺服器啟動失敗（{host}:{port}）：{e}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="chao_bi_metrics", daemon=True).start()
+    print(f"[info] metrics 已啟動：http://{host}:{_server.server_address[1]}/metrics")
+    return _server
+
+register_json_endpoint("/traces", recent_traces)
+
+def _bench(n=200_000):
+    new_correlation_id(symbol="BENCH")
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with stage("bench"):
+            pass
+    per = (time.perf_counter() - t0) / n * 1e6
+    with _traces_lock:
+        _traces.clear()
+    print(f"stage() 開銷：{per:.2f} µs / 次（{n} 次，含 trace 記錄）")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["bench"]:
+        _bench()
+    else:
+        print(render())
@@ -0,0 +1,464 @@
+# mock_binance.py
+import time
+import random
+import threading
+from decimal import Decimal, ROUND_DOWN
+try:
+    from binance.error import ClientError as _ClientErrorBase
+except ImportError:
+    _ClientErrorBase = Exception
+
+# === [mock] 本地幣安期貨替身（離線 replay / 壓測用，不會連線到 fapi.binance.com）===
+# 只實作本專案實際呼叫到的 UMFutures 方法；價格以隨機漫步產生，LIMIT 單在價格穿越或
+# 掛單滿 fill_after_sec 秒後成交（可設定先部分成交）。另外支援：
+#   • 延遲（固定 + 抖動）與錯誤注入（指定方法的下 N 次呼叫回 -4028 / -4048 / 429 …，或隨機 429）
+#   • 撮合引擎執行緒（start_engine）：主動成交 LIMIT、觸發 STOP_MARKET / TAKE_PROFIT_MARKET 平倉並記錄收益
+#   • batchOrders、income、listenKey 與 user stream（ORDER_TRADE_UPDATE 事件回呼）
+
+DEFAULT_MOCK_PRICES = {
+    'BTCUSDT': '100000', 'ETHUSDT': '3500', 'BNBUSDT': '650', 'SOLUSDT': '150',
+    'PIPPINUSDT': '0.05', 'GIGGLEUSDT': '150', 'TRUMPUSDT': '8', 'TRUSTUSDT': '0.3',
+    'AIAUSDT': '1.2', 'MITOUSDT': '0.2', 'PHAUSDT': '0.1', '币安人生USDT': '0.2',
+    '1000PEPEUSDT': '0.01',
+}
+
+class MockClientError(_ClientErrorBase):
+    """ClientError 的子類別（有安裝 SDK 時），讓既有的 except ClientError 分支照常運作。"""
+
+    def __init__(self, status_code, error_code, error_message):
+        Exception.__init__(self, status_code, error_code, error_message)
+        self.status_code = status_code
+        self.error_code = error_code
+        self.error_message = error_message
+        self.header = {}
+        self.error_data = None
+
+def _tick_for(price: Decimal) -> str:
+    if price >= 1000:
+        return '0.10'
+    if price >= 10:
+        return '0.010'
+    if price >= 1:
+        return '0.0010'
+    return '0.0000100'
+
+class MockUMFutures:
+    """
+    in-process 的 UMFutures 替身。
+    latency: 每次呼叫的模擬延遲（秒）；fill_after_sec: 未被價格穿越的 LIMIT 單多久後視為成交（None=永不）。
+    gtd_unsupported: 不接受 timeInForce=GTD 的 symbol（下單回 -1116）。
+    latency_jitter: 延遲的隨機抖動上限（秒，均勻分布）；error_rate: 每次呼叫回 429 的機率。
+    partial_fill: 0~1；設定時 LIMIT 單在 fill_after_sec 的一半先成交這個比例（PARTIALLY_FILLED）。
+    """
+
+    def __init__(self, prices=None, balance='1000', latency=0.0, fill_after_sec=2.0,
+                 volatility=0.0005, seed=None, gtd_unsupported=(), latency_jitter=0.0,
+                 error_rate=0.0, partial_fill=None):
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.prices = {s: Decimal(str(p)) for s, p in (prices or DEFAULT_MOCK_PRICES).items()}
+        self.balance = Decimal(str(balance))
+        self.latency = latency
+        self.fill_after_sec = fill_after_sec
+        self.volatility = volatility
+        self.leverage = {}
+        self.orders = {}            # orderId → order dict
+        self.positions = {}         # (symbol, positionSide) → Decimal amount
+        self.calls = {}             # method → 呼叫次數
+        self._next_id = 1000
+        self.gtd_unsupported = set(gtd_unsupported)
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.partial_fill = partial_fill
+        self.entry_prices = {}      # (symbol, positionSide) → 持倉均價
+        self.income = []            # income 紀錄（REALIZED_PNL / COMMISSION）
+        self.first_fill_ms = {}     # orderId → 第一次成交時間（ms），bench 計算成交→掛出場單延遲
+        self.errors = {}            # 錯誤碼 → 次數（注入 / 隨機 429）
+        self._faults = {}           # method → [(status, code, msg), ...]
+        self._listeners = []
+        self._listen_keys = set()
+        self._engine = None
+        self._engine_stop = threading.Event()
+        self._next_tran = 1
+
+    # ---- 內部工具 ----
+    def _enter(self, name, variant=None):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        delay = self.latency + (self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay:
+            time.sleep(delay)
+        fault = None
+        with self._lock:
+            queue = (variant and self._faults.get(f"{name}.{variant}")) or self._faults.get(name)
+            if queue:
+                fault = queue.pop(0)
+            elif self.error_rate and self._rng.random() < self.error_rate:
+                fault = (429, -1003, "Too many requests; current limit of IP is 2400 requests per minute.")
+            if fault:
+                self.errors[fault[1]] = self.errors.get(fault[1], 0) + 1
+        if fault:
+            raise MockClientError(*fault)
+
+    def inject_error(self, method, error_code, times=1, status=400, message=None):
+        """
+        讓 method 的下 times 次呼叫回傳指定錯誤（例如 change_leverage / -4028、new_order / 429）。
+        new_order 可以指定單別，例如 new_order.STOP_MARKET 只讓掛 SL 失敗。
+        """
+        msg = message or {
+            -4028: "Leverage is not valid.", -4048: "Leverage not changed.", -1003: "Too many requests.",
+            -2019: "Margin is insufficient.", -1001: "Internal error; unable to process your request.",
+        }.get(error_code, f"mock error {error_code}")
+        if error_code == -1003 and status == 400:
+            status = 429
+        with self._lock:
+            self._faults.setdefault(method, []).extend([(status, error_code, msg)] * times)
+
+    def _emit(self, od, exec_type='TRADE'):
+        """user stream：送出 ORDER_TRADE_UPDATE（在持有 _lock 時呼叫；回呼必須不阻塞）。"""
+        if not self._listeners:
+            return
+        event = {
+            'e': 'ORDER_TRADE_UPDATE', 'E': int(time.time() * 1000), 'T': od['updateTime'],
+            'o': {'s': od['symbol'], 'i': od['orderId'], 'S': od['side'], 'o': od['type'],
+                  'ps': od['positionSide'], 'x': exec_type, 'X': od['status'], 'q': od['origQty'],
+                  'z': od['executedQty'], 'p': od['price'], 'sp': od['stopPrice'],
+                  'f': od['timeInForce'], 'cp': od['closePosition']},
+        }
+        for fn in list(self._listeners):
+            try:
+                fn(event)
+            except Exception:
+                pass
+
+    def _require_symbol(self, symbol):
+        if symbol not in self.prices:
+            raise MockClientError(400, -1121, "Invalid symbol.")
+
+    def _price(self, symbol) -> Decimal:
+        p = self.prices[symbol]
+        p = p * (1 + Decimal(str(self._rng.gauss(0, self.volatility))))
+        p = p.quantize(Decimal(_tick_for(p)).normalize(), rounding=ROUND_DOWN)
+        self.prices[symbol] = p
+        return p
+
+    def _fill(self, od, qty=None, px=None):
+        """成交 qty（預設為剩餘全部）；開倉單增加持倉並更新均價。"""
+        now_ms = int(time.time() * 1000)
+        executed = Decimal(od['executedQty'])
+        qty = Decimal(od['origQty']) - executed if qty is None else qty
+        od['executedQty'] = str(executed + qty)
+        od['status'] = 'FILLED' if executed + qty >= Decimal(od['origQty']) else 'PARTIALLY_FILLED'
+        od['updateTime'] = now_ms
+        self.first_fill_ms.setdefault(od['orderId'], now_ms)
+        if od['type'] in ('LIMIT', 'MARKET') and qty > 0:
+            fill_px = px or (Decimal(od['price']) if od['type'] == 'LIMIT' else self.prices[od['symbol']])
+            od['avgPrice'] = str(fill_px)
+            side = 1 if od['side'] == 'BUY' else -1
+            key = (od['symbol'], od['positionSide'])
+            old_amt = self.positions.get(key, Decimal('0'))
+            new_amt = old_amt + side * qty
+            old_px = self.entry_prices.get(key, fill_px)
+            self.entry_prices[key] = (abs(old_amt) * old_px + qty * fill_px) / abs(new_amt) if new_amt else fill_px
+            self.positions[key] = new_amt
+            self._add_income(od['symbol'], 'COMMISSION', -(qty * fill_px * Decimal('0.0004')))
+        self._emit(od)
+
+    def _maybe_fill(self, od):
+        if od['status'] not in ('NEW', 'PARTIALLY_FILLED') or od['type'] != 'LIMIT':
+            return
+        now_ms = time.time() * 1000
+        if od['timeInForce'] == 'GTD' and now_ms >= od['goodTillDate']:
+            od['status'] = 'EXPIRED'
+            od['updateTime'] = int(now_ms)
+            self._emit(od, 'EXPIRED')
+            return
+        px = self._price(od['symbol'])
+        limit = Decimal(od['price'])
+        crossed = (od['side'] == 'BUY' and px <= limit) or (od['side'] == 'SELL' and px >= limit)
+        age_ms = now_ms - od['time']
+        aged = self.fill_after_sec is not None and age_ms >= self.fill_after_sec * 1000
+        if crossed or aged:
+            self._fill(od)
+        elif (self.partial_fill and od['status'] == 'NEW' and self.fill_after_sec is not None
+              and age_ms >= self.fill_after_sec * 500):
+            qty = (Decimal(od['origQty']) * Decimal(str(self.partial_fill))).quantize(Decimal('0.001'), rounding=ROUND_DOWN)
+            if qty > 0:
+                self._fill(od, qty=qty)
+
+    def _maybe_trigger(self, od):
+        """STOP_MARKET / TAKE_PROFIT_MARKET：標記價格穿越 stopPrice 即以市價平掉整個倉位。"""
+        if od['status'] != 'NEW' or od['type'] not in ('STOP_MARKET', 'TAKE_PROFIT_MARKET'):
+            return
+        key = (od['symbol'], od['positionSide'])
+        amt = self.positions.get(key, Decimal('0'))
+        if amt == 0:
+            return
+        px = self.prices[od['symbol']]
+        stop = Decimal(od['stopPrice'])
+        long_pos = od['positionSide'] == 'LONG' or (od['positionSide'] == 'BOTH' and amt > 0)
+        if od['type'] == 'STOP_MARKET':
+            hit = px <= stop if long_pos else px >= stop
+        else:
+            hit = px >= stop if long_pos else px <= stop
+        if not hit:
+            return
+        qty = abs(amt)
+        entry = self.entry_prices.get(key, px)
+        pnl = (px - entry) * qty if long_pos else (entry - px) * qty
+        self.positions[key] = Decimal('0')
+        self.entry_prices.pop(key, None)
+        od['origQty'] = str(qty)
+        od['executedQty'] = str(qty)
+        od['avgPrice'] = str(px)
+        od['status'] = 'FILLED'
+        od['updateTime'] = int(time.time() * 1000)
+        self.first_fill_ms.setdefault(od['orderId'], od['updateTime'])
+        self._add_income(od['symbol'], 'REALIZED_PNL', pnl)
+        self._add_income(od['symbol'], 'COMMISSION', -(qty * px * Decimal('0.0004')))
+        self._emit(od)
+
+    def _add_income(self, symbol, income_type, amount):
+        self.income.append({'symbol': symbol, 'incomeType': income_type, 'income': str(amount.quantize(Decimal('0.00000001'))),
+                            'asset': 'USDT', 'time': int(time.time() * 1000), 'tranId': self._next_tran})
+        self._next_tran += 1
+        self.balance += amount
+
+    # ---- 撮合引擎（可選）----
+    def start_engine(self, interval=0.05):
+        """背景執行緒每 interval 秒推進價格、成交 LIMIT、觸發 SL/TP；沒啟動時只在查詢時順便撮合。"""
+        if self._engine is not None:
+            return
+        self._engine_stop.clear()
+
+        def _run():
+            while not self._engine_stop.wait(interval):
+                self.step()
+
+        self._engine = threading.Thread(target=_run, name="mock_binance_engine", daemon=True)
+        self._engine.start()
+
+    def stop_engine(self):
+        if self._engine is not None:
+            self._engine_stop.set()
+            self._engine.join(timeout=2)
+            self._engine = None
+
+    def step(self):
+        """撮合一輪（start_engine 會定期呼叫；測試也可以手動呼叫）。"""
+        with self._lock:
+            for symbol in {od['symbol'] for od in self.orders.values() if od['status'] in ('NEW', 'PARTIALLY_FILLED')}:
+                self._price(symbol)
+            for od in list(self.orders.values()):
+                if od['status'] in ('NEW', 'PARTIALLY_FILLED'):
+                    self._maybe_fill(od)
+                    self._maybe_trigger(od)
+
+    # ---- 帳戶 / 市場資料 ----
+    def get_position_mode(self):
+        self._enter('get_position_mode')
+        return {'dualSidePosition': True}
+
+    def change_position_mode(self, **kwargs):
+        self._enter('change_position_mode')
+        return {'code': 200, 'msg': 'success'}
+
+    def account(self, **kwargs):
+        self._enter('account')
+        with self._lock:
+            positions = [
+                {'symbol': s, 'positionSide': side, 'positionAmt': str(amt)}
+                for (s, side), amt in self.positions.items()
+            ]
+        return {'availableBalance': str(self.balance), 'positions': positions}
+
+    def exchange_info(self):
+        self._enter('exchange_info')
+        symbols = []
+        for s, p in self.prices.items():
+            tick = _tick_for(p)
+            symbols.append({
+                'symbol': s, 'baseAsset': s[:-4], 'quoteAsset': 'USDT',
+                'contractType': 'PERPETUAL', 'status': 'TRADING',
+                'filters': [
+                    {'filterType': 'PRICE_FILTER', 'tickSize': tick, 'minPrice': tick, 'maxPrice': '1000000'},
+                    {'filterType': 'LOT_SIZE', 'stepSize': '0.001', 'minQty': '0.001', 'maxQty': '100000000'},
+                    {'filterType': 'MIN_NOTIONAL', 'notional': '5'},
+                ],
+            })
+        return {'symbols': symbols}
+
+    def ticker_price(self, symbol=None):
+        self._enter('ticker_price')
+        self._require_symbol(symbol)
+        with self._lock:
+            return {'symbol': symbol, 'price': str(self._price(symbol))}
+
+    def klines(self, symbol, interval='5m', limit=500, **kwargs):
+        self._enter('klines')
+        self._require_symbol(symbol)
+        with self._lock:
+            close = self.prices[symbol]
+        rng = random.Random(hash((symbol, interval, limit)))
+        now_ms = int(time.time() * 1000)
+        bars, px = [], close
+        for i in range(limit):
+            o = px
+            c = o * (1 + Decimal(str(rng.gauss(0, 0.002))))
+            h = max(o, c) * (1 + Decimal(str(abs(rng.gauss(0, 0.001)))))
+            l = min(o, c) * (1 - Decimal(str(abs(rng.gauss(0, 0.001)))))
+            t = now_ms - (limit - i) * 300_000
+            bars.append([t, str(o), str(h), str(l), str(c), f"{rng.uniform(100, 1000):.3f}", t + 299_999])
+            px = c
+        # 讓最後一根收盤價等於目前價格
+        shift = close / px
+        for b in bars:
+            for j in (1, 2, 3, 4):
+                b[j] = str((Decimal(b[j]) * shift).quantize(Decimal(_tick_for(close)).normalize()))
+        return bars
+
+    def leverage_bracket(self, symbol=None):
+        self._enter('leverage_bracket')
+        items = [{'symbol': s, 'brackets': [{'initialLeverage': 125 if s in ('BTCUSDT', 'ETHUSDT') else 50}]}
+                 for s in ([symbol] if symbol else self.prices)]
+        return items
+
+    def change_leverage(self, symbol, leverage, **kwargs):
+        self._enter('change_leverage')
+        self._require_symbol(symbol)
+        max_lev = 125 if symbol in ('BTCUSDT', 'ETHUSDT') else 50
+        if int(leverage) > max_lev:
+            raise MockClientError(400, -4028, f"Leverage {leverage} is not valid")
+        if self.leverage.get(symbol) == int(leverage):
+            raise MockClientError(400, -4048, "Leverage not changed.")
+        self.leverage[symbol] = int(leverage)
+        return {'symbol': symbol, 'leverage': int(leverage)}
+
+    # ---- 下單 / 查單 ----
+    def new_order(self, **params):
+        self._enter('new_order', params.get('type'))
+        return self._place_order(params)
+
+    def _place_order(self, params):
+        symbol = params['symbol']
+        self._require_symbol(symbol)
+        if params.get('timeInForce') == 'GTD':
+            if symbol in self.gtd_unsupported:
+                raise MockClientError(400, -1116, "Invalid timeInForce.")
+            gtd = int(params.get('goodTillDate') or 0)
+            if gtd < (time.time() + 600) * 1000:
+                raise MockClientError(400, -1102, "goodTillDate must be greater than current time plus 600 seconds.")
+        with self._lock:
+            client_id = params.get('newClientOrderId')
+            if client_id and any(o['clientOrderId'] == client_id and o['status'] in ('NEW', 'PARTIALLY_FILLED')
+                                 for o in self.orders.values()):
+                raise MockClientError(400, -4116, "ClientOrderId is duplicated.")
+            self._next_id += 1
+            now_ms = int(time.time() * 1000)
+            od = {
+                'orderId': self._next_id, 'clientOrderId': client_id or f"mock_{self._next_id}",
+                'symbol': symbol, 'side': params['side'],
+                'positionSide': params.get('positionSide', 'BOTH'), 'type': params['type'],
+                'origQty': str(params.get('quantity', '0')), 'executedQty': '0',
+                'price': str(params.get('price', '0')), 'stopPrice': str(params.get('stopPrice', '0')),
+                'timeInForce': params.get('timeInForce', 'GTC'),
+                'goodTillDate': int(params.get('goodTillDate') or 0),
+                'closePosition': str(params.get('closePosition', 'false')).lower() == 'true',
+                'reduceOnly': False, 'status': 'NEW', 'time': now_ms, 'updateTime': now_ms,
+            }
+            self.orders[od['orderId']] = od
+            self._emit(od, 'NEW')
+            if od['type'] == 'MARKET':
+                self._fill(od)
+            return dict(od)
+
+    def new_batch_order(self, batchOrders, **kwargs):
+        """batchOrders：最多 5 筆；每筆各自成功（訂單）或失敗（{'code', 'msg'}），與幣安相同不會整批回滾。"""
+        self._enter('new_batch_order')
+        if len(batchOrders) > 5:
+            raise MockClientError(400, -1130, "Data sent for parameter 'batchOrders' is not valid.")
+        out = []
+        for params in batchOrders:
+            try:
+                out.append(self._place_order(dict(params)))
+            except MockClientError as e:
+                out.append({'code': e.error_code, 'msg': e.error_message})
+        return out
+
+    def query_order(self, symbol, orderId=None, origClientOrderId=None, **kwargs):
+        self._enter('query_order')
+        with self._lock:
+            if orderId is None and origClientOrderId:
+                orderId = next((i for i, o in self.orders.items() if o['clientOrderId'] == origClientOrderId), None)
+            od = self.orders.get(orderId)
+            if od is None or od['symbol'] != symbol:
+                raise MockClientError(400, -2013, "Order does not exist.")
+            self._maybe_fill(od)
+            return dict(od)
+
+    def cancel_order(self, symbol, orderId=None, **kwargs):
+        self._enter('cancel_order')
+        with self._lock:
+            od = self.orders.get(orderId)
+            if od is None or od['status'] not in ('NEW', 'PARTIALLY_FILLED'):
+                raise MockClientError(400, -2011, "Unknown order sent.")
+            od['status'] = 'CANCELED'
+            od['updateTime'] = int(time.time() * 1000)
+            self._emit(od, 'CANCELED')
+            return dict(od)
+
+    def get_open_orders(self, symbol=None, **kwargs):
+        self._enter('get_open_orders')
+        with self._lock:
+            out = []
+            for od in self.orders.values():
+                if symbol and od['symbol'] != symbol:
+                    continue
+                self._maybe_fill(od)
+                if od['status'] in ('NEW', 'PARTIALLY_FILLED'):
+                    out.append(dict(od))
+            return out
+
+    def get_income_history(self, symbol=None, incomeType=None, startTime=None, endTime=None, limit=100, **kwargs):
+        self._enter('income')
+        with self._lock:
+            rows = [r for r in self.income
+                    if (not symbol or r['symbol'] == symbol)
+                    and (not incomeType or r['incomeType'] == incomeType)
+                    and (startTime is None or r['time'] >= int(startTime))
+                    and (endTime is None or r['time'] <= int(endTime))]
+        return [dict(r) for r in rows[:int(limit)]]
+
+    # ---- user data stream ----
+    def new_listen_key(self):
+        self._enter('new_listen_key')
+        key = f"mock{self._rng.getrandbits(64):016x}"
+        self._listen_keys.add(key)
+        return {'listenKey': key}
+
+    def renew_listen_key(self, listenKey):
+        self._enter('renew_listen_key')
+        if listenKey not in self._listen_keys:
+            raise MockClientError(400, -1125, "This listenKey does not exist.")
+        return {}
+
+    def close_listen_key(self, listenKey):
+        self._enter('close_listen_key')
+        self._listen_keys.discard(listenKey)
+        return {}
+
+    def add_user_stream_listener(self, fn):
+        """註冊 ORDER_TRADE_UPDATE 回呼（在下單 / 撮合的執行緒中同步呼叫，請自行轉回事件迴圈）。"""
+        self._listeners.append(fn)
+
+    def sign_request(self, method, path, payload=None):
+        """低階簽名請求：支援 openOrders / allOpenOrders / income / batchOrders / DELETE order。"""
+        payload = payload or {}
+        if method == 'GET' and path in ('/fapi/v1/openOrders', '/fapi/v1/allOpenOrders'):
+            return self.get_open_orders(symbol=payload.get('symbol'))
+        if method == 'GET' and path == '/fapi/v1/income':
+            return self.get_income_history(**payload)
+        if method == 'POST' and path == '/fapi/v1/batchOrders':
+            return self.new_batch_order(payload.get('batchOrders') or [])
+        if method == 'DELETE' and path == '/fapi/v1/order':
+            return self.cancel_order(payload.get('symbol'), orderId=payload.get('orderId'))
+        raise MockClientError(404, -1, f"mock: unsupported {method} {path}")
@@ -0,0 +1,634 @@
+# order_tracker.py
+import time
+import asyncio
+from enum import Enum
+from decimal import Decimal
+from config import (
+    AUTO_CANCEL_SECONDS, ORDER_MONITOR_INTERVAL,
+    INITIAL_FILL_WAIT_SECONDS, INITIAL_POLL_INTERVAL,
+    ORDER_MONITOR_ALL_OPEN_THRESHOLD,
+    EXIT_ATTACH_MAX_ATTEMPTS, EXIT_ATTACH_RETRY_BASE_SEC, EXIT_ATTACH_RETRY_MAX_SEC,
+)
+from binance_api import (
+    _query_order, _cancel_order_safely, _attach_exits_after_fill,
+    get_binance_market_price, _sdk_get_open_orders, _fapi_signed_get,
+    _monitoring_orders,
+)
+from state_store import update_trade_status, mark_entry_terminal
+from trade_journal import record_fields as journal_record_fields
+from telegram import notify_user
+from scheduler import run_in_pool
+from app import use_account
+from metrics import stage, observe_stage
+from logs import get_printer
+print = get_printer("order_tracker")
+
+# === [tracker] 開倉單狀態機 ===
+# 每張開倉單（LIMIT / MARKET）對應一個 OrderTracker，所有階段都走同一套轉移：
+#   NEW → PARTIAL → FILLED → EXITS_ATTACHED → CLOSED
+# （部分成交就先掛 SL/TP，因此 PARTIAL 也可以直接進入 EXITS_ATTACHED；任何狀態都可以直接 CLOSED）
+# 狀態只由 on_order_update()（查單結果或成交事件）與 expire()（逾時）推進；
+# 驅動者是單一的 OrderMonitor（見下方），等待期間不佔用任何執行緒，REST 呼叫才短暫丟到 scheduler 的 order / market 池。
+
+class OrderState(str, Enum):
+    NEW = "NEW"
+    PARTIAL = "PARTIAL"
+    FILLED = "FILLED"
+    EXITS_ATTACHED = "EXITS_ATTACHED"
+    CLOSED = "CLOSED"
+
+_TRANSITIONS = {
+    OrderState.NEW: {OrderState.PARTIAL, OrderState.FILLED, OrderState.CLOSED},
+    OrderState.PARTIAL: {OrderState.FILLED, OrderState.EXITS_ATTACHED, OrderState.CLOSED},
+    OrderState.FILLED: {OrderState.EXITS_ATTACHED, OrderState.CLOSED},
+    OrderState.EXITS_ATTACHED: {OrderState.CLOSED},
+    OrderState.CLOSED: set(),
+}
+
+# 交易所回報的終止狀態（未成交部分不會再成交）
+_TERMINAL_STATUSES = ("CANCELED", "EXPIRED", "REJECTED", "EXPIRED_IN_MATCH")
+
+# 註冊表即 binance_api._monitoring_orders：(symbol, order_id) → OrderTracker
+
+def attach_exits_for_fill(symbol, position_side, sl_price_str, tp_price_str, entry_order_id):
+    """
+    成交後掛 SL/TP（同步，請在 scheduler 的 order 池執行）。
+    若 TP 以目前價格會立即觸發，為避免『成交即平倉』只掛 SL。
+    sl_price_str / tp_price_str 為 None 的一邊不掛（重試時只補失敗的那一邊）。
+    回傳 (sl_id, tp_id, tp_skipped)；失敗的一邊為 None。
+    """
+    is_buy = position_side == "LONG"
+    if tp_price_str is not None:
+        try:
+            current_mark_price = Decimal(get_binance_market_price(symbol))
+            tp_price_dec = Decimal(tp_price_str)
+            print(f"   [Binance] 成交後 TP 檢查：目標 {tp_price_dec}，當前 {current_mark_price}")
+            will_trigger_immediately = (is_buy and tp_price_dec <= current_mark_price) or \
+                                       ((not is_buy) and tp_price_dec >= current_mark_price)
+            if will_trigger_immediately:
+                print("[warning] [Binance 提示] TP 將立即觸發。依照目前設定，為避免『成交即平倉』，**略過** TP（仍保留 SL）。")
+                journal_record_fields(entry_order_id, tp_skipped=True)
+                sl_id = None
+                if sl_price_str is not None:
+                    sl_id, _ = _attach_exits_after_fill(symbol, position_side, sl_price_str, None, entry_order_id=entry_order_id)
+                return sl_id, None, True
+        except Exception as e:
+            print(f"[warning] 當前價查詢失敗，仍將嘗試掛 SL/TP：{e}")
+    sl_id, tp_id = _attach_exits_after_fill(symbol, position_side, sl_price_str, tp_price_str, entry_order_id=entry_order_id)
+    return sl_id, tp_id, False
+
+class OrderTracker:
+    """
+    單張開倉單的非同步狀態機。
+    context 用於通知內容（action / signal_text / decision_signal / leverage_note），
+    以及把等待成交 / 掛 SL/TP 的耗時記到原訊號的 correlation id（cid）。
+    account：下單的幣安帳戶名稱（None = 主帳戶）；查單 / 撤單 / 掛 SL/TP 都在該帳戶執行。
+    """
+
+    def __init__(self, symbol, order_id, position_side, sl_price, tp_price, loop,
+                 order_type="LIMIT", timeout_seconds=AUTO_CANCEL_SECONDS, context=None, account=None):
+        self.symbol = symbol
+        self.account = account
+        self.order_id = int(order_id)
+        self.position_side = position_side
+        self.sl_price = sl_price
+        self.tp_price = tp_price
+        self.order_type = order_type
+        self.loop = loop
+        self.context = context or {}
+        self.state = OrderState.NEW
+        self.fully_filled = False
+        self.close_reason = None
+        self.created_at = time.time()
+        self.filled_at = None
+        self.deadline = self.created_at + timeout_seconds if timeout_seconds else None
+        self.sl_id = None
+        self.tp_id = None
+        self.tp_skipped = False
+        self.attach_failures = 0
+        self.next_attach_at = 0.0   # 掛 SL/TP 失敗後的下次重試時間（退避）
+        self.entry_final = None     # 開倉單已終止但有成交：SL/TP 掛齊後以此原因結案
+        self._lock = asyncio.Lock()
+        self._closed = asyncio.Event()
+        self.last_status = None
+
+    @property
+    def key(self):
+        return (self.symbol, self.order_id)
+
+    @property
+    def closed(self):
+        return self.state == OrderState.CLOSED
+
+    @property
+    def exits_pending(self):
+        """已有成交但 SL/TP 還沒掛齊。"""
+        return self.state in (OrderState.PARTIAL, OrderState.FILLED)
+
+    def attach_due(self, now=None):
+        return self.exits_pending and (time.time() if now is None else now) >= self.next_attach_at
+
+    def _to(self, new_state):
+        if new_state not in _TRANSITIONS[self.state]:
+            raise RuntimeError(f"OrderTracker {self.symbol}/{self.order_id}: 非法狀態轉移 {self.state.value} → {new_state.value}")
+        self.state = new_state
+
+    def _close(self, reason):
+        if self.closed:
+            return
+        self._to(OrderState.CLOSED)
+        self.close_reason = reason
+        _monitoring_orders.pop(self.key, None)
+        _timers.cancel(self.key)
+        self._closed.set()
+        print(f"   [Tracker] {self.symbol}/{self.order_id} 結束追蹤（{reason}）。")
+
+    async def wait_closed(self):
+        await self._closed.wait()
+
+    def run_in_account(self, pool, fn, *args):
+        """在此單所屬帳戶的 context 中丟到執行緒池（run_in_pool 會帶上呼叫當下的 contextvars）。"""
+        with use_account(self.account):
+            return run_in_pool(pool, fn, *args)
+
+    # ---- 事件入口 ----
+    async def on_order_update(self, od: dict):
+        """餵入查單結果或成交事件（dict 需含 status）。"""
+        async with self._lock:
+            await self._apply_update(od)
+
+    async def _apply_update(self, od, cause=None):
+        """on_order_update 的本體（呼叫端需持有 _lock）。cause：結案原因前綴（例如 timeout）。"""
+        status = str(od.get("status", "")).upper()
+        if self.closed:
+            return
+        if (self.filled_at is None and status in ("PARTIALLY_FILLED", "FILLED")
+                and self.state in (OrderState.NEW, OrderState.PARTIAL)):
+            self.filled_at = time.time()
+            observe_stage("fill_wait", self.filled_at - self.created_at, cid=self.context.get("cid"))
+        if status == "PARTIALLY_FILLED":
+            if self.state == OrderState.NEW:
+                self._to(OrderState.PARTIAL)
+                update_trade_status(self.order_id, "PARTIALLY_FILLED")
+                self._notify_fill(status)
+            if self.state == OrderState.PARTIAL:
+                await self._attach_exits(status)
+        elif status == "FILLED":
+            self.fully_filled = True
+            if self.state in (OrderState.NEW, OrderState.PARTIAL):
+                self._to(OrderState.FILLED)
+                update_trade_status(self.order_id, "FILLED")
+                if self.order_type != "MARKET":
+                    self._notify_fill(status)
+            if self.state == OrderState.FILLED:
+                await self._attach_exits(status)
+            if self.state == OrderState.EXITS_ATTACHED:
+                print(f"   [Tracker] 訂單 {self.order_id} 已完全成交。")
+                if self.order_type != "MARKET":
+                    notify_user(text=(f"✅ 監控：開倉單已完全成交\n"
+                                      f"• 標的: {self.symbol}\n"
+                                      + self._account_line()
+                                      + f"• OrderID: {self.order_id}"))
+                self._close("filled")
+        elif status in _TERMINAL_STATUSES:
+            # 包含 GTD 到期（EXPIRED）：沒成交就結案；部分成交則倉位與 SL/TP 仍在，狀態檔保留
+            if self.entry_final:
+                # 已處理過終止狀態，只剩 SL/TP 待補
+                await self._attach_exits(status)
+                return
+            print(f"   [Tracker] 訂單 {self.order_id} 狀態 {status}。")
+            prefix = f"{cause}_" if cause else ""
+            kept = mark_entry_terminal(self.order_id, status, od.get("executedQty"),
+                                       reason=f"{prefix}{status.lower()}" if cause else None)
+            if kept and self.state in (OrderState.NEW, OrderState.PARTIAL, OrderState.FILLED):
+                # 有成交但 SL/TP 還沒掛齊（沒看到部分成交，或上次補掛失敗）：掛齊後才結案，失敗則依退避重試
+                self.entry_final = f"{prefix}remainder_{status.lower()}"
+                if self.state == OrderState.NEW:
+                    self._to(OrderState.PARTIAL)
+                await self._attach_exits(status)
+            else:
+                self._close(f"{prefix}remainder_{status.lower()}" if kept else f"{prefix}{status.lower()}")
+
+    async def expire(self):
+        """
+        逾時：撤掉未成交的部分，再查一次最終成交量，走與交易所終止狀態相同的流程：
+        有成交（含上次查單後才成交的部分）就保留倉位並先補掛 SL/TP 再結案，完全沒成交才移除紀錄。
+        """
+        async with self._lock:
+            if self.closed or self.fully_filled or self.entry_final:
+                return
+            print(f"   [Tracker] 超過期限未完全成交，嘗試撤單 {self.order_id} ...")
+            ok = await self.run_in_account('order', _cancel_order_safely, self.symbol, self.order_id)
+            if not ok:
+                notify_user(text=(f"⚠️ 監控：撤單失敗\n"
+                                  f"• 標的: {self.symbol}\n"
+                                  + self._account_line()
+                                  + f"• OrderID: {self.order_id}"))
+                # 撤單失敗多半是剛好成交或已被撤；不再排逾時，交給下一次查單結果決定
+                self.deadline = None
+                return
+            od = await self.run_in_account('market', _query_order, self.symbol, self.order_id)
+            if not od:
+                # 不知道實際成交量就不能判斷是否有倉位；交給監控下一輪查單（訂單已不在 open orders）處理
+                print(f"   [Tracker] 撤單後查單失敗，由下一輪監控確認 {self.order_id} 的成交量。")
+                self.deadline = None
+                return
+            final = dict(od)
+            if str(final.get("status", "")).upper() not in ("FILLED",) + _TERMINAL_STATUSES:
+                final["status"] = "CANCELED"
+            await self._apply_update(final, cause="timeout")
+            if str(final["status"]).upper() == "FILLED":
+                return
+            notify_user(text=(f"🕒 監控：超過期限未完全成交，已撤單\n"
+                              f"• 標的: {self.symbol}\n"
+                              + self._account_line()
+                              + f"• OrderID: {self.order_id}"))
+
+    # ---- 內部 ----
+    async def _attach_exits(self, status):
+        """補掛還沒掛上的 SL / TP（只送缺的那一邊）；失敗時依退避排下次重試，達上限就放棄。"""
+        if time.time() < self.next_attach_at:
+            return
+        need_sl = self.sl_id is None
+        need_tp = self.tp_id is None and not self.tp_skipped and self.tp_price is not None
+        with stage("attach_exits", cid=self.context.get("cid")):
+            sl_id, tp_id, tp_skipped = await self.run_in_account(
+                'order', attach_exits_for_fill,
+                self.symbol, self.position_side,
+                self.sl_price if need_sl else None, self.tp_price if need_tp else None, self.order_id,
+            )
+        self.sl_id = self.sl_id if sl_id is None else sl_id
+        self.tp_id = self.tp_id if tp_id is None else tp_id
+        self.tp_skipped = self.tp_skipped or tp_skipped
+        missing = self._missing_exits()
+        if missing:
+            self.attach_failures += 1
+            if self.attach_failures >= EXIT_ATTACH_MAX_ATTEMPTS:
+                await self._give_up_exits()
+                return
+            delay = min(EXIT_ATTACH_RETRY_MAX_SEC, EXIT_ATTACH_RETRY_BASE_SEC * 2 ** (self.attach_failures - 1))
+            self.next_attach_at = time.time() + delay
+            print(f"   [Tracker] 補掛 {missing} 失敗（第 {self.attach_failures} 次），{delay}s 後重試（{self.symbol}/{self.order_id}）。")
+            return
+        sl_id, tp_id, tp_skipped = self.sl_id, self.tp_id, self.tp_skipped
+        self._to(OrderState.EXITS_ATTACHED)
+        if tp_skipped:
+            text = (f"[warning] 價格過近，僅掛 SL 以避免即刻觸發 TP\n"
+                    f"• 標的: {self.symbol}\n"
+                    + self._account_line() +
+                    f"• 方向: {self.context.get('action', '')} ({self.position_side})\n"
+                    f"• SL: {self.sl_price} (ID: {sl_id})")
+        else:
+            text = (f"📎 已掛上風控單 (SL/TP)\n"
+                    f"• 標的: {self.symbol}\n"
+                    + self._account_line() +
+                    f"• 方向: {self.context.get('action', '')} ({self.position_side})\n"
+                    f"• 狀態: {status}\n"
+                    f"• SL: {self.sl_price} (ID: {sl_id})\n"
+                    f"• TP: {self.tp_price} (ID: {tp_id})\n"
+                    f"• OrderID: {self.order_id}\n"
+                    f"• 來源訊號: {self.context.get('signal_text', '')}")
+        notify_user(text=text)
+        if self.entry_final:
+            self._close(self.entry_final)
+
+    async def _give_up_exits(self):
+        """補掛 SL/TP 達重試上限：撤掉仍可能成交的剩餘開倉單（不再擴大沒有保護的倉位），推播提醒後結束追蹤。"""
+        missing = self._missing_exits()
+        if self.state == OrderState.PARTIAL and not self.entry_final:
+            if await self.run_in_account('order', _cancel_order_safely, self.symbol, self.order_id):
+                mark_entry_terminal(self.order_id, "CANCELED", reason="exits_failed")
+        print(f"   [Tracker] 補掛 {missing} 已失敗 {self.attach_failures} 次，停止重試（{self.symbol}/{self.order_id}）。")
+        notify_user(text=(f"🚨 監控：SL/TP 補掛失敗 {self.attach_failures} 次，已停止重試，請手動處理\n"
+                          f"• 標的: {self.symbol}\n"
+                          + self._account_line()
+                          + f"• 方向: {self.context.get('action', '')} ({self.position_side})\n"
+                          f"• 缺少: {missing}\n"
+                          f"• SL: {self.sl_price} / TP: {self.tp_price}\n"
+                          f"• OrderID: {self.order_id}"))
+        self._close("exits_failed")
+
+    def _missing_exits(self):
+        """還沒掛上的出場單，例如 "SL / TP"；都掛齊（或 TP 已略過）時回傳空字串。"""
+        missing = ["SL"] if self.sl_id is None else []
+        if self.tp_id is None and not self.tp_skipped and self.tp_price is not None:
+            missing.append("TP")
+        return " / ".join(missing)
+
+    def _account_line(self):
+        return f"• 帳戶: {self.account}\n" if self.account else ""
+
+    def _notify_fill(self, status):
+        notify_user(text=(f"✅ 開倉單成交狀態: {status}\n"
+                          f"• 標的: {self.symbol}\n"
+                          + self._account_line() +
+                          f"• 方向: {self.context.get('action', '')} ({self.position_side})\n"
+                          f"• 決策訊號: {self.context.get('decision_signal', 'N/A')}\n"
+                          f"• 將掛 SL/TP: SL {self.sl_price} / TP {self.tp_price}\n"
+                          f"• OrderID: {self.order_id}\n"
+                          + self.context.get('leverage_note', '')
+                          + f"• 來源訊號: {self.context.get('signal_text', '')}"))
+
+# === [timer] 階層式時間輪（逾時撤單期限） ===
+class TimerWheel:
+    """
+    三層時間輪：第 0 層每格 tick 秒、第 1 層每格 tick*slots 秒、第 2 層每格 tick*slots² 秒，
+    超出範圍的放在 overflow。schedule / cancel 為 O(1)；advance 只處理走過的格子，
+    較遠的期限在上層格子到期時才往下層重新分配（cascade），成本與到期筆數成正比而非與總筆數成正比。
+    中間沒有任何期限的空檔（含閒置很久之後）直接跳過，不逐格推進。
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=3, now=None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self._overflow = set()
+        self._deadlines = {}          # key → deadline（epoch 秒）
+        self._where = {}              # key → 所在的 set（cancel 用）
+        self._cursor = int((now if now is not None else time.time()) // tick)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def _place(self, key, deadline, earliest):
+        # 以無條件進位決定格子：到期只會晚（最多一格），不會提早
+        target = max(int(-(-deadline // self.tick)), earliest)
+        delta = target - self._cursor
+        bucket = self._overflow
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots:
+                bucket = self._wheels[level][(target // span) % self.slots]
+                break
+            span *= self.slots
+        bucket.add(key)
+        self._where[key] = bucket
+
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        self._deadlines[key] = deadline
+        # 目前格子已處理過，最早只能排到下一格
+        self._place(key, deadline, self._cursor + 1)
+
+    def cancel(self, key):
+        bucket = self._where.pop(key, None)
+        if bucket is not None:
+            bucket.discard(key)
+        self._deadlines.pop(key, None)
+
+    def advance(self, now=None):
+        """把時間輪推進到 now，回傳已到期的 key 清單。"""
+        now = time.time() if now is None else now
+        target = int(now // self.tick)
+        expired = []
+        while self._cursor < target:
+            if not self._deadlines:
+                # 沒有待到期的項目（例如監控閒置期間）：游標直接對齊，不逐格空轉
+                self._cursor = target
+                break
+            due = min(int(-(-d // self.tick)) for d in self._deadlines.values())
+            if due > self._cursor + 1:
+                # 到最早的期限之前都沒有東西要處理：直接跳到它的前一格，所有項目依新游標重新分配
+                self._cursor = min(target, due - 1)
+                self._replace_all()
+                continue
+            self._cursor += 1
+            # 上層格子在下層轉完一圈時往下重新分配；由高層往低層做，剛放進下層的項目本步就能處理
+            spans = []
+            span = 1
+            for level in range(1, self.levels):
+                span *= self.slots
+                if self._cursor % span:
+                    break
+                spans.append((level, span))
+            else:
+                if self._cursor % (span * self.slots) == 0:
+                    self._cascade(self._overflow)
+            for level, span in reversed(spans):
+                self._cascade(self._wheels[level][(self._cursor // span) % self.slots])
+            bucket = self._wheels[0][self._cursor % self.slots]
+            for key in list(bucket):
+                if self._deadlines[key] <= self._cursor * self.tick:
+                    expired.append(key)
+                    bucket.discard(key)
+                    self._where.pop(key, None)
+                    self._deadlines.pop(key, None)
+        return expired
+
+    def _replace_all(self):
+        for key, bucket in list(self._where.items()):
+            bucket.discard(key)
+            self._place(key, self._deadlines[key], self._cursor + 1)
+
+    def _cascade(self, bucket):
+        for key in list(bucket):
+            bucket.discard(key)
+            self._place(key, self._deadlines[key], self._cursor)
+
+_timers = TimerWheel()
+
+# === [monitor] 單一多工監控 ===
+class OrderMonitor:
+    """
+    取代「每張開倉單一個輪詢協程」：每輪依 symbol 取一次 open orders（symbol 多時改為一次取全部），
+    與註冊表中的開倉單比對：
+      • 仍掛著 → 以 open orders 裡的狀態（NEW / PARTIALLY_FILLED）餵入狀態機
+      • 不見了 → 才對該單個別查一次最終狀態（FILLED / CANCELED / EXPIRED …）
+    逾時撤單期限放在 TimerWheel。每輪 REST 次數 ≈ 涉及的 symbol 數 + 狀態有變化的單數。
+    剛下單的前 INITIAL_FILL_WAIT_SECONDS 秒內，只針對那些 symbol 以 INITIAL_POLL_INTERVAL 快速輪詢。
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._wake = asyncio.Event()
+        self._task = None
+        self._last_full = 0.0
+        self.stats = {"ticks": 0, "open_order_calls": 0, "query_calls": 0, "expired": 0}
+
+    def ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+        self._wake.set()
+
+    async def _run(self):
+        while _monitoring_orders:
+            now = time.time()
+            young = any(now - t.created_at < INITIAL_FILL_WAIT_SECONDS
+                        for t in _monitoring_orders.values() if t.order_type != "MARKET")
+            # 逾時期限在每輪 tick 檢查，精度為一個輪詢間隔
+            timeout = INITIAL_POLL_INTERVAL if young else ORDER_MONITOR_INTERVAL
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"   [Monitor] 本輪監控發生錯誤：{e}")
+
+    async def tick(self, now=None):
+        now = time.time() if now is None else now
+        self.stats["ticks"] += 1
+        trackers = [t for t in list(_monitoring_orders.values()) if not t.closed]
+
+        # 1) 已有成交但 SL/TP 尚未掛上（例如上次掛單失敗）→ 重送成交事件觸發重試，不需查單。
+        #    PARTIAL 一定有成交量；交易所狀態若一直停在 PARTIALLY_FILLED，步驟 2 不會再送事件，要在這裡重試
+        #    失敗後依退避時間重試，只補缺的那一邊；達上限會停止並結束追蹤
+        retry = {OrderState.FILLED: "FILLED", OrderState.PARTIAL: "PARTIALLY_FILLED"}
+        updates = [t.on_order_update({"status": retry[t.state]}) for t in trackers if t.attach_due(now)]
+
+        # 2) 掛單中的開倉單依（帳戶, symbol）分組；快速輪詢期只查有新單的 symbol，慢速期查全部
+        full = now - self._last_full >= ORDER_MONITOR_INTERVAL
+        by_symbol = {}
+        for t in trackers:
+            if t.order_type == "MARKET" or t.fully_filled or t.entry_final or t.closed:
+                continue
+            if full or now - t.created_at < INITIAL_FILL_WAIT_SECONDS:
+                by_symbol.setdefault((t.account, t.symbol), []).append(t)
+        if full:
+            self._last_full = now
+        if by_symbol:
+            by_account = {}
+            for account, symbol in by_symbol:
+                by_account.setdefault(account, []).append(symbol)
+            fetched = await asyncio.gather(*(self._fetch_open_orders(symbols, account)
+                                             for account, symbols in by_account.items()))
+            open_by_id = {(account, symbol): orders
+                          for account, res in zip(by_account, fetched) for symbol, orders in res.items()}
+            gone = []
+            for key, group in by_symbol.items():
+                live = open_by_id.get(key)
+                if live is None:
+                    continue       # 這個 symbol 本輪取得失敗，下輪再試
+                for t in group:
+                    od = live.get(t.order_id)
+                    if od is None:
+                        gone.append(t)
+                    elif str(od.get("status", "")).upper() != t.last_status:
+                        t.last_status = str(od.get("status", "")).upper()
+                        updates.append(t.on_order_update(od))
+            # 不在 open orders：已成交或已終止 → 個別查一次最終狀態
+            if gone:
+                self.stats["query_calls"] += len(gone)
+                results = await asyncio.gather(
+                    *(t.run_in_account('market', _query_order, t.symbol, t.order_id) for t in gone),
+                    return_exceptions=True,
+                )
+                for t, od in zip(gone, results):
+                    if isinstance(od, dict) and od:
+                        t.last_status = str(od.get("status", "")).upper()
+                        updates.append(t.on_order_update(od))
+        # 各開倉單的狀態機各自有鎖，可同時推進（補掛 SL/TP 會並行送出）
+        for res in await asyncio.gather(*updates, return_exceptions=True):
+            if isinstance(res, Exception):
+                print(f"   [Monitor] 狀態更新失敗：{res}")
+
+        # 3) 逾時撤單
+        for key in _timers.advance(now):
+            t = _monitoring_orders.get(key)
+            if t is not None and not t.closed:
+                self.stats["expired"] += 1
+                await t.expire()
+
+    async def _fetch_open_orders(self, symbols, account=None):
+        """回傳 account 帳戶的 {symbol: {orderId: order}}；取得失敗的 symbol 不會出現在結果中。"""
+        with use_account(account):
+            return await self._fetch_account_open_orders(symbols)
+
+    async def _fetch_account_open_orders(self, symbols):
+        out = {}
+        if len(symbols) > ORDER_MONITOR_ALL_OPEN_THRESHOLD:
+            try:
+                self.stats["open_order_calls"] += 1
+                ods = await run_in_pool('market', _fapi_signed_get, '/fapi/v1/openOrders', {'recvWindow': 5000})
+                if isinstance(ods, list):
+                    out = {s: {} for s in symbols}
+                    for od in ods:
+                        if od.get("symbol") in out:
+                            out[od["symbol"]][int(od.get("orderId"))] = od
+                    return out
+            except Exception as e:
+                print(f"   [Monitor] 一次取全部 open orders 失敗，改為逐 symbol：{e}")
+        for symbol in symbols:
+            try:
+                self.stats["open_order_calls"] += 1
+                ods = await run_in_pool('market', _sdk_get_open_orders, symbol)
+                out[symbol] = {int(od.get("orderId")): od for od in (ods or [])}
+            except Exception as e:
+                print(f"   [Monitor] 取 {symbol} open orders 失敗：{e}")
+        return out
+
+_monitor = None
+
+def get_monitor(loop=None):
+    global _monitor
+    loop = loop or asyncio.get_running_loop()
+    if _monitor is None or _monitor.loop is not loop:
+        _monitor = OrderMonitor(loop)
+    return _monitor
+
+def track_order(symbol, order_id, position_side, sl_price, tp_price, order_type="LIMIT",
+                initial_status=None, exits_attached=False, timeout_seconds=AUTO_CANCEL_SECONDS,
+                exchange_expiry=False, context=None, account=None):
+    """
+    在事件迴圈中建立（或取回既有的）OrderTracker 並開始驅動。必須在事件迴圈執行緒呼叫；
+    其他執行緒請用 loop.call_soon_threadsafe(...)。
+    initial_status：下單回應中的狀態（例如 MARKET 單的 FILLED），會立刻餵入狀態機。
+    exits_attached：重啟恢復時，狀態檔顯示 SL/TP 已掛 → 直接從 EXITS_ATTACHED 開始，不重複掛單。
+    exchange_expiry：開倉單以 GTD 下單，到期由幣安撤單（監控會看到 EXPIRED）；此時不排程式端計時，
+                     程式端計時只作為不能用 GTD 的 symbol 的備援。
+    account：下單的幣安帳戶名稱（None = 主帳戶）。
+    """
+    key = (symbol, int(order_id))
+    tracker = _monitoring_orders.get(key)
+    if tracker is not None:
+        return tracker
+    loop = asyncio.get_running_loop()
+    tracker = OrderTracker(symbol, order_id, position_side, sl_price, tp_price, loop,
+                           order_type=order_type, timeout_seconds=timeout_seconds, context=context,
+                           account=account)
+    if exits_attached:
+        tracker.state = OrderState.EXITS_ATTACHED
+    _monitoring_orders[key] = tracker
+    if initial_status:
+        loop.create_task(tracker.on_order_update({"status": initial_status}))
+    if order_type != "MARKET":
+        if exchange_expiry:
+            tracker.deadline = None
+            print(f"   [Tracker] 開始追蹤 {symbol} 訂單 {order_id}（GTD，{timeout_seconds:.0f}s 後由交易所到期撤單）。")
+        else:
+            if tracker.deadline is not None:
+                _timers.schedule(key, tracker.deadline)
+            print(f"   [Tracker] 開始追蹤 {symbol} 訂單 {order_id}，逾時 {timeout_seconds:.0f}s 未成交將撤單。")
+    get_monitor(loop).ensure_running()
+    return tracker
+
+def get_tracker(symbol, order_id):
+    return _monitoring_orders.get((symbol, int(order_id)))
+
+def dispatch_order_update(event):
+    """
+    user data stream 的 ORDER_TRADE_UPDATE → 對應的 OrderTracker（必須在事件迴圈執行緒呼叫）。
+    推送只是讓狀態機提早前進，輪詢仍照常作為漏訊息時的備援；未追蹤的訂單（SL/TP 等）直接忽略。
+    """
+    if not isinstance(event, dict) or event.get("e") != "ORDER_TRADE_UPDATE":
+        return None
+    o = event.get("o") or {}
+    try:
+        tracker = _monitoring_orders.get((o.get("s"), int(o.get("i"))))
+    except (TypeError, ValueError):
+        return None
+    status = str(o.get("X", "")).upper()
+    if tracker is None or tracker.closed or not status or status == "NEW":
+        return None
+    tracker.last_status = status
+    return tracker.loop.create_task(tracker.on_order_update({"status": status, "executedQty": o.get("z")}))
+
+def tracker_stats():
+    """各狀態的追蹤中訂單數（給 replay / 指令使用）。"""
+    out = {}
+    for t in list(_monitoring_orders.values()):
+        out[t.state.value] = out.get(t.state.value, 0) + 1
+    return out
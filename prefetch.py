@@ -0,0 +1,118 @@
+# prefetch.py
+import time
+import asyncio
+from config import (
+    ENABLE_SPECULATIVE_PREFETCH, PREFETCH_MAX_LEVERAGE,
+    PREFETCH_PRICE_MAX_AGE_SEC, PREFETCH_KLINES_MAX_AGE_SEC,
+    USE_PY_RISK_MANAGER, ATR_PERIOD,
+)
+from binance_api import (
+    guess_symbol_from_text, get_symbol_info,
+    get_binance_market_price, get_binance_klines_raw,
+    get_binance_klines_for_llm, get_symbol_max_leverage,
+    load_symbol_registry, symbol_registry_fresh,
+)
+from scheduler import run_in_pool
+from logs import get_printer
+print = get_printer("prefetch")
+
+# === [prefetch] 訊號投機預取 ===
+# 訊息一到就以正規式猜出 symbol，在 LLM 解析的同時平行抓取：
+#   交易對資訊 / 市價 / K 線 / 槓桿上限
+# LLM 結果出來後，若 symbol 一致就直接沿用（省去整段幣安往返），不一致則整包捨棄。
+# 預取只做唯讀查詢：訊息還沒被確認是訊號，不能動到帳戶設定（change_leverage 留到下單時）。
+
+_registry_refresh = None
+
+async def _refresh_registry():
+    try:
+        await run_in_pool('market', load_symbol_registry)
+    except Exception as e:
+        print(f"[Prefetch] 背景更新 symbol 註冊表失敗：{e}")
+
+def warm_symbol_registry():
+    """
+    註冊表過期（或尚未載入）時在 market 池背景下載，不在事件迴圈上等 exchange_info。
+    回傳進行中的下載 Task（已是最新則回傳 None）；啟動時呼叫可讓第一則訊息就能預取。
+    """
+    global _registry_refresh
+    if symbol_registry_fresh():
+        return None
+    if _registry_refresh is None or _registry_refresh.done():
+        _registry_refresh = asyncio.ensure_future(_refresh_registry())
+    return _registry_refresh
+
+def start_prefetch(loop, text: str):
+    """若能從訊息猜出 symbol，啟動背景預取並回傳 asyncio.Task；否則回傳 None。"""
+    if not ENABLE_SPECULATIVE_PREFETCH:
+        return None
+    warm_symbol_registry()
+    try:
+        # 只用已載入的註冊表猜測；第一次載入完成前的訊息不預取
+        symbol = guess_symbol_from_text(text, refresh=False)
+    except Exception as e:
+        print(f"[Prefetch] 猜測 symbol 失敗，略過預取：{e}")
+        return None
+    if not symbol:
+        return None
+    print(f"[Prefetch] 猜測 symbol = {symbol}，與 LLM 解析平行預取幣安資料 ...")
+    task = asyncio.ensure_future(_run_prefetch(loop, symbol))
+    task.symbol = symbol
+    return task
+
+async def _run_prefetch(loop, symbol: str) -> dict:
+    """平行執行所有幣安查詢；個別失敗只會讓該欄位為 None，不影響其他欄位。"""
+    t0 = time.time()
+    jobs = {
+        "info": run_in_pool('market', get_symbol_info, symbol),
+        "price": run_in_pool('market', get_binance_market_price, symbol),
+        "klines_raw": run_in_pool('market', get_binance_klines_raw, symbol, '5m', max(ATR_PERIOD + 20, 60)),
+    }
+    if not USE_PY_RISK_MANAGER:
+        jobs["klines_llm"] = run_in_pool('market', get_binance_klines_for_llm, symbol)
+    if PREFETCH_MAX_LEVERAGE:
+        jobs["max_leverage"] = run_in_pool('market', get_symbol_max_leverage, symbol)
+
+    results = await asyncio.gather(*jobs.values(), return_exceptions=True)
+    out = {"symbol": symbol, "started_at": t0}
+    for name, res in zip(jobs.keys(), results):
+        if isinstance(res, Exception):
+            print(f"[Prefetch] {symbol} 預取 {name} 失敗：{res}")
+            res = None
+        out[name] = res
+    out["finished_at"] = time.time()
+    print(f"[Prefetch] {symbol} 預取完成，耗時 {out['finished_at'] - t0:.2f}s。")
+    return out
+
+async def take_prefetch(task, symbol):
+    """
+    取得預取結果：symbol 與 LLM 解析不一致時捨棄（回傳 None）。
+    若預取尚未完成則等待它完成（仍比重新發起查詢快）。
+    過期欄位（市價 / K 線）會被移除，交由呼叫端即時重抓。
+    """
+    if task is None:
+        return None
+    guessed = getattr(task, "symbol", None)
+    if not symbol or guessed != symbol:
+        print(f"[Prefetch] LLM 解析的 symbol（{symbol}）與預取（{guessed}）不一致，捨棄預取結果。")
+        task.cancel()
+        return None
+    try:
+        out = await task
+    except Exception as e:
+        print(f"[Prefetch] 預取失敗，改為即時查詢：{e}")
+        return None
+
+    age = time.time() - out.get("finished_at", 0)
+    if age > PREFETCH_PRICE_MAX_AGE_SEC:
+        out["price"] = None
+    if age > PREFETCH_KLINES_MAX_AGE_SEC:
+        out["klines_raw"] = None
+        out["klines_llm"] = None
+    print(f"[Prefetch] 沿用 {symbol} 預取結果（距完成 {age:.1f}s）。")
+    return out
+
+def discard_prefetch(task):
+    """非交易訊號等情況下丟棄尚未取用的預取任務。"""
+    if task is not None and not task.done():
+        task.cancel()
@@ -0,0 +1,299 @@
+# profiler.py
+"""
+線上診斷：不必重啟 systemd 服務，從 Telegram 指令開關 profiler、看記憶體與佇列。
+
+  /profile [N | Ts] [cprofile]   對接下來 N 則交易訊號（或 T 秒）做 profiling；預設 PROFILE_DEFAULT_SIGNALS 則
+  /profile stop                  提早結束並輸出結果
+  /mem [N]                       tracemalloc 前 N 名（第一次呼叫只會開始追蹤）；/mem stop 關閉追蹤
+  /stats                         快取 / 佇列 / 執行緒池 / 事件迴圈 / 日誌統計
+
+  • 預設是取樣式 profiler：背景執行緒每 PROFILE_SAMPLE_INTERVAL_SEC 秒擷取所有執行緒的堆疊（牆鐘時間，
+    含等 REST / LLM 的時間，略過閒置中的執行緒），開銷固定、與呼叫次數無關。
+  • cprofile 模式用 cProfile 精確計數，但只涵蓋事件迴圈執行緒（執行緒池裡的工作要用取樣模式看）。
+完整報告寫到 PROFILE_DIR，聊天只回摘要。
+"""
+import os
+import sys
+import time
+import pstats
+import asyncio
+import cProfile
+import threading
+import tracemalloc
+from io import StringIO
+from collections import Counter
+from config import (
+    PROFILE_DIR, PROFILE_DEFAULT_SIGNALS, PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL_SEC,
+    PROFILE_TOP_N, TRACEMALLOC_FRAMES,
+)
+from scheduler import run_in_pool, format_pool_stats
+from metrics import collect
+from logs import get_printer
+print = get_printer("profiler")
+
+# 葉節點落在這些函式 = 該執行緒閒置（等事件、等工作、等佇列），不計入取樣
+_IDLE_LEAVES = {
+    ("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get"),
+    ("thread.py", "_worker"), ("socketserver.py", "serve_forever"), ("profiler.py", "_sample_loop"),
+}
+# cProfile：事件迴圈閒置時停在這些內建方法
+_IDLE_BUILTINS = ("<method 'poll' of 'select.", "<method 'select' of 'select.", "<method 'control' of 'select.")
+
+def _report_path(kind):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+
+def _frame_key(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+# === [profile] 取樣式 / cProfile ===
+class _Session:
+    def __init__(self, mode, signals=None, seconds=None, on_done=None):
+        self.mode = mode
+        self.signals_left = signals
+        self.seconds = seconds
+        self.on_done = on_done
+        self.started = time.time()
+        self.signals_seen = 0
+        self.samples = 0
+        self.self_counts = Counter()      # 葉節點函式 → 次數
+        self.total_counts = Counter()     # 堆疊中出現過的函式 → 次數（每個樣本每個函式只算一次）
+        self.stacks = Counter()           # folded stack → 次數（可直接丟給 flamegraph.pl / speedscope）
+        self.threads = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._cprofile = None
+        self._timer = None
+
+    def start(self, loop):
+        if self.mode == "cprofile":
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self._thread = threading.Thread(target=self._sample_loop, name="chao_bi_profiler", daemon=True)
+            self._thread.start()
+        limit = min(self.seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self._timer = loop.call_later(limit, lambda: asyncio.ensure_future(stop_profile("時間到")))
+
+    def stop(self):
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL_SEC):
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                chain = []
+                while frame is not None:
+                    chain.append(_frame_key(frame.f_code))
+                    frame = frame.f_back
+                self.samples += 1
+                self.self_counts[chain[0]] += 1
+                self.total_counts.update(set(chain))
+                self.stacks[";".join(reversed(chain))] += 1
+                self.threads[names.get(tid, str(tid))] += 1
+
+    def write_report(self):
+        """寫完整報告（在 maint 池執行），回傳 (檔案路徑, 聊天摘要)。"""
+        elapsed = time.time() - self.started
+        head = (f"🔬 profile（{'cProfile，事件迴圈執行緒' if self.mode == 'cprofile' else '取樣'}）"
+                f"{elapsed:.1f}s，訊號 {self.signals_seen} 則")
+        if self.mode == "cprofile":
+            path = _report_path("profile")
+            self._cprofile.dump_stats(path.replace(".txt", ".pstats"))
+            buf = StringIO()
+            pstats.Stats(self._cprofile, stream=buf).sort_stats("cumulative").print_stats(60)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(head + "\n\n" + buf.getvalue())
+            top = pstats.Stats(self._cprofile).sort_stats("tottime")
+            rows = sorted(((k, st) for k, st in top.stats.items() if not k[2].startswith(_IDLE_BUILTINS)),
+                          key=lambda kv: kv[1][2], reverse=True)[:PROFILE_TOP_N]
+            lines = [f"• {os.path.basename(fn)}:{ln}({name}) 自身 {st[2] * 1000:.0f}ms / 累計 {st[3] * 1000:.0f}ms"
+                     for (fn, ln, name), st in rows]
+            return path, "\n".join([head] + lines + [f"完整報告：{path}"])
+
+        path = _report_path("profile")
+        n = max(self.samples, 1)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"{head}，樣本 {self.samples}（每 {PROFILE_SAMPLE_INTERVAL_SEC * 1000:.0f}ms）\n\n")
+            f.write("== 依執行緒 ==\n")
+            f.writelines(f"{c:>8} {c / n * 100:6.1f}%  {name}\n" for name, c in self.threads.most_common())
+            f.write("\n== 自身（葉節點）==\n")
+            f.writelines(f"{c:>8} {c / n * 100:6.1f}%  {k}\n" for k, c in self.self_counts.most_common(60))
+            f.write("\n== 累計（在堆疊中）==\n")
+            f.writelines(f"{c:>8} {c / n * 100:6.1f}%  {k}\n" for k, c in self.total_counts.most_common(60))
+        with open(path.replace(".txt", ".folded"), "w", encoding="utf-8") as f:
+            f.writelines(f"{stack} {c}\n" for stack, c in self.stacks.most_common())
+        lines = [f"• {c / n * 100:5.1f}%  {k}" for k, c in self.self_counts.most_common(PROFILE_TOP_N)]
+        return path, "\n".join([f"{head}，樣本 {self.samples}", "自身時間前幾名："] + lines + [f"完整報告：{path}"])
+
+_session = None
+
+def start_profile(mode="sample", signals=None, seconds=None, on_done=None):
+    """開始 profiling（事件迴圈執行緒呼叫）；signals 與 seconds 都沒給時預設 PROFILE_DEFAULT_SIGNALS 則。"""
+    global _session
+    if _session is not None:
+        return None
+    if signals is None and seconds is None:
+        signals = PROFILE_DEFAULT_SIGNALS
+    _session = _Session(mode, signals, seconds, on_done)
+    _session.start(asyncio.get_running_loop())
+    print(f"[info] profiler 已啟動（{mode}，{f'{signals} 則訊號' if signals else f'{seconds:g} 秒'}）。")
+    return _session
+
+async def stop_profile(reason="手動停止"):
+    """停止目前的 profiling，把報告寫檔並交給 on_done（沒有進行中的 session 時回傳 None）。"""
+    global _session
+    session, _session = _session, None
+    if session is None:
+        return None
+    session.stop()
+    try:
+        path, summary = await run_in_pool('maint', session.write_report)
+    except Exception as e:
+        summary = f"[warning] profile 報告輸出失敗：{e}"
+    else:
+        print(f"[info] profiler 結束（{reason}），報告：{path}")
+    summary = f"{summary}\n（{reason}）"
+    if session.on_done is not None:
+        session.on_done(summary)
+    return summary
+
+def note_signal():
+    """每處理完一則交易訊號呼叫一次；達到指定則數就結束 profiling。"""
+    session = _session
+    if session is None:
+        return
+    session.signals_seen += 1
+    if session.signals_left is not None and session.signals_seen >= session.signals_left:
+        asyncio.ensure_future(stop_profile(f"已處理 {session.signals_seen} 則訊號"))
+
+def profile_status():
+    if _session is None:
+        return "profiler 未啟動。"
+    return (f"profiler 進行中（{_session.mode}）：{time.time() - _session.started:.0f}s，"
+            f"訊號 {_session.signals_seen}/{_session.signals_left or '-'}，樣本 {_session.samples}")
+
+# === [mem] tracemalloc 快照 ===
+_last_snapshot = None
+
+def _mem_report(top_n):
+    global _last_snapshot
+    snap = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    stats = snap.statistics("lineno")
+    diff = snap.compare_to(_last_snapshot, "lineno") if _last_snapshot is not None else []
+    _last_snapshot = snap
+    current, peak = tracemalloc.get_traced_memory()
+    head = f"🧠 tracemalloc：目前 {current / 1e6:.1f}MB，峰值 {peak / 1e6:.1f}MB，{len(stats)} 個配置位置"
+    path = _report_path("mem")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(head + "\n\n== 前 100 名（依大小）==\n")
+        f.writelines(f"{s}\n" for s in stats[:100])
+        if diff:
+            f.write("\n== 與上次快照相比（依增加量）==\n")
+            f.writelines(f"{d}\n" for d in diff[:100])
+    lines = [f"• {s.size / 1024:8.0f}KB ×{s.count:<6} {os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}"
+             for s in stats[:top_n]]
+    if diff:
+        lines.append("與上次相比增加最多：")
+        lines += [f"• +{d.size_diff / 1024:.0f}KB {os.path.basename(d.traceback[0].filename)}:{d.traceback[0].lineno}"
+                  for d in diff[:3] if d.size_diff > 0]
+    return "\n".join([head] + lines + [f"完整報告：{path}"])
+
+async def memory_snapshot(top_n=PROFILE_TOP_N):
+    """第一次呼叫開始 tracemalloc（之後的配置才看得到）；之後每次回傳前 N 名與相對上次的增量。"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        return "🧠 已開始 tracemalloc 追蹤（會增加記憶體與 CPU 開銷）；稍後再 /mem 查看，/mem stop 關閉。"
+    return await run_in_pool('maint', _mem_report, top_n)
+
+def stop_memory_trace():
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return "tracemalloc 未啟動。"
+    tracemalloc.stop()
+    _last_snapshot = None
+    return "🧠 已關閉 tracemalloc 追蹤。"
+
+# === [stats] 快取 / 佇列統計 ===
+def format_runtime_stats():
+    """/stats：metrics collector 的 gauge（佇列、快取、追蹤中訂單）＋ 執行緒池 ＋ 事件迴圈 ＋ 日誌。"""
+    lines = ["📊 執行期統計"]
+    for name, mtype, help, samples in collect():
+        if mtype is None:
+            lines.append(f"• {name}: 讀取失敗（{help}）")
+            continue
+        if not samples:
+            continue
+        short = name.replace("chao_bi_", "")
+        if len(samples) == 1 and not samples[0][0]:
+            value = samples[0][1]
+            lines.append(f"• {short}: {value:.1f}" if isinstance(value, float) else f"• {short}: {value}")
+        else:
+            parts = ", ".join(f"{'/'.join(map(str, labels.values()))}={v:.1f}" if isinstance(v, float)
+                              else f"{'/'.join(map(str, labels.values()))}={v}" for labels, v in samples)
+            lines.append(f"• {short}: {parts}")
+    lines.append(format_pool_stats())
+    mods = sys.modules
+    if "loop_monitor" in mods and mods["loop_monitor"].get_loop_monitor() is not None:
+        lines.append(mods["loop_monitor"].get_loop_monitor().format_summary())
+    if "logs" in mods:
+        ls = mods["logs"].log_stats
+        lines.append(f"• 日誌: 佇列 {mods['logs']._queue.qsize()}，丟棄 {ls['dropped']}，抽樣略過 {ls['sampled_out']}")
+    lines.append(profile_status())
+    return "\n".join(lines)
+
+# === [command] Telegram 指令解析 ===
+async def handle_admin_command(cmd, args, reply):
+    """
+    處理 /profile、/mem、/stats（只給自己的帳號用，權限由呼叫端檢查）。
+    reply(text) 為 coroutine function；profiling 結束時的摘要也會透過它回到同一個聊天。
+    """
+    if cmd == "/stats":
+        await reply(format_runtime_stats())
+        return
+    if cmd == "/mem":
+        if args[:1] == ["stop"]:
+            await reply(stop_memory_trace())
+            return
+        top_n = int(args[0]) if args and args[0].isdigit() else PROFILE_TOP_N
+        await reply(await memory_snapshot(top_n))
+        return
+    # /profile
+    if args[:1] == ["stop"]:
+        if await stop_profile() is None:
+            await reply("profiler 未啟動。")
+        return
+    if args[:1] == ["status"]:
+        await reply(profile_status())
+        return
+    mode = "cprofile" if "cprofile" in args else "sample"
+    signals = seconds = None
+    for a in args:
+        if a.endswith("s") and a[:-1].replace(".", "", 1).isdigit():
+            seconds = float(a[:-1])
+        elif a.isdigit():
+            signals = int(a)
+    loop = asyncio.get_running_loop()
+    on_done = lambda text: loop.create_task(reply(text))
+    if start_profile(mode, signals, seconds, on_done) is None:
+        await reply(f"⚠️ 已有進行中的 profiling。{profile_status()}（/profile stop 結束）")
+        return
+    scope = f"{seconds:g} 秒" if seconds else f"接下來 {signals or PROFILE_DEFAULT_SIGNALS} 則訊號"
+    await reply(f"🔬 profiler 已啟動（{mode}），{scope}，最長 {PROFILE_MAX_SECONDS} 秒；/profile stop 可提早結束。")
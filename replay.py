@@ -0,0 +1,500 @@
+# replay.py
+"""
+Telegram 歷史訊息 replay 與壓測工具（dry-run，不會真的下單或推播）。
+
+用法：
+  匯出歷史訊息（需先完成 login_once.py 登入）：
+    python replay.py export --chat -1001234567890 --chat @some_channel --limit 500 --out replay_messages.jsonl
+  以 1x / 加速 / 最快速度 replay：
+    python replay.py run --file replay_messages.jsonl --speed 10
+  合成突發流量（每秒 20 則，共 200 則）：
+    python replay.py run --synthetic 200 --rate 20
+
+replay 時幣安改用 mock_binance.MockUMFutures、LLM 改用本地規則解析（可用 --real-llm 保留 Ollama），
+狀態檔寫入暫存目錄；最後輸出吞吐量、各階段延遲、併發堆積與被丟棄的訊號。
+"""
+import re
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# replay 中目前處理的訊息 id（透過 _ContextExecutor 帶進 executor 執行緒）
+_current_msg = contextvars.ContextVar("replay_msg", default=None)
+
+class _ContextExecutor(ThreadPoolExecutor):
+    """run_in_executor 預設不傳遞 contextvars；replay 需要它把各階段計時對應回訊息。"""
+
+    def submit(self, fn, *args, **kwargs):
+        ctx = contextvars.copy_context()
+        return super().submit(ctx.run, fn, *args, **kwargs)
+
+# ---------------------------------------------------------------------------
+# 匯出
+# ---------------------------------------------------------------------------
+async def export_history(chats, limit, out_path):
+    from app import get_telegram_client
+    client = get_telegram_client()
+    if client is None:
+        print("[error] Telethon 客戶端未初始化。請檢查您的 'telegram.txt'。")
+        return
+    await client.start()
+    count = 0
+    with open(out_path, "w", encoding="utf-8") as f:
+        for chat in chats:
+            target = int(chat) if re.fullmatch(r"-?\d+", chat) else chat
+            entity = await client.get_entity(target)
+            title = getattr(entity, "title", getattr(entity, "username", str(chat)))
+            rows = []
+            async for m in client.iter_messages(entity, limit=limit):
+                if not m.message:
+                    continue
+                rows.append({
+                    "chat_id": m.chat_id,
+                    "chat_title": title,
+                    "message_id": m.id,
+                    "date": m.date.timestamp(),
+                    "text": m.message,
+                    "out": bool(m.out),
+                    "sender_id": m.sender_id,
+                    "via_bot_id": getattr(m, "via_bot_id", None),
+                })
+            # iter_messages 由新到舊，寫檔時改為由舊到新
+            for r in reversed(rows):
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            count += len(rows)
+            print(f"[info] 已匯出 {title} 共 {len(rows)} 則訊息。")
+    await client.disconnect()
+    print(f"[info] 匯出完成：{count} 則 → {out_path}")
+
+def load_messages(path):
+    with open(path, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    rows.sort(key=lambda r: r.get("date", 0))
+    return rows
+
+def synthetic_messages(n, rate, symbols, seed=None):
+    """合成訊息：約 60% 為交易訊號，其餘為喊單廣告 / 閒聊。"""
+    rng = random.Random(seed)
+    noise = ["#BTC 104000空单目前浮盈1100点🌟", "已翻倉！速減倉", "週末不打烊，日內行情繼續進行", "#PHA 猛拉起飛中"]
+    t0 = time.time()
+    rows = []
+    for i in range(n):
+        if rng.random() < 0.6:
+            base = rng.choice(symbols)
+            side = rng.choice(["多", "空"])
+            text = f"#{base} {side}" if rng.random() < 0.3 else f"#{base} {side}\n進場：市價\n止損：無"
+        else:
+            text = rng.choice(noise)
+        rows.append({"chat_id": -1000 - (i % 5), "chat_title": f"synthetic-{i % 5}", "message_id": i + 1,
+                     "date": t0 + i / max(rate, 1e-9), "text": text, "out": False, "sender_id": 42, "via_bot_id": None})
+    return rows
+
+# ---------------------------------------------------------------------------
+# 本地替身
+# ---------------------------------------------------------------------------
+class _Msg:
+    def __init__(self, row):
+        self.message = row["text"]
+        self.id = row.get("message_id")
+        self.out = bool(row.get("out"))
+        self.via_bot_id = row.get("via_bot_id")
+        self.sender_id = row.get("sender_id")
+        self.from_id = None
+
+class ReplayEvent:
+    """模擬 Telethon NewMessage.Event 中 handler 會用到的欄位。"""
+
+    def __init__(self, row):
+        self.message = _Msg(row)
+        self.chat_id = row.get("chat_id")
+        self.chat = type("Chat", (), {"title": row.get("chat_title"), "id": row.get("chat_id")})()
+        self.sender = type("Sender", (), {"bot": False, "id": row.get("sender_id")})()
+        self.is_private = False
+        self.peer_id = None
+        self.replies = []
+
+    async def get_sender(self):
+        return self.sender
+
+    async def reply(self, text):
+        self.replies.append(text)
+        if self.message.out:
+            # 自己送出的指令（例如 --profile 注入的 /profile）：回覆直接印出
+            print(f"[replay] 指令回覆：\n{text}")
+
+_NUM = r"(\d+(?:\.\d+)?)"
+
+def standin_parse_signal(text, latency=0.0, jitter=0.0):
+    """本地規則版的 LLM 1/2 解析（僅供 replay；行為接近 MASTER_PROMPT_TEMPLATE 的規則）。"""
+    from binance_api import guess_symbol_from_text
+    if latency:
+        time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+    none = {"action": "NONE", "symbol": None, "entry_price": None, "take_profit": None, "stop_loss": None, "leverage": None}
+    if re.search(r"浮盈|獲利|获利|拿下|觸及|触及|翻倉|@", text):
+        return none
+    if re.search(r"空|短|short|sell", text, re.IGNORECASE):
+        action = "SELL"
+    elif re.search(r"多|長|long|buy", text, re.IGNORECASE):
+        action = "BUY"
+    else:
+        return none
+    symbol = guess_symbol_from_text(text)
+    if not symbol:
+        m = re.search(r"#?([A-Za-z]{2,15})", text)
+        symbol = (m.group(1).upper() + "USDT") if m else None
+    entry = None if "市價" in text or "市价" in text else _first(rf"(?:進場|进场|入場|入场)[：: ]*{_NUM}", text)
+    return {
+        "action": action, "symbol": symbol, "entry_price": entry,
+        "take_profit": _first(rf"(?:止盈|TP)[：: \n]*{_NUM}", text),
+        "stop_loss": _first(rf"(?:止損|止损|SL)[：: ]*{_NUM}", text),
+        "leverage": _first(r"(\d+)\s*[xX]", text),
+    }
+
+def _first(pattern, text):
+    m = re.search(pattern, text, re.IGNORECASE)
+    return m.group(1) if m else None
+
+def standin_complete_trade(trade_command, klines_data, latency=0.0):
+    """本地版 LLM 2/2：直接核准，SL/TP 交給 sanitize_targets 矯正。"""
+    if latency:
+        time.sleep(latency)
+    return {"approve": True, "reason": "replay stand-in", "stop_loss": trade_command.get("stop_loss"),
+            "take_profit": trade_command.get("take_profit"), "leverage": trade_command.get("leverage")}
+
+# ---------------------------------------------------------------------------
+# 計時與統計
+# ---------------------------------------------------------------------------
+class ReplayStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_ms = {}        # stage → [ms, ...]
+        self.per_msg = {}         # message_id → {"stages": [...], "parsed": dict|None, "executed": bool}
+        self.inflight = 0
+        self.max_inflight = 0
+        self.max_executor_queue = 0
+        self.handler_ms = []
+        self.trackers_left = {}
+        self.pools = {}
+        self.monitor = {}
+        self.loop_lag = {}
+        self.stalls = []
+        self.sub_accounts = {}    # 子帳戶名稱 → MockUMFutures（--accounts）
+
+    def record(self, stage, ms):
+        msg_id = _current_msg.get()
+        with self.lock:
+            self.stage_ms.setdefault(stage, []).append(ms)
+            if msg_id is not None:
+                self.per_msg.setdefault(msg_id, {"stages": [], "parsed": None, "executed": False})["stages"].append(stage)
+
+    def msg(self, msg_id):
+        with self.lock:
+            return self.per_msg.setdefault(msg_id, {"stages": [], "parsed": None, "executed": False})
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    vs = sorted(values)
+    k = min(len(vs) - 1, max(0, int(round(p / 100 * (len(vs) - 1)))))
+    return vs[k]
+
+def _timed(stats, stage, fn, on_result=None):
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            res = fn(*args, **kwargs)
+        finally:
+            stats.record(stage, (time.perf_counter() - t0) * 1000)
+        if on_result is not None:
+            on_result(res)
+        return res
+    return wrapper
+
+def install_standins(stats, args):
+    """把幣安 / Ollama / 推播 / 狀態檔換成本地替身，並在 chao_bi 的各階段函式外包計時。"""
+    import config
+    tmp_dir = tempfile.mkdtemp(prefix="chao_bi_replay_")
+    # JSON 日誌寫到暫存目錄（必須在任何模組取得 logger 之前設定）
+    import logs
+    logs.LOG_FILE_PATH = os.path.join(tmp_dir, "chao_bi.log.jsonl")
+    import state_store
+    import telegram
+    import chao_bi
+    from mock_binance import MockUMFutures
+
+    state_store.STATE_FILE_PATH = os.path.join(tmp_dir, "chao_bi_state.json")
+    backend = state_store.configure_backend(path=os.path.join(tmp_dir, "chao_bi_state.db")
+                                            if config.STATE_BACKEND == 'sqlite' else state_store.STATE_FILE_PATH)
+    print(f"[replay] 狀態檔（{backend.name}）改寫至 {backend.path}")
+    import trade_journal
+    trade_journal.configure(path=os.path.join(tmp_dir, "chao_bi_journal.db"))
+    import profiler
+    profiler.PROFILE_DIR = tmp_dir
+
+    mock = MockUMFutures(latency=args.binance_latency, fill_after_sec=args.fill_after, seed=args.seed,
+                         latency_jitter=args.binance_jitter, error_rate=args.error_rate,
+                         partial_fill=args.partial_fill)
+    for item in filter(None, (args.inject or "").split(",")):
+        method, code, times = (item.split(":") + ["1"])[:3]
+        mock.inject_error(method.strip(), int(code), times=int(times))
+    from metrics import instrument_client
+    import app
+    app.set_binance_client(instrument_client(mock))
+    app.get_app().available_margin = float(mock.balance)
+    for k in range(1, max(1, args.accounts)):
+        # 多帳戶 fan-out：每個子帳戶一個獨立的 mock（orderId 起點錯開，方便在日誌裡分辨）
+        sub = MockUMFutures(latency=args.binance_latency, fill_after_sec=args.fill_after, seed=args.seed,
+                            latency_jitter=args.binance_jitter, error_rate=args.error_rate,
+                            partial_fill=args.partial_fill)
+        sub._next_id = 1000 + k * 10_000_000
+        app.get_app().add_account(f"sub{k}", instrument_client(sub), available_margin=float(sub.balance))
+        stats.sub_accounts[f"sub{k}"] = sub
+    for item in filter(None, (args.pools or "").split(",")):
+        name, _, size = item.partition("=")
+        config.EXECUTOR_POOL_SIZES[name.strip()] = int(size)
+    if args.fill_wait is not None:
+        import order_tracker
+        order_tracker.INITIAL_FILL_WAIT_SECONDS = args.fill_wait
+
+    sent = []
+    telegram._send_bot_message = lambda text, chat_id: (sent.append(text) or (True, None, False))
+    # 推播一律走上面的替身；給假的 Bot 設定，replay 不必讀取真正的金鑰檔
+    app.set_secret("BOT_TOKEN", "replay")
+    app.set_secret("BOT_CHAT_ID", "0")
+    telegram.NOTIFY_MIN_INTERVAL_SEC = telegram.NOTIFY_GROUP_MIN_INTERVAL_SEC = 0
+
+    def _on_parsed(res):
+        msg_id = _current_msg.get()
+        if msg_id is not None:
+            stats.msg(msg_id)["parsed"] = res
+
+    def _on_executed(_res):
+        msg_id = _current_msg.get()
+        if msg_id is not None:
+            stats.msg(msg_id)["executed"] = True
+
+    if args.real_llm:
+        parse_fn, complete_fn = chao_bi.parse_signal_with_llm, chao_bi.complete_trade_with_llm
+    else:
+        parse_fn = lambda text: standin_parse_signal(text, args.llm_latency, args.llm_jitter)
+        complete_fn = lambda cmd, kl: standin_complete_trade(cmd, kl, args.llm_latency)
+
+    chao_bi.parse_signal_with_llm = _timed(stats, "llm_parse", parse_fn, _on_parsed)
+    chao_bi.complete_trade_with_llm = _timed(stats, "llm_risk", complete_fn)
+    chao_bi.is_valid_symbol = _timed(stats, "is_valid_symbol", chao_bi.is_valid_symbol)
+    chao_bi.get_binance_market_price = _timed(stats, "market_price", chao_bi.get_binance_market_price)
+    chao_bi.get_binance_klines_for_llm = _timed(stats, "klines_llm", chao_bi.get_binance_klines_for_llm)
+    chao_bi.select_sl_tp_with_user_pref = _timed(stats, "risk_py", chao_bi.select_sl_tp_with_user_pref)
+    chao_bi.execute_trade = _timed(stats, "execute_trade", chao_bi.execute_trade, _on_executed)
+    return mock, sent
+
+# ---------------------------------------------------------------------------
+# replay 主流程
+# ---------------------------------------------------------------------------
+async def run_replay(rows, args):
+    stats = ReplayStats()
+    mock, sent = install_standins(stats, args)
+    import chao_bi
+    from telegram import accept_new_message, flush_notifications
+
+    loop = asyncio.get_running_loop()
+    executor = _ContextExecutor(max_workers=args.workers)
+    loop.set_default_executor(executor)
+    import order_tracker
+    if args.user_stream:
+        # 模擬 user data stream：mock 在撮合執行緒送出 ORDER_TRADE_UPDATE，轉回事件迴圈推進 OrderTracker
+        mock.add_user_stream_listener(lambda ev: loop.call_soon_threadsafe(order_tracker.dispatch_order_update, ev))
+    if args.engine_interval:
+        mock.start_engine(args.engine_interval)
+    from loop_monitor import start_loop_monitor
+    loop_monitor = start_loop_monitor(loop)
+    # 與正式啟動相同：先載入 symbol 註冊表，第一則訊息就能預取
+    warming = chao_bi.warm_symbol_registry()
+    if warming is not None:
+        await warming
+
+    async def _one(row):
+        _current_msg.set(row["message_id"])
+        ev = ReplayEvent(row)
+        if not accept_new_message(ev):
+            stats.record("filtered", 0.0)
+            return
+        stats.inflight += 1
+        stats.max_inflight = max(stats.max_inflight, stats.inflight)
+        t0 = time.perf_counter()
+        try:
+            await chao_bi.handle_new_channel_message(ev)
+        except Exception as e:
+            print(f"[replay] handler 例外（message {row['message_id']}）：{e}")
+        finally:
+            stats.inflight -= 1
+            stats.handler_ms.append((time.perf_counter() - t0) * 1000)
+
+    async def _sample_queue():
+        import scheduler
+        while True:
+            queued = executor._work_queue.qsize() + sum(s["queued"] for k, s in scheduler.pool_stats().items() if k != "lanes")
+            stats.max_executor_queue = max(stats.max_executor_queue, queued)
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(_sample_queue())
+    first = rows[0].get("date", 0) if rows else 0
+    t_start = time.perf_counter()
+    tasks = []
+    for row in rows:
+        if args.speed > 0:
+            due = (row.get("date", first) - first) / args.speed
+            delay = due - (time.perf_counter() - t_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(_one(row)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t_start
+    # 等 OrderTracker 把已成交的單掛完 SL/TP（最多 --fill-wait 秒），未完成的列入報告
+    drain_until = time.perf_counter() + (args.fill_wait or 0)
+    while order_tracker._monitoring_orders and time.perf_counter() < drain_until:
+        await asyncio.sleep(0.1)
+    stats.trackers_left = order_tracker.tracker_stats()
+    import scheduler
+    stats.pools = scheduler.pool_stats()
+    stats.monitor = dict(order_tracker._monitor.stats) if order_tracker._monitor else {}
+    import profiler
+    await profiler.stop_profile("replay 結束")
+    stats.loop_lag, stats.stalls = loop_monitor.stats(), list(loop_monitor.stalls)
+    loop_monitor.stop()
+    sampler.cancel()
+    mock.stop_engine()
+    flush_notifications(5)
+    executor.shutdown(wait=False)
+    import logs
+    logs.flush()
+    print_report(rows, stats, mock, sent, elapsed)
+    return stats, mock
+
+def print_report(rows, stats, mock, sent, elapsed):
+    signals = {mid: m for mid, m in stats.per_msg.items()
+               if m["parsed"] and m["parsed"].get("action") in ("BUY", "SELL")}
+    executed = sum(1 for m in signals.values() if m["executed"])
+    dropped = [(mid, m) for mid, m in signals.items() if not m["executed"]]
+    by_id = {r["message_id"]: r for r in rows}
+
+    print("\n" + "=" * 30)
+    print("📈 Replay 報告（dry-run）")
+    print(f"• 訊息數: {len(rows)}，耗時 {elapsed:.2f}s，吞吐量 {len(rows) / elapsed if elapsed else 0:.2f} msg/s")
+    print(f"• 交易訊號: {len(signals)}，送出交易: {executed}，被丟棄: {len(dropped)}")
+    print(f"• 最大同時處理中的訊息: {stats.max_inflight}，執行緒池佇列最大堆積（合計）: {stats.max_executor_queue}")
+    if stats.monitor:
+        print(f"• 訂單監控: {stats.monitor['ticks']} 輪，open orders 查詢 {stats.monitor['open_order_calls']} 次，"
+              f"個別查單 {stats.monitor['query_calls']} 次，逾時撤單 {stats.monitor['expired']} 筆")
+    if stats.trackers_left:
+        print("• 結束時仍在追蹤的開倉單: " + ", ".join(f"{k} {v}" for k, v in sorted(stats.trackers_left.items())))
+    print(f"• 模擬下單: {mock.calls.get('new_order', 0)}，模擬 REST 呼叫: {sum(mock.calls.values())}，推播 (未送出): {len(sent)}")
+    for name, sub in stats.sub_accounts.items():
+        print(f"  子帳戶 {name}: 模擬下單 {sub.calls.get('new_order', 0)}，模擬 REST 呼叫 {sum(sub.calls.values())}")
+    import logs
+    if logs.log_stats["dropped"] or logs.log_stats["sampled_out"]:
+        print(f"• 日誌: 丟棄 {logs.log_stats['dropped']} 筆，抽樣略過 {logs.log_stats['sampled_out']} 筆")
+    if stats.loop_lag:
+        lag = stats.loop_lag
+        print(f"• 事件迴圈延遲: p50 {lag['p50_ms']:.1f}ms / p99 {lag['p99_ms']:.1f}ms / 最大 {lag['max_ms']:.1f}ms，"
+              f"阻塞超過門檻 {lag['stalls']} 次")
+        for st in stats.stalls[:3]:
+            top = next((line for line in reversed(st["stack"]) if "loop_monitor.py" not in line), "").strip()
+            print(f"  卡住 {st['duration_ms'] or st['stalled_ms']}ms @ {top.splitlines()[0] if top else '?'}")
+    if mock.errors:
+        print("• mock 注入錯誤: " + ", ".join(f"{code} ×{n}" for code, n in sorted(mock.errors.items())))
+    if stats.pools:
+        print("— 執行緒池 —")
+        for name, s in stats.pools.items():
+            if name == "lanes":
+                print(f"  symbol 通道: 最深 {s['max_depth']}，曾排隊 {s['waited']} 次，排隊 p95 {s['wait_p95_ms']:.1f}ms")
+                continue
+            print(f"  {name:<7}({s['size']}) 完成 {s['completed']:>4}  最多排隊 {s['max_queued']:>3}  "
+                  f"使用率 {s['utilization'] * 100:5.1f}%  全滿 {s['saturated_pct'] * 100:5.1f}%  "
+                  f"排隊 p50/p95 {s['wait_p50_ms']:.1f}/{s['wait_p95_ms']:.1f}ms")
+    import metrics
+    stages = sorted({labels[0] for labels in metrics.STAGE_SECONDS._series})
+    if stages:
+        print("— metrics 階段直方圖（bucket 上界估計，ms）—")
+        for name in stages:
+            n = sum(metrics.STAGE_SECONDS.snapshot((name,))[:-1])
+            p50, p95 = metrics.STAGE_SECONDS.quantile(0.5, (name,)), metrics.STAGE_SECONDS.quantile(0.95, (name,))
+            print(f"  {name:<16}{n:>6}  p50 ≤ {p50 * 1000:>8.1f}  p95 ≤ {p95 * 1000:>8.1f}")
+        print(f"  REST 權重（最近 60 秒）: {metrics.rest_weight_1m()}")
+    print("— 各階段延遲 (ms) —")
+    print(f"  {'stage':<16}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage, vals in sorted(stats.stage_ms.items()) + [("handler_total", stats.handler_ms)]:
+        if stage == "filtered":
+            print(f"  {'filtered':<16}{len(vals):>6}")
+            continue
+        print(f"  {stage:<16}{len(vals):>6}{_pct(vals, 50):>10.1f}{_pct(vals, 95):>10.1f}{_pct(vals, 99):>10.1f}{max(vals or [0]):>10.1f}")
+    if dropped:
+        print("— 被丟棄的訊號（最後到達的階段）—")
+        for mid, m in dropped[:50]:
+            row = by_id.get(mid, {})
+            last = m["stages"][-1] if m["stages"] else "-"
+            text = (row.get("text") or "").replace("\n", " ")[:50]
+            print(f"  #{mid} [{row.get('chat_title')}] {m['parsed'].get('symbol')} {m['parsed'].get('action')} @ {last} | {text}")
+    print("=" * 30)
+
+def build_parser():
+    ap = argparse.ArgumentParser(description="chao_bi Telegram replay / 壓測工具（dry-run）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    ex = sub.add_parser("export", help="用 Telethon 匯出聊天歷史訊息")
+    ex.add_argument("--chat", action="append", required=True, help="chat_id 或 @username，可重複")
+    ex.add_argument("--limit", type=int, default=500)
+    ex.add_argument("--out", default="replay_messages.jsonl")
+
+    rp = sub.add_parser("run", help="以 dry-run 模式 replay 訊息")
+    rp.add_argument("--file", help="export 產生的 JSONL 檔")
+    rp.add_argument("--synthetic", type=int, default=0, help="改用 N 則合成訊息")
+    rp.add_argument("--rate", type=float, default=10.0, help="合成訊息的每秒則數")
+    rp.add_argument("--symbols", default="BTC,ETH,SOL,PIPPIN,TRUMP", help="合成訊息使用的幣種")
+    rp.add_argument("--speed", type=float, default=1.0, help="replay 倍速；0 = 不等待、全部同時送入")
+    rp.add_argument("--llm-latency", type=float, default=2.0, help="本地 LLM 替身的延遲（秒）")
+    rp.add_argument("--llm-jitter", type=float, default=0.5)
+    rp.add_argument("--real-llm", action="store_true", help="仍呼叫 Ollama（只替換幣安）")
+    rp.add_argument("--binance-latency", type=float, default=0.05, help="mock 幣安每次呼叫的延遲（秒）")
+    rp.add_argument("--binance-jitter", type=float, default=0.0, help="mock 幣安延遲的隨機抖動上限（秒）")
+    rp.add_argument("--error-rate", type=float, default=0.0, help="mock 幣安每次呼叫回 429 的機率")
+    rp.add_argument("--fill-after", type=float, default=2.0, help="mock LIMIT 單多久後成交（秒）")
+    rp.add_argument("--inject", default=None, help="mock 錯誤注入 method:錯誤碼[:次數]，例如 change_leverage:-4028:3,new_order:-1003")
+    rp.add_argument("--partial-fill", type=float, default=None, help="mock LIMIT 單在 fill-after 一半時先成交的比例（0~1）")
+    rp.add_argument("--engine-interval", type=float, default=0.0, help="啟動 mock 撮合引擎，每 N 秒主動成交 / 觸發 SL/TP（0 = 只在查單時撮合）")
+    rp.add_argument("--user-stream", action="store_true", help="以 mock 的 ORDER_TRADE_UPDATE 推送驅動 OrderTracker（輪詢仍作為備援）")
+    rp.add_argument("--fill-wait", type=float, default=None, help="覆寫 INITIAL_FILL_WAIT_SECONDS（OrderTracker 快速查單的時間窗），並在結束前最多等這麼久讓追蹤收尾")
+    rp.add_argument("--pools", default=None, help="覆寫 EXECUTOR_POOL_SIZES，例如 llm=4,order=8")
+    rp.add_argument("--workers", type=int, default=min(32, (os.cpu_count() or 1) + 4), help="預設 executor 執行緒數（scheduler 各階段池以外的工作）")
+    rp.add_argument("--profile", default=None, help="開頭注入一則自己送出的 /profile 指令，例如 20、30s、\"20 cprofile\"")
+    rp.add_argument("--seed", type=int, default=None)
+    rp.add_argument("--accounts", type=int, default=1, help="模擬的幣安帳戶數（>1 時每則訊號平行對所有帳戶下單）")
+    return ap
+
+def main(argv=None):
+    ap = build_parser()
+    args = ap.parse_args(argv)
+    if args.cmd == "export":
+        asyncio.run(export_history(args.chat, args.limit, args.out))
+        return
+    if args.synthetic:
+        rows = synthetic_messages(args.synthetic, args.rate, [s.strip().upper() for s in args.symbols.split(",")], args.seed)
+    elif args.file:
+        rows = load_messages(args.file)
+    else:
+        ap.error("run 需要 --file 或 --synthetic")
+    if args.profile and rows:
+        rows.insert(0, {"chat_id": 0, "chat_title": "replay", "message_id": 0, "date": rows[0].get("date", 0),
+                        "text": f"/profile {args.profile}", "out": True, "sender_id": 0, "via_bot_id": None})
+    asyncio.run(run_replay(rows, args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+# scheduler.py
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import EXECUTOR_POOL_SIZES
+
+# === [scheduler] 分階段執行緒池與 per-symbol 執行通道 ===
+# 所有阻塞工作原本共用事件迴圈的預設 ThreadPoolExecutor：一次 10 分鐘的 reconcile 或卡住的 Ollama
+# 就可能把下單擠在佇列後面。這裡把工作依階段分到各自大小固定的池：
+#   llm    : Ollama 解析 / 風控
+#   market : 市價 / K 線 / 交易對資訊 / 訂單監控查詢
+#   order  : 下單 / 撤單 / 掛 SL/TP / 設定槓桿
+#   maint  : reconcile / 狀態恢復 / 紀錄壓實
+#   queue  : 行程拆分模式的 SQLite 佇列存取
+# 另外每個 symbol 有一條執行通道（run_in_lane）：同一 symbol 的下單流程依序執行（避免兩個訊號同時
+# change_leverage / 計算倉位），不同 symbol 之間仍平行。
+
+_WAIT_SAMPLES = 1024
+
+class StagePool:
+    """大小固定的執行緒池 + 飽和度統計（排隊數、排隊等待時間、使用率、全滿時間比例）。"""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"chao_bi_{name}")
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.active = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.busy_sec = 0.0
+        self.saturated_sec = 0.0        # 所有執行緒同時忙碌的累計時間
+        self._saturated_since = None
+        self._waits = deque(maxlen=_WAIT_SAMPLES)   # 最近的排隊等待（ms）
+        self.started_at = time.perf_counter()
+
+    def _call(self, enqueued_at, fn, args, kwargs):
+        start = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            if self.active >= self.size and self._saturated_since is None:
+                self._saturated_since = start
+            self._waits.append((start - enqueued_at) * 1000)
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                if self._saturated_since is not None:
+                    self.saturated_sec += end - self._saturated_since
+                    self._saturated_since = None
+                self.active -= 1
+                self.completed += 1
+                self.busy_sec += end - start
+
+    def run(self, fn, *args, **kwargs):
+        """在此池執行 fn，回傳 asyncio future；會帶上呼叫端的 contextvars。"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.submitted += 1
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        ctx = contextvars.copy_context()
+        return loop.run_in_executor(self.executor, ctx.run, self._call, time.perf_counter(), fn, args, kwargs)
+
+    def stats(self):
+        now = time.perf_counter()
+        elapsed = max(1e-9, now - self.started_at)
+        with self._lock:
+            waits = sorted(self._waits)
+            saturated = self.saturated_sec + (now - self._saturated_since if self._saturated_since is not None else 0.0)
+            return {
+                "size": self.size,
+                "active": self.active,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "utilization": self.busy_sec / (self.size * elapsed),
+                "saturated_pct": saturated / elapsed,
+                "wait_p50_ms": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95_ms": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                "wait_max_ms": waits[-1] if waits else 0.0,
+            }
+
+class _Lane:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+class SymbolLanes:
+    """每個 symbol 一條通道（asyncio.Lock）；只在事件迴圈執行緒使用，閒置的通道會被回收。"""
+
+    def __init__(self):
+        self._lanes = {}
+        self.max_depth = 0
+        self.waited = 0
+        self._waits = deque(maxlen=_WAIT_SAMPLES)
+
+    async def run(self, symbol, pool, fn, *args, **kwargs):
+        lane = self._lanes.get(symbol)
+        if lane is None:
+            lane = self._lanes[symbol] = _Lane()
+        lane.depth += 1
+        self.max_depth = max(self.max_depth, lane.depth)
+        t0 = time.perf_counter()
+        try:
+            async with lane.lock:
+                if lane.depth > 1:
+                    self.waited += 1
+                self._waits.append((time.perf_counter() - t0) * 1000)
+                fut = pool.run(fn, *args, **kwargs)
+                try:
+                    return await asyncio.shield(fut)
+                except asyncio.CancelledError:
+                    # 呼叫端被取消，但執行緒內的工作停不下來：等它跑完才釋放通道，維持同 symbol 序列化
+                    await asyncio.wait([fut])
+                    raise
+        finally:
+            lane.depth -= 1
+            if lane.depth == 0 and self._lanes.get(symbol) is lane:
+                del self._lanes[symbol]
+
+    def stats(self):
+        waits = sorted(self._waits)
+        return {
+            "active_lanes": len(self._lanes),
+            "busiest": max((l.depth for l in self._lanes.values()), default=0),
+            "max_depth": self.max_depth,
+            "waited": self.waited,
+            "wait_p95_ms": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+        }
+
+_pools = {}
+_pools_lock = threading.Lock()
+_lanes = SymbolLanes()
+
+def get_pool(stage):
+    pool = _pools.get(stage)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(stage)
+            if pool is None:
+                if stage not in EXECUTOR_POOL_SIZES:
+                    raise KeyError(f"未知的執行緒池：{stage}（可用：{', '.join(EXECUTOR_POOL_SIZES)}）")
+                pool = _pools[stage] = StagePool(stage, int(EXECUTOR_POOL_SIZES[stage]))
+    return pool
+
+def run_in_pool(stage, fn, *args, **kwargs):
+    """在指定階段的池執行阻塞函式，回傳可 await 的 future。"""
+    return get_pool(stage).run(fn, *args, **kwargs)
+
+async def run_in_lane(symbol, stage, fn, *args, **kwargs):
+    """同 symbol 依序執行（跨 symbol 平行），實際工作在指定階段的池中執行。"""
+    return await _lanes.run(symbol, get_pool(stage), fn, *args, **kwargs)
+
+def pool_stats():
+    """{stage: 統計, ..., "lanes": 通道統計}；尚未使用過的池不會出現。"""
+    out = {name: pool.stats() for name, pool in list(_pools.items())}
+    out["lanes"] = _lanes.stats()
+    return out
+
+def format_pool_stats():
+    """給 /pools 指令與日誌使用的文字版統計。"""
+    stats = pool_stats()
+    lines = ["🧵 執行緒池狀態"]
+    for name, s in stats.items():
+        if name == "lanes":
+            continue
+        lines.append(f"• {name}({s['size']}): 執行中 {s['active']}、排隊 {s['queued']}（最多 {s['max_queued']}）、"
+                     f"使用率 {s['utilization'] * 100:.1f}%、全滿 {s['saturated_pct'] * 100:.1f}%、"
+                     f"排隊 p95 {s['wait_p95_ms']:.1f}ms、完成 {s['completed']}（失敗 {s['failed']}）")
+    ln = stats["lanes"]
+    lines.append(f"• symbol 通道: 使用中 {ln['active_lanes']}、最深 {ln['max_depth']}、"
+                 f"曾排隊 {ln['waited']} 次、排隊 p95 {ln['wait_p95_ms']:.1f}ms")
+    return "\n".join(lines)
+
+def shutdown(wait=False):
+    for pool in list(_pools.values()):
+        pool.executor.shutdown(wait=wait)
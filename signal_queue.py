@@ -0,0 +1,271 @@
+# signal_queue.py
+"""
+行程間的本機訊號佇列（SQLite，WAL 模式；不需要外部 broker）。
+
+listener 以 put(topic, key, payload) 寫入事件，executor 以 claim() 領取、處理完 ack()。
+  至少一次（at-least-once）：領取時設定租約（SIGNAL_QUEUE_LEASE_SEC），處理中的行程當掉或被重啟，
+    租約到期後事件會再被領取（attempts + 1）；超過 SIGNAL_QUEUE_MAX_ATTEMPTS 次就成為 dead letter。
+  冪等鍵：同一 (topic, key) 只會寫入一次（listener 重啟後 Telethon 補送的同一則訊息不會重複排隊）；
+    重新投遞時 executor 以 key 導出的 newClientOrderId 避免重複下單。
+  喚醒：consumer 綁定一個 Unix datagram socket（<db>.<owner>.wake），put 之後送出一個位元組即時喚醒，
+    不必縮短輪詢間隔；沒有 AF_UNIX 或綁定失敗時退回輪詢。
+
+用法：
+  python signal_queue.py stats
+  python signal_queue.py list --limit 20            # 最近的事件（含租約、重試次數、錯誤）
+  python signal_queue.py retry <id>                  # 把 dead letter 重新放回佇列
+"""
+import os
+import glob
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from config import (
+    SIGNAL_QUEUE_PATH, SIGNAL_QUEUE_LEASE_SEC, SIGNAL_QUEUE_MAX_ATTEMPTS,
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic         TEXT NOT NULL,
+    key           TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    enqueued_at   REAL NOT NULL,
+    available_at  REAL NOT NULL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    lease_owner   TEXT,
+    lease_until   REAL,
+    done_at       REAL,
+    outcome       TEXT,
+    error         TEXT,
+    UNIQUE (topic, key)
+);
+CREATE INDEX IF NOT EXISTS idx_events_ready ON events (topic, done_at, available_at);
+"""
+
+class QueuedEvent:
+    __slots__ = ("id", "topic", "key", "payload", "enqueued_at", "attempts")
+
+    def __init__(self, id, topic, key, payload, enqueued_at, attempts):
+        self.id = id
+        self.topic = topic
+        self.key = key
+        self.payload = payload
+        self.enqueued_at = enqueued_at
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"QueuedEvent({self.id}, {self.topic}, {self.key}, attempts={self.attempts})"
+
+class SignalQueue:
+    """
+    多個行程可同時開同一個 DB：每個執行緒各自一條連線，領取以 BEGIN IMMEDIATE 序列化，
+    同一事件同時只會租給一個 consumer。
+    """
+
+    def __init__(self, path=SIGNAL_QUEUE_PATH, lease_sec=SIGNAL_QUEUE_LEASE_SEC, max_attempts=SIGNAL_QUEUE_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_sec = float(lease_sec)
+        self.max_attempts = int(max_attempts)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- producer ----
+    def put(self, topic, key, payload, delay=0.0):
+        """寫入事件；同一 (topic, key) 已存在時不重複寫入並回傳 False。"""
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO events (topic, key, payload, enqueued_at, available_at) VALUES (?, ?, ?, ?, ?)",
+            (topic, str(key), json.dumps(payload, ensure_ascii=False), now, now + delay))
+        if cur.rowcount != 1:
+            return False
+        self.notify()
+        return True
+
+    # ---- consumer ----
+    def claim(self, topic, owner, limit=1):
+        """領取最多 limit 筆可處理的事件（未完成、已到可用時間、沒有有效租約、未超過重試上限）。"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, topic, key, payload, enqueued_at, attempts FROM events "
+                "WHERE topic = ? AND done_at IS NULL AND available_at <= ? "
+                "AND (lease_until IS NULL OR lease_until < ?) AND attempts < ? ORDER BY id LIMIT ?",
+                (topic, now, now, self.max_attempts, int(limit))).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE events SET lease_owner = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(owner, now + self.lease_sec, r[0]) for r in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [QueuedEvent(r[0], r[1], r[2], json.loads(r[3]), r[4], r[5] + 1) for r in rows]
+
+    def extend(self, event_id, owner):
+        """處理時間較長時續租；租約已被別人接手回傳 False。"""
+        cur = self._conn().execute(
+            "UPDATE events SET lease_until = ? WHERE id = ? AND lease_owner = ? AND done_at IS NULL",
+            (time.time() + self.lease_sec, event_id, owner))
+        return cur.rowcount == 1
+
+    def ack(self, event_id, owner, outcome="ok"):
+        cur = self._conn().execute(
+            "UPDATE events SET done_at = ?, outcome = ?, lease_until = NULL WHERE id = ? AND lease_owner = ? AND done_at IS NULL",
+            (time.time(), outcome, event_id, owner))
+        return cur.rowcount == 1
+
+    def nack(self, event_id, owner, error=None, delay=0.0):
+        """處理失敗：釋放租約，delay 秒後可再被領取（attempts 已在領取時累加）。"""
+        cur = self._conn().execute(
+            "UPDATE events SET lease_owner = NULL, lease_until = NULL, available_at = ?, error = ? "
+            "WHERE id = ? AND lease_owner = ? AND done_at IS NULL",
+            (time.time() + delay, (str(error)[:500] if error else None), event_id, owner))
+        return cur.rowcount == 1
+
+    def release(self, owner):
+        """
+        釋放 owner 名下所有未完成的租約（同名 consumer 重新啟動時呼叫：舊行程的租約不必等到期），回傳筆數。
+        """
+        cur = self._conn().execute(
+            "UPDATE events SET lease_owner = NULL, lease_until = NULL WHERE lease_owner = ? AND done_at IS NULL", (owner,))
+        return cur.rowcount
+
+    # ---- 維護 ----
+    def take_dead_letters(self):
+        """把重試次數用完、租約也已過期的事件標成 dead 並回傳（呼叫端負責提醒）。"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, topic, key, payload, enqueued_at, attempts, error FROM events "
+                "WHERE done_at IS NULL AND attempts >= ? AND (lease_until IS NULL OR lease_until < ?)",
+                (self.max_attempts, now)).fetchall()
+            conn.executemany("UPDATE events SET done_at = ?, outcome = 'dead', lease_until = NULL WHERE id = ?",
+                             [(now, r[0]) for r in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [(QueuedEvent(*r[:5], r[5]), r[6]) for r in rows]
+
+    def retry(self, event_id):
+        """把已結束（例如 dead）的事件重新放回佇列，重試次數歸零。"""
+        cur = self._conn().execute(
+            "UPDATE events SET done_at = NULL, outcome = NULL, attempts = 0, lease_owner = NULL, "
+            "lease_until = NULL, available_at = ? WHERE id = ?", (time.time(), event_id))
+        if cur.rowcount == 1:
+            self.notify()
+        return cur.rowcount == 1
+
+    def purge(self, older_than_sec):
+        """刪除完成超過 older_than_sec 秒的事件；回傳筆數。"""
+        cur = self._conn().execute("DELETE FROM events WHERE done_at IS NOT NULL AND done_at < ?",
+                                   (time.time() - older_than_sec,))
+        return cur.rowcount
+
+    def stats(self):
+        now = time.time()
+        conn = self._conn()
+        out = {"ready": 0, "leased": 0, "delayed": 0}
+        for state, n in conn.execute(
+                "SELECT CASE WHEN lease_until IS NOT NULL AND lease_until >= ? THEN 'leased' "
+                "WHEN available_at > ? THEN 'delayed' ELSE 'ready' END, COUNT(*) "
+                "FROM events WHERE done_at IS NULL GROUP BY 1", (now, now)):
+            out[state] = n
+        for outcome, n in conn.execute("SELECT outcome, COUNT(*) FROM events WHERE done_at IS NOT NULL GROUP BY outcome"):
+            out[outcome or "done"] = n
+        row = conn.execute("SELECT MIN(enqueued_at) FROM events WHERE done_at IS NULL").fetchone()
+        out["oldest_pending_sec"] = round(now - row[0], 1) if row and row[0] else 0.0
+        return out
+
+    def recent(self, limit=20):
+        cols = ("id", "topic", "key", "enqueued_at", "attempts", "lease_owner", "lease_until", "done_at", "outcome", "error")
+        rows = self._conn().execute(f"SELECT {', '.join(cols)} FROM events ORDER BY id DESC LIMIT ?", (int(limit),))
+        return [dict(zip(cols, r)) for r in rows]
+
+    # ---- 喚醒（Unix datagram socket）----
+    def _wake_path(self, owner):
+        return f"{self.path}.{owner}.wake"
+
+    def open_wakeup(self, owner):
+        """綁定 owner 的喚醒 socket（非阻塞）；平台不支援或綁定失敗回傳 None（只靠輪詢）。"""
+        if not hasattr(socket, "AF_UNIX"):
+            return None
+        path = self._wake_path(owner)
+        try:
+            if os.path.exists(path):
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            sock.setblocking(False)
+            return sock
+        except OSError as e:
+            print(f"[warning] 佇列喚醒 socket 綁定失敗（改用輪詢）：{e}")
+            return None
+
+    def close_wakeup(self, sock, owner):
+        if sock is None:
+            return
+        sock.close()
+        try:
+            os.unlink(self._wake_path(owner))
+        except OSError:
+            pass
+
+    def notify(self):
+        """喚醒所有 consumer；沒有人在聽（socket 檔殘留）就略過。"""
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        paths = glob.glob(glob.escape(self.path) + ".*.wake")
+        if not paths:
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            for path in paths:
+                try:
+                    sock.sendto(b"1", path)
+                except OSError:
+                    pass
+
+def main():
+    ap = argparse.ArgumentParser(description="行程間訊號佇列（SQLite）")
+    ap.add_argument("--db", default=SIGNAL_QUEUE_PATH)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats")
+    ls = sub.add_parser("list")
+    ls.add_argument("--limit", type=int, default=20)
+    rt = sub.add_parser("retry")
+    rt.add_argument("id", type=int)
+    args = ap.parse_args()
+
+    q = SignalQueue(args.db)
+    if args.cmd == "stats":
+        for name, value in q.stats().items():
+            print(f"{name:<20} {value}")
+    elif args.cmd == "list":
+        for r in q.recent(args.limit):
+            when = time.strftime("%m-%d %H:%M:%S", time.localtime(r["enqueued_at"]))
+            state = r["outcome"] or ("leased" if r["lease_until"] and r["lease_until"] >= time.time() else "pending")
+            print(f"#{r['id']:<6} {when} {r['topic']:<8} {r['key']:<28} {state:<8} attempts={r['attempts']}"
+                  f"{' ' + r['lease_owner'] if r['lease_owner'] else ''}{' err=' + r['error'] if r['error'] else ''}")
+    elif args.cmd == "retry":
+        print("已重新排入佇列。" if q.retry(args.id) else "找不到這個事件。")
+
+if __name__ == "__main__":
+    main()
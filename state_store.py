@@ -1,86 +1,535 @@
 # state_store.py
 import os
 import json
+import atexit
+import sqlite3
+import threading
 from datetime import datetime
-from config import STATE_FILE_PATH
+from decimal import Decimal
+from config import (
+    STATE_FILE_PATH, STATE_BACKEND, STATE_SQLITE_PATH,
+    STATE_FSYNC_MODE, STATE_FSYNC_INTERVAL_SEC, STATE_WAL_COMPACT_EVERY,
+)
+from trade_record import TrackedTrade, TradeStatus
+import trade_journal
+from logs import get_printer
+print = get_printer("state_store")
 
-# key: str(entry_order_id) → value: dict
+# key: str(entry_order_id) → value: TrackedTrade（不可變；異動時整筆替換）
 _tracked_trades = {}
+# iter_tracked_trades 的快照：沒有異動時重複回傳同一個 tuple，不再每次複製
+_snapshot = None
+# 保護 _tracked_trades / 索引 / 快照與後端寫入順序的鎖。
+# 讀取-修改-寫回整段都在鎖內完成，因此每筆交易的異動是原子的；
+# 持久化也在鎖內，確保 WAL 的紀錄順序與記憶體中的異動順序一致。
+# 使用 RLock：回呼或巢狀呼叫（例如壓實時序列化全部紀錄）可以重入。
+_lock = threading.RLock()
 
-def load_state():
-    global _tracked_trades
-    if not os.path.exists(STATE_FILE_PATH):
-        _tracked_trades.clear()
-        return
+# === 次要索引（每次寫入時同步維護；值皆為 _tracked_trades 的 key）===
+_by_symbol = {}          # symbol → set(key)
+_by_symbol_side = {}     # (symbol, position_side) → set(key)
+_by_status = {}          # status → set(key)
+_by_exit_order = {}      # str(sl/tp order id) → key
+
+# === 持久化後端 ===
+# 每個後端提供 load() → dict、put(key, rec)、delete(key)、snapshot(all_trades)、close()。
+# put / delete 為 O(1)（不會重寫整份狀態），snapshot 用於整份覆寫（save_state / 壓實）。
+
+def _read_json_file(path):
+    """讀取 JSON 狀態檔；不存在或格式錯誤回傳 {}。"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {str(k): v for k, v in data.items()} if isinstance(data, dict) else {}
+
+def _atomic_write_json(path, data, fsync=True):
+    """寫到暫存檔後 os.replace，崩潰時只會留下舊檔或新檔，不會出現寫一半的狀態檔。"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class _Fsyncer:
+    """STATE_FSYNC_MODE='batch' 時的背景 fsync：有髒資料才 fsync，最多延遲 interval 秒。"""
+
+    def __init__(self, fileno_getter, interval):
+        self._fileno_getter = fileno_getter
+        self._interval = interval
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="state-fsync", daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self):
+        self._dirty.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._dirty.wait()
+            if self._stop.wait(self._interval):
+                break
+            self.flush()
+
+    def flush(self):
+        if self._dirty.is_set():
+            self._dirty.clear()
+            try:
+                fd = self._fileno_getter()
+                if fd is not None:
+                    os.fsync(fd)
+            except Exception as e:
+                print(f"⚠️ 狀態檔 fsync 失敗：{e}")
+
+    def stop(self):
+        self._stop.set()
+        self._dirty.set()
+        self._thread.join(timeout=2)
+        self.flush()
+
+class JsonStateBackend:
+    """原行為：每次異動整份重寫 JSON（改為原子替換）。寫入成本 O(追蹤筆數)。"""
+
+    name = "json"
+
+    def __init__(self, path, fsync_mode=STATE_FSYNC_MODE):
+        self.path = path
+        self.fsync = fsync_mode != 'off'
+
+    def load(self):
+        return _read_json_file(self.path)
+
+    def put(self, key, rec):
+        self.snapshot(_serialized_trades())
+
+    def delete(self, key):
+        self.snapshot(_serialized_trades())
+
+    def snapshot(self, trades):
+        _atomic_write_json(self.path, trades, fsync=self.fsync)
+
+    def close(self):
+        pass
+
+class WalStateBackend:
+    """
+    快照 + 追加日誌：
+      • STATE_FILE_PATH：最近一次壓實的 JSON 快照（仍可人工閱讀）
+      • STATE_FILE_PATH + '.wal'：每行一筆 {"op": "put"/"del", "k": ..., "v": ...}
+    載入時先讀快照再重播日誌；日誌最後一行若因崩潰而不完整，會被略過。
+    """
+
+    name = "wal"
+
+    def __init__(self, path, fsync_mode=STATE_FSYNC_MODE, compact_every=STATE_WAL_COMPACT_EVERY):
+        self.path = path
+        self.wal_path = f"{path}.wal"
+        self.fsync_mode = fsync_mode
+        self.compact_every = compact_every
+        self._f = None
+        self._entries = 0
+        self._fsyncer = None
+
+    def load(self):
+        data = _read_json_file(self.path)
+        self._entries = 0
+        corrupt = False
+        if os.path.exists(self.wal_path):
+            with open(self.wal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        print("⚠️ 狀態日誌有不完整的紀錄（可能是上次崩潰），已略過。")
+                        corrupt = True
+                        continue
+                    if entry.get("op") == "put":
+                        data[str(entry["k"])] = entry["v"]
+                    elif entry.get("op") == "del":
+                        data.pop(str(entry["k"]), None)
+                    self._entries += 1
+        if corrupt:
+            # 立刻壓實，避免之後追加的紀錄接在殘缺的行尾
+            self.snapshot(data)
+        return data
+
+    def _open(self):
+        if self._f is None:
+            self._f = open(self.wal_path, "a", encoding="utf-8")
+            if self.fsync_mode == 'batch':
+                self._fsyncer = _Fsyncer(lambda: self._f.fileno() if self._f else None, STATE_FSYNC_INTERVAL_SEC)
+        return self._f
+
+    def _append(self, entry):
+        f = self._open()
+        f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        f.flush()
+        if self.fsync_mode == 'always':
+            os.fsync(f.fileno())
+        elif self._fsyncer is not None:
+            self._fsyncer.mark_dirty()
+        self._entries += 1
+        if self._entries >= self.compact_every:
+            self.snapshot(_serialized_trades())
+
+    def put(self, key, rec):
+        self._append({"op": "put", "k": key, "v": rec})
+
+    def delete(self, key):
+        self._append({"op": "del", "k": key})
+
+    def snapshot(self, trades):
+        """壓實：先原子寫入完整快照，再清空日誌（順序保證崩潰時不會遺失資料）。"""
+        _atomic_write_json(self.path, trades, fsync=self.fsync_mode != 'off')
+        if self._f is not None:
+            self._f.truncate(0)
+            self._f.flush()
+        elif os.path.exists(self.wal_path):
+            open(self.wal_path, "w").close()
+        self._entries = 0
+
+    def close(self):
+        if self._fsyncer is not None:
+            self._fsyncer.stop()
+            self._fsyncer = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+class SqliteStateBackend:
+    """SQLite（journal_mode=WAL）：每次異動一筆 UPSERT / DELETE。"""
+
+    name = "sqlite"
+
+    def __init__(self, path, fsync_mode=STATE_FSYNC_MODE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 模式下 NORMAL 可承受程式崩潰；always 時用 FULL 連斷電也不遺失
+        sync = {"always": "FULL", "batch": "NORMAL", "off": "OFF"}.get(fsync_mode, "NORMAL")
+        self._conn.execute(f"PRAGMA synchronous={sync}")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS tracked_trades (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+
+    def load(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT k, v FROM tracked_trades").fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+    def put(self, key, rec):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO tracked_trades (k, v) VALUES (?, ?) ON CONFLICT(k) DO UPDATE SET v = excluded.v",
+                (key, json.dumps(rec, ensure_ascii=False)),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM tracked_trades WHERE k = ?", (key,))
+
+    def snapshot(self, trades):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM tracked_trades")
+            self._conn.executemany(
+                "INSERT INTO tracked_trades (k, v) VALUES (?, ?)",
+                [(k, json.dumps(v, ensure_ascii=False)) for k, v in trades.items()],
+            )
+            self._conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_backend = None
+
+def _make_backend(name, path, fsync_mode):
+    if name == 'json':
+        return JsonStateBackend(path, fsync_mode)
+    if name == 'sqlite':
+        return SqliteStateBackend(path, fsync_mode)
+    return WalStateBackend(path, fsync_mode)
+
+def configure_backend(name=None, path=None, fsync_mode=None):
+    """
+    切換持久化後端（給工具 / replay / benchmark 使用；正式執行直接吃 config）。
+    path 為 json/wal 的 JSON 路徑或 sqlite 的 DB 路徑。
+    """
+    global _backend
+    with _lock:
+        if _backend is not None:
+            _backend.close()
+        name = name or STATE_BACKEND
+        if path is None:
+            path = STATE_SQLITE_PATH if name == 'sqlite' else STATE_FILE_PATH
+        _backend = _make_backend(name, path, fsync_mode or STATE_FSYNC_MODE)
+        return _backend
+
+def _get_backend():
+    with _lock:
+        return _backend if _backend is not None else configure_backend()
+
+def _serialized_trades():
+    with _lock:
+        return {k: rec.to_dict() for k, rec in _tracked_trades.items()}
+
+def _persist_put(key):
     try:
-        with open(STATE_FILE_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                _tracked_trades.clear()
-                _tracked_trades.update({str(k): v for k, v in data.items()})
-            else:
-                _tracked_trades.clear()
+        _get_backend().put(key, _tracked_trades[key].to_dict())
     except Exception as e:
-        print(f"⚠️ 載入狀態檔失敗，將從空白開始：{e}")
-        _tracked_trades.clear()
+        print(f"⚠️ 寫入狀態檔失敗：{e}")
 
-def save_state():
-    """將目前追蹤中的交易寫回 JSON，供重啟後恢復。"""
+def _persist_delete(key):
     try:
-        with open(STATE_FILE_PATH, "w", encoding="utf-8") as f:
-            json.dump(_tracked_trades, f, ensure_ascii=False, indent=2)
+        _get_backend().delete(key)
     except Exception as e:
         print(f"⚠️ 寫入狀態檔失敗：{e}")
 
+def close_state():
+    """關閉後端（flush 尚未 fsync 的資料）。"""
+    global _backend
+    with _lock:
+        if _backend is not None:
+            try:
+                _backend.close()
+            except Exception as e:
+                print(f"⚠️ 關閉狀態檔失敗：{e}")
+            _backend = None
+
+atexit.register(close_state)
+
+def _index_add(key, rec):
+    _by_symbol.setdefault(rec.symbol, set()).add(key)
+    _by_symbol_side.setdefault((rec.symbol, rec.position_side), set()).add(key)
+    _by_status.setdefault(rec.status, set()).add(key)
+    for order_id in rec.exit_order_ids:
+        _by_exit_order[str(order_id)] = key
+
+def _discard(index, ikey, key):
+    keys = index.get(ikey)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            index.pop(ikey, None)
+
+def _index_remove(key, rec):
+    _discard(_by_symbol, rec.symbol, key)
+    _discard(_by_symbol_side, (rec.symbol, rec.position_side), key)
+    _discard(_by_status, rec.status, key)
+    for order_id in rec.exit_order_ids:
+        if _by_exit_order.get(str(order_id)) == key:
+            _by_exit_order.pop(str(order_id), None)
+
+def _put_record(key, rec):
+    """替換一筆紀錄並同步索引 / 快照 / 後端。呼叫端須持有 _lock。"""
+    global _snapshot
+    old = _tracked_trades.get(key)
+    if old is not None:
+        _index_remove(key, old)
+    _tracked_trades[key] = rec
+    _index_add(key, rec)
+    _snapshot = None
+    _persist_put(key)
+
+def _drop_record(key):
+    """移除一筆紀錄並同步索引 / 快照 / 後端。呼叫端須持有 _lock。"""
+    global _snapshot
+    rec = _tracked_trades.pop(key, None)
+    if rec is None:
+        return False
+    _index_remove(key, rec)
+    _snapshot = None
+    _persist_delete(key)
+    return True
+
+def rebuild_indexes():
+    """依 _tracked_trades 重建全部索引（載入狀態檔後，或外部直接改寫 dict 時使用）。"""
+    global _snapshot
+    with _lock:
+        for index in (_by_symbol, _by_symbol_side, _by_status, _by_exit_order):
+            index.clear()
+        for key, rec in _tracked_trades.items():
+            _index_add(key, rec)
+        _snapshot = None
+
+def load_state():
+    with _lock:
+        backend = _get_backend()
+        try:
+            data = backend.load()
+            # wal / sqlite 首次使用時，匯入既有的 JSON 狀態檔
+            if not data and backend.name == 'sqlite' and os.path.exists(STATE_FILE_PATH):
+                data = _read_json_file(STATE_FILE_PATH)
+                if data:
+                    backend.snapshot(data)
+                    print(f"[info] 已自 {STATE_FILE_PATH} 匯入 {len(data)} 筆交易狀態至 SQLite。")
+            _tracked_trades.clear()
+            for key, raw in data.items():
+                try:
+                    _tracked_trades[str(key)] = TrackedTrade.from_dict(raw, key=key)
+                except Exception as e:
+                    print(f"⚠️ 狀態檔中的開倉單 {key} 格式錯誤，已略過：{e}")
+        except Exception as e:
+            print(f"⚠️ 載入狀態檔失敗，將從空白開始：{e}")
+            _tracked_trades.clear()
+        rebuild_indexes()
+
+def save_state():
+    """將目前追蹤中的交易整份寫回（wal 後端即為壓實），供重啟後恢復。"""
+    with _lock:
+        try:
+            _get_backend().snapshot(_serialized_trades())
+        except Exception as e:
+            print(f"⚠️ 寫入狀態檔失敗：{e}")
+
 def register_entry_trade(symbol, position_side, order_type, entry_price, quantity,
-                         leverage, stop_loss, take_profit, entry_order_id):
+                         leverage, stop_loss, take_profit, entry_order_id,
+                         channel=None, signal_text=None, timeline=None, expires_at=None, account=None):
     """
     註冊一筆新的開倉交易。
-    建議傳進來的 entry_price / stop_loss / take_profit / quantity / leverage 都是字串。
+    entry_price / stop_loss / take_profit / quantity 可傳字串或 Decimal，會在這裡驗證並轉成 Decimal。
+    expires_at：GTD 開倉單的交易所端到期時間（epoch 秒），GTC 為 None。
+    account：下單的幣安帳戶名稱；None = 主帳戶。
+    channel / signal_text / timeline（{階段: epoch 秒}）只寫入 trade_journal 供事後分析。
     """
     if not entry_order_id:
         return
-    key = str(entry_order_id)
     now_iso = datetime.utcnow().isoformat()
-    _tracked_trades[key] = {
-        "symbol": symbol,
-        "position_side": position_side,
-        "order_type": order_type,
-        "entry_price": entry_price,
-        "quantity": quantity,
-        "leverage": leverage,
-        "stop_loss": stop_loss,
-        "take_profit": take_profit,
-        "entry_order_id": entry_order_id,
-        "sl_order_id": None,
-        "tp_order_id": None,
-        "created_at": now_iso,
-        "updated_at": now_iso,
-    }
-    save_state()
+    try:
+        rec = TrackedTrade(
+            entry_order_id=entry_order_id, symbol=symbol, position_side=position_side,
+            order_type=order_type, entry_price=entry_price, quantity=quantity, leverage=leverage,
+            stop_loss=stop_loss, take_profit=take_profit, status=TradeStatus.NEW,
+            created_at=now_iso, updated_at=now_iso, expires_at=expires_at, account=account,
+        )
+    except ValueError as e:
+        print(f"⚠️ 開倉單 {entry_order_id} 資料不合法，未寫入狀態檔：{e}")
+        return
+    with _lock:
+        _put_record(rec.key, rec)
+    trade_journal.record_open(rec, channel=channel, signal_text=signal_text, timeline=timeline)
     print(f"📝 已記錄開倉單 {entry_order_id} 於狀態檔。")
 
 def update_exits_for_trade(entry_order_id, sl_order_id, tp_order_id):
     """在 SL/TP 掛單成功後更新對應的出場單 ID。"""
     key = str(entry_order_id)
-    if key not in _tracked_trades:
-        return
-    if sl_order_id is not None:
-        _tracked_trades[key]["sl_order_id"] = sl_order_id
-    if tp_order_id is not None:
-        _tracked_trades[key]["tp_order_id"] = tp_order_id
-    _tracked_trades[key]["updated_at"] = datetime.utcnow().isoformat()
-    save_state()
+    with _lock:
+        rec = _tracked_trades.get(key)
+        if rec is None:
+            return
+        changes = {"updated_at": datetime.utcnow().isoformat()}
+        if sl_order_id is not None:
+            changes["sl_order_id"] = sl_order_id
+        if tp_order_id is not None:
+            changes["tp_order_id"] = tp_order_id
+        rec = rec.replace(**changes)
+        if rec.exit_order_ids:
+            rec = rec.replace(status=TradeStatus.EXITS_ATTACHED)
+        _put_record(key, rec)
+    trade_journal.record_fields(entry_order_id, sl_order_id=rec.sl_order_id, tp_order_id=rec.tp_order_id)
+    if rec.exit_order_ids:
+        trade_journal.record_stage(entry_order_id, "exits_attached")
     print(f"📝 已更新開倉單 {entry_order_id} 的 SL/TP ID。")
 
-def clear_closed_trade(entry_order_id):
-    """當開倉單確定不再需要追蹤（撤單/完成/錯誤）時，從狀態檔移除。"""
+def update_trade_status(entry_order_id, status):
+    """
+    更新開倉單的生命週期狀態（例如監控偵測到部分 / 完全成交）。
+    EXITS_ATTACHED 之後不會再被成交狀態覆蓋回去。
+    """
+    key = str(entry_order_id)
+    try:
+        status = TradeStatus(status)
+    except ValueError:
+        return
+    with _lock:
+        rec = _tracked_trades.get(key)
+        if rec is None or rec.status in (status, TradeStatus.EXITS_ATTACHED):
+            return
+        _put_record(key, rec.replace(status=status, updated_at=datetime.utcnow().isoformat()))
+    if status in (TradeStatus.PARTIALLY_FILLED, TradeStatus.FILLED):
+        trade_journal.record_stage(entry_order_id, "filled")
+
+def mark_entry_terminal(entry_order_id, status, executed_qty=None, reason=None):
+    """
+    開倉單已終止（CANCELED / EXPIRED / REJECTED，包含 GTD 到期與程式端逾時撤單）：
+    • 完全沒有成交 → 結案移除（reason 預設為 status 小寫）
+    • 已部分成交 → 倉位仍在，保留追蹤；剩餘部分不會再成交，數量改為實際成交量、狀態視為 FILLED
+    回傳是否仍保留追蹤。
+    """
     key = str(entry_order_id)
-    if key in _tracked_trades:
-        _tracked_trades.pop(key, None)
-        save_state()
+    try:
+        filled_qty = Decimal(str(executed_qty)) if executed_qty not in (None, "") else Decimal("0")
+    except Exception:
+        filled_qty = Decimal("0")
+    with _lock:
+        rec = _tracked_trades.get(key)
+        if rec is None:
+            return False
+        has_fill = filled_qty > 0 or rec.status != TradeStatus.NEW
+        if has_fill:
+            changes = {"updated_at": datetime.utcnow().isoformat(), "expires_at": None}
+            if filled_qty > 0:
+                changes["quantity"] = filled_qty
+            if rec.status != TradeStatus.EXITS_ATTACHED:
+                changes["status"] = TradeStatus.FILLED
+            _put_record(key, rec.replace(**changes))
+    if has_fill:
+        print(f"📝 開倉單 {entry_order_id} 剩餘部分已終止（{status}），保留已成交 {filled_qty or rec.quantity} 的追蹤。")
+        return True
+    clear_closed_trade(entry_order_id, reason=reason or str(status).lower())
+    return False
+
+def clear_closed_trade(entry_order_id, reason=None):
+    """
+    當開倉單確定不再需要追蹤（撤單/完成/錯誤）時，從狀態檔移除；
+    完整生命週期保留在 trade_journal（reason 例如 canceled / expired / position_closed）。
+    """
+    with _lock:
+        dropped = _drop_record(str(entry_order_id))
+    if dropped:
+        trade_journal.record_close(entry_order_id, reason=reason)
         print(f"🧹 已自狀態檔移除開倉單 {entry_order_id}。")
 
 def iter_tracked_trades():
-    """提供一個安全的 iterator 給外面使用。"""
-    return list(_tracked_trades.items())
\ No newline at end of file
+    """
+    回傳 ((key, TrackedTrade), ...) 的唯讀快照。
+    紀錄不可變、異動時整筆替換，所以快照在下一次異動前可重複使用，不必每次複製。
+    """
+    global _snapshot
+    snap = _snapshot
+    if snap is None:
+        with _lock:
+            snap = _snapshot
+            if snap is None:
+                snap = _snapshot = tuple(_tracked_trades.items())
+    return snap
+
+# === 索引查詢（皆回傳 [(key, rec), ...]，與 iter_tracked_trades 相同格式）===
+def get_tracked_trade(entry_order_id):
+    """依開倉單 ID 取得紀錄；不存在回傳 None。"""
+    return _tracked_trades.get(str(entry_order_id))
+
+def find_trades_by_symbol(symbol, position_side=None):
+    """列出某 symbol（可再指定 LONG/SHORT）的追蹤中交易。"""
+    with _lock:
+        if position_side is None:
+            keys = _by_symbol.get(symbol, ())
+        else:
+            keys = _by_symbol_side.get((symbol, position_side.upper()), ())
+        return [(k, _tracked_trades[k]) for k in keys]
+
+def find_trades_by_status(status):
+    """列出處於指定生命週期狀態的追蹤中交易。"""
+    with _lock:
+        return [(k, _tracked_trades[k]) for k in _by_status.get(status, ())]
+
+def find_trade_by_exit_order(order_id):
+    """由 SL/TP 單 ID 反查所屬交易；回傳 (key, rec) 或 None。"""
+    with _lock:
+        key = _by_exit_order.get(str(order_id))
+        if key is None or key not in _tracked_trades:
+            return None
+        return key, _tracked_trades[key]
@@ -1,58 +1,331 @@
-import requests
+import time
+import queue
+import atexit
+import threading
+from collections import OrderedDict
 from config import (
-    BOT_TOKEN, BOT_CHAT_ID,
-    API_ID, API_HASH,
-    CLIENT_SESSION_NAME
+    NOTIFY_QUEUE_MAXSIZE, NOTIFY_COALESCE_WINDOW_SEC,
+    NOTIFY_MIN_INTERVAL_SEC, NOTIFY_GROUP_MIN_INTERVAL_SEC,
+    NOTIFY_MAX_RETRIES,
+    SOURCE_CHAT_IDS, COMMAND_CHAT_IDS,
+    ALLOW_SELF_TEST_CHAT, ENTITY_CACHE_SIZE,
 )
-# --- 導入 Telethon (v32) ---
-try:
-    from telethon import TelegramClient
-    from telethon.tl.functions.messages import ImportChatInviteRequest
-except ImportError as e:
-    print(f"[error] 致命錯誤：找不到 'telethon' 模組！")
-    print(f"錯誤詳情: {e}")
-    exit()
-
-# --- 5. 📞 Telethon 客戶端 (v32 工作流) ---
-client = None
-if not API_ID or not API_HASH:
-    print("[error] 找不到 'telegram.txt' 或金鑰不完整。")
-else:
+from app import get_secret
+from logs import get_printer
+print = get_printer("telegram")
+# Telethon 客戶端改由 app.get_telegram_client() 在第一次使用時建立（import 本模組不會連線或讀金鑰）
+
+# --- 訊息來源過濾與實體快取 ---
+# 便利指令（不受 SOURCE_CHAT_IDS 限制，改受 COMMAND_CHAT_IDS 限制）
+COMMANDS = ("/where", "/id", "/ping", "/pools")
+# 診斷指令（profiler.py）：只接受自己帳號送出的訊息（Saved Messages 或自己在聊天中發的），可帶參數
+ADMIN_COMMANDS = ("/profile", "/mem", "/stats")
+
+def command_of(text: str):
+    """回傳訊息對應的指令（小寫）；不是指令時回傳 None。便利指令須完全相符，診斷指令可帶參數。"""
+    stripped = text.strip().lower()
+    if stripped in COMMANDS:
+        return stripped
+    head = stripped.split(maxsplit=1)[0] if stripped else ""
+    return head if head in ADMIN_COMMANDS else None
+
+class EntityLRU:
+    """有上限的 LRU 快取（id → Telethon 實體），避免每則訊息都對 sender/chat 發出網路查詢。"""
+
+    def __init__(self, maxsize=ENTITY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key is None:
+            return None
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key is None or value is None:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+sender_cache = EntityLRU()
+chat_cache = EntityLRU()
+_self_user_id = None
+
+def _bot_id_from_token(token):
+    """Bot token 形如 '123456:xxxx'，冒號前即為 bot 的 user id。"""
     try:
-        client = TelegramClient(CLIENT_SESSION_NAME, API_ID, API_HASH)
-    except Exception as e:
-        print(f"[error] Telethon 錯誤: {e}")
-        client = None
+        return int(str(token).split(":", 1)[0])
+    except Exception:
+        return None
 
-def notify_via_bot_api(text: str) -> bool:
-    """若提供 BOT_TOKEN/BOT_CHAT_ID，透過 Telegram Bot API 送訊息（會觸發推播）。"""
-    if not BOT_TOKEN or not BOT_CHAT_ID:
+_own_bot_id = None        # 第一次過濾訊息時才由 BOT_TOKEN 算出（避免 import 時讀金鑰）
+_own_bot_resolved = False
+
+def _get_own_bot_id():
+    global _own_bot_id, _own_bot_resolved
+    if not _own_bot_resolved:
+        _own_bot_id = _bot_id_from_token(get_secret("BOT_TOKEN"))
+        _own_bot_resolved = True
+    return _own_bot_id
+
+def set_self_user_id(user_id):
+    """登入後記錄自己的 user id，用於零網路判斷 Saved Messages。"""
+    global _self_user_id
+    _self_user_id = user_id
+
+def is_saved_message(event) -> bool:
+    """自己傳到 Saved Messages 的訊息（自我測試）。"""
+    msg = event.message
+    if not (event.is_private and msg.out):
         return False
+    if _self_user_id is not None:
+        return event.chat_id == _self_user_id
     try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+        return event.peer_id.user_id == msg.from_id.user_id
+    except Exception:
+        return False
+
+def accept_new_message(event) -> bool:
+    """
+    Telethon NewMessage 的 func 過濾器：只用訊息本身的欄位與快取判斷，不做任何網路呼叫。
+    依序排除：空訊息 → via_bot / 自己的通知 Bot / 已知 Bot 帳號 → 指令聊天限制 → 來源聊天白名單。
+    """
+    msg = event.message
+    text = msg.message
+    if not text:
+        return False
+    if getattr(msg, "via_bot_id", None):
+        return False
+    sender_id = getattr(msg, "sender_id", None)
+    if sender_id is not None:
+        own_bot_id = _get_own_bot_id()
+        if own_bot_id is not None and sender_id == own_bot_id:
+            return False
+        cached = sender_cache.get(sender_id)
+        if cached is not None and getattr(cached, "bot", False):
+            return False
+
+    saved = is_saved_message(event)
+    cmd = command_of(text)
+    if cmd in ADMIN_COMMANDS:
+        return saved or bool(msg.out)
+    if cmd is not None:
+        return saved or not COMMAND_CHAT_IDS or event.chat_id in COMMAND_CHAT_IDS
+    if saved and ALLOW_SELF_TEST_CHAT:
+        return True
+    if SOURCE_CHAT_IDS and event.chat_id not in SOURCE_CHAT_IDS:
+        return False
+    return True
+
+async def get_sender_cached(event):
+    """優先使用事件內附帶的實體與 LRU 快取，只有都沒有時才呼叫 event.get_sender()（可能走網路）。"""
+    sender_id = getattr(event.message, "sender_id", None)
+    sender = getattr(event, "sender", None) or sender_cache.get(sender_id)
+    if sender is None:
+        sender = await event.get_sender()
+    sender_cache.put(sender_id, sender)
+    return sender
+
+def get_chat_title(event) -> str:
+    """以事件內附帶的 chat 實體或 LRU 快取取得聊天標題（不走網路）。"""
+    chat = event.chat or chat_cache.get(event.chat_id)
+    if chat is None:
+        return "未知聊天"
+    chat_cache.put(event.chat_id, chat)
+    return getattr(chat, 'title', getattr(chat, 'username', str(chat.id)))
+
+# --- 通知佇列：notify_user 只負責排入佇列，由背景執行緒合併、限速、重試後送出 ---
+TELEGRAM_MAX_MESSAGE_CHARS = 4096
+_DIGEST_SEPARATOR = "\n\n━━━━━━━━━━\n"
+
+_notify_queue = queue.Queue(maxsize=NOTIFY_QUEUE_MAXSIZE)
+_notify_thread = None
+_notify_thread_lock = threading.Lock()
+_last_sent_at = {}  # chat_id → 上次送出的 monotonic 時間
+notify_stats = {"enqueued": 0, "sent": 0, "digests": 0, "dropped": 0, "failed": 0, "retries": 0, "split": 0}
+
+def _send_bot_message(text: str, chat_id):
+    """
+    送出單則 Bot API 訊息。
+    回傳 (ok, retry_after, retryable)：retry_after 為 429 要求等待的秒數；retryable 表示可重試（網路 / 5xx）。
+    """
+    import requests
+    try:
+        url = f"https://api.telegram.org/bot{get_secret('BOT_TOKEN')}/sendMessage"
+        # 以純文字送出（不設 parse_mode）：通知會夾帶訊號原文（可能含 < 或 &），合併 / 切塊後也不保證標記完整
         payload = {
-            "chat_id": BOT_CHAT_ID,
+            "chat_id": chat_id,
             "text": text,
             "disable_notification": False,  # 確保會推播
-            "parse_mode": "HTML"
         }
         r = requests.post(url, data=payload, timeout=10)
         if r.status_code == 200 and r.json().get("ok"):
-            return True
-        else:
-            print(f"⚠️ Bot API 通知失敗：{r.status_code} {r.text}")
-            return False
+            return True, None, False
+        retry_after = None
+        if r.status_code == 429:
+            try:
+                retry_after = float(r.json().get("parameters", {}).get("retry_after", 1))
+            except Exception:
+                retry_after = 1.0
+        print(f"⚠️ Bot API 通知失敗：{r.status_code} {r.text}")
+        return False, retry_after, r.status_code >= 500
     except Exception as e:
         print(f"⚠️ Bot API 通知例外：{e}")
+        return False, None, True
+
+def notify_via_bot_api(text: str) -> bool:
+    """若提供 BOT_TOKEN/BOT_CHAT_ID，透過 Telegram Bot API 同步送訊息（會觸發推播）。"""
+    bot_chat_id = get_secret("BOT_CHAT_ID")
+    if not get_secret("BOT_TOKEN") or not bot_chat_id:
         return False
+    ok, _retry_after, _retryable = _send_bot_message(text, bot_chat_id)
+    return ok
+
+def _build_digests(texts):
+    """
+    把同一時間窗的多則通知合併成彙整訊息，並依 Telegram 單則長度上限切塊。
+    回傳 [(彙整後的訊息, [組成的各則通知])]。
+    """
+    if len(texts) == 1:
+        return [(texts[0][:TELEGRAM_MAX_MESSAGE_CHARS], texts[:1])]
+    budget = TELEGRAM_MAX_MESSAGE_CHARS - 40  # 預留彙整標題長度
+    groups, cur, size = [], [], 0
+    for t in texts:
+        t = t[:budget]
+        add = len(t) + (len(_DIGEST_SEPARATOR) if cur else 0)
+        if cur and size + add > budget:
+            groups.append(cur)
+            cur, size = [], 0
+            add = len(t)
+        cur.append(t)
+        size += add
+    if cur:
+        groups.append(cur)
+    return [(f"📦 彙整通知（{len(g)} 則）\n" + _DIGEST_SEPARATOR.join(g) if len(g) > 1 else g[0], g) for g in groups]
+
+def _wait_rate_limit(chat_id):
+    """依聊天類型等待到允許發送的時間點（群組 / 頻道的 chat_id 為負數）。"""
+    try:
+        is_group = int(chat_id) < 0
+    except Exception:
+        is_group = False
+    min_interval = NOTIFY_GROUP_MIN_INTERVAL_SEC if is_group else NOTIFY_MIN_INTERVAL_SEC
+    last = _last_sent_at.get(chat_id)
+    if last is not None:
+        wait = min_interval - (time.monotonic() - last)
+        if wait > 0:
+            time.sleep(wait)
+
+def _deliver(chat_id, text):
+    """
+    送出一則（可能是彙整後的）訊息；429 依 retry_after 等待，網路 / 5xx 以指數退避重試。
+    回傳 "sent" / "rejected"（Telegram 拒收，重試無效，例如 400）/ "failed"（重試用盡）。
+    """
+    for attempt in range(NOTIFY_MAX_RETRIES + 1):
+        _wait_rate_limit(chat_id)
+        ok, retry_after, retryable = _send_bot_message(text, chat_id)
+        _last_sent_at[chat_id] = time.monotonic()
+        if ok:
+            notify_stats["sent"] += 1
+            return "sent"
+        if retry_after is None and not retryable:
+            notify_stats["failed"] += 1
+            return "rejected"
+        if attempt >= NOTIFY_MAX_RETRIES:
+            break
+        notify_stats["retries"] += 1
+        time.sleep(retry_after if retry_after is not None else min(2 ** attempt, 30))
+    notify_stats["failed"] += 1
+    return "failed"
+
+def _notify_worker():
+    """背景執行緒：取出第一則後等待合併時間窗，期間抵達的通知依 chat 合併送出。"""
+    stopping = False
+    while not stopping:
+        item = _notify_queue.get()
+        if item is None:
+            break
+        batch = [item]
+        deadline = time.monotonic() + NOTIFY_COALESCE_WINDOW_SEC
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                nxt = _notify_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if nxt is None:
+                stopping = True
+                break
+            batch.append(nxt)
+
+        by_chat = {}
+        for chat_id, text in batch:
+            by_chat.setdefault(chat_id, []).append(text)
+        for chat_id, texts in by_chat.items():
+            try:
+                digests = _build_digests(texts)
+                if len(texts) > 1:
+                    notify_stats["digests"] += 1
+                for text, parts in digests:
+                    if _deliver(chat_id, text) == "rejected" and len(parts) > 1:
+                        # 被拒多半是其中一則的內容有問題：改為逐則送出，不連累同批的其他通知
+                        notify_stats["split"] += 1
+                        for part in parts:
+                            _deliver(chat_id, part)
+            except Exception as e:
+                print(f"⚠️ 通知發送執行緒錯誤：{e}")
+
+def _ensure_notify_worker():
+    global _notify_thread
+    if _notify_thread is not None and _notify_thread.is_alive():
+        return
+    with _notify_thread_lock:
+        if _notify_thread is None or not _notify_thread.is_alive():
+            _notify_thread = threading.Thread(target=_notify_worker, name="notify-dispatcher", daemon=True)
+            _notify_thread.start()
+
+def flush_notifications(timeout: float = 10.0):
+    """結束前呼叫：送出佇列中剩餘的通知後停止背景執行緒（最多等待 timeout 秒）。"""
+    if _notify_thread is None or not _notify_thread.is_alive():
+        return
+    try:
+        _notify_queue.put(None, timeout=timeout)
+    except queue.Full:
+        return
+    _notify_thread.join(timeout)
+
+atexit.register(flush_notifications)
 
 def notify_user(text: str, loop=None):
     """
-    先嘗試用 Bot API（可推播），失敗才退回 Telethon（同帳號訊息可能不推播）。
+    非阻塞通知：排入背景佇列後立即返回（可在事件迴圈或任何執行緒中呼叫）。
+    佇列滿時丟棄該則並計數；loop 參數保留以相容舊呼叫。
     """
+    bot_chat_id = get_secret("BOT_CHAT_ID")
+    if not get_secret("BOT_TOKEN") or not bot_chat_id:
+        return
     try:
-        # 1) 優先走 Bot 推播
-        if notify_via_bot_api(text):
-            return
+        _ensure_notify_worker()
+        _notify_queue.put_nowait((bot_chat_id, text))
+        notify_stats["enqueued"] += 1
+    except queue.Full:
+        notify_stats["dropped"] += 1
+        print(f"⚠️ 通知佇列已滿（{NOTIFY_QUEUE_MAXSIZE}），丟棄一則通知。")
     except Exception as e:
-        print(f"⚠️ 通知排程失敗：{e}")
\ No newline at end of file
+        print(f"⚠️ 通知排程失敗：{e}")
@@ -0,0 +1,437 @@
+# trade_journal.py
+"""
+已結案交易的歷史紀錄（SQLite）。
+
+state_store 只保存「仍需追蹤」的交易，結案即刪除；這裡則保留每筆交易完整的生命週期：
+  signal_received → parsed → order_sent → filled → exits_attached → closed
+以及來源頻道、是否略過 TP、結案原因等欄位，方便事後分析（例如各頻道的成交延遲、TP 被略過的比例）。
+
+寫入一律丟進背景佇列由單一執行緒批次寫入，不會阻塞下單流程；查詢使用獨立的唯讀連線。
+超過 TRADE_JOURNAL_RETENTION_DAYS 的已結案交易會被壓實成每日彙總（daily_summary）後刪除。
+
+用法：
+  python trade_journal.py stats --by channel --days 7
+  python trade_journal.py list --symbol BTCUSDT --days 30
+  python trade_journal.py compact
+  python trade_journal.py bench --rows 300000        # 在暫存 DB 產生假資料並量測查詢時間
+"""
+import os
+import time
+import queue
+import atexit
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from config import (
+    TRADE_JOURNAL_ENABLED, TRADE_JOURNAL_PATH,
+    TRADE_JOURNAL_RETENTION_DAYS, TRADE_JOURNAL_QUEUE_MAXSIZE,
+)
+
+# 生命週期階段 → 欄位名稱（epoch 秒，REAL）
+STAGES = ("signal_received", "parsed", "order_sent", "filled", "exits_attached", "closed")
+_STAGE_COLUMNS = {s: f"{s}_at" for s in STAGES}
+# record_fields 允許更新的欄位
+_FIELD_COLUMNS = ("tp_skipped", "sl_order_id", "tp_order_id", "close_reason")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trades (
+    entry_order_id      INTEGER PRIMARY KEY,
+    symbol              TEXT NOT NULL,
+    position_side       TEXT,
+    order_type          TEXT,
+    channel             TEXT,
+    entry_price         TEXT,
+    quantity            TEXT,
+    leverage            INTEGER,
+    stop_loss           TEXT,
+    take_profit         TEXT,
+    sl_order_id         INTEGER,
+    tp_order_id         INTEGER,
+    tp_skipped          INTEGER NOT NULL DEFAULT 0,
+    close_reason        TEXT,
+    signal_text         TEXT,
+    signal_received_at  REAL,
+    parsed_at           REAL,
+    order_sent_at       REAL,
+    filled_at           REAL,
+    exits_attached_at   REAL,
+    closed_at           REAL
+);
+CREATE INDEX IF NOT EXISTS idx_trades_closed ON trades (closed_at);
+CREATE INDEX IF NOT EXISTS idx_trades_symbol_closed ON trades (symbol, closed_at);
+CREATE INDEX IF NOT EXISTS idx_trades_channel_closed ON trades (channel, closed_at);
+CREATE TABLE IF NOT EXISTS daily_summary (
+    day                 TEXT NOT NULL,
+    symbol              TEXT NOT NULL,
+    channel             TEXT NOT NULL,
+    trades              INTEGER NOT NULL,
+    filled              INTEGER NOT NULL,
+    tp_skipped          INTEGER NOT NULL,
+    sum_fill_latency    REAL NOT NULL,
+    sum_signal_to_order REAL NOT NULL,
+    n_signal_to_order   INTEGER NOT NULL,
+    PRIMARY KEY (day, symbol, channel)
+);
+"""
+
+_path = TRADE_JOURNAL_PATH
+_enabled = TRADE_JOURNAL_ENABLED
+_queue = queue.Queue(maxsize=TRADE_JOURNAL_QUEUE_MAXSIZE)
+_thread = None
+_thread_lock = threading.Lock()
+journal_stats = {"written": 0, "dropped": 0, "errors": 0}
+
+def configure(path=None, enabled=None):
+    """切換 DB 路徑 / 開關（replay、benchmark 使用）。會先送出舊路徑佇列中的紀錄。"""
+    global _path, _enabled
+    flush()
+    if path is not None:
+        _path = path
+    if enabled is not None:
+        _enabled = enabled
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")   # 只在建立新 DB 時生效
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+# === 背景寫入 ===
+def _writer():
+    """單一寫入執行緒：一次取出佇列中所有紀錄，包在同一個 transaction 內寫入。"""
+    conn = None
+    conn_path = None
+    stopping = False
+    while not stopping:
+        item = _queue.get()
+        batch = []
+        while item is not None:
+            batch.append(item)
+            try:
+                item = _queue.get_nowait()
+            except queue.Empty:
+                break
+        if item is None:
+            stopping = True
+        if not batch:
+            continue
+        try:
+            if conn is None or conn_path != _path:
+                if conn is not None:
+                    conn.close()
+                conn, conn_path = _connect(_path), _path
+            conn.execute("BEGIN")
+            for sql, params in batch:
+                conn.execute(sql, params)
+            conn.execute("COMMIT")
+            journal_stats["written"] += len(batch)
+        except Exception as e:
+            journal_stats["errors"] += 1
+            print(f"⚠️ 交易紀錄寫入失敗（{len(batch)} 筆）：{e}")
+            try:
+                conn.execute("ROLLBACK")
+            except Exception:
+                pass
+    if conn is not None:
+        conn.close()
+
+def _ensure_writer():
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_writer, name="trade-journal", daemon=True)
+            _thread.start()
+
+def _submit(sql, params):
+    if not _enabled:
+        return
+    try:
+        _ensure_writer()
+        _queue.put_nowait((sql, params))
+    except queue.Full:
+        journal_stats["dropped"] += 1
+    except Exception as e:
+        print(f"⚠️ 交易紀錄排程失敗：{e}")
+
+def flush(timeout: float = 10.0):
+    """送出佇列中剩餘的紀錄並停止寫入執行緒（下一次寫入會自動重啟）。"""
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        return
+    try:
+        _queue.put(None, timeout=timeout)
+    except queue.Full:
+        return
+    _thread.join(timeout)
+    _thread = None
+
+atexit.register(flush)
+
+# === 紀錄 API（皆為非阻塞）===
+def record_open(rec, channel=None, signal_text=None, timeline=None):
+    """
+    開倉單送出後建立紀錄。rec 為 TrackedTrade；timeline 為 {stage: epoch 秒}，
+    帶入下單前的 signal_received / parsed 時間（order_sent 未提供時以現在時間代替）。
+    """
+    timeline = dict(timeline or {})
+    timeline.setdefault("order_sent", time.time())
+    _submit(
+        """INSERT INTO trades (entry_order_id, symbol, position_side, order_type, channel,
+               entry_price, quantity, leverage, stop_loss, take_profit, signal_text,
+               signal_received_at, parsed_at, order_sent_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(entry_order_id) DO UPDATE SET
+               symbol = excluded.symbol, position_side = excluded.position_side,
+               order_type = excluded.order_type, channel = COALESCE(excluded.channel, channel),
+               entry_price = excluded.entry_price, quantity = excluded.quantity,
+               leverage = excluded.leverage, stop_loss = excluded.stop_loss,
+               take_profit = excluded.take_profit,
+               signal_text = COALESCE(excluded.signal_text, signal_text)""",
+        (rec.entry_order_id, rec.symbol, rec.position_side, rec.order_type, channel,
+         _dec_str(rec.entry_price), _dec_str(rec.quantity), rec.leverage,
+         _dec_str(rec.stop_loss), _dec_str(rec.take_profit), signal_text,
+         timeline.get("signal_received"), timeline.get("parsed"), timeline.get("order_sent")),
+    )
+
+def record_stage(entry_order_id, stage, ts=None):
+    """記錄某生命週期階段的時間；同一階段只保留第一次（例如 PARTIALLY_FILLED 先於 FILLED）。"""
+    col = _STAGE_COLUMNS.get(stage)
+    if col is None or entry_order_id is None:
+        return
+    _submit(f"UPDATE trades SET {col} = COALESCE({col}, ?) WHERE entry_order_id = ?",
+            (ts or time.time(), int(entry_order_id)))
+
+def record_fields(entry_order_id, **fields):
+    """更新非時間欄位（tp_skipped / sl_order_id / tp_order_id / close_reason）。"""
+    cols = [c for c in fields if c in _FIELD_COLUMNS]
+    if not cols or entry_order_id is None:
+        return
+    sets = ", ".join(f"{c} = ?" for c in cols)
+    params = tuple(int(fields[c]) if c == "tp_skipped" else fields[c] for c in cols)
+    _submit(f"UPDATE trades SET {sets} WHERE entry_order_id = ?", params + (int(entry_order_id),))
+
+def record_close(entry_order_id, reason=None, ts=None):
+    """結案：寫入 closed_at 與原因。"""
+    if entry_order_id is None:
+        return
+    _submit("UPDATE trades SET closed_at = COALESCE(closed_at, ?), close_reason = COALESCE(?, close_reason) "
+            "WHERE entry_order_id = ?", (ts or time.time(), reason, int(entry_order_id)))
+
+def _dec_str(d):
+    return None if d is None else format(d, 'f')
+
+# === 查詢（唯讀連線；皆走 closed_at / symbol / channel 索引）===
+def _read_conn():
+    if not os.path.exists(_path):
+        return None
+    conn = sqlite3.connect(f"file:{_path}?mode=ro", uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _range_clause(symbol=None, channel=None, since=None, until=None):
+    where, params = ["closed_at IS NOT NULL"], []
+    if symbol:
+        where.append("symbol = ?")
+        params.append(symbol)
+    if channel:
+        where.append("channel = ?")
+        params.append(channel)
+    if since is not None:
+        where.append("closed_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("closed_at < ?")
+        params.append(until)
+    return " AND ".join(where), params
+
+def query_trades(symbol=None, channel=None, since=None, until=None, limit=200):
+    """列出已結案交易（新到舊）；since / until 為 epoch 秒。"""
+    conn = _read_conn()
+    if conn is None:
+        return []
+    try:
+        where, params = _range_clause(symbol, channel, since, until)
+        rows = conn.execute(f"SELECT * FROM trades WHERE {where} ORDER BY closed_at DESC LIMIT ?",
+                            params + [limit]).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        conn.close()
+
+def trade_stats(by="channel", symbol=None, channel=None, since=None, until=None):
+    """
+    依 channel / symbol / day 分組統計：筆數、成交數、TP 略過比例、
+    平均成交延遲（filled - order_sent）與平均訊號到下單延遲（order_sent - signal_received）。
+    """
+    group_expr = {
+        "channel": "COALESCE(channel, '')",
+        "symbol": "symbol",
+        "day": "date(closed_at, 'unixepoch', 'localtime')",
+    }[by]
+    conn = _read_conn()
+    if conn is None:
+        return []
+    try:
+        where, params = _range_clause(symbol, channel, since, until)
+        rows = conn.execute(
+            f"""SELECT {group_expr} AS grp,
+                       COUNT(*) AS trades,
+                       COUNT(filled_at) AS filled,
+                       SUM(tp_skipped) AS tp_skipped,
+                       AVG(filled_at - order_sent_at) AS avg_fill_latency,
+                       AVG(order_sent_at - signal_received_at) AS avg_signal_to_order,
+                       AVG(exits_attached_at - filled_at) AS avg_fill_to_exits
+                FROM trades WHERE {where}
+                GROUP BY grp ORDER BY trades DESC""",
+            params,
+        ).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        conn.close()
+
+# === 壓實 ===
+def compact(retention_days=None, now=None):
+    """
+    把超過保留天數的已結案交易彙總進 daily_summary 後刪除，並回收空間。
+    同步執行（請在 executor 中呼叫）；回傳被壓實的筆數。
+    """
+    flush()
+    retention_days = TRADE_JOURNAL_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = (now or time.time()) - retention_days * 86400
+    if not os.path.exists(_path):
+        return 0
+    conn = _connect(_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            """INSERT INTO daily_summary (day, symbol, channel, trades, filled, tp_skipped,
+                   sum_fill_latency, sum_signal_to_order, n_signal_to_order)
+               SELECT date(closed_at, 'unixepoch', 'localtime'), symbol, COALESCE(channel, ''),
+                      COUNT(*), COUNT(filled_at), SUM(tp_skipped),
+                      COALESCE(SUM(filled_at - order_sent_at), 0),
+                      COALESCE(SUM(order_sent_at - signal_received_at), 0),
+                      COUNT(order_sent_at - signal_received_at)
+               FROM trades WHERE closed_at IS NOT NULL AND closed_at < ?
+               GROUP BY 1, 2, 3
+               ON CONFLICT(day, symbol, channel) DO UPDATE SET
+                   trades = trades + excluded.trades,
+                   filled = filled + excluded.filled,
+                   tp_skipped = tp_skipped + excluded.tp_skipped,
+                   sum_fill_latency = sum_fill_latency + excluded.sum_fill_latency,
+                   sum_signal_to_order = sum_signal_to_order + excluded.sum_signal_to_order,
+                   n_signal_to_order = n_signal_to_order + excluded.n_signal_to_order""",
+            (cutoff,),
+        )
+        n = conn.execute("DELETE FROM trades WHERE closed_at IS NOT NULL AND closed_at < ?", (cutoff,)).rowcount
+        conn.execute("COMMIT")
+        conn.execute("PRAGMA incremental_vacuum")
+        conn.execute("PRAGMA optimize")
+        if n:
+            print(f"[Journal] 已壓實 {n} 筆 {retention_days} 天前的已結案交易至每日彙總。")
+        return n
+    except Exception:
+        try:
+            conn.execute("ROLLBACK")
+        except Exception:
+            pass
+        raise
+    finally:
+        conn.close()
+
+# === CLI ===
+def _fmt_sec(v):
+    return "-" if v is None else f"{v:.2f}s"
+
+def _print_stats(rows, by):
+    print(f"{by:<28} {'筆數':>6} {'成交':>6} {'略過TP':>6} {'成交延遲':>10} {'訊號→下單':>10} {'成交→掛單':>10}")
+    for r in rows:
+        print(f"{str(r['grp'])[:28]:<28} {r['trades']:>6} {r['filled']:>6} {r['tp_skipped'] or 0:>6} "
+              f"{_fmt_sec(r['avg_fill_latency']):>10} {_fmt_sec(r['avg_signal_to_order']):>10} "
+              f"{_fmt_sec(r['avg_fill_to_exits']):>10}")
+
+def _bench(rows):
+    import random
+    import tempfile
+    tmp = tempfile.mkdtemp(prefix="chao_bi_journal_")
+    path = os.path.join(tmp, "journal.db")
+    conn = _connect(path)
+    rng = random.Random(1)
+    symbols = [f"SYM{i}USDT" for i in range(200)]
+    channels = [f"channel-{i}" for i in range(40)]
+    now = time.time()
+    t0 = time.perf_counter()
+    conn.execute("BEGIN")
+    for i in range(rows):
+        sent = now - rng.uniform(0, 365 * 86400)
+        conn.execute(
+            "INSERT INTO trades (entry_order_id, symbol, position_side, order_type, channel, tp_skipped,"
+            " signal_received_at, parsed_at, order_sent_at, filled_at, exits_attached_at, closed_at)"
+            " VALUES (?, ?, 'LONG', 'LIMIT', ?, ?, ?, ?, ?, ?, ?, ?)",
+            (i + 1, rng.choice(symbols), rng.choice(channels), int(rng.random() < 0.1),
+             sent - 3, sent - 1, sent, sent + rng.uniform(0.1, 60), sent + 61, sent + rng.uniform(100, 86400)),
+        )
+    conn.execute("COMMIT")
+    conn.close()
+    print(f"[bench] 寫入 {rows} 筆假資料：{time.perf_counter() - t0:.1f}s（{path}）")
+
+    global _path
+    old_path, _path = _path, path
+    try:
+        cases = [
+            ("list symbol 30d", lambda: query_trades(symbol="SYM7USDT", since=now - 30 * 86400)),
+            ("list channel 7d", lambda: query_trades(channel="channel-3", since=now - 7 * 86400)),
+            ("stats by channel 7d", lambda: trade_stats("channel", since=now - 7 * 86400)),
+            ("stats by symbol 30d", lambda: trade_stats("symbol", since=now - 30 * 86400)),
+            ("stats symbol by day 90d", lambda: trade_stats("day", symbol="SYM7USDT", since=now - 90 * 86400)),
+            ("compact >180d", lambda: compact(180, now=now)),
+        ]
+        for name, fn in cases:
+            t0 = time.perf_counter()
+            res = fn()
+            n = res if isinstance(res, int) else len(res)
+            print(f"  {name:<26} {(time.perf_counter() - t0) * 1000:8.1f} ms  （{n}）")
+    finally:
+        _path = old_path
+        import shutil
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main():
+    ap = argparse.ArgumentParser(description="已結案交易紀錄查詢")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("stats", "list"):
+        p = sub.add_parser(name)
+        p.add_argument("--symbol")
+        p.add_argument("--channel")
+        p.add_argument("--days", type=float, default=7, help="只看最近 N 天（依結案時間）")
+        if name == "stats":
+            p.add_argument("--by", default="channel", choices=["channel", "symbol", "day"])
+        else:
+            p.add_argument("--limit", type=int, default=50)
+    p = sub.add_parser("compact")
+    p.add_argument("--days", type=float, default=None, help="保留天數（預設 TRADE_JOURNAL_RETENTION_DAYS）")
+    p = sub.add_parser("bench")
+    p.add_argument("--rows", type=int, default=300000)
+    args = ap.parse_args()
+
+    if args.cmd == "bench":
+        _bench(args.rows)
+        return
+    if args.cmd == "compact":
+        compact(args.days)
+        return
+    since = time.time() - args.days * 86400
+    if args.cmd == "stats":
+        _print_stats(trade_stats(args.by, args.symbol, args.channel, since=since), args.by)
+    else:
+        for r in query_trades(args.symbol, args.channel, since=since, limit=args.limit):
+            closed = datetime.fromtimestamp(r["closed_at"]).strftime("%m-%d %H:%M")
+            fill = _fmt_sec(r["filled_at"] - r["order_sent_at"]) if r["filled_at"] and r["order_sent_at"] else "-"
+            print(f"{closed}  {r['symbol']:<14} {r['position_side'] or '':<5} #{r['entry_order_id']:<12} "
+                  f"成交延遲 {fill:>8}  {'略過TP ' if r['tp_skipped'] else ''}{r['close_reason'] or ''}  [{r['channel'] or ''}]")
+
+if __name__ == "__main__":
+    main()
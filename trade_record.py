@@ -0,0 +1,164 @@
+# trade_record.py
+from enum import Enum
+from decimal import Decimal, InvalidOperation
+
+# === [trade_record] 追蹤中交易的型別化紀錄 ===
+# 取代原本「全部欄位都是字串」的 dict：價格 / 數量在建立時就驗證並轉成 Decimal，
+# 之後 reconcile / 恢復流程不必再反覆 Decimal(str(...))。
+# 紀錄本身視為不可變：任何異動都透過 replace() 產生新物件（copy-on-write），
+# 讓 state_store 可以直接把同一批物件放進快照給讀者迭代，不需要複製。
+
+# 序列化版本：1 = 舊版字串 dict（沒有 "v" 欄位）；2 = 本模組格式
+RECORD_VERSION = 2
+
+class TradeStatus(str, Enum):
+    """開倉單生命週期：NEW → PARTIALLY_FILLED / FILLED → EXITS_ATTACHED。"""
+    NEW = "NEW"
+    PARTIALLY_FILLED = "PARTIALLY_FILLED"
+    FILLED = "FILLED"
+    EXITS_ATTACHED = "EXITS_ATTACHED"
+
+def _to_decimal(value, field, required=True):
+    if value is None or value == "":
+        if required:
+            raise ValueError(f"TrackedTrade.{field} 不可為空")
+        return None
+    try:
+        d = value if isinstance(value, Decimal) else Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"TrackedTrade.{field} 不是合法數字：{value!r}")
+    if not d.is_finite():
+        raise ValueError(f"TrackedTrade.{field} 不是有限數值：{value!r}")
+    return d
+
+def _to_order_id(value):
+    return int(value) if value not in (None, "") else None
+
+def fmt_decimal(d):
+    """Decimal → 幣安接受的字串（不使用科學記號，例如 1E-7 → '0.0000001'）。"""
+    return None if d is None else format(d, 'f')
+
+class TrackedTrade:
+    __slots__ = (
+        "entry_order_id", "symbol", "position_side", "order_type",
+        "entry_price", "quantity", "leverage", "stop_loss", "take_profit",
+        "sl_order_id", "tp_order_id", "status", "created_at", "updated_at", "expires_at", "account",
+    )
+
+    def __init__(self, entry_order_id, symbol, position_side, order_type, entry_price, quantity,
+                 leverage, stop_loss=None, take_profit=None, sl_order_id=None, tp_order_id=None,
+                 status=TradeStatus.NEW, created_at=None, updated_at=None, expires_at=None, account=None):
+        if not symbol:
+            raise ValueError("TrackedTrade.symbol 不可為空")
+        position_side = (position_side or "").upper()
+        if position_side not in ("LONG", "SHORT"):
+            raise ValueError(f"TrackedTrade.position_side 必須是 LONG/SHORT：{position_side!r}")
+        self.entry_order_id = int(entry_order_id)
+        self.symbol = symbol
+        self.position_side = position_side
+        self.order_type = (order_type or "").upper()
+        self.entry_price = _to_decimal(entry_price, "entry_price")
+        self.quantity = _to_decimal(quantity, "quantity")
+        self.leverage = int(Decimal(str(leverage))) if leverage not in (None, "") else None
+        self.stop_loss = _to_decimal(stop_loss, "stop_loss", required=False)
+        self.take_profit = _to_decimal(take_profit, "take_profit", required=False)
+        self.sl_order_id = _to_order_id(sl_order_id)
+        self.tp_order_id = _to_order_id(tp_order_id)
+        self.status = TradeStatus(status)
+        self.created_at = created_at
+        self.updated_at = updated_at or created_at
+        # 交易所端到期時間（GTD goodTillDate，epoch 秒）；None = GTC，由程式端計時撤單
+        self.expires_at = float(expires_at) if expires_at not in (None, "") else None
+        # 下單的幣安帳戶名稱（config.BINANCE_ACCOUNTS）；None = 主帳戶（舊紀錄沒有這個欄位）
+        self.account = account or None
+
+    @property
+    def key(self):
+        """_tracked_trades 的 key（字串形式的開倉單 ID）。"""
+        return str(self.entry_order_id)
+
+    @property
+    def exit_order_ids(self):
+        return tuple(i for i in (self.sl_order_id, self.tp_order_id) if i is not None)
+
+    def replace(self, **changes):
+        """回傳套用 changes 後的新紀錄（原物件不變）。"""
+        new = object.__new__(TrackedTrade)
+        for name in self.__slots__:
+            setattr(new, name, getattr(self, name))
+        for name, value in changes.items():
+            if name in ("entry_price", "quantity"):
+                value = _to_decimal(value, name)
+            elif name in ("stop_loss", "take_profit"):
+                value = _to_decimal(value, name, required=False)
+            elif name in ("sl_order_id", "tp_order_id"):
+                value = _to_order_id(value)
+            elif name == "status":
+                value = TradeStatus(value)
+            setattr(new, name, value)
+        return new
+
+    def to_dict(self):
+        """序列化為 JSON 友善的 dict（Decimal 以字串保存，避免精度損失）。"""
+        return {
+            "v": RECORD_VERSION,
+            "entry_order_id": self.entry_order_id,
+            "symbol": self.symbol,
+            "position_side": self.position_side,
+            "order_type": self.order_type,
+            "entry_price": fmt_decimal(self.entry_price),
+            "quantity": fmt_decimal(self.quantity),
+            "leverage": self.leverage,
+            "stop_loss": fmt_decimal(self.stop_loss),
+            "take_profit": fmt_decimal(self.take_profit),
+            "sl_order_id": self.sl_order_id,
+            "tp_order_id": self.tp_order_id,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "expires_at": self.expires_at,
+            "account": self.account,
+        }
+
+    @classmethod
+    def from_dict(cls, data, key=None):
+        """
+        由狀態檔的 dict 還原；相容舊版（v1）的全字串格式：
+        舊版沒有 status 欄位，有 SL/TP ID 即視為 EXITS_ATTACHED，否則 NEW。
+        """
+        version = data.get("v", 1)
+        if version > RECORD_VERSION:
+            raise ValueError(f"狀態檔紀錄版本 {version} 比程式支援的 {RECORD_VERSION} 新")
+        status = data.get("status")
+        if status is None:
+            status = TradeStatus.EXITS_ATTACHED if (data.get("sl_order_id") or data.get("tp_order_id")) else TradeStatus.NEW
+        return cls(
+            entry_order_id=data.get("entry_order_id") or key,
+            symbol=data.get("symbol"),
+            position_side=data.get("position_side") or "LONG",
+            order_type=data.get("order_type"),
+            entry_price=data.get("entry_price"),
+            quantity=data.get("quantity"),
+            leverage=data.get("leverage"),
+            stop_loss=data.get("stop_loss"),
+            take_profit=data.get("take_profit"),
+            sl_order_id=data.get("sl_order_id"),
+            tp_order_id=data.get("tp_order_id"),
+            status=status,
+            created_at=data.get("created_at"),
+            updated_at=data.get("updated_at"),
+            expires_at=data.get("expires_at"),
+            account=data.get("account"),
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, TrackedTrade):
+            return NotImplemented
+        return all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"TrackedTrade({self.symbol} {self.position_side} #{self.entry_order_id} "
+                f"{self.status.value} entry={fmt_decimal(self.entry_price)} qty={fmt_decimal(self.quantity)} "
+                f"sl={fmt_decimal(self.stop_loss)} tp={fmt_decimal(self.take_profit)})")
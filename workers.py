@@ -0,0 +1,319 @@
+# workers.py
+"""
+行程拆分模式：把 chao_bi.py 的單一行程拆成三種可各自重啟的行程，以本機 SQLite 佇列（signal_queue.py）串接。
+
+  listener : Telethon 收訊息、來源過濾、別名正規化、指令回覆 → 把訊號寫入佇列（不連幣安、不跑 LLM）
+  executor : 領取訊號 → LLM 解析 / 風控 / 多帳戶下單 / OrderTracker；擁有狀態檔，負責恢復追蹤與週期性 reconcile
+  maint    : 每日盈虧推播、交易紀錄壓實、佇列清理與 dead letter / 積壓提醒
+
+用法：
+  python workers.py listener
+  python workers.py executor [--name exec2]    # 多個 executor 各用自己的狀態檔（chao_bi_state.<name>.json）
+  python workers.py maint
+  python workers.py all                        # 啟動上面三個子行程，任何一個結束就重啟它
+
+訊號以 chat_id:message_id 為冪等鍵：listener 重啟後重複收到的訊息不會再排隊；
+executor 在處理途中被重啟時，事件會重新投遞，開倉單以同一個 newClientOrderId 查回，不會重複下單。
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import threading
+import argparse
+import subprocess
+from config import (
+    METRICS_PORT, WORKER_METRICS_PORT_OFFSET, STATE_BACKEND, STATE_FILE_PATH, STATE_SQLITE_PATH,
+    SIGNAL_QUEUE_POLL_SEC, SIGNAL_QUEUE_RETENTION_SEC, SIGNAL_MAX_AGE_SEC,
+    EXECUTOR_MAX_INFLIGHT, TRADE_JOURNAL_COMPACT_INTERVAL_SEC,
+)
+from signal_queue import SignalQueue
+from scheduler import run_in_pool
+from metrics import (
+    stage, observe_stage, new_correlation_id, start_metrics_server,
+    register_json_endpoint, register_collector,
+)
+from loop_monitor import start_loop_monitor
+from logs import get_printer
+print = get_printer("workers")
+
+ROLES = ("listener", "executor", "maint")
+SIGNAL_TOPIC = "signal"
+BACKLOG_ALERT_SEC = 60        # 佇列最舊的待處理訊號超過此秒數 → maint 提醒 executor 可能停止
+BACKLOG_ALERT_COOLDOWN_SEC = 600
+
+def _start_observability(role, queue=None):
+    start_metrics_server(port=METRICS_PORT + WORKER_METRICS_PORT_OFFSET.get(role, 0))
+    start_loop_monitor(asyncio.get_running_loop())
+    if queue is not None:
+        register_json_endpoint("/queue", queue.stats)
+        register_collector(lambda: _queue_metrics(queue))
+
+def _queue_metrics(queue):
+    st = queue.stats()
+    oldest = st.pop("oldest_pending_sec", 0.0)
+    return [
+        ("chao_bi_queue_events", "gauge", "訊號佇列中各狀態的事件數", [({"state": k}, v) for k, v in st.items()]),
+        ("chao_bi_queue_oldest_pending_seconds", "gauge", "最舊的待處理訊號已排隊秒數", [({}, oldest)]),
+    ]
+
+# === [listener] 收訊息 → 寫入佇列 ===
+async def run_listener(client):
+    import chao_bi
+    from telegram import set_self_user_id
+    queue = SignalQueue()
+
+    async def enqueue(sig):
+        with stage("enqueue"):
+            fresh = await run_in_pool('queue', queue.put, SIGNAL_TOPIC, sig["key"], sig)
+        if fresh:
+            print(f"[listener] 訊號 {sig['key']}（{sig['channel']}）已排入佇列。")
+        else:
+            print(f"[listener] 訊號 {sig['key']} 已在佇列中（重複收到），略過。")
+
+    chao_bi.set_signal_dispatcher(enqueue)
+    print("[info] 正在啟動 Telethon 客戶端...")
+    await client.start()
+    try:
+        me = await client.get_me()
+        set_self_user_id(me.id)
+    except Exception as e:
+        print(f"[warning] 取得自身帳號資訊失敗（Saved Messages 判斷改用訊息欄位）：{e}")
+    chao_bi.register_handlers(client)
+    _start_observability("listener")
+    print(f"[listener] 已登入，訊號寫入 {queue.path}")
+    await client.run_until_disconnected()
+
+# === [executor] 領取訊號 → 解析 / 風控 / 下單 ===
+def _state_path_for(name):
+    """預設 executor 沿用原本的狀態檔；其他名稱各自一份（避免兩個行程寫同一個檔案）。"""
+    path = STATE_SQLITE_PATH if STATE_BACKEND == 'sqlite' else STATE_FILE_PATH
+    if name == "executor":
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
+
+async def _wait_wakeup(loop, sock, timeout):
+    """等 listener 的喚醒通知或 timeout 秒；沒有喚醒 socket 時單純輪詢。"""
+    if sock is None:
+        await asyncio.sleep(timeout)
+        return
+    try:
+        await asyncio.wait_for(loop.sock_recv(sock, 64), timeout)
+    except asyncio.TimeoutError:
+        return
+    # 一次領取會拿走所有可處理的事件：積著的其他通知直接讀掉
+    while True:
+        try:
+            sock.recv(64)
+        except OSError:
+            return
+
+async def _keep_lease(queue, owner, event_id):
+    while True:
+        await asyncio.sleep(queue.lease_sec / 3)
+        if not await run_in_pool('queue', queue.extend, event_id, owner):
+            print(f"[warning] 事件 #{event_id} 的租約已失效（可能被其他 executor 接手）。")
+            return
+
+async def _consume(queue, owner, ev):
+    import chao_bi
+    payload = dict(ev.payload, attempt=ev.attempts)
+    now = time.time()
+    observe_stage("queue_wait", max(0.0, now - ev.enqueued_at))
+    age = now - float(payload.get("received_at") or ev.enqueued_at)
+    if age > SIGNAL_MAX_AGE_SEC:
+        if ev.attempts == 1:
+            # 從未開始處理的舊訊號：行情已過，不再下單
+            print(f"[executor] 訊號 {ev.key} 已排隊 {age:.0f}s（上限 {SIGNAL_MAX_AGE_SEC}s），不再下單。")
+            await run_in_pool('queue', queue.ack, ev.id, owner, "expired")
+            return
+        # 上次處理到一半：只接手已送出的開倉單，不再對其他帳戶補下新單
+        payload["adopt_only"] = True
+    if ev.attempts > 1:
+        print(f"[executor] 訊號 {ev.key} 第 {ev.attempts} 次投遞（上次處理未完成），以 clientOrderId 查回已送出的開倉單。")
+
+    heartbeat = asyncio.create_task(_keep_lease(queue, owner, ev.id))
+    cid = new_correlation_id(chat_id=payload.get("chat_id"))
+    try:
+        with stage("handler_total"):
+            await chao_bi.process_signal(payload)
+        await run_in_pool('queue', queue.ack, ev.id, owner)
+    except Exception as e:
+        print(f"[error] 訊號 {ev.key} 處理失敗（稍後重新投遞）：{e}")
+        await run_in_pool('queue', queue.nack, ev.id, owner, e, 5.0)
+    finally:
+        heartbeat.cancel()
+        chao_bi.finish_signal_trace(cid)
+
+async def run_executor(name, max_inflight=EXECUTOR_MAX_INFLIGHT):
+    import chao_bi
+    import state_store
+    from app import connect_binance
+    if not connect_binance():
+        print("[error] 幣安客戶端未初始化。請檢查您的 'binance.txt' 和 API Key 權限。")
+        return
+    state_store.configure_backend(path=_state_path_for(name))
+    try:
+        state_store.load_state()
+    except Exception as e:
+        print(f"[warning] 載入狀態檔失敗：{e}")
+
+    queue = SignalQueue()
+    released = queue.release(name)
+    if released:
+        print(f"[executor:{name}] 釋放上次未完成的 {released} 筆租約，立即重新投遞。")
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    asyncio.create_task(chao_bi._periodic_reconcile_task(600))
+    chao_bi.warm_symbol_registry()
+    _start_observability("executor", queue)
+
+    wake = queue.open_wakeup(name)
+    inflight = set()
+    print(f"[executor:{name}] 開始領取訊號（同時最多 {max_inflight} 則）。")
+    try:
+        while not stop.is_set():
+            free = max_inflight - len(inflight)
+            if free <= 0:
+                await asyncio.wait(inflight, timeout=SIGNAL_QUEUE_POLL_SEC, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            events = await run_in_pool('queue', queue.claim, SIGNAL_TOPIC, name, free)
+            for ev in events:
+                task = asyncio.create_task(_consume(queue, name, ev))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+            if not events:
+                await _wait_wakeup(loop, wake, SIGNAL_QUEUE_POLL_SEC)
+    finally:
+        queue.close_wakeup(wake, name)
+        if inflight:
+            # 處理中的訊號給一點時間收尾；來不及的不 ack，重啟後重新投遞
+            print(f"[executor:{name}] 停止中，等待 {len(inflight)} 則處理中的訊號...")
+            await asyncio.wait(inflight, timeout=30)
+        state_store.close_state()
+
+# === [maint] 盈虧 / 紀錄壓實 / 佇列維護 ===
+async def _queue_housekeeping(queue, last_alert):
+    from telegram import notify_user
+    for ev, error in await run_in_pool('queue', queue.take_dead_letters):
+        print(f"[maint] 訊號 {ev.key} 投遞 {ev.attempts} 次仍未完成，已移入 dead letter：{error}")
+        notify_user(f"☠️ 訊號處理失敗 {ev.attempts} 次，已停止重試\n"
+                    f"• 來源: {ev.payload.get('channel')}\n"
+                    f"• 訊息: {str(ev.payload.get('text'))[:80]}\n"
+                    f"• 錯誤: {error or 'executor 處理中中斷'}\n"
+                    f"• 重新排入：python signal_queue.py retry {ev.id}")
+    purged = await run_in_pool('queue', queue.purge, SIGNAL_QUEUE_RETENTION_SEC)
+    if purged:
+        print(f"[maint] 已清除 {purged} 筆過期的已完成事件。")
+    st = await run_in_pool('queue', queue.stats)
+    if st["oldest_pending_sec"] > BACKLOG_ALERT_SEC and time.time() - last_alert > BACKLOG_ALERT_COOLDOWN_SEC:
+        print(f"[warning] 佇列積壓：{st['ready']} 則待處理，最舊已等 {st['oldest_pending_sec']:.0f}s。")
+        notify_user(f"⚠️ 訊號佇列積壓：{st['ready']} 則待處理，最舊已等 {st['oldest_pending_sec']:.0f}s（executor 是否在執行？）")
+        return time.time()
+    return last_alert
+
+async def run_maint(interval_sec=60):
+    import chao_bi
+    from app import connect_binance
+    from binance_api import daily_pnl_notifier
+    if not connect_binance():
+        print("[error] 幣安客戶端未初始化。請檢查您的 'binance.txt' 和 API Key 權限。")
+        return
+    queue = SignalQueue()
+    asyncio.create_task(daily_pnl_notifier('Asia/Taipei', 0, 0))
+    asyncio.create_task(chao_bi._periodic_journal_compact_task(TRADE_JOURNAL_COMPACT_INTERVAL_SEC))
+    _start_observability("maint", queue)
+    print(f"[maint] 已啟動（每 {interval_sec}s 檢查佇列）。")
+    last_alert = 0.0
+    while True:
+        try:
+            last_alert = await _queue_housekeeping(queue, last_alert)
+        except Exception as e:
+            print(f"[warning] 佇列維護失敗：{e}")
+        await asyncio.sleep(interval_sec)
+
+# === [supervisor] 一次啟動全部角色 ===
+def supervise(roles=ROLES):
+    """
+    各角色一個子行程；結束就重啟（短時間內反覆失敗時退避，最長 60 秒）。
+    收到 SIGTERM / SIGINT（systemd、docker stop、Ctrl-C）時先停掉所有子行程再結束，避免子行程成為孤兒、繼續持有佇列租約。
+    """
+    procs, started, failures = {}, {}, {}
+    script = os.path.abspath(__file__)
+    stopping = threading.Event()
+
+    def spawn(role):
+        procs[role] = subprocess.Popen([sys.executable, "-u", script, role])
+        started[role] = time.time()
+        print(f"[supervisor] 已啟動 {role}（pid {procs[role].pid}）")
+
+    def on_signal(signum, frame):
+        stopping.set()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, on_signal)
+
+    for role in roles:
+        spawn(role)
+    try:
+        while not stopping.wait(1):
+            for role in roles:
+                code = procs[role].poll()
+                if code is None:
+                    continue
+                failures[role] = failures.get(role, 0) + 1 if time.time() - started[role] < 30 else 0
+                delay = min(60, 2 ** failures[role]) if failures[role] else 1
+                print(f"[warning] [supervisor] {role} 已結束（exit {code}），{delay}s 後重啟。")
+                if stopping.wait(delay):
+                    break
+                spawn(role)
+    finally:
+        print("\n[supervisor] 停止所有子行程 ...")
+        for p in procs.values():
+            if p.poll() is None:
+                p.terminate()
+        for p in procs.values():
+            try:
+                p.wait(timeout=40)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+def main():
+    ap = argparse.ArgumentParser(description="行程拆分模式：listener / executor / maint")
+    ap.add_argument("role", choices=ROLES + ("all",))
+    ap.add_argument("--name", default="executor", help="executor 名稱（佇列租約與狀態檔以此區分）")
+    ap.add_argument("--max-inflight", type=int, default=EXECUTOR_MAX_INFLIGHT)
+    args = ap.parse_args()
+
+    if args.role == "all":
+        supervise()
+    elif args.role == "listener":
+        from app import get_telegram_client
+        client = get_telegram_client()
+        if client is None:
+            print("[error] Telethon 客戶端未初始化。請檢查您的 'telegram.txt'。")
+            raise SystemExit(1)
+        try:
+            client.loop.run_until_complete(run_listener(client))
+        except KeyboardInterrupt:
+            print("\n[warning] 手動停止 listener。")
+    else:
+        try:
+            if args.role == "executor":
+                asyncio.run(run_executor(args.name, args.max_inflight))
+            else:
+                asyncio.run(run_maint())
+        except KeyboardInterrupt:
+            print(f"\n[warning] 手動停止 {args.role}。")
+    import logs
+    logs.flush()
+
+if __name__ == "__main__":
+    main()